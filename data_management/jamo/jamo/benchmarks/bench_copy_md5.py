@@ -0,0 +1,96 @@
+"""Benchmark copying a file and computing its md5, as the dt_service copy and md5 tasks do.
+
+Compares the two pass path the dt_service used (`shutil.copyfile`, then an `md5sum` subprocess reading the copy back)
+with `checksum.copy_md5`, which hashes the data while copying it so the file is read once. Then compares hashing
+`--files` files one `md5sum` subprocess at a time with `checksum.md5_files` for each `--workers` count. The source
+files are dropped from the page cache before every run (`posix_fadvise(POSIX_FADV_DONTNEED)`), so files larger than
+the free memory give disk bound numbers.
+
+The files are written to `--dir` on the first run and reused.
+
+Usage:
+    PYTHONPATH=src:../lapinpy/src:../sdm-common/lib/python python benchmarks/bench_copy_md5.py [--size-gb 2] \\
+        [--files 2] [--dir /tmp/jamo_bench_copy_md5] [--workers 1 2 4]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import time
+
+from jamo import checksum
+
+
+def drop_cache(file_path: str) -> None:
+    with open(file_path, 'rb') as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def build(directory: str, files: int, size: int) -> list[str]:
+    os.makedirs(directory, exist_ok=True)
+    file_paths = []
+    block = os.urandom(checksum.BUFFER_SIZE)
+    for i in range(files):
+        file_path = os.path.join(directory, f'source_{i}.bin')
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != size:
+            with open(file_path, 'wb') as f:
+                for offset in range(0, size, len(block)):
+                    f.write(block[:size - offset])
+        file_paths.append(file_path)
+    return file_paths
+
+
+def two_pass(from_file: str, to_file: str) -> str:
+    shutil.copyfile(from_file, to_file)
+    return subprocess.run(['md5sum', to_file], stdout=subprocess.PIPE, check=True).stdout.decode('utf-8').split(' ')[0]
+
+
+def single_pass(from_file: str, to_file: str) -> str:
+    return checksum.copy_md5(from_file, to_file)[1]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-gb', type=float, default=2, help='Size of each file in GB')
+    parser.add_argument('--files', type=int, default=2, help='Files copied and hashed')
+    parser.add_argument('--dir', default='/tmp/jamo_bench_copy_md5')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='`md5_files` worker counts to run')
+    args = parser.parse_args()
+    size = int(args.size_gb * 1e9)
+    file_paths = build(args.dir, args.files, size)
+    total_mb = size * args.files / 1e6
+    print(f'{args.files} files of {args.size_gb}GB, {os.cpu_count()} CPUs')
+    print(f'{"copy + md5":>16} {"seconds":>8} {"MB/s":>8}')
+    md5s = {}
+    for name, function in (('two pass', two_pass), ('single pass', single_pass)):
+        seconds = 0
+        for file_path in file_paths:
+            to_file = file_path.replace('source_', 'copy_')
+            drop_cache(file_path)
+            md5s[name, file_path], elapsed = timed(function, file_path, to_file)
+            seconds += elapsed
+            os.remove(to_file)
+        print(f'{name:>16} {seconds:>8.2f} {total_mb / seconds:>8.0f}')
+    print(f'{"md5 only":>16} {"seconds":>8} {"MB/s":>8}')
+    runs = [('md5sum', lambda: {file_path: subprocess.run(['md5sum', file_path], stdout=subprocess.PIPE, check=True)
+                                .stdout.decode('utf-8').split(' ')[0] for file_path in file_paths})]
+    runs += [(f'md5_files x{workers}', lambda workers=workers: {
+        file_path: future.result() for file_path, future in checksum.md5_files(file_paths, workers).items()})
+        for workers in args.workers]
+    for name, function in runs:
+        for file_path in file_paths:
+            drop_cache(file_path)
+        result, seconds = timed(function)
+        assert all(result[file_path] == md5s['two pass', file_path] for file_path in file_paths)
+        print(f'{name:>16} {seconds:>8.2f} {total_mb / seconds:>8.0f}')
+    assert all(md5s['two pass', file_path] == md5s['single pass', file_path] for file_path in file_paths)
+
+
+if __name__ == '__main__':
+    main()
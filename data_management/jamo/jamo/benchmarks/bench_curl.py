@@ -0,0 +1,97 @@
+"""Benchmark small JSON calls through `sdm_curl.Curl` against a local stand-in server.
+
+Compares the pooled keep-alive transport against opening a new connection for every request (what `Curl` did with
+`urllib.request.urlopen`), reporting requests per second and the number of connections the server accepted, for each
+number of client threads.
+
+Usage:
+    PYTHONPATH=../sdm-common/lib/python python benchmarks/bench_curl.py [--requests 5000] [--threads 1 8] \\
+        [--latency-ms 0]
+"""
+import argparse
+import concurrent.futures
+import http.server
+import json
+import threading
+import time
+import urllib.request
+
+from sdm_curl import Curl
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Answers every request with a small JSON document, like most JAMO API calls made by dt_service.
+    """
+    protocol_version = 'HTTP/1.1'
+    # Buffer the response so it is sent in one write, as CherryPy does, rather than stalling on delayed ACKs
+    wbufsize = -1
+    latency = 0.0
+    connections = 0
+
+    def setup(self):
+        StandInHandler.connections += 1
+        http.server.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.dumps({'file_id': 1, 'file_status': 'BACKUP_COMPLETE', 'path': self.path}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+def per_request_get(server: str, url: str, data: dict) -> dict:
+    """A new connection for every request, as `Curl` made before the connection pool.
+    """
+    request = urllib.request.Request('{}/{}?{}'.format(server, url, ''.join('%s=%s&' % item for item in data.items())))
+    request.add_header('Content-type', 'application/json; charset=utf-8')
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def run(requests: int, threads: int, call) -> tuple[float, int]:
+    StandInHandler.connections = 0
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        list(executor.map(call, range(requests)))
+    return requests / (time.perf_counter() - start), StandInHandler.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--latency-ms', type=float, default=0, help='Simulated server processing time per request')
+    args = parser.parse_args()
+    StandInHandler.latency = args.latency_ms / 1000.0
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    server = 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+    try:
+        print(f'{"threads":>8} {"per-request req/s":>18} {"connections":>12} {"pooled req/s":>13} {"connections":>12}')
+        for threads in args.threads:
+            per_request_rate, per_request_connections = run(
+                args.requests, threads, lambda i: per_request_get(server, 'api/metadata/file', {'file_id': i}))
+            curl = Curl(server, pool_size=threads)
+            pooled_rate, pooled_connections = run(
+                args.requests, threads, lambda i: curl.get('api/metadata/file', data={'file_id': i}))
+            curl.close()
+            print(f'{threads:>8} {per_request_rate:>18.0f} {per_request_connections:>12} {pooled_rate:>13.0f} '
+                  f'{pooled_connections:>12}')
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
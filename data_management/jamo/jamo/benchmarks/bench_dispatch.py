@@ -0,0 +1,101 @@
+"""Benchmark handing out tasks with `TaskManager.get_task` from queues indexed by feature set.
+
+Fills the queues with `--tasks` tasks spread over `--combinations` distinct feature sets and drains them with
+handlers that each have a subset of the features, as the dt_services do, reporting the time per `get_task` call. The
+same run is repeated with `task.Queue.next` replaced by the previous implementation, which walked every feature set in
+round-robin order and compared the feature lists for each one. Both hand out the tasks in the same order.
+
+Usage:
+    PYTHONPATH=src:../lapinpy/src python benchmarks/bench_dispatch.py [--tasks 100000] [--combinations 50] \\
+        [--features 12] [--handlers 8]
+"""
+import argparse
+import itertools
+import random
+import time
+
+from jamo import task
+
+
+def linear_next(self, available_features):
+    """The previous implementation of `task.Queue.next`.
+    """
+    for i in range(len(self.round_robin_queues)):
+        getting = (self.round_robin_on + i) % len(self.round_robin_queues)
+        feature_str = self.round_robin_queues[getting]
+        features = feature_str.split(',')
+        if len(self.feature_queues.get(feature_str)) > 0 and task.contains_list(features, available_features):
+            self.round_robin_on = getting + 1
+            data = self.feature_queues.get(feature_str).popleft()
+            with self._lock:
+                self.record_count -= 1
+            if self.on_task_selected is not None:
+                ret = self.on_task_selected(data)
+                if ret is not None:
+                    if len(ret) > 0:
+                        data = ret
+                else:
+                    return linear_next(self, available_features)
+            with self._lock:
+                self.currently_running += 1
+            return {'uses_resources': features, 'data': data}
+
+
+def build(tasks: int, combinations: int, features: int, handlers: int, seed: int):
+    rng = random.Random(seed)
+    names = [f'feature_{i}' for i in range(features)]
+    signatures = rng.sample([list(combination) for size in (1, 2, 3)
+                             for combination in itertools.combinations(names, size)], combinations)
+    # Every handler has half of the features, the last one has all of them so that every task can be handed out
+    handler_features = [rng.sample(names, features // 2) for _ in range(handlers - 1)] + [names]
+    manager = task.TaskManager('jgi')
+    queues = [task.Queue(name, priority) for priority, name in enumerate(['ingest', 'copy', 'tar', 'put', 'md5'])]
+    manager.set_queues(*queues)
+    for i in range(tasks):
+        rng.choice(queues).add({'id': i, 'file_size': 1}, signatures[i % combinations], add_default_features=False)
+    return manager, handler_features
+
+
+def drain(manager: task.TaskManager, handler_features: list[list[str]]) -> tuple[int, float, list[int]]:
+    has_tasks = [queue.name for queue in manager.queues]
+    handed_out = []
+    calls = 0
+    idle = 0
+    start = time.perf_counter()
+    for handler in itertools.cycle(range(len(handler_features))):
+        calls += 1
+        task_data = manager.get_task(handler_features[handler], has_tasks, None, handler, True)
+        if task_data is None:
+            idle += 1
+            if idle == len(handler_features):
+                break
+            continue
+        idle = 0
+        handed_out.append(task_data['data']['id'])
+        manager.set_task_complete(task_data['task_id'], True)
+    return calls, time.perf_counter() - start, handed_out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, default=100000, help='Tasks queued')
+    parser.add_argument('--combinations', type=int, default=50, help='Distinct feature sets of the tasks')
+    parser.add_argument('--features', type=int, default=12, help='Distinct features')
+    parser.add_argument('--handlers', type=int, default=8, help='Handlers with distinct feature sets')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    print(f'{args.tasks} tasks, {args.combinations} feature sets, {args.handlers} handlers')
+    print(f'{"next":>8} {"calls":>8} {"total s":>8} {"us/call":>8}')
+    orders = {}
+    indexed_next = task.Queue.next
+    for name, implementation in (('linear', linear_next), ('indexed', indexed_next)):
+        task.Queue.next = implementation
+        manager, handler_features = build(args.tasks, args.combinations, args.features, args.handlers, args.seed)
+        calls, seconds, orders[name] = drain(manager, handler_features)
+        print(f'{name:>8} {calls:>8} {seconds:>8.2f} {seconds / calls * 1e6:>8.1f}')
+    task.Queue.next = indexed_next
+    print('same order' if orders['linear'] == orders['indexed'] else 'ORDER DIFFERS')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Benchmark `file_copy.copy_file` against `shutil.copy2`, which the dt_service used to stage restored files and
+Globus transfers.
+
+Copies a `--size-gb` file within `--dir` once with `shutil.copy2` and once with each `copy_file` mechanism available
+here (the preferred ones are disabled to force each fallback), then moves it as a disposable source. The source is
+dropped from the page cache before every run (`posix_fadvise(POSIX_FADV_DONTNEED)`) and the destination is flushed to
+disk (`fsync`) as part of the timed copy.
+
+Usage:
+    PYTHONPATH=src:../lapinpy/src:../sdm-common/lib/python python benchmarks/bench_file_copy.py [--size-gb 2] \\
+        [--dir /tmp/jamo_bench_file_copy]
+"""
+import argparse
+import errno
+import os
+import shutil
+import time
+from unittest.mock import patch
+
+from jamo import checksum, file_copy
+
+
+def drop_cache(file_path: str) -> None:
+    with open(file_path, 'rb') as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def fsync(file_path: str) -> None:
+    with open(file_path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def unsupported(source, destination, size):
+    raise OSError(errno.EOPNOTSUPP, 'Operation not supported')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-gb', type=float, default=2, help='Size of the file in GB')
+    parser.add_argument('--dir', default='/tmp/jamo_bench_file_copy')
+    args = parser.parse_args()
+    os.makedirs(args.dir, exist_ok=True)
+    size = int(args.size_gb * 1e9)
+    from_file = os.path.join(args.dir, 'source.bin')
+    to_file = os.path.join(args.dir, 'copy.bin')
+    if not os.path.exists(from_file) or os.path.getsize(from_file) != size:
+        block = os.urandom(checksum.BUFFER_SIZE)
+        with open(from_file, 'wb') as f:
+            for offset in range(0, size, len(block)):
+                f.write(block[:size - offset])
+    print(f'{args.size_gb}GB file in {args.dir}')
+    print(f'{"copy":>31} {"seconds":>8} {"MB/s":>8}')
+
+    def run(name, function):
+        drop_cache(from_file)
+        start = time.perf_counter()
+        mechanism = function()
+        fsync(to_file)
+        seconds = time.perf_counter() - start
+        print(f'{name:>31} {seconds:>8.2f} {size / 1e6 / seconds:>8.0f}' + (f'  ({mechanism})' if mechanism else ''))
+
+    run('shutil.copy2', lambda: shutil.copy2(from_file, to_file) and None)
+    names = [name for name, _ in file_copy.MECHANISMS]
+    for i, name in enumerate(names):
+        mechanisms = [(other, unsupported) for other, _ in file_copy.MECHANISMS[:i]] + file_copy.MECHANISMS[i:]
+        with patch.object(file_copy, 'MECHANISMS', mechanisms):
+            run(f'copy_file from {name}', lambda: file_copy.copy_file(from_file, to_file, copy_stat=True).mechanism)
+    os.remove(to_file)
+    shutil.copyfile(from_file, to_file)
+    fsync(to_file)
+    os.rename(to_file, from_file + '.moving')
+    run('copy_file disposable', lambda: file_copy.copy_file(from_file + '.moving', to_file, disposable=True).mechanism)
+    shutil.rmtree(args.dir)
+
+
+if __name__ == '__main__':
+    main()
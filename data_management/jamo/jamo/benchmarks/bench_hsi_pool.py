@@ -0,0 +1,107 @@
+"""Benchmark HSI metadata lookups through `hsi.HSIPool` against starting an `hsi` process per lookup.
+
+`hsi` is simulated by a small script that sleeps `--login-ms` when it starts (authentication and connection to the
+server) and `--command-ms` per command (the round trip to the server). `--files` puts are verified:
+- with the previous `DTService._verify_path_in_hsi`, pasted below as `legacy_verify`, which ran
+  `hsi -P -q -h server 'ls -1s path'` for every put;
+- with `DTService._verify_path_in_hsi`, which runs the `ls` on a long-lived session of the pool;
+- with all the `ls` pipelined on one session, as `run_prep_batch` does for the position lookups of a batch.
+
+Usage:
+    PYTHONPATH=src:../lapinpy/src:../sdm-common/lib/python python benchmarks/bench_hsi_pool.py [--files 200] \\
+        [--login-ms 300] [--command-ms 2]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+from jamo import hsi
+from jamo.dt_service import DTService, HSIVerificationFailedException
+
+FAKE_HSI = '''
+import sys, time
+login, command_seconds = float(sys.argv[1]), float(sys.argv[2])
+time.sleep(login)
+
+
+def answer(command):
+    time.sleep(command_seconds)
+    if command == 'pwd':
+        return 'pwd0: /home/u/user\\n'
+    return f'999 {command.split()[-1]}\\n'
+
+
+if len(sys.argv) > 7:
+    # hsi -P -q -h server command
+    sys.stdout.write(answer(sys.argv[7]))
+else:
+    for line in sys.stdin:
+        sys.stdout.write('A:/home/u/user-> ' + answer(line.strip()))
+        sys.stdout.flush()
+'''
+
+
+def legacy_verify(self, server, path, expected_size, exact_size=True):
+    """The previous `DTService._verify_path_in_hsi`.
+    """
+    cmd = ['hsi', '-P', '-q', '-h', server, f'ls -1s {path}']
+    results = subprocess.run(cmd, check=True, stdout=subprocess.PIPE)
+    size = int(results.stdout.decode('utf-8').split()[0])
+    if size != expected_size:
+        raise HSIVerificationFailedException(f'HSI size {size} does not match expected size {expected_size} for {path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200, help='Puts to verify')
+    parser.add_argument('--login-ms', type=float, default=300, help='Time to start hsi and log in, in milliseconds')
+    parser.add_argument('--command-ms', type=float, default=2, help='Time per hsi command, in milliseconds')
+    args = parser.parse_args()
+    with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as f:
+        f.write(FAKE_HSI)
+    fake_hsi = [sys.executable, f.name, str(args.login_ms / 1000), str(args.command_ms / 1000)]
+    paths = [f'/archive/path/to/file_{i}' for i in range(args.files)]
+    print(f'{args.files} puts verified, {args.login_ms}ms login, {args.command_ms}ms per command')
+    print(f'{"verify":>10} {"seconds":>8} {"files/s":>8} {"logins":>7}')
+    run = subprocess.run
+    try:
+        for name in ('legacy', 'pool', 'pipelined'):
+            logins = 0
+
+            def fake_run(cmd, **kwargs):
+                nonlocal logins
+                logins += 1
+                return run(fake_hsi + cmd[1:], **kwargs)
+
+            def fake_connect(session, connect=hsi.HSISession.connect):
+                nonlocal logins
+                logins += 1
+                connect(session)
+
+            runner = DTService.__new__(DTService)
+            runner.hsi_pool = hsi.HSIPool()
+            with patch.object(subprocess, 'run', fake_run), patch.object(hsi.HSISession, 'command', fake_hsi), \
+                    patch.object(hsi.HSISession, 'connect', fake_connect):
+                start = time.perf_counter()
+                if name == 'legacy':
+                    for path in paths:
+                        legacy_verify(runner, 'archive', path, 999)
+                elif name == 'pool':
+                    for path in paths:
+                        runner._verify_path_in_hsi('archive', path, 999)
+                else:
+                    outputs = runner.hsi_pool.run('archive', [f'ls -1s {path}' for path in paths])
+                    assert all(int(output.split()[0]) == 999 for output in outputs)
+                seconds = time.perf_counter() - start
+            runner.hsi_pool.close()
+            print(f'{name:>10} {seconds:>8.2f} {args.files / seconds:>8.0f} {logins:>7}')
+    finally:
+        os.remove(f.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Benchmark scanning a large collection with `MongoRestful.pagequery` and `get_nextpage`.
+
+Compares the in-memory cursor sessions against keyset pagination, reporting records per second and the page latency at
+the start and end of the scan. Requires a MongoDB server; with `--seed` the collection is filled with `--records`
+synthetic file documents (and the sort index created) first.
+
+Usage:
+    PYTHONPATH=src:../lapinpy/src python benchmarks/bench_pagequery.py --host localhost --user jamo --password ... \\
+        --db jamo_bench [--seed] [--records 10000000] [--page-size 10000] [--sort file_size]
+"""
+import argparse
+import datetime
+import statistics
+import time
+
+from lapinpy.mongorestful import MongoRestful
+
+COLLECTION = 'bench_pagequery'
+
+
+def seed(store: MongoRestful, records: int, sort: str) -> None:
+    collection = store.db[COLLECTION]
+    existing = collection.estimated_document_count()
+    batch = []
+    added_date = datetime.datetime(2020, 1, 1)
+    for i in range(existing, records):
+        batch.append({'file_id': i, 'file_name': f'file_{i}.fastq.gz', 'file_size': (i * 7919) % 1000000,
+                      'added_date': added_date + datetime.timedelta(seconds=i),
+                      'metadata': {'library_name': f'LIB{i % 5000}', 'sequencing_project_id': i % 100000}})
+        if len(batch) == 10000:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+    collection.create_index([(sort, 1), ('_id', 1)])
+
+
+def scan(store: MongoRestful, page_size: int, sort: str, keyset: bool) -> tuple[int, float, list[float]]:
+    latencies = []
+    start = time.perf_counter()
+    page = store.pagequery(COLLECTION, {}, ['file_name', 'file_size'], page_size, (sort, 1), keyset=keyset)
+    latencies.append(time.perf_counter() - start)
+    scanned = len(page['records'])
+    while page['end'] < page['record_count'] and page['records']:
+        page_start = time.perf_counter()
+        page = store.get_nextpage([page['cursor_id']], None)
+        latencies.append(time.perf_counter() - page_start)
+        scanned += len(page['records'])
+    return scanned, time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=27017)
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--seed', action='store_true', help='Fill the benchmark collection up to --records documents')
+    parser.add_argument('--records', type=int, default=10000000)
+    parser.add_argument('--page-size', type=int, default=10000)
+    parser.add_argument('--sort', default='file_size')
+    args = parser.parse_args()
+    store = MongoRestful(args.host, args.user, args.password, args.db, thread=False, host_port=args.port)
+    try:
+        if args.seed:
+            seed(store, args.records, args.sort)
+        print(f'{"mode":>8} {"records":>10} {"seconds":>9} {"records/s":>10} {"first 10 ms":>12} {"last 10 ms":>11}')
+        for mode, keyset in (('cursor', False), ('keyset', True)):
+            scanned, elapsed, latencies = scan(store, args.page_size, args.sort, keyset)
+            print(f'{mode:>8} {scanned:>10} {elapsed:>9.1f} {scanned / elapsed:>10.0f} '
+                  f'{statistics.mean(latencies[:10]) * 1000:>12.1f} {statistics.mean(latencies[-10:]) * 1000:>11.1f}')
+    finally:
+        store.stop()
+
+
+if __name__ == '__main__':
+    main()
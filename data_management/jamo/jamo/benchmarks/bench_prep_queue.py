@@ -0,0 +1,76 @@
+"""Benchmark claiming a prep batch with `Tape.PrepQueue.next`.
+
+Compares the number of database round trips (and the time spent with a simulated per round trip latency) of the
+batched claim against the previous one-update-per-row claim, for increasing batch sizes.
+
+Usage:
+    PYTHONPATH=src python benchmarks/bench_prep_queue.py [--batch-sizes 10 100 1000] [--latency-ms 0.5]
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+from jamo.tape import Tape
+
+
+class FakeTape:
+    """Minimal stand-in for `Tape` that counts queries and sleeps `latency` seconds per round trip.
+    """
+
+    def __init__(self, batch_size: int, latency: float):
+        self.batch_size = batch_size
+        self.latency = latency
+        self.round_trips = 0
+        self.config = SimpleNamespace(db_prep_tasks_max_batch_size=batch_size)
+        self.queue_status = SimpleNamespace(REGISTERED=1, PREP_IN_PROGRESS=7)
+
+    def query(self, sql, values=None, uselimit=True):
+        self.round_trips += 1
+        time.sleep(self.latency)
+        if sql.startswith('select pull_queue_id from'):
+            return [{'pull_queue_id': i} for i in range(self.batch_size)]
+        return [{'pull_queue_id': i, 'tar_record_id': None, 'remote_path': None, 'remote_file_path': '/path',
+                 'remote_file_name': f'file_{i}', 'service': 1} for i in range(self.batch_size)]
+
+    def modify(self, sql, *values):
+        self.round_trips += 1
+        time.sleep(self.latency)
+        return 1
+
+
+def per_row_claim(prep_queue: Tape.PrepQueue) -> None:
+    """The previous implementation of the claim, issuing one update per pull request.
+    """
+    tape = prep_queue.tape
+    prep_recs = tape.query('select pull_queue_id from pull_queue p join backup_record b using(file_id) where volume is null and b.service = %s and queue_status_id = %s limit %s',
+                           [prep_queue.backup_service, tape.queue_status.REGISTERED, prep_queue.db_prep_tasks_max_batch_size])
+    for rec in prep_recs:
+        tape.modify('update pull_queue set queue_status_id = %s where pull_queue_id = %s',
+                    tape.queue_status.PREP_IN_PROGRESS, rec.get('pull_queue_id'))
+    tape.query(f'select ... where p.pull_queue_id in ({",".join(["%s"] * len(prep_recs))})',
+               [rec.get('pull_queue_id') for rec in prep_recs], uselimit=False)
+
+
+def run(batch_size: int, latency: float, claim) -> tuple[int, float]:
+    tape = FakeTape(batch_size, latency)
+    prep_queue = Tape.PrepQueue('prep', tape, 1, ['hsi'])
+    start = time.perf_counter()
+    claim(prep_queue)
+    return tape.round_trips, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--latency-ms', type=float, default=0.5, help='Simulated latency per database round trip')
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000.0
+    print(f'{"batch":>8} {"per-row trips":>14} {"per-row s":>10} {"batched trips":>14} {"batched s":>10}')
+    for batch_size in args.batch_sizes:
+        per_row_trips, per_row_time = run(batch_size, latency, per_row_claim)
+        batched_trips, batched_time = run(batch_size, latency, lambda prep_queue: prep_queue.next(['hsi']))
+        print(f'{batch_size:>8} {per_row_trips:>14} {per_row_time:>10.3f} {batched_trips:>14} {batched_time:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Benchmark restoring the members of the tars of a volume with `DTService.run_pull`.
+
+Pulls `--tars` tars of `--members` members of `--member-mb` MB each. `htar` is simulated: reading the members of a
+tar from tape sleeps `--tape-seconds` and writes them to the restore directory under `--temp-dir`. The members are
+restored to `--dir`, by default on another file system than the restore directory so they are copied rather than
+renamed. The pull is run twice:
+- with the previous implementation, pasted below as `legacy_pull`. It read all the tars from tape first, then moved
+  each member to its destination one after the other;
+- with `DTService.run_pull`, which moves the members of a tar to their destinations (`--pull-io-workers` tars at a
+  time) while the next tar is read from tape.
+
+Usage:
+    PYTHONPATH=src:../lapinpy/src:../sdm-common/lib/python python benchmarks/bench_pull.py [--tars 20] \\
+        [--members 25] [--member-mb 1] [--tape-seconds 0.5] [--pull-io-workers 4] [--temp-dir /dev/shm] \\
+        [--dir /tmp/jamo_bench_pull]
+"""
+import argparse
+import datetime
+import logging
+import os
+import shutil
+import subprocess
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from jamo import file_copy
+from jamo.dt_service import DTService
+
+
+class FakeHtar:
+    """Stands in for `subprocess.run`, writing the members listed to an `htar -x` after sleeping `tape_seconds`.
+    """
+
+    def __init__(self, member_bytes: int, tape_seconds: float):
+        self.data = os.urandom(member_bytes)
+        self.tape_seconds = tape_seconds
+
+    def __call__(self, cmd, **kwargs):
+        time.sleep(self.tape_seconds)
+        with open(cmd[cmd.index('-L') + 1]) as f:
+            for member in f.read().split():
+                path = os.path.join(os.getcwd(), member.lstrip('/'))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as out:
+                    out.write(self.data)
+
+
+def legacy_pull(self, files):
+    """The tar member restore of the previous `DTService.run_pull`.
+    """
+    service = self.get_service(files[0].get('service'))
+    volume = files[0].get('volume')
+    orig_dir = os.getcwd()
+    temp_dir = os.path.join(self.temp_dir, "tape_" + volume + datetime.datetime.now().strftime("_%Y%m%d_%H%M%S"))
+    os.makedirs(temp_dir)
+    os.chdir(temp_dir)
+    tar_files = {}
+    for in_file in files:
+        in_file['restore_path'] = os.path.join(in_file.get('file_path'), '.' + in_file.get('file_name'))
+        in_file['destination_path'] = os.path.join(in_file.get('file_path'), in_file.get('file_name'))
+        os.makedirs(in_file.get('file_path'), 0o751, exist_ok=True)
+        tar_file = os.path.join(in_file.get('remote_file_path'), in_file.get('remote_file_name'))
+        in_file['tar_restore_path'] = os.path.join(temp_dir, tar_file.lstrip("/"))
+        tar_files.setdefault(in_file.get('remote_path'), []).append((tar_file, in_file))
+    for tar in sorted(tar_files, key=lambda t: min((in_file.get('position_a'), in_file.get('position_b'))
+                                                   for _, in_file in tar_files.get(t))):
+        member_list = os.path.join(temp_dir, f'{os.path.basename(tar)}.members')
+        with open(member_list, 'w') as f:
+            for tar_file, _ in tar_files.get(tar):
+                f.write(f'{tar_file}\n')
+        subprocess.run(['htar', '-x', '-H', f'server={service.get("server")}', '-f', tar, '-L', member_list],
+                       timeout=60 * 60 * 3, check=True)
+    pull_updates = []
+    for in_file in files:
+        try:
+            file_copy.copy_file(str(in_file.get('tar_restore_path')), str(in_file.get('restore_path')),
+                                disposable=True, copy_stat=True)
+            os.rename(str(in_file.get('restore_path')), str(in_file.get('destination_path')))
+            queue_status_id = self.cv.queue_status.COMPLETE
+        except Exception:
+            queue_status_id = self.cv.queue_status.FAILED
+        pull_updates.append({'pull_queue_id': in_file.get('pull_queue_id'), 'queue_status_id': queue_status_id})
+    self._put_pulls(pull_updates)
+    os.chdir(orig_dir)
+    shutil.rmtree(temp_dir)
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tars', type=int, default=20, help='Tars in the volume')
+    parser.add_argument('--members', type=int, default=25, help='Members pulled per tar')
+    parser.add_argument('--member-mb', type=float, default=1, help='Size of each member in MB')
+    parser.add_argument('--tape-seconds', type=float, default=0.5, help='Time to read the members of a tar from tape')
+    parser.add_argument('--pull-io-workers', type=int, default=4, help='Tars to move the members of at the same time')
+    parser.add_argument('--temp-dir', default='/dev/shm', help='Directory the restore directory is created in')
+    parser.add_argument('--dir', default='/tmp/jamo_bench_pull', help='Directory the members are restored to')
+    args = parser.parse_args()
+    logger = logging.getLogger('bench_pull')
+    logger.setLevel(logging.ERROR)
+    members = args.tars * args.members
+    member_bytes = int(args.member_mb * 1e6)
+    print(f'{members} members in {args.tars} tars, {args.member_mb}MB each, {args.tape_seconds}s per tar from tape')
+    print(f'{"run_pull":>8} {"seconds":>8} {"members/s":>10} {"MB/s":>7} {"failed":>7}')
+    for name in ('legacy', 'parallel'):
+        shutil.rmtree(args.dir, ignore_errors=True)
+        pulls = []
+        runner = DTService.__new__(DTService)
+        runner.sdm_curl = SimpleNamespace(put=lambda url, **kwargs: pulls.extend(kwargs.get('pulls', [])))
+        runner.logger = logger
+        runner.debug = False
+        runner.temp_dir = args.temp_dir
+        runner.division_name = 'jgi'
+        runner.pull_io_workers = args.pull_io_workers
+        runner.remote_services = {2: {'server': 'bench'}}
+        runner.hsi_state = SimpleNamespace(isup=lambda server: True)
+        runner.cv = SimpleNamespace(queue_status=SimpleNamespace(REGISTERED=1, COMPLETE=3, FAILED=4))
+        files = [{'service': 2, 'volume': 'BENCH1', 'file_path': os.path.join(args.dir, f'tar_{t}'),
+                  'file_name': f'member_{m}.dat', 'tar_record_id': t, 'remote_path': f'/archive/tar_{t}.tar',
+                  'remote_file_path': f'/archive/tar_{t}', 'remote_file_name': f'member_{m}.dat',
+                  'position_a': t, 'position_b': m, 'pull_queue_id': t * args.members + m}
+                 for t in range(args.tars) for m in range(args.members)]
+        with patch.object(subprocess, 'run', FakeHtar(member_bytes, args.tape_seconds)):
+            start = time.perf_counter()
+            if name == 'legacy':
+                legacy_pull(runner, files)
+            else:
+                runner.run_pull(files)
+            seconds = time.perf_counter() - start
+        failed = sum(1 for pull in pulls if pull.get('queue_status_id') != 3)
+        print(f'{name:>8} {seconds:>8.2f} {members / seconds:>10.0f} {members * member_bytes / 1e6 / seconds:>7.0f} '
+              f'{failed:>7}')
+    shutil.rmtree(args.dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""Benchmark loading the queue backlog when the tape service starts, against a synthetic backlog in SQLite.
+
+Compares loading every `select *` row of the copy, tar, md5 and ingest backlog before serving anything (what
+`Tape.Division` did) with creating empty queues and hydrating them from compact records in chunks
+(`Tape.Division.hydrate`), reporting the time until the service can hand out a task, the time until a copy task is
+queued, the time until the whole backlog is queued and the peak resident memory. Each mode runs in its own process so
+the peak memory is its own.
+
+The backlog is split 40% copy, 40% tar, 10% md5 and 10% ingest records. The SQLite database is built on the first run
+and reused (pass a new `--db` to rebuild it with a different size).
+
+Usage:
+    PYTHONPATH=src:../lapinpy/src python benchmarks/bench_startup.py [--rows 5000000] [--chunk-size 50000] \\
+        [--db /tmp/jamo_backlog.sqlite] [--modes eager chunked]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+from jamo import task
+from jamo.tape import Tape
+
+COPY_READY = 2
+TAR_READY = 14
+REGISTERED = 1
+
+
+class BacklogTape:
+    """Stand-in for `Tape` that answers its queries from SQLite, with the same dict records as the MySQL cursor.
+    """
+    _add_all_to_queue_by_feature = Tape._add_all_to_queue_by_feature
+    _add_to_queue_by_feature = Tape._add_to_queue_by_feature
+    _get_tar_record_path = Tape._get_tar_record_path
+    _query_chunked = Tape._query_chunked
+
+    def __init__(self, db: str, chunk_size: int):
+        self.connection = sqlite3.connect(db, check_same_thread=False)
+        self.connection.row_factory = lambda cursor, row: {column[0]: value for column, value in
+                                                           zip(cursor.description, row)}
+        self.connection.create_function('unix_timestamp', 1, lambda value: 0)
+        self.lock = threading.Lock()
+        self.config = SimpleNamespace(startup_chunk_size=chunk_size)
+        self.file_status = SimpleNamespace(REGISTERED=REGISTERED, COPY_READY=COPY_READY, TAR_READY=TAR_READY)
+        self.queue_status = SimpleNamespace(REGISTERED=REGISTERED)
+        self.remote_path_prefixes = {'/remote/source': 'remote'}
+        self.remote_path_filter = '^/remote/source'
+
+    def query(self, sql, values=None, uselimit=True):
+        with self.lock:
+            return self.connection.execute(sql, values or []).fetchall()
+
+    def copy_selected(self, record):
+        return {}
+
+    tar_selected = md5_selected = transfer_selected = copy_selected
+
+
+def build(db: str, rows: int, seed: int) -> None:
+    rng = random.Random(seed)
+    connection = sqlite3.connect(db)
+    connection.executescript('''
+        create table file (file_id integer primary key, transaction_id int, file_name text, file_path text,
+            origin_file_name text, origin_file_path text, file_size int, file_date text, file_owner text,
+            file_group text, file_permissions text, local_purge_days int, md5sum text, file_status_id int,
+            created_dt text, modified_dt text, validate_mode int, user_save_till text, metadata_id text,
+            auto_uncompress int, remote_purge_days int, transfer_mode int, source text, division text);
+        create index file_status on file (file_status_id, division, file_id);
+        create table md5_queue (md5_queue_id integer primary key, file_path text, queue_status_id int, file_size int,
+            md5sum text, dt_modified text, callback text, division text);
+        create index md5_status on md5_queue (queue_status_id, division, md5_queue_id);
+        create table file_ingest (file_ingest_id integer primary key, file_ingest_status_id int, file_id int,
+            file_size int, validate_mode int, transfer_mode int, local_purge_days int, auto_uncompress int,
+            _put_mode int, _is_folder int, _is_file int, _dt_modified text, _file text, _services text,
+            _destination text, _call_source text, _status text, _callback text, metadata_id text,
+            _metadata_ingest_id text, file_date text, file_owner text, file_group text, file_permissions text,
+            file_name text, file_path text, source text, division text);
+        create index ingest_status on file_ingest (file_ingest_status_id, division, file_ingest_id);
+        create table pull_queue (pull_queue_id integer primary key, file_id int, volume text, priority int,
+            queue_status_id int, dt_modified text);
+    ''')
+    files = int(rows * 0.8)
+
+    def file_rows():
+        for file_id in range(1, files + 1):
+            project = rng.choice(['sdm/illumina', 'img/submissions', 'rqc/analyses', 'sdm/pacbio'])
+            path = f'/global/dna/dm_archive/{project}/{file_id // 1000000:02}/{file_id // 10000 % 100:02}'
+            origin = (f'/remote/source/{project}' if rng.random() < 0.1 else f'/global/cfs/cdirs/{project}/run')
+            name = f'{file_id}.{rng.randrange(10 ** 6)}.fastq.gz'
+            yield (file_id, file_id // 100, name, path, name, origin, rng.randrange(10 ** 10), '2022-04-28 15:34:51',
+                   'qc_user', 'qc_user', '0100644', 90, None, COPY_READY if file_id % 2 else TAR_READY,
+                   '2022-04-28 15:34:51', '2022-05-05 13:54:19', 0, '2022-06-05 13:54:19',
+                   f'{rng.getrandbits(96):024x}', 0, None, 0, None, 'jgi')
+
+    def md5_rows():
+        for md5_queue_id in range(1, rows // 10 + 1):
+            yield (md5_queue_id, f'/global/dna/dm_archive/sdm/illumina/{md5_queue_id}.fastq.gz', REGISTERED,
+                   rng.randrange(10 ** 10), None, '2022-05-05 13:54:19', f'local://put_file/{md5_queue_id}', 'jgi')
+
+    def ingest_rows():
+        for file_ingest_id in range(1, rows // 10 + 1):
+            source = f'/global/cfs/cdirs/rqc/pipelines/filter/archive/{file_ingest_id}.filtered-report.txt'
+            yield (file_ingest_id, REGISTERED, files + file_ingest_id, rng.randrange(10 ** 8), 0, 0, 90, 0, 0, 0, 1,
+                   '2022-05-05 13:54:19', source, '[1]', f'/global/dna/dm_archive/rqc/{file_ingest_id}.txt', 'file',
+                   'new', 'file_ingest', f'{rng.getrandbits(96):024x}', f'{rng.getrandbits(96):024x}',
+                   '2022-04-28 15:34:51', 'qc_user', 'qc_user', '0100755', f'{file_ingest_id}.filtered-report.txt',
+                   '/global/cfs/cdirs/rqc/pipelines/filter/archive', None, 'jgi')
+
+    connection.executemany(f'insert into file values ({",".join("?" * 24)})', file_rows())
+    connection.executemany(f'insert into md5_queue values ({",".join("?" * 8)})', md5_rows())
+    connection.executemany(f'insert into file_ingest values ({",".join("?" * 28)})', ingest_rows())
+    connection.commit()
+    connection.close()
+
+
+def eager(tape: BacklogTape, division: Tape.Division) -> None:
+    """Load the backlog as `Tape.Division` did before it was hydrated in chunks.
+    """
+    tape._add_all_to_queue_by_feature(division.ingest_queue, tape.query(
+        'select * from file_ingest where file_ingest_status_id = ? and division = ?', [REGISTERED, 'jgi']),
+        lambda record: record.get('_file'))
+    tape._add_all_to_queue_by_feature(division.copy_queue, tape.query(
+        'select * from file where file_status_id = ? and division = ?', [COPY_READY, 'jgi']),
+        lambda record: record.get('origin_file_path'))
+    tape._add_all_to_queue_by_feature(division.tar_queue, tape.query(
+        'select * from file where file_status_id = ? and division = ?', [TAR_READY, 'jgi']),
+        tape._get_tar_record_path)
+    division.md5_queue.add_all(tape.query(
+        'select * from md5_queue where queue_status_id = ? and division = ?', [REGISTERED, 'jgi']))
+
+
+def run(mode: str, db: str, chunk_size: int) -> dict:
+    tape = BacklogTape(db, chunk_size)
+    bounds = tape.query('select (select max(file_id) from file) as file_id, '
+                        '(select max(file_ingest_id) from file_ingest) as file_ingest_id, '
+                        '(select max(md5_queue_id) from md5_queue) as md5_queue_id')[0]
+    # SQLite uses `?` placeholders
+    query = tape.query
+    tape.query = lambda sql, values=None, uselimit=True: query(sql.replace('%s', '?'), values)
+    start = time.perf_counter()
+    division = Tape.Division('jgi', tape, {'default_queue_features': {'copy': ['dna_w'], 'tar': ['compute'],
+                                                                       'md5': ['compute'], 'ingest': ['nersc']}})
+    if mode == 'eager':
+        eager(tape, division)
+        ready = first_copy = time.perf_counter() - start
+        hydrated = ready
+    else:
+        thread = threading.Thread(target=division.hydrate, args=(tape, bounds))
+        thread.start()
+        ready = time.perf_counter() - start
+        while division.copy_queue.get_size() == 0 and thread.is_alive():
+            time.sleep(0.001)
+        first_copy = time.perf_counter() - start
+        thread.join()
+        hydrated = time.perf_counter() - start
+    queued = sum(queue.get_size() for queue in division.task_manager.queues if isinstance(queue, task.Queue))
+    return {'ready': ready, 'first_copy': first_copy, 'hydrated': hydrated, 'queued': queued,
+            'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000000, help='Records in the synthetic backlog')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='`startup_chunk_size`')
+    parser.add_argument('--db', default='/tmp/jamo_backlog.sqlite')
+    parser.add_argument('--modes', nargs='+', default=['eager', 'chunked'], choices=['eager', 'chunked'])
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        print(json.dumps(run(args.run, args.db, args.chunk_size)))
+        return
+    if not os.path.exists(args.db):
+        start = time.perf_counter()
+        build(args.db, args.rows, args.seed)
+        print(f'built {args.db} with {args.rows} backlog records in {time.perf_counter() - start:.0f}s')
+    print(f'{"mode":>8} {"ready s":>8} {"first copy s":>13} {"hydrated s":>11} {"queued":>9} {"max RSS MB":>11}')
+    for mode in args.modes:
+        process = subprocess.run([sys.executable, __file__, '--run', mode, '--db', args.db,
+                                  '--chunk-size', str(args.chunk_size)], stdout=subprocess.PIPE, text=True)
+        if process.returncode != 0:
+            print(f'{mode:>8} failed with exit code {process.returncode} (out of memory?)')
+            continue
+        result = json.loads(process.stdout)
+        print(f'{mode:>8} {result["ready"]:>8.2f} {result["first_copy"]:>13.2f} {result["hydrated"]:>11.2f} '
+              f'{result["queued"]:>9} {result["max_rss_mb"]:>11.0f}')
+
+
+if __name__ == '__main__':
+    main()
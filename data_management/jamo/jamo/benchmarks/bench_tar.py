@@ -0,0 +1,192 @@
+"""Benchmark creating the tar of a folder with `DTService.run_tar` on a synthetic tree of small files.
+
+Builds a tree of `--files` files of `--file-bytes` bytes, `--files-per-folder` per folder, where `--link-fraction` of
+the files are symlinks to files outside of the tree (half of them archived already). It then tars the tree twice:
+- with the previous implementation, pasted below as `legacy_tar`. It walked the tree with `os.walk`, added each file with
+  `tarfile.add` and looked up each external symlink with its own `api/tape/latestfile` request;
+- with `DTService.run_tar`, which scans the tree in parallel, reads the files ahead of a buffered tar writer and looks
+  up the external symlinks with one `api/tape/latestfiles` request.
+
+Each request sleeps `--latency-ms`. The page cache is dropped between runs if `/proc/sys/vm/drop_caches` is writable,
+so both runs read a cold tree. The tree is built on the first run and reused.
+
+Usage:
+    PYTHONPATH=src:../lapinpy/src:../sdm-common/lib/python python benchmarks/bench_tar.py [--files 500000] \\
+        [--files-per-folder 100] [--file-bytes 256] [--link-fraction 0.01] [--latency-ms 5] \\
+        [--dir /tmp/jamo_bench_tar]
+"""
+import argparse
+import copy
+import logging
+import os
+import random
+import shutil
+import tarfile
+import time
+from types import SimpleNamespace
+
+from jamo.dt_service import DTService
+
+
+class FakeCurl:
+    """Answers the requests `run_tar` makes, sleeping `latency` seconds per request.
+    """
+
+    def __init__(self, archived: set[str], latency: float):
+        self.archived = archived
+        self.latency = latency
+        self.requests = 0
+
+    def get(self, url, **kwargs):
+        self.requests += 1
+        time.sleep(self.latency)
+        if kwargs.get('file') in self.archived:
+            return {'metadata_id': kwargs.get('file')}
+
+    def post(self, url, **kwargs):
+        self.requests += 1
+        time.sleep(self.latency)
+        if url == 'api/tape/latestfiles':
+            return {file: {'metadata_id': file} for file in kwargs.get('files') if file in self.archived}
+
+    def put(self, url, **kwargs):
+        self.requests += 1
+        time.sleep(self.latency)
+
+
+def legacy_tar(self, root_folder, tar_file, ignore, extract_keys, index):
+    """The folder scan and tar creation of the previous `DTService.run_tar`.
+    """
+    tar = tarfile.open(tar_file, 'w')
+    file_idx = []
+    metadata_records = []
+    for root, dirs, files in os.walk(root_folder):
+        new_dirs = copy.copy(dirs)
+        for folder in new_dirs:
+            if os.path.join(root, folder)[len(root_folder) + 1:] in ignore:
+                dirs.remove(folder)
+
+        for file_name in files:
+            file = os.path.join(root, file_name)
+            tar_dest = file[len(root_folder) + 1:]
+            if ignore is not None and tar_dest in ignore:
+                continue
+
+            if os.path.islink(file):
+                realpath = os.path.realpath(file)
+                if realpath.startswith(root_folder + '/'):
+                    info = tarfile.TarInfo(tar_dest)
+                    info.size = 0
+                    info.mode = 493
+                    info.type = tarfile.SYMTYPE
+                    if file == realpath:
+                        continue
+                    info.linkname = self.get_relative_link(file, realpath)
+                    tar.addfile(info)
+                    continue
+                else:
+                    rec = self.sdm_curl.get('api/tape/latestfile', file=realpath)
+                    if rec is None:
+                        if os.path.exists(realpath):
+                            file = realpath
+                        else:
+                            continue
+                    else:
+                        tar_folder, tar_file_name = os.path.split(tar_dest)
+                        metadata_records.append(
+                            {'file_name': tar_file_name, 'file_path': tar_folder, 'id': rec.get('metadata_id')})
+                        continue
+
+            if index and len(files) < 100:
+                tar_folder, tar_file_name = os.path.split(tar_dest)
+                file_idx.append({'file_name': tar_file_name, 'file_path': tar_folder})
+            if os.access(file, os.R_OK):
+                tar.add(file, arcname=tar_dest)
+    tar.close()
+    return file_idx + metadata_records
+
+
+def build(directory: str, files: int, files_per_folder: int, file_bytes: int, link_fraction: float,
+          seed: int) -> set[str]:
+    rng = random.Random(seed)
+    root = os.path.join(directory, 'tree')
+    outside = os.path.join(directory, 'outside')
+    marker = os.path.join(directory, f'built_{files}_{files_per_folder}_{file_bytes}_{link_fraction}')
+    archived = set()
+    if os.path.exists(marker):
+        with open(marker) as f:
+            return set(f.read().split('\n')) - {''}
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(outside)
+    data = os.urandom(file_bytes)
+    for i in range(files):
+        folder = os.path.join(root, f'{i // files_per_folder // 100:04}', f'{i // files_per_folder % 100:02}')
+        if i % files_per_folder == 0:
+            os.makedirs(folder)
+        file = os.path.join(folder, f'file_{i}.dat')
+        if rng.random() < link_fraction:
+            target = os.path.join(outside, f'file_{i}.dat')
+            with open(target, 'wb') as f:
+                f.write(data)
+            if rng.random() < 0.5:
+                archived.add(target)
+            os.symlink(target, file)
+        else:
+            with open(file, 'wb') as f:
+                f.write(data)
+    with open(marker, 'w') as f:
+        f.write('\n'.join(sorted(archived)))
+    return archived
+
+
+def drop_caches() -> bool:
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3\n')
+        return True
+    except OSError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=500000, help='Files in the tree')
+    parser.add_argument('--files-per-folder', type=int, default=100, help='Files per folder')
+    parser.add_argument('--file-bytes', type=int, default=256, help='Size of each file')
+    parser.add_argument('--link-fraction', type=float, default=0.01,
+                        help='Fraction of the files that are symlinks to files outside of the tree')
+    parser.add_argument('--latency-ms', type=float, default=5, help='Round trip time per request in milliseconds')
+    parser.add_argument('--dir', default='/tmp/jamo_bench_tar')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    archived = build(args.dir, args.files, args.files_per_folder, args.file_bytes, args.link_fraction, args.seed)
+    print(f'tree of {args.files} files ready in {time.perf_counter() - start:.0f}s, {args.latency_ms}ms per request')
+    root = os.path.join(args.dir, 'tree')
+    tar_file = os.path.join(args.dir, 'tree.1.tar')
+    logger = logging.getLogger('bench_tar')
+    logger.setLevel(logging.ERROR)
+    print(f'{"run_tar":>8} {"requests":>9} {"seconds":>8} {"files/s":>8} {"tar MB":>7}')
+    for name in ('legacy', 'parallel'):
+        cold = drop_caches()
+        curl = FakeCurl(archived, args.latency_ms / 1000)
+        runner = SimpleNamespace(sdm_curl=curl, logger=logger, temp_dir=args.dir, remote_sources={},
+                                 cv=SimpleNamespace(file_status=SimpleNamespace(TAR_COMPLETE=16, COPY_READY=2,
+                                                                                BACKUP_READY=6)))
+        runner.get_relative_link = lambda link_loc, file_loc: DTService.get_relative_link(runner, link_loc, file_loc)
+        runner._get_remote_config = lambda file_path, record: None
+        start = time.perf_counter()
+        if name == 'legacy':
+            legacy_tar(runner, root, tar_file, [], {}, 1)
+        else:
+            DTService.run_tar(runner, {'file_name': 'tree', 'file_id': 1, 'file_path': args.dir,
+                                       'origin_file_name': None, 'index': 1, '_id': 'id'})
+        seconds = time.perf_counter() - start
+        print(f'{name:>8} {curl.requests:>9} {seconds:>8.1f} {args.files / seconds:>8.0f} '
+              f'{os.path.getsize(tar_file) / 1e6:>7.0f}' + ('' if cold else '  (page cache not dropped)'))
+        os.remove(tar_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Benchmark the small task throughput of one dt_service runner when leasing batches of tasks.
+
+A runner (`DTService.runner`) drains a queue of small md5 tasks through `Tape.post_nexttask` with a simulated round
+trip latency for every request (HTTP, auth and the request handling in the tape service), once getting one task per
+request and once per `--max-tasks` batch size. Each task hashes `--task-bytes` of data in memory, so the run time is
+the request overhead plus the work.
+
+Usage:
+    PYTHONPATH=src:../lapinpy/src:../sdm-common/lib/python python benchmarks/bench_task_lease.py [--tasks 2000] \\
+        [--latency-ms 20] [--task-bytes 65536] [--max-tasks 1 10 50 100]
+"""
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import time
+from types import SimpleNamespace
+
+from jamo import task
+from jamo.dt_service import DTService
+from jamo.tape import Tape
+
+
+class FakeCurl:
+    """Routes the runner's requests to the `Tape` endpoints, sleeping `latency` seconds per request.
+    """
+
+    def __init__(self, server: SimpleNamespace, latency: float):
+        self.server = server
+        self.latency = latency
+        self.requests = 0
+
+    def post(self, url, **kwargs):
+        return self._call(Tape.post_nexttask, url, kwargs)
+
+    def put(self, url, **kwargs):
+        endpoints = {'api/tape/taskcomplete': Tape.put_taskcomplete, 'api/tape/leasecomplete': Tape.put_leasecomplete,
+                     'api/tape/leaseheartbeat': Tape.put_leaseheartbeat, 'api/tape/task': Tape.put_task}
+        return self._call(endpoints.get(url), url, kwargs)
+
+    def _call(self, endpoint, url, kwargs):
+        self.requests += 1
+        time.sleep(self.latency)
+        return endpoint(self.server, None, kwargs)
+
+
+def run(tasks: int, latency: float, task_bytes: int, max_tasks: int) -> tuple[int, float]:
+    md5_queue = task.Queue('md5', 5, default_features=['compute'])
+    md5_queue.add_all([{'md5_queue_id': i, 'file_path': f'/path/to/file_{i}', 'file_size': task_bytes}
+                       for i in range(tasks)])
+    task_manager = task.TaskManager('jgi')
+    task_manager.set_queues(md5_queue)
+    server = SimpleNamespace(divisions={'jgi': SimpleNamespace(task_manager=task_manager, md5_queue=md5_queue)},
+                             config=SimpleNamespace(remote_sources=[]))
+    curl = FakeCurl(server, latency)
+    payload = bytes(task_bytes)
+    logger = logging.getLogger('bench_task_lease')
+    logger.setLevel(logging.WARNING)
+    runner = SimpleNamespace(sdm_curl=curl, features=['compute'], tasks=['md5'], service_id=1, division_name='jgi',
+                             max_tasks=max_tasks, max_bytes=None, hash_workers=1, pending_md5={}, logger=logger,
+                             LEASE_HEARTBEAT_INTERVAL=DTService.LEASE_HEARTBEAT_INTERVAL,
+                             task_runners={'md5': lambda data: hashlib.md5(payload).hexdigest()},
+                             hsi_pool=SimpleNamespace(close=lambda: None))
+    runner.run_leases = lambda stop, pid: DTService.run_leases(runner, stop, pid)
+    runner._heartbeat_lease = lambda lease_id, done, lost: DTService._heartbeat_lease(runner, lease_id, done, lost)
+    start = time.perf_counter()
+    DTService.runner(runner, multiprocessing.Value('i', 0), multiprocessing.Value('i', 0))
+    seconds = time.perf_counter() - start
+    assert md5_queue.get_size() == 0 and not task_manager.current_tasks and not task_manager.leases
+    return curl.requests, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, default=2000, help='Small tasks queued')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Round trip time per request in milliseconds')
+    parser.add_argument('--task-bytes', type=int, default=65536, help='Bytes hashed per task')
+    parser.add_argument('--max-tasks', type=int, nargs='+', default=[1, 10, 50, 100], help='Batch sizes to run')
+    args = parser.parse_args()
+    print(f'{args.tasks} tasks of {args.task_bytes} bytes, {args.latency_ms}ms per request')
+    print(f'{"max tasks":>9} {"requests":>9} {"seconds":>8} {"tasks/s":>8} {"speedup":>8}')
+    baseline = None
+    for max_tasks in args.max_tasks:
+        requests, seconds = run(args.tasks, args.latency_ms / 1000, args.task_bytes, max_tasks)
+        throughput = args.tasks / seconds
+        baseline = baseline or throughput
+        print(f'{max_tasks:>9} {requests:>9} {seconds:>8.2f} {throughput:>8.0f} {throughput / baseline:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
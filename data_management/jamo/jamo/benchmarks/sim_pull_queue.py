@@ -0,0 +1,145 @@
+"""Replay a `pull_queue` trace against the pull queue scheduling policies and report tape mounts per restored TB.
+
+Every policy is simulated with the same `PullQueueIndex` the tape service uses: a free drive takes the volume
+`next_volume` selects and restores every request registered for it by then (as `Tape.pull_selected` does), paying a
+mount plus a seek per file and the transfer time. `immediate` hands a volume out as soon as it has a request; the
+other policies hold each volume for a window per priority (`pull_queue_hold_windows` in the division configuration).
+
+A trace is a tab separated file with a header and the columns `pull_queue_id`, `volume`, `priority`, `registered`
+(epoch seconds) and `file_size`, which can be exported with:
+
+    select q.pull_queue_id, q.volume, q.priority, unix_timestamp(min(h.dt_begin)) as registered, f.file_size
+    from pull_queue q join file f using(file_id)
+    join pull_queue_status_history h on h.pull_queue_id = q.pull_queue_id and h.queue_status_id = 1
+    where q.volume is not null and h.dt_begin >= now() - interval 30 day group by q.pull_queue_id
+
+Without a trace, a synthetic one with bursts of requests for the same volume is generated.
+
+Usage:
+    PYTHONPATH=src python benchmarks/sim_pull_queue.py [--trace pull_queue.tsv] [--drives 4] \\
+        [--policy hold_5m=0:300,1:300,2:300] [--policy hold_30m=0:1800,1:1800,2:1800]
+"""
+import argparse
+import csv
+import heapq
+import random
+import statistics
+
+from jamo.pull_index import PullQueueIndex
+
+
+def load_trace(path: str) -> list[dict]:
+    with open(path) as f:
+        return sorted(({'pull_queue_id': int(row['pull_queue_id']), 'volume': row['volume'],
+                        'priority': int(row['priority']), 'registered': float(row['registered']),
+                        'file_size': int(row['file_size'])} for row in csv.DictReader(f, delimiter='\t')),
+                      key=lambda request: (request['registered'], request['pull_queue_id']))
+
+
+def synthetic_trace(requests: int, volumes: int, seed: int) -> list[dict]:
+    """Bursts of 1 to 50 requests for one volume spread over up to 10 minutes, a burst starting every 10 minutes on
+    average, with file sizes between 10MB and 10GB.
+    """
+    rng = random.Random(seed)
+    trace = []
+    start = 0.0
+    while len(trace) < requests:
+        start += rng.expovariate(1 / 600.0)
+        volume = f'AG{rng.randrange(volumes):04}'
+        priority = rng.choice([0, 1, 1, 2])
+        for _ in range(min(rng.randint(1, 50), requests - len(trace))):
+            trace.append({'pull_queue_id': len(trace) + 1, 'volume': volume, 'priority': priority,
+                          'registered': start + rng.uniform(0, 600),
+                          'file_size': int(10 ** rng.uniform(7, 10))})
+    return sorted(trace, key=lambda request: (request['registered'], request['pull_queue_id']))
+
+
+def parse_policy(spec: str) -> tuple[str, dict[int, float]]:
+    name, _, windows = spec.partition('=')
+    return name, {int(priority): float(window) for priority, window in
+                  (item.split(':') for item in windows.split(',') if item)}
+
+
+def simulate(trace: list[dict], hold_windows: dict[int, float], drives: int, mount_seconds: float,
+             seek_seconds: float, rate: float) -> dict:
+    index = PullQueueIndex()
+    sizes = {request['pull_queue_id']: request['file_size'] for request in trace}
+    registered = {request['pull_queue_id']: request['registered'] for request in trace}
+    priorities = sorted({request['priority'] for request in trace})
+    busy = []  # heap of (time the drive is free, volume)
+    locked = set()
+    waits = []
+    mounts = 0
+    restored = 0
+    now = trace[0]['registered'] if trace else 0.0
+    position = 0
+    while position < len(trace) or len(index) or busy:
+        while position < len(trace) and trace[position]['registered'] <= now:
+            request = trace[position]
+            index.add(request['pull_queue_id'], request['volume'], request['priority'], request['registered'])
+            position += 1
+        while busy and busy[0][0] <= now:
+            locked.discard(heapq.heappop(busy)[1])
+        while len(busy) < drives:
+            selected = index.next_volume(priorities, locked, hold_windows, now)
+            if selected is None:
+                break
+            volume = selected['volume']
+            batch = index.get_volume_requests(volume)
+            index.remove(batch)
+            batch_bytes = sum(sizes[pull_queue_id] for pull_queue_id in batch)
+            done = now + mount_seconds + seek_seconds * len(batch) + batch_bytes / rate
+            heapq.heappush(busy, (done, volume))
+            locked.add(volume)
+            mounts += 1
+            restored += batch_bytes
+            waits.extend(done - registered[pull_queue_id] for pull_queue_id in batch)
+        # Advance to the next arrival, drive becoming free or hold window ending
+        wakeups = []
+        if position < len(trace):
+            wakeups.append(trace[position]['registered'])
+        if busy:
+            wakeups.append(busy[0][0])
+        if hold_windows and len(busy) < drives:
+            for volume in index.get_volumes():
+                if volume not in locked:
+                    wakeups.extend(until for until in (index.held_until(volume, priority, window)
+                                                       for priority, window in hold_windows.items())
+                                   if until is not None and until > now)
+        if not wakeups:
+            break
+        now = min(wakeups)
+    terabytes = restored / 1e12
+    waits.sort()
+    return {'mounts': mounts, 'terabytes': terabytes, 'mounts_per_tb': mounts / terabytes if terabytes else 0.0,
+            'mean_wait': statistics.mean(waits) if waits else 0.0,
+            'p95_wait': waits[int(len(waits) * 0.95)] if waits else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trace', help='Tab separated pull_queue trace (default: synthetic)')
+    parser.add_argument('--policy', action='append', default=[], type=parse_policy,
+                        help='NAME=PRIORITY:SECONDS[,PRIORITY:SECONDS...], can be repeated')
+    parser.add_argument('--drives', type=int, default=4)
+    parser.add_argument('--mount-seconds', type=float, default=120, help='Mount, load and unmount time per volume')
+    parser.add_argument('--seek-seconds', type=float, default=10, help='Locate time per file')
+    parser.add_argument('--rate-mb', type=float, default=300, help='Read rate in MB/s')
+    parser.add_argument('--requests', type=int, default=20000, help='Requests in the synthetic trace')
+    parser.add_argument('--volumes', type=int, default=2000, help='Volumes in the synthetic trace')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    trace = load_trace(args.trace) if args.trace else synthetic_trace(args.requests, args.volumes, args.seed)
+    policies = [('immediate', {})] + (args.policy or [('hold_5m', {0: 300, 1: 300, 2: 300}),
+                                                      ('hold_30m', {0: 1800, 1: 1800, 2: 1800})])
+    print(f'{len(trace)} requests, {len({request["volume"] for request in trace})} volumes, {args.drives} drives')
+    print(f'{"policy":>12} {"mounts":>8} {"TB":>8} {"mounts/TB":>10} {"mean wait h":>12} {"p95 wait h":>11}')
+    for name, hold_windows in policies:
+        result = simulate(trace, hold_windows, args.drives, args.mount_seconds, args.seek_seconds,
+                          args.rate_mb * 1e6)
+        print(f'{name:>12} {result["mounts"]:>8} {result["terabytes"]:>8.2f} {result["mounts_per_tb"]:>10.1f} '
+              f'{result["mean_wait"] / 3600:>12.2f} {result["p95_wait"] / 3600:>11.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+-- Repository footprint totals kept up to date by triggers on `file`, replacing the full table scan done by
+-- Tape.repository_footprint. Set @dm_archive_root to the `dm_archive_root` of the tape config before running.
+SET @dm_archive_root = '/global/dna/dm_archive';
+
+create table if not exists file_footprint (
+    division varchar(64) not null,
+    file_status_id tinyint unsigned not null,
+    slot tinyint unsigned not null,
+    files bigint not null default 0,
+    disk_usage bigint not null default 0,
+    primary key (division, file_status_id, slot)
+) ENGINE = InnoDB DEFAULT CHARSET=latin1;
+
+create table if not exists file_footprint_root (
+    root varchar(256) not null primary key
+) ENGINE = InnoDB DEFAULT CHARSET=latin1;
+
+insert ignore into file_footprint_root (root) values (@dm_archive_root);
+
+DELIMITER $$
+
+DROP TRIGGER IF EXISTS file_footprint_insert_trigger$$
+CREATE TRIGGER file_footprint_insert_trigger
+    AFTER INSERT ON file
+    FOR EACH ROW
+    BEGIN
+        IF EXISTS (SELECT 1 FROM file_footprint_root WHERE NEW.file_path LIKE CONCAT(root, '%')) THEN
+            INSERT INTO file_footprint (division, file_status_id, slot, files, disk_usage)
+            VALUES (NEW.division, NEW.file_status_id, NEW.file_id % 16, 1,
+                    IF(NEW.file_size < 384, 512, CEIL(NEW.file_size / 32768.0) * 32768))
+            ON DUPLICATE KEY UPDATE files = files + 1, disk_usage = disk_usage + VALUES(disk_usage);
+        END IF;
+    END;
+$$
+
+DROP TRIGGER IF EXISTS file_footprint_update_trigger$$
+CREATE TRIGGER file_footprint_update_trigger
+    AFTER UPDATE ON file
+    FOR EACH ROW
+    BEGIN
+        IF NOT (OLD.file_status_id <=> NEW.file_status_id AND OLD.division <=> NEW.division
+                AND OLD.file_path <=> NEW.file_path AND OLD.file_size <=> NEW.file_size) THEN
+            IF EXISTS (SELECT 1 FROM file_footprint_root WHERE OLD.file_path LIKE CONCAT(root, '%')) THEN
+                INSERT INTO file_footprint (division, file_status_id, slot, files, disk_usage)
+                VALUES (OLD.division, OLD.file_status_id, OLD.file_id % 16, -1,
+                        -IF(OLD.file_size < 384, 512, CEIL(OLD.file_size / 32768.0) * 32768))
+                ON DUPLICATE KEY UPDATE files = files + VALUES(files), disk_usage = disk_usage + VALUES(disk_usage);
+            END IF;
+            IF EXISTS (SELECT 1 FROM file_footprint_root WHERE NEW.file_path LIKE CONCAT(root, '%')) THEN
+                INSERT INTO file_footprint (division, file_status_id, slot, files, disk_usage)
+                VALUES (NEW.division, NEW.file_status_id, NEW.file_id % 16, 1,
+                        IF(NEW.file_size < 384, 512, CEIL(NEW.file_size / 32768.0) * 32768))
+                ON DUPLICATE KEY UPDATE files = files + 1, disk_usage = disk_usage + VALUES(disk_usage);
+            END IF;
+        END IF;
+    END;
+$$
+
+DROP TRIGGER IF EXISTS file_footprint_delete_trigger$$
+CREATE TRIGGER file_footprint_delete_trigger
+    AFTER DELETE ON file
+    FOR EACH ROW
+    BEGIN
+        IF EXISTS (SELECT 1 FROM file_footprint_root WHERE OLD.file_path LIKE CONCAT(root, '%')) THEN
+            INSERT INTO file_footprint (division, file_status_id, slot, files, disk_usage)
+            VALUES (OLD.division, OLD.file_status_id, OLD.file_id % 16, -1,
+                    -IF(OLD.file_size < 384, 512, CEIL(OLD.file_size / 32768.0) * 32768))
+            ON DUPLICATE KEY UPDATE files = files + VALUES(files), disk_usage = disk_usage + VALUES(disk_usage);
+        END IF;
+    END;
+$$
+
+DELIMITER ;
+
+-- Initial totals, Tape.reconcile_repository_footprint corrects for any file changed while this runs
+delete from file_footprint;
+insert into file_footprint (division, file_status_id, slot, files, disk_usage)
+select division, file_status_id, 0, count(*), ifnull(sum(case when file_size < 384 then 512 else ceil(file_size/32768.0)*32768 end), 0)
+  from file
+ where file_path like concat(@dm_archive_root, '%')
+ group by 1, 2;
@@ -0,0 +1,5 @@
+-- Member index of the aggregated tars written by DTService.run_put, used to restore single members without staging
+-- and extracting the whole tar.
+alter table backup_record
+    add column tar_offset bigint unsigned default null after dt_to_release,
+    add column tar_size bigint unsigned default null after tar_offset;
@@ -0,0 +1,93 @@
+import concurrent.futures
+import hashlib
+import mmap
+import os
+from typing import Optional
+
+# Size of the read buffer, a multiple of the page size so that the buffer is page aligned (see `_buffer`)
+BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def _buffer(buffer_size: int) -> mmap.mmap:
+    # An anonymous map is page aligned, which lets the kernel read straight into it
+    return mmap.mmap(-1, max(mmap.PAGESIZE, buffer_size - buffer_size % mmap.PAGESIZE))
+
+
+def _advise_sequential(fd: int) -> None:
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+
+def copy_md5(from_file: str, to_file: str, buffer_size: int = BUFFER_SIZE) -> tuple[int, str]:
+    """Copy a file and compute the md5 of its content in the same pass, so the content is only read once.
+
+    :param from_file: Path of the file to copy
+    :param to_file: Path to copy the file to, it is created or truncated
+    :param buffer_size: Bytes to read at a time
+    :return: The number of bytes copied and the md5 hex digest
+    """
+    md5 = hashlib.md5()
+    copied = 0
+    buffer = _buffer(buffer_size)
+    view = memoryview(buffer)
+    try:
+        with open(from_file, 'rb', buffering=0) as source, open(to_file, 'wb', buffering=0) as destination:
+            _advise_sequential(source.fileno())
+            while True:
+                read = source.readinto(view)
+                if not read:
+                    break
+                with view[:read] as chunk:
+                    md5.update(chunk)
+                    written = 0
+                    while written < read:
+                        written += destination.write(chunk[written:])
+                copied += read
+    finally:
+        view.release()
+        buffer.close()
+    return copied, md5.hexdigest()
+
+
+def md5_file(file_path: str, buffer_size: int = BUFFER_SIZE) -> str:
+    """Compute the md5 of a file.
+
+    :param file_path: Path of the file
+    :param buffer_size: Bytes to read at a time
+    :return: The md5 hex digest
+    """
+    md5 = hashlib.md5()
+    buffer = _buffer(buffer_size)
+    view = memoryview(buffer)
+    try:
+        with open(file_path, 'rb', buffering=0) as f:
+            _advise_sequential(f.fileno())
+            while True:
+                read = f.readinto(view)
+                if not read:
+                    break
+                md5.update(view[:read])
+    finally:
+        view.release()
+        buffer.close()
+    return md5.hexdigest()
+
+
+def md5_files(file_paths: list[str], workers: int = 1, buffer_size: int = BUFFER_SIZE,
+              executor: Optional[concurrent.futures.Executor] = None) -> dict[str, concurrent.futures.Future]:
+    """Compute the md5 of several files, `workers` at a time. `hashlib` releases the GIL while hashing, so the files
+    are hashed in parallel by threads.
+
+    :param file_paths: Paths of the files
+    :param workers: Number of files to hash at the same time, ignored if `executor` is passed
+    :param buffer_size: Bytes to read at a time
+    :param executor: Executor to hash the files with, defaults to a thread pool of `workers` threads that is shut down
+        once the files are hashed
+    :return: Dictionary of file path to the future of its md5 hex digest
+    """
+    pool = executor or concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        return {file_path: pool.submit(md5_file, file_path, buffer_size) for file_path in dict.fromkeys(file_paths)}
+    finally:
+        if executor is None:
+            pool.shutdown(wait=False)
@@ -1,7 +1,8 @@
 from tempfile import TemporaryDirectory
 import re
 import argparse
-import copy
+import collections
+import concurrent.futures
 import datetime
 import multiprocessing
 import os
@@ -11,11 +12,15 @@ import signal
 import subprocess
 import sys
 import tarfile
+import threading
 import time
 import traceback
 import itertools
 
+from . import checksum
+from . import file_copy
 from . import hsi
+from . import tar_stream
 import sdm_logger
 from .hsi import HSI
 from sdm_curl import Curl
@@ -85,7 +90,12 @@ class HSIQueue(multiprocessing.Process):
 
 
 class DTService(object):
-    def __init__(self, curl, features, tasks, threads, debug, service_id, division_name, log_ext=None, email=None):
+    # Seconds between heartbeats of a lease on a batch of tasks
+    LEASE_HEARTBEAT_INTERVAL = 60
+
+    def __init__(self, curl, features, tasks, threads, debug, service_id, division_name, log_ext=None, email=None,
+                 max_tasks=1, max_bytes=None, hash_workers=1, pull_io_workers=4,
+                 hsi_sessions=1):
         name = '-'.join(x for x in ['dt_service', platform.node(), log_ext] if x)
         sdm_logger.config(f'{name}.log', emailTo=email, curl=curl)  # , backupCount=20)
         self.logger = sdm_logger.getLogger('dt_service')
@@ -97,7 +107,17 @@ class DTService(object):
         self.tasks = tasks
         self.service_id = service_id
         self.division_name = division_name
+        # Tasks (and their total bytes) to lease per request, 1 to get one task at a time
+        self.max_tasks = max_tasks
+        self.max_bytes = max_bytes
+        # Files hashed at the same time for the md5 tasks of a lease, and the md5s being computed by file path
+        self.hash_workers = hash_workers
+        self.pending_md5 = {}
+        # Tars of a volume pull whose members are written to their restore paths at the same time
+        self.pull_io_workers = pull_io_workers
         self.hsi_gone = {}
+        # Long-lived `hsi` sessions per server for metadata commands (`ls`), created by each runner process as needed
+        self.hsi_pool = hsi.HSIPool(size=hsi_sessions)
         self.hsi_list = [feature for feature in features if 'hsi' in feature]
         config = curl.get('api/core/settings/tape')
         self.temp_dir = os.getcwd()
@@ -166,6 +186,12 @@ class DTService(object):
         pid = os.getpid()
         with thread_count.get_lock():
             thread_count.value += 1
+        if self.max_tasks > 1:
+            self.run_leases(stop, pid)
+            self.hsi_pool.close()
+            with thread_count.get_lock():
+                thread_count.value -= 1
+            return
         while stop.value == 0:
             task = self.sdm_curl.post('api/tape/nexttask', features=self.features, tasks=self.tasks,
                                       previous_task_id=prev_task_id, service=self.service_id, returned=prev_ret,
@@ -187,9 +213,104 @@ class DTService(object):
 
         # set our last task to complete
         self.sdm_curl.put('api/tape/taskcomplete', task_id=prev_task_id, returned=prev_ret, division=self.division_name)
+        self.hsi_pool.close()
         with thread_count.get_lock():
             thread_count.value -= 1
 
+    def run_leases(self, stop, pid):
+        """Lease batches of up to `max_tasks` tasks (or `max_bytes` bytes) at a time and run them, reporting the results
+        of each batch when leasing the next one. The lease is kept alive from a background thread for as long as the
+        batch runs. If a resource is lost or a task fails to run, the tasks of the batch that were not run are put back
+        in their queue and the runner stops. If the lease is lost, the tape service has already taken its tasks back,
+        so the rest of the batch is dropped and the next batch is leased.
+
+        :param multiprocessing.Value stop: Set to 1 to stop the runner after the current batch
+        :param int pid: Process ID, for logging
+        """
+        def put_back(not_run):
+            for task_not_run in not_run:
+                if task_not_run.get('task_id') is None:
+                    # Not tracked by the task manager (prep and pull tasks)
+                    self.sdm_curl.put('api/tape/task', task=task_not_run)
+                else:
+                    requeue.append(task_not_run.get('task_id'))
+
+        lease_id = None
+        results = {}
+        requeue = []
+        stopped = False
+        while stop.value == 0 and not stopped:
+            lease = self.sdm_curl.post('api/tape/nexttask', features=self.features, tasks=self.tasks,
+                                       max_tasks=self.max_tasks, max_bytes=self.max_bytes, lease_id=lease_id,
+                                       results=results, requeue=requeue, service=self.service_id,
+                                       division=self.division_name)
+            lease_id, results, requeue = None, {}, []
+            if lease is None:
+                break
+            lease_id = lease.get('lease_id')
+            tasks = lease.get('tasks')
+            self.logger.info(f'lease {lease_id} with {len(tasks)} tasks was received, pid = {pid}')
+            if self.hash_workers > 1:
+                # Hash the files of the md5 tasks in parallel, `run_md5` waits for the result
+                self.pending_md5 = checksum.md5_files([task.get('data').get('file_path') for task in tasks
+                                                       if task.get('task') == 'md5'], self.hash_workers)
+            done, lost = threading.Event(), threading.Event()
+            if lease_id is not None:
+                threading.Thread(target=self._heartbeat_lease, args=(lease_id, done, lost),
+                                 name=f'heartbeat_{lease_id}', daemon=True).start()
+            try:
+                for i, task in enumerate(tasks):
+                    if lost.is_set():
+                        self.logger.warning(f'lease {lease_id} was lost, dropping its {len(tasks) - i} tasks not run, '
+                                            f'pid = {pid}')
+                        break
+                    try:
+                        ret = self.task_runners.get(task.get('task'))(task.get('data'))
+                    except ResourceLostException as e:  # noqa: F841
+                        put_back(tasks[i:])
+                        stopped = True
+                        break
+                    except Exception as e:
+                        # This probably should be a critical
+                        self.logger.error(f'failed to run task: {str(e)}, pid = {pid}')
+                        ret = None
+                        put_back(tasks[i + 1:])
+                        stopped = True
+                    if task.get('task_id') is not None:
+                        results[task.get('task_id')] = ret
+                    if stopped:
+                        break
+            finally:
+                done.set()
+            if lost.is_set():
+                # The tape service has taken the tasks of the lease back, their results are no longer wanted
+                lease_id, results, requeue = None, {}, []
+            for pending in self.pending_md5.values():
+                pending.cancel()
+            self.pending_md5 = {}
+
+        # report the results of our last batch
+        if lease_id is not None:
+            self.sdm_curl.put('api/tape/leasecomplete', lease_id=lease_id, results=results, requeue=requeue,
+                              division=self.division_name)
+
+    def _heartbeat_lease(self, lease_id: str, done: threading.Event, lost: threading.Event) -> None:
+        """Send a heartbeat for a lease every `LEASE_HEARTBEAT_INTERVAL` seconds until `done` is set.
+
+        :param lease_id: ID of the lease
+        :param done: Set once the batch has been run
+        :param lost: Set here when the tape service reports that the lease is no longer held
+        """
+        while not done.wait(self.LEASE_HEARTBEAT_INTERVAL):
+            try:
+                ret = self.sdm_curl.put('api/tape/leaseheartbeat', lease_id=lease_id, division=self.division_name)
+            except Exception as e:
+                self.logger.warning(f'failed to send the heartbeat of lease {lease_id}, ({repr(e)})')
+                continue
+            if ret is not None and not ret.get('active', True):
+                lost.set()
+                return
+
     def stop_threads(self):
         self.stop.value = 1
 
@@ -274,7 +395,7 @@ class DTService(object):
                         backup_records.append({'backup_record_id': file_item.get('backup_record_id'),
                                                'backup_record_status_id': self.cv.backup_record_status.TRANSFER_COMPLETE,
                                                'tar_record_id': tar_id, 'remote_file_name': rfile_name,
-                                               'remote_file_path': '.'})
+                                               'remote_file_path': '.', 'tar_size': file_stat.st_size})
                         if os.path.exists(os.path.join(file_list_loc, rfile_name)):
                             os.unlink(os.path.join(file_list_loc, rfile_name))
                         os.symlink(local_file, os.path.join(file_list_loc, rfile_name))
@@ -282,9 +403,20 @@ class DTService(object):
                 tar_location = os.path.join(self._get_sharded_path(service.get('default_path')),
                                             f'{self.to_folder_str(tar_id, 9, 3)[:-3]}{tar_id}.tar')
 
+                # Pass the members to `htar` as an input list, so they are written in the order of `backup_records`
+                # and the offset of each member can be recorded for single member restores
+                member_list = f'{file_list_loc}.list'
+                with open(member_list, 'w') as f:
+                    for backup_record in backup_records:
+                        f.write(f'./{backup_record.get("remote_file_name")}\n')
+                offsets = self._tar_member_offsets([(f'./{backup_record.get("remote_file_name")}',
+                                                     backup_record.get('tar_size')) for backup_record in backup_records])
+                for backup_record, offset in zip(backup_records, offsets):
+                    backup_record['tar_offset'] = offset
+
                 self.sdm_curl.put(f'api/tape/tar/{tar_id}', remote_path=tar_location)
                 put_cmd = ['htar', '-P', '-h', '-H', 'server=' + service.get('server'), '-cf', tar_location, '-T', '10',
-                           '.']
+                           '-L', member_list]
                 put_cmd = f'cd {file_list_loc}; {" ".join(put_cmd)}'
                 try:
                     if not self.debug:
@@ -305,6 +437,7 @@ class DTService(object):
                     return False
                 else:
                     shutil.rmtree(file_list_loc)
+                    os.remove(member_list)
                     return True
         elif service.get('type') == 'globus':
             return self._put_globus(service, in_file)
@@ -351,7 +484,9 @@ class DTService(object):
 
     def run_copy(self, in_file: dict[str, Any]) -> bool:
         """Runs the copy operation. It looks at the `tape`'s configuration to find any file path prefix mappings
-        that are configured as remote sources and copies the data via `rsync`, otherwise does a "local" copy.
+        that are configured as remote sources and copies the data via `rsync`, otherwise does a "local" copy with
+        `file_copy.copy_file`. A local copy computes the md5 of the file in the same pass and reports it with
+        `COPY_COMPLETE`.
 
         :param dict in_file: Dictionary for the file record and should contain values for the following keys:
             ['origin_file_path']: (str) Original file path for file (required)
@@ -363,6 +498,7 @@ class DTService(object):
         """
         from_file = os.path.join(in_file.get('origin_file_path'), in_file.get('origin_file_name'))
         to_file = os.path.join(in_file.get('file_path'), in_file.get('file_name'))
+        md5sum = None
         try:
             remote_config = self._get_remote_config(from_file, in_file)
             if remote_config is not None:
@@ -383,16 +519,21 @@ class DTService(object):
                     except Exception:
                         pass
                 temp_file = os.path.join(in_file.get('file_path'), '.' + in_file.get('file_name'))
-                shutil.copyfile(from_file, temp_file)
+                # The md5 is computed while copying, so the file does not need to be read again by an md5 task. The
+                # source is not disposable even if it is in our temporary directory, as it is only deleted once
+                # `COPY_COMPLETE` is recorded.
+                result = file_copy.copy_file(from_file, temp_file, md5=True, copy_stat=True)
+                self.logger.info(f'copied {from_file} to {to_file}, {result}')
+                copied_file_size, md5sum = result.size, result.md5sum
                 os.rename(temp_file, to_file)
-                shutil.copystat(from_file, to_file)
                 os.chmod(to_file, 0o640)
-                copied_file_size = os.path.getsize(to_file)
             if copied_file_size > -1 and in_file.get('file_size') != copied_file_size:
                 self.logger.warning(f'copy size is different for file {to_file}')
                 self.sdm_curl.put(f'api/tape/file/{in_file.get("file_id")}', data={'file_size': copied_file_size})
-            self.sdm_curl.put(f'api/tape/file/{in_file.get("file_id")}',
-                              data={'file_status_id': self.cv.file_status.COPY_COMPLETE})
+            data = {'file_status_id': self.cv.file_status.COPY_COMPLETE}
+            if md5sum is not None:
+                data['md5sum'] = md5sum
+            self.sdm_curl.put(f'api/tape/file/{in_file.get("file_id")}', data=data)
             # We delete the file only after a successful update to the database to `COPY_COMPLETE`, at which point the
             # file will no longer be needed
             temp_dir = self.temp_dir if remote_config is None else remote_config.get('path_temp')
@@ -410,17 +551,17 @@ class DTService(object):
     '''
         We are assuming that the file that is going
         be checked already because it should be.
-        return the md5 for the file using linux md5
+        return the md5 for the file, hashed in process
     '''
 
     def run_md5(self, in_file):
         file_path = in_file.get('file_path')
         try:
-            result = subprocess.run(['md5sum', file_path], stdout=subprocess.PIPE, check=True)
-            md5 = result.stdout.decode('utf-8').split(' ')[0]
+            pending = self.pending_md5.pop(file_path, None)
+            md5 = pending.result() if pending is not None else checksum.md5_file(file_path)
             data = {'md5sum': md5, 'queue_status_id': self.cv.queue_status.COMPLETE}
             self.sdm_curl.put(f'api/tape/md5/{in_file.get("md5_queue_id")}', data)
-        except subprocess.CalledProcessError:
+        except OSError:
             self.sdm_curl.put(f'api/tape/md5/{in_file.get("md5_queue_id")}',
                               data={'queue_status_id': self.cv.queue_status.FAILED})
             traceback.print_exc()
@@ -439,8 +580,8 @@ class DTService(object):
         """
 
         def put_pull_queue_status(recs: list[dict[str, Any]], queue_status_id: int) -> None:
-            for rec in recs:
-                self.sdm_curl.put(f'api/tape/pull/{rec.get("pull_queue_id")}', queue_status_id=queue_status_id)
+            self._put_pulls([{'pull_queue_id': rec.get('pull_queue_id'), 'queue_status_id': queue_status_id}
+                             for rec in recs])
 
         records_by_service_id = {}
         for record in records:
@@ -465,18 +606,19 @@ class DTService(object):
                 if not tape_files_to_records.get(tape_file, None):
                     tape_files_to_records[tape_file] = []
                 tape_files_to_records.get(tape_file).append(rec)
-            hsi_cmd = ['hsi', '-P', '-q', '-h', service.get('server')]
-            hsi_data = bytes(''.join([f'ls -P -N {f}\n' for f in tape_files_to_records]), 'utf-8')
+            hsi_commands = [f'ls -P -N {f}' for f in tape_files_to_records]
             hsi_output = ''
             tries = 1
             # Attempt a few times as this occasionally fails (according to existing code). Since we're doing a batch
-            # `ls`, we can't rely on the process exit code, since if some files are not found, it will return a `64`
-            # exit code (which happens to be overloaded). We make the assumption that if `stdout` has no lines
-            # containing `FILE` that something may have gone wrong on `hsi` side, so we retry.
+            # `ls`, some files may not be found, we make the assumption that if no output has lines containing `FILE`
+            # that something may have gone wrong on `hsi` side, so we retry.
             while 'FILE' not in hsi_output and tries <= 3:
                 tries += 1
-                result = subprocess.run(hsi_cmd, stdout=subprocess.PIPE, input=hsi_data)
-                hsi_output = result.stdout.decode('utf-8')
+                try:
+                    hsi_output = '\n'.join(self.hsi_pool.run(service.get('server'), hsi_commands))
+                except (hsi.HSIError, OSError) as e:
+                    self.logger.warning(f'failed to look up tape positions on {service.get("server")}, ({repr(e)})')
+            pull_updates = []
             for line in hsi_output.strip('\n').split('\n'):
                 if 'FILE\t' in line:
                     file_info = line.split('\t')
@@ -485,10 +627,11 @@ class DTService(object):
                     volume = file_info[5][:6]
                     (position_a, position_b) = file_info[4].split('+')
                     for rec in tape_files_to_records.get(tape_file):
-                        self.sdm_curl.put(f'api/tape/pull/{rec.get("pull_queue_id")}', volume=volume,
-                                          position_a=position_a, position_b=position_b,
-                                          queue_status_id=self.cv.queue_status.REGISTERED)
+                        pull_updates.append({'pull_queue_id': rec.get('pull_queue_id'), 'volume': volume,
+                                             'position_a': int(position_a), 'position_b': int(position_b),
+                                             'queue_status_id': self.cv.queue_status.REGISTERED})
                     del tape_files_to_records[tape_file]
+            self._put_pulls(pull_updates)
             if len(tape_files_to_records) > 0:
                 # Not all files prep info were retrieved, set anything not processed to `PREP_FAILED`.
                 put_pull_queue_status(list(itertools.chain(*tape_files_to_records.values())),
@@ -496,6 +639,164 @@ class DTService(object):
                 success = False
         return success
 
+    def _tar_member_offsets(self, members: list[tuple[str, int]]) -> list[int]:
+        """Compute the offset of the data of each member of a ustar archive written with the members in the given
+        order, as `htar` does for an input list: every member is a header followed by its data padded to the block size.
+
+        :param members: Name and size of each member
+        :return: Offset of the data of each member
+        """
+        offsets = []
+        offset = 0
+        for name, size in members:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            offset += len(info.tobuf(tarfile.USTAR_FORMAT, tarfile.ENCODING, 'surrogateescape'))
+            offsets.append(offset)
+            offset += -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        return offsets
+
+    def _read_tar_member(self, tar_path: str, name: str, offset: int, size: int, destination: str) -> bool:
+        """Copy the data of a tar member to `destination` with a byte-range read of the tar. The header in front of the
+        data is checked first, so that a stale or wrong index isn't used to restore the wrong bytes, and gives the mode
+        and modification time of the member.
+
+        :param tar_path: Path to the tar
+        :param name: Name of the member in the tar
+        :param offset: Offset of the member's data in the tar
+        :param size: Size of the member
+        :param destination: Path to write the member to
+        :return: Whether the member was copied, False if the header in front of `offset` isn't the member's
+        """
+        if offset < tarfile.BLOCKSIZE:
+            return False
+        with open(tar_path, 'rb') as src:
+            src.seek(offset - tarfile.BLOCKSIZE)
+            try:
+                info = tarfile.TarInfo.frombuf(src.read(tarfile.BLOCKSIZE), tarfile.ENCODING, 'surrogateescape')
+            except tarfile.HeaderError:
+                return False
+            if os.path.normpath(info.name.lstrip('/')) != os.path.normpath(name.lstrip('/')) or info.size != size:
+                return False
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            with open(destination, 'wb') as dst:
+                remaining = size
+                while remaining > 0:
+                    data = src.read(min(remaining, 1024 * 1024))
+                    if not data:
+                        raise EOFError(f'{tar_path} ends before the member at {offset} of {size} bytes')
+                    dst.write(data)
+                    remaining -= len(data)
+        os.chmod(destination, info.mode)
+        os.utime(destination, (info.mtime, info.mtime))
+        return True
+
+    def _extract_tar_members(self, server: str, tape_file: str, members: list[tuple[str, dict[str, Any]]],
+                             temp_dir: str, pool: concurrent.futures.Executor) -> Optional[concurrent.futures.Future]:
+        """Read the requested members of a tar on tape and submit writing them to their restore paths to `pool`, so
+        they are written while the next tar is read from tape. `htar` reads only the members listed (using the index it
+        wrote with the tar) into `temp_dir`, so the cost scales with the size of the members rather than the tar. If
+        that fails, the whole tar is staged with `hsi` and the members are read from it straight to their restore paths.
+        Each member written to its restore path is marked `extracted`.
+
+        :param server: HSI server
+        :param tape_file: Path of the tar on tape
+        :param members: Name of each member in the tar and the pull record it's restored for
+        :param temp_dir: Directory to extract to
+        :param pool: Executor to write the members with
+        :return: The future writing the members, None if the tar could not be read
+        """
+        member_list = os.path.join(temp_dir, f'{os.path.basename(tape_file)}.members')
+        with open(member_list, 'w') as f:
+            for tar_file, _ in members:
+                f.write(f'{tar_file}\n')
+        htar_cmd = ['htar', '-x', '-H', f'server={server}', '-f', tape_file, '-L', member_list]
+        if self.debug:
+            # `htar` isn't run, so there are no members to write
+            return None
+        try:
+            subprocess.run(htar_cmd, timeout=60 * 60 * 3, check=True)
+            return pool.submit(self._place_tar_members, members)
+        except Exception as e:
+            self.logger.warning(f'failed to run htar command: {" ".join(htar_cmd)}, ({repr(e)}), staging the whole tar')
+        restore_path = os.path.join(temp_dir, os.path.basename(tape_file))
+        try:
+            subprocess.run(['hsi', '-h', server, f'get {restore_path} : {tape_file}'], timeout=60 * 60 * 3,
+                           check=True)
+        except Exception as e:
+            self.logger.error(f'failed to stage tar {tape_file}, ({repr(e)})')
+            try:
+                os.remove(restore_path)
+            except Exception:
+                pass
+            return None
+        return pool.submit(self._read_staged_tar, restore_path, members)
+
+    def _place_tar_members(self, members: list[tuple[str, dict[str, Any]]]) -> None:
+        """Move members extracted by `htar` to their restore paths, renaming them when on the same file system.
+
+        :param members: Name of each member in the tar and the pull record it's restored for
+        """
+        for _, in_file in members:
+            try:
+                # the extracted file is removed with the restore directory so it can be moved when it can
+                result = file_copy.copy_file(str(in_file.get('tar_restore_path')), str(in_file.get('restore_path')),
+                                             disposable=True, copy_stat=True)
+                self.logger.info(f'staged {in_file.get("restore_path")}, {result}')
+                in_file['extracted'] = True
+            except Exception as e:
+                self.logger.error(f'failed to stage {in_file.get("restore_path")}, ({repr(e)})')
+
+    def _read_staged_tar(self, tar_path: str, members: list[tuple[str, dict[str, Any]]]) -> None:
+        """Write members of a staged tar straight to their restore paths, by byte range when the member index is known
+        and matches the tar, otherwise by reading the tar with `tarfile`. The staged tar is removed afterwards.
+
+        :param tar_path: Path to the staged tar
+        :param members: Name of each member in the tar and the pull record it's restored for
+        """
+        tar = None
+        try:
+            for tar_file, in_file in members:
+                try:
+                    if in_file.get('tar_offset') is not None and self._read_tar_member(
+                            tar_path, tar_file, in_file.get('tar_offset'), in_file.get('tar_size'),
+                            in_file.get('restore_path')):
+                        in_file['extracted'] = True
+                        continue
+                    if tar is None:
+                        tar = tarfile.open(tar_path)
+                    try:
+                        member = tar.getmember(tar_file)
+                    except KeyError:
+                        # `tar` strips the leading `/` of member names
+                        member = tar.getmember(tar_file.lstrip('/'))
+                    source = tar.extractfile(member)
+                    if source is None:
+                        raise ValueError(f'{tar_file} is not a regular file')
+                    with source, open(in_file.get('restore_path'), 'wb') as destination:
+                        shutil.copyfileobj(source, destination, 1024 * 1024)
+                    os.chmod(in_file.get('restore_path'), member.mode)
+                    os.utime(in_file.get('restore_path'), (member.mtime, member.mtime))
+                    in_file['extracted'] = True
+                except Exception as e:
+                    self.logger.error(f'failed to extract {tar_file} from tar {tar_path}, ({repr(e)})')
+        finally:
+            if tar is not None:
+                tar.close()
+            try:
+                os.remove(tar_path)
+            except Exception:
+                pass
+
+    def _put_pulls(self, pull_updates: list[dict[str, Any]]) -> None:
+        """Send a batch of `pull_queue` updates to the tape service in a single request.
+
+        :param pull_updates: Updates containing `pull_queue_id`, `queue_status_id` and optionally `volume`,
+            `position_a` and `position_b`
+        """
+        if pull_updates:
+            self.sdm_curl.put('api/tape/pulls', pulls=pull_updates)
+
     def run_pull(self, files):
         if len(files) == 0:
             return 0
@@ -504,9 +805,8 @@ class DTService(object):
         if not self.hsi_state.isup(service.get('server')):
             self.sdm_curl.put(f'api/tape/releaselockedvolume/{self.division_name}/{volume}')
             # HSI is down, requeue records.
-            for rec in files:
-                self.sdm_curl.put(f'api/tape/pull/{rec.get("pull_queue_id")}',
-                                  queue_status_id=self.cv.queue_status.REGISTERED)
+            self._put_pulls([{'pull_queue_id': rec.get('pull_queue_id'),
+                              'queue_status_id': self.cv.queue_status.REGISTERED} for rec in files])
             return False
         orig_dir = os.getcwd()
         self.logger.info(f'pull volume {volume}, {len(files)} files')
@@ -536,68 +836,63 @@ class DTService(object):
             if in_file.get('tar_record_id') is None:
                 # what the file is called on tape
                 tape_file = os.path.join(in_file.get('remote_file_path'), in_file.get('remote_file_name'))
-                key_file = in_file.get('remote_file_name')
-                cmd = f'get {restore_path} : {tape_file}'
+                key = f'{in_file.get("position_a"):015}{in_file.get("position_b"):015}{in_file.get("remote_file_name")}'
+                tape_list[key] = f'get {restore_path} : {tape_file}'
             else:
-                # what the file is called on tape
-                key_file = tape_file = in_file.get('remote_path')
-                # where the tar file will be restored to
-                restore_path = os.path.join(temp_dir, in_file.get('remote_path').split('/')[-1])
-                cmd = f'get {restore_path} : {tape_file}'
-                # file within the tar ball restore path
+                # file within the tar ball restore path, only these members are read from the tar on tape
                 tar_file = in_file.get('remote_file_path') if in_file.get('remote_file_path').endswith(
                     in_file.get('remote_file_name')) else os.path.join(in_file.get('remote_file_path'),
                                                                        in_file.get('remote_file_name'))
                 in_file['tar_restore_path'] = os.path.join(temp_dir, tar_file.lstrip("/"))
-                if key_file in tar_files:
-                    tar_files.get(key_file).append(tar_file)
-                else:
-                    tar_files[key_file] = [tar_file]
-            key = f'{in_file.get("position_a"):015}{in_file.get("position_b"):015}{key_file}'
-            tape_list[key] = cmd
-        # write sorted list to task file
-        with open(volume + '.cmd', 'w') as f:
-            for key, value in sorted(tape_list.items()):
-                f.write(value + '\n')
-        # execute task file
-        pull_cmd = ['hsi', '-h', service.get('server'), f'in {volume}.cmd']
+                tar_files.setdefault(in_file.get('remote_path'), []).append((tar_file, in_file))
         ret_value = 1
-        if not self.debug:
-            try:
-                subprocess.run(pull_cmd, timeout=60 * 60 * 3, check=True)
-            # except subprocess.TimeoutExpired as e:
-            except Exception as e:
-                self.logger.warning(f'failed to run hsi command: {" ".join(pull_cmd)}, ({repr(e)})')
-                for in_file in files:
-                    self.sdm_curl.put(f'api/tape/pull/{in_file.get("pull_queue_id")}',
-                                      queue_status_id=self.cv.queue_status.FAILED)
-                ret_value = 0
-        # loop through tar balls, extract files and put them in the correct location
-        if ret_value:
-            for tar in tar_files:
-                tar_cmd = ['tar', 'xvf', os.path.basename(tar)] + tar_files.get(tar)
+        if tape_list:
+            # write sorted list to task file
+            with open(volume + '.cmd', 'w') as f:
+                for key, value in sorted(tape_list.items()):
+                    f.write(value + '\n')
+            # execute task file
+            pull_cmd = ['hsi', '-h', service.get('server'), f'in {volume}.cmd']
+            if not self.debug:
                 try:
-                    if not self.debug:
-                        subprocess.run(tar_cmd, check=True)
+                    subprocess.run(pull_cmd, timeout=60 * 60 * 3, check=True)
+                # except subprocess.TimeoutExpired as e:
                 except Exception as e:
-                    self.logger.error(f'failed to run tar command: {" ".join(tar_cmd)}, ({repr(e)})')
-                    for in_file in tar_files.get(tar):
-                        try:
-                            os.remove(in_file)
-                        except Exception:
-                            pass
+                    self.logger.warning(f'failed to run hsi command: {" ".join(pull_cmd)}, ({repr(e)})')
+                    self._put_pulls([{'pull_queue_id': in_file.get('pull_queue_id'),
+                                      'queue_status_id': self.cv.queue_status.FAILED} for in_file in files])
+                    ret_value = 0
+        # read the requested members of each tar ball from tape in tape order, writing the members of a tar to their
+        # restore paths while the next one is read
+        if ret_value:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.pull_io_workers) as pool:
+                # At most `pull_io_workers` tars are read or staged ahead of the ones being written, so the extracted
+                # members and staged tars don't pile up in the restore directory
+                writing = collections.deque()
+                for tar in sorted(tar_files, key=lambda t: min((in_file.get('position_a'), in_file.get('position_b'))
+                                                               for _, in_file in tar_files.get(t))):
+                    while len(writing) >= self.pull_io_workers:
+                        writing.popleft().result()
+                    future = self._extract_tar_members(service.get('server'), tar, tar_files.get(tar), temp_dir, pool)
+                    if future is not None:
+                        writing.append(future)
             # loop through files, renaming them to the final name, setting jamo to success
+            pull_updates = []
             for in_file in files:
-                try:
-                    if in_file.get('tar_record_id') is not None:
-                        # doing the tar in two steps (move, then rename) as we might be on a different file system
-                        shutil.copy2(str(in_file.get('tar_restore_path')), str(in_file.get('restore_path')))
-                    os.rename(str(in_file.get('restore_path')), str(in_file.get('destination_path')))
-                    self.sdm_curl.put(f'api/tape/pull/{in_file.get("pull_queue_id")}',
-                                      queue_status_id=self.cv.queue_status.COMPLETE)
-                except Exception:
-                    self.sdm_curl.put(f'api/tape/pull/{in_file.get("pull_queue_id")}',
-                                      queue_status_id=self.cv.queue_status.FAILED)
+                queue_status_id = self.cv.queue_status.FAILED
+                if in_file.get('tar_record_id') is None or in_file.get('extracted'):
+                    try:
+                        os.rename(str(in_file.get('restore_path')), str(in_file.get('destination_path')))
+                        queue_status_id = self.cv.queue_status.COMPLETE
+                    except Exception:
+                        pass
+                else:
+                    try:
+                        os.remove(str(in_file.get('restore_path')))
+                    except Exception:
+                        pass
+                pull_updates.append({'pull_queue_id': in_file.get('pull_queue_id'), 'queue_status_id': queue_status_id})
+            self._put_pulls(pull_updates)
         # remove restore directory
         os.chdir(orig_dir)
         try:
@@ -664,66 +959,63 @@ class DTService(object):
         for rec in extract:
             extract_keys[rec.get('path')] = rec
         del extract
-        tar = tarfile.open(tar_file, 'w')
         index = metadata_record.get('index')
         file_idx = []
         metadata_records = []
-        for root, dirs, files in os.walk(root_folder):
-            new_dirs = copy.copy(dirs)
-            for folder in new_dirs:
-                if os.path.join(root, folder)[len(root_folder) + 1:] in ignore:
-                    dirs.remove(folder)
-
-            for file_name in files:
-                file = os.path.join(root, file_name)
-                tar_dest = file[len(root_folder) + 1:]
-                if ignore is not None and tar_dest in ignore:
-                    continue
-
-                if os.path.islink(file):
-                    realpath = os.path.realpath(file)
-                    # if realpath.startswith('/home/assembly_QC/ESTs'):
-                    #     realpath = realpath.replace('/home/assembly_QC/ESTs','/house/groupdirs/assembly_QC/ESTs_Sync/ESTs')
-                    if realpath.startswith(root_folder + '/'):
-                        info = tarfile.TarInfo(tar_dest)
-                        info.size = 0
-                        info.mode = 493
-                        info.type = tarfile.SYMTYPE
-                        if file == realpath:
-                            continue
-                        info.linkname = self.get_relative_link(file, realpath)
-                        tar.addfile(info)
+        # Symlinks pointing outside of the folder by the path they resolve to, looked up in a single request once the
+        # folder has been scanned
+        external_links = {}
+        unresolved = set()
+
+        def add(entry):
+            if entry.tar_dest in extract_keys:
+                tar_folder, tar_file_name = os.path.split(entry.tar_dest)
+                metadata_records.append({'file_name': tar_file_name, 'file_path': tar_folder,
+                                         'id': self.add_extracted_file(entry.path, extract_keys.get(entry.tar_dest),
+                                                                       metadata_record)})
+                return
+            if index and entry.folder_files < 100:
+                tar_folder, tar_file_name = os.path.split(entry.tar_dest)
+                file_idx.append({'file_name': tar_file_name, 'file_path': tar_folder})
+            yield entry
+
+        def entries():
+            for entry in tar_stream.scan_tree(root_folder, ignore or []):
+                if entry.realpath is None:
+                    yield from add(entry)
+                elif entry.realpath.startswith(root_folder + '/'):
+                    if entry.path != entry.realpath:
+                        entry.linkname = self.get_relative_link(entry.path, entry.realpath)
+                        yield entry
+                else:
+                    tar_folder, tar_file_name = os.path.split(entry.tar_dest)
+                    # Keeps the record's place in the index until the link is resolved
+                    record = {'file_name': tar_file_name, 'file_path': tar_folder, 'id': None}
+                    metadata_records.append(record)
+                    external_links.setdefault(entry.realpath, []).append((entry, record))
+            if not external_links:
+                return
+            records = self.sdm_curl.post('api/tape/latestfiles', files=list(external_links))
+            for realpath, links in external_links.items():
+                rec = records.get(realpath)
+                for entry, record in links:
+                    if rec is not None:
+                        record['id'] = rec.get('metadata_id')
                         continue
+                    unresolved.add(id(record))
+                    if os.path.exists(realpath):
+                        # Archive the file the link points to
+                        yield from add(tar_stream.Entry(entry.tar_dest, realpath, os.stat(realpath),
+                                                        folder_files=entry.folder_files))
                     else:
-                        rec = self.sdm_curl.get('api/tape/latestfile', file=realpath)
-                        if rec is None:
-                            if os.path.exists(realpath):
-                                file = realpath
-                            else:
-                                self.logger.warning(
-                                    f'tar file {root_folder} has a broken link from {tar_dest} to {realpath}')
-                                continue
-                        else:
-                            tar_folder, tar_file_name = os.path.split(tar_dest)
-                            metadata_records.append(
-                                {'file_name': tar_file_name, 'file_path': tar_folder, 'id': rec.get('metadata_id')})
-                            continue
-
-                if tar_dest in extract_keys:
-                    tar_folder, tar_file_name = os.path.split(tar_dest)
-                    metadata_records.append({'file_name': tar_file_name, 'file_path': tar_folder,
-                                             'id': self.add_extracted_file(file, extract_keys.get(tar_dest),
-                                                                           metadata_record)})
-                    continue
-
-                if index and len(files) < 100:
-                    tar_folder, tar_file_name = os.path.split(tar_dest)
-                    file_idx.append({'file_name': tar_file_name, 'file_path': tar_folder})
-                if os.access(file, os.R_OK):
-                    tar.add(file, arcname=tar_dest)
-                else:
-                    self.logger.warning(f'tar file {file} can not be read.. skipping')
-        tar.close()
+                        self.logger.warning(
+                            f'tar file {root_folder} has a broken link from {entry.tar_dest} to {realpath}')
+
+        with tar_stream.TarWriter(tar_file) as writer:
+            unreadable = writer.add_all(entries())
+        for entry in unreadable:
+            self.logger.warning(f'tar file {entry.path} can not be read.. skipping')
+        metadata_records = [record for record in metadata_records if id(record) not in unresolved]
         if len(file_idx) > 100:
             file_idx = []
         file_size = os.path.getsize(tar_file)
@@ -853,9 +1145,10 @@ class DTService(object):
         :param expected_size: Expected size in bytes
         :param exact_size: If `True`, check that the size matches exactly, otherwise check that the path size is at least `expected_size`
         """
-        cmd = ['hsi', '-P', '-q', '-h', server, f'ls -1s {path}']
-        results = subprocess.run(cmd, check=True, stdout=subprocess.PIPE)
-        size = int(results.stdout.decode('utf-8').split()[0])
+        output = self.hsi_pool.check_output(server, f'ls -1s {path}')
+        if output.startswith('***') or not output.split():
+            raise hsi.HSIError(f'failed to list {path} in HSI: {output}')
+        size = int(output.split()[0])
         if exact_size:
             if size != expected_size:
                 raise HSIVerificationFailedException(
@@ -893,7 +1186,8 @@ class DTService(object):
             try:
                 os.makedirs(globus_file_path, exist_ok=True)
                 # Copy into a hidden dot file to make the operation "atomic"
-                shutil.copy2(local_file, globus_file_name_temp)
+                result = file_copy.copy_file(local_file, globus_file_name_temp, copy_stat=True)
+                self.logger.info(f'copied {local_file} to {globus_file_name_temp}, {result}')
                 # Rename to non hidden dot file
                 os.rename(globus_file_name_temp, globus_file_name)
             except Exception as e:
@@ -1006,6 +1300,16 @@ def main():
     parser.add_argument('-D', '--division', type=str, help='Division for tasks that can run with this manager')
     parser.add_argument('-e', '--email', type=str, help='Email to send notificaitons to when critical errors occur', default=None)
     parser.add_argument('-R', '--n_retry', type=int, help='The number of retries when getting HTTP errors', default=1000)
+    parser.add_argument('-b', '--max_tasks', type=int, default=1,
+                        help='The number of tasks to lease per request, 1 to get one task at a time')
+    parser.add_argument('-B', '--max_bytes', type=int, default=None,
+                        help='The total file size in bytes to stop adding tasks to a lease at')
+    parser.add_argument('-H', '--hash_workers', type=int, default=1,
+                        help='The number of files to hash at the same time for the md5 tasks of a lease')
+    parser.add_argument('-P', '--pull_io_workers', type=int, default=4,
+                        help='The number of tars of a volume pull to write the members of at the same time')
+    parser.add_argument('-S', '--hsi_sessions', type=int, default=1,
+                        help='The number of long-lived hsi sessions per server in each runner for metadata commands')
     args = parser.parse_args()
 
     # We are going to look in the environment variable specified by the -j flag for the JAMO token
@@ -1025,7 +1329,9 @@ def main():
                                  'division': args.division}).get('service_id')
     run_tasks = args.tasks.split(',')
     dtn_service = DTService(curl, args.features.split(','), run_tasks, args.threads, args.debug, service_id,
-                            args.division, log_ext=args.log, email=args.email)
+                            args.division, log_ext=args.log, email=args.email, max_tasks=args.max_tasks,
+                            max_bytes=args.max_bytes, hash_workers=args.hash_workers,
+                            pull_io_workers=args.pull_io_workers, hsi_sessions=args.hsi_sessions)
     start_time = datetime.datetime.now()
 
     def finish_service(stop_gracefully=True):
@@ -0,0 +1,165 @@
+import errno
+import os
+import shutil
+import sys
+import time
+from typing import Optional
+
+from . import checksum
+
+RENAME = 'rename'
+REFLINK = 'reflink'
+COPY_FILE_RANGE = 'copy_file_range'
+SENDFILE = 'sendfile'
+BUFFERED = 'buffered'
+
+# `ioctl` request to share the extents of one file with another (linux/fs.h), on filesystems that support it (XFS,
+# Btrfs, ...) the copy is done without reading or writing the data
+FICLONE = 0x40049409
+# Errors meaning the mechanism is not supported for these two files, so the next mechanism should be tried
+_UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EPERM,
+                errno.ETXTBSY}
+# Bytes per `copy_file_range` and `sendfile` call
+CHUNK_SIZE = 1024 * 1024 * 1024
+
+
+class CopyResult:
+    """How a file was copied, returned by `copy_file`.
+    """
+
+    def __init__(self, mechanism: str, size: int, seconds: float, md5sum: Optional[str] = None):
+        self.mechanism = mechanism
+        self.size = size
+        self.seconds = seconds
+        self.md5sum = md5sum
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.size / self.seconds if self.seconds > 0 else float('inf')
+
+    def __str__(self):
+        return f'{self.size} bytes with {self.mechanism} at {self.bytes_per_second / 1e6:.1f} MB/s'
+
+
+def _unsupported(e: OSError) -> bool:
+    return e.errno in _UNSUPPORTED
+
+
+def _reflink(source: int, destination: int, size: int) -> int:
+    import fcntl
+    fcntl.ioctl(destination, FICLONE, source)
+    return size
+
+
+def _copy_file_range(source: int, destination: int, size: int) -> int:
+    copied = 0
+    while True:
+        n = os.copy_file_range(source, destination, CHUNK_SIZE)
+        if n == 0:
+            if copied == 0 and size > 0:
+                # Some filesystems (e.g., procfs, some FUSE and NFS setups) report success without copying anything
+                raise OSError(errno.EOPNOTSUPP, 'copy_file_range copied nothing')
+            return copied
+        copied += n
+
+
+def _sendfile(source: int, destination: int, size: int) -> int:
+    copied = 0
+    while True:
+        n = os.sendfile(destination, source, None, CHUNK_SIZE)
+        if n == 0:
+            if copied == 0 and size > 0:
+                raise OSError(errno.EOPNOTSUPP, 'sendfile copied nothing')
+            return copied
+        copied += n
+
+
+def _buffered(source: int, destination: int, size: int) -> int:
+    copied = 0
+    with open(source, 'rb', buffering=0, closefd=False) as f, open(destination, 'wb', buffering=0, closefd=False) as t:
+        buffer = bytearray(checksum.BUFFER_SIZE)
+        with memoryview(buffer) as view:
+            while True:
+                read = f.readinto(view)
+                if not read:
+                    return copied
+                with view[:read] as chunk:
+                    written = 0
+                    while written < read:
+                        written += t.write(chunk[written:])
+                copied += read
+
+
+def _mechanisms():
+    mechanisms = []
+    if sys.platform.startswith('linux'):
+        mechanisms.append((REFLINK, _reflink))
+    if hasattr(os, 'copy_file_range'):
+        mechanisms.append((COPY_FILE_RANGE, _copy_file_range))
+    if hasattr(os, 'sendfile'):
+        mechanisms.append((SENDFILE, _sendfile))
+    return mechanisms + [(BUFFERED, _buffered)]
+
+
+# Mechanisms to try in order of preference after `rename`
+MECHANISMS = _mechanisms()
+
+
+def copy_file(from_file: str, to_file: str, disposable: bool = False, md5: bool = False,
+              copy_stat: bool = False) -> CopyResult:
+    """Copy a file with the cheapest mechanism that works for the two paths, in order of preference:
+
+    - `rename`, if the source is disposable and on the same filesystem as the destination
+    - `reflink`, sharing the data blocks of the source on filesystems that support it
+    - `copy_file_range`, copying in the kernel (and server side on NFS)
+    - `sendfile`, copying in the kernel
+    - buffered copy through user space
+
+    If the md5 of the content is needed, it is computed while copying with a buffered copy, since reading the file
+    again after a kernel copy costs more than the user space copy saves. A `rename` or `reflink` does not read the
+    data, so the md5 is computed after them.
+
+    :param from_file: Path of the file to copy
+    :param to_file: Path to copy the file to, it is created or replaced
+    :param disposable: Whether the source is not needed after the copy, which allows it to be renamed to the
+        destination
+    :param md5: Whether to compute the md5 of the content
+    :param copy_stat: Whether to copy the permission bits and times of the source to the destination
+        (`shutil.copystat`), a renamed file keeps its own
+    :return: How the file was copied
+    """
+    start = time.perf_counter()
+    if disposable:
+        try:
+            os.rename(from_file, to_file)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        else:
+            size = os.path.getsize(to_file)
+            md5sum = checksum.md5_file(to_file) if md5 else None
+            return CopyResult(RENAME, size, time.perf_counter() - start, md5sum)
+    # With `md5`, only the mechanisms that do not read the data are worth trying before the hashing buffered copy
+    mechanisms = [(name, mechanism) for name, mechanism in MECHANISMS if not md5 or name == REFLINK]
+    with open(from_file, 'rb') as source, open(to_file, 'wb') as destination:
+        size = os.fstat(source.fileno()).st_size
+        for name, mechanism in mechanisms:
+            try:
+                copied = mechanism(source.fileno(), destination.fileno(), size)
+                break
+            except OSError as e:
+                # Only fall back to the next mechanism if nothing was written yet
+                if not _unsupported(e) or os.fstat(destination.fileno()).st_size > 0:
+                    raise
+        else:
+            name = None
+    if name is None:
+        name = BUFFERED
+        copied, md5sum = checksum.copy_md5(from_file, to_file)
+    else:
+        md5sum = checksum.md5_file(to_file) if md5 else None
+    if copied != size:
+        raise OSError(errno.EIO, f'copied {copied} of the {size} bytes of {from_file} with {name}')
+    if copy_stat:
+        shutil.copystat(from_file, to_file)
+    return CopyResult(name, copied, time.perf_counter() - start, md5sum)
@@ -1,5 +1,7 @@
 import datetime
 import lapinpy.sdmlogger as logger
+import os
+import re
 import select
 import subprocess
 import threading
@@ -8,7 +10,7 @@ from lapinpy.curl import Curl
 
 
 class HSIError(Exception):
-    def __init(self, message):
+    def __init__(self, message):
         self.response = message
         Exception.__init__(self, message)
 
@@ -164,6 +166,188 @@ class HSI(object):
         return self.runHtarCommand(f'-Df {htarRecord["remote_path"]} {relativeFile}')
 
 
+class HSISession(object):
+    """A long-lived `hsi` process that runs metadata commands (`ls`, `rm`, ...) without paying the process start and
+    login for each of them. Every command is followed by `marker_command`, whose output delimits the output of the
+    command, so commands can be pipelined: up to `pipeline_depth` commands are written before their output is read.
+
+    :param server: HSI server
+    :param timeout: Seconds to wait for the output of a command
+    """
+    command = ['hsi', '-P', '-q', '-h']
+    # Command sent after each command, the line it outputs marks the end of the output of the command before it
+    marker_command = 'pwd'
+    marker = re.compile(r'^pwd\d+: ')
+    # Prompts `hsi` prints before reading each command, e.g. `A:/home/u/user-> `
+    prompt = re.compile(r'^(?:[A-Z]:\S*-> )+')
+    pipeline_depth = 64
+
+    def __init__(self, server, timeout=300):
+        self.server = server
+        self.timeout = timeout
+        self.process = None
+        self.last_used = 0
+        self._buffer = b''
+
+    def connect(self):
+        # Only reconnected after a failure, the previous process is not waited on
+        self.close(wait=False)
+        logger.getLogger('hsi').info(f'connecting to hsi server {self.server}')
+        self.process = subprocess.Popen(self.command + [self.server], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, bufsize=0)
+        self._buffer = b''
+        # The first marker is only answered once logged in
+        self.run([])
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def close(self, wait=True):
+        """Log out and stop `hsi`.
+
+        :param wait: Give `hsi` a few seconds to log out, otherwise it's killed straight away
+        """
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5 if wait else 0)
+            except Exception:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+
+    def _read_line(self, deadline):
+        fd = self.process.stdout.fileno()
+        while b'\n' not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise HSIError(f'timed out waiting for hsi server {self.server}')
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if ready:
+                data = os.read(fd, 65536)
+                if not data:
+                    raise HSIError(f'hsi session to {self.server} closed')
+                self._buffer += data
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return self.prompt.sub('', line.decode('utf-8', 'replace'))
+
+    def _read_output(self):
+        lines = []
+        deadline = time.monotonic() + self.timeout
+        line = self._read_line(deadline)
+        while not self.marker.match(line):
+            lines.append(line)
+            line = self._read_line(deadline)
+        return '\n'.join(lines)
+
+    def run(self, commands):
+        """Run commands in order, pipelined.
+
+        :param commands: Commands to run, each on a single line
+        :return: The output of each command
+        """
+        if any('\n' in command for command in commands):
+            raise ValueError('hsi commands must be on a single line')
+        outputs = []
+        # No commands only sends the marker, as a login and health check
+        probe = not commands
+        commands = list(commands) or ['']
+        sent = 0
+        while len(outputs) < len(commands):
+            # The commands in flight are small enough to fit in the pipe, so writing never waits on `hsi`
+            window = commands[sent:len(outputs) + self.pipeline_depth]
+            if window:
+                self.process.stdin.write(''.join(f'{command}\n{self.marker_command}\n' if command else
+                                                 f'{self.marker_command}\n' for command in window).encode('utf-8'))
+                sent += len(window)
+            outputs.append(self._read_output())
+        self.last_used = time.monotonic()
+        return [] if probe else outputs
+
+
+class HSIPool(object):
+    """Per server pool of `HSISession`, each process keeps its own sessions. Sessions idle for longer than
+    `health_check_seconds` are checked before use, and a session that fails is reconnected and the commands it was
+    running are retried once.
+
+    :param size: Sessions per server
+    :param timeout: Seconds to wait for the output of a command
+    :param health_check_seconds: Idle time after which a session is checked before it's used
+    """
+
+    def __init__(self, size=1, timeout=300, health_check_seconds=60):
+        self.size = size
+        self.timeout = timeout
+        self.health_check_seconds = health_check_seconds
+        self.condition = threading.Condition()
+        self.idle = {}
+        self.created = {}
+        self.pid = os.getpid()
+
+    def _acquire(self, server):
+        with self.condition:
+            if self.pid != os.getpid():
+                # Sessions of a parent process can not be shared with a forked child
+                self.idle, self.created, self.pid = {}, {}, os.getpid()
+            while not self.idle.get(server) and self.created.get(server, 0) >= self.size:
+                self.condition.wait()
+            if self.idle.get(server):
+                return self.idle.get(server).pop()
+            self.created[server] = self.created.get(server, 0) + 1
+        return HSISession(server, self.timeout)
+
+    def _release(self, server, session):
+        with self.condition:
+            if session.alive():
+                self.idle.setdefault(server, []).append(session)
+            else:
+                self.created[server] -= 1
+            self.condition.notify()
+
+    def _check(self, session):
+        if session.alive() and time.monotonic() - session.last_used < self.health_check_seconds:
+            return
+        try:
+            if session.alive():
+                session.run([])
+                return
+        except (HSIError, OSError) as e:
+            logger.getLogger('hsi').warning(f'hsi session to {session.server} failed its health check, ({repr(e)})')
+        session.connect()
+
+    def run(self, server, commands):
+        """Run commands in order on a session to `server`.
+
+        :param server: HSI server
+        :param commands: Commands to run, each on a single line
+        :return: The output of each command
+        """
+        session = self._acquire(server)
+        try:
+            try:
+                self._check(session)
+                return session.run(commands)
+            except (HSIError, OSError) as e:
+                logger.getLogger('hsi').warning(f'hsi session to {server} failed, reconnecting, ({repr(e)})')
+                session.connect()
+                return session.run(commands)
+        except Exception:
+            session.close(wait=False)
+            raise
+        finally:
+            self._release(server, session)
+
+    def check_output(self, server, command):
+        return self.run(server, [command])[0]
+
+    def close(self):
+        with self.condition:
+            for sessions in self.idle.values():
+                for session in sessions:
+                    session.close()
+            self.idle, self.created = {}, {}
+
+
 class HSI_status(object):
     def __init__(self):
         self.curl = Curl('https://api.nersc.gov/api/v1.2/status')
@@ -28,6 +28,8 @@ drop_statements = [
     "DROP TABLE IF EXISTS queue_status_cv;",
     "DROP TABLE IF EXISTS backup_record_status_cv;",
     "DROP TABLE IF EXISTS quota;",
+    "DROP TABLE IF EXISTS file_footprint;",
+    "DROP TABLE IF EXISTS file_footprint_root;",
 
     # Drop existing triggers and views
     "DROP TRIGGER IF EXISTS file_ingest_update_trigger;",
@@ -40,6 +42,9 @@ drop_statements = [
     "DROP TRIGGER IF EXISTS backup_record_update_trigger",
     "DROP TRIGGER IF EXISTS file_insert_trigger",
     "DROP TRIGGER IF EXISTS file_update_trigger",
+    "DROP TRIGGER IF EXISTS file_footprint_insert_trigger",
+    "DROP TRIGGER IF EXISTS file_footprint_update_trigger",
+    "DROP TRIGGER IF EXISTS file_footprint_delete_trigger",
 
     "DROP VIEW IF EXISTS active;",
     "DROP VIEW IF EXISTS status;",
@@ -215,6 +220,8 @@ create_statements = [
         md5sum varchar(64) default null,
         dt_modified timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
         dt_to_release timestamp default null,
+        tar_offset bigint unsigned default null,
+        tar_size bigint unsigned default null,
         key file_id_backup_record_fk (file_id),
         key tar_record_id_fk (tar_record_id),
         key backup_record_status_id_cv_fk (backup_record_status_id),
@@ -294,6 +301,24 @@ create_statements = [
         dt_modified timestamp not null default current_timestamp on update current_timestamp
        ) ENGINE = InnoDB DEFAULT CHARSET=latin1;""",
 
+    # Repository footprint totals, kept up to date by the file_footprint triggers. Rows are spread over slots by
+    # file_id so concurrent updates don't all wait on the same row. A slot can go negative when a file leaves it before
+    # anything was added to it, only the sum over the slots of a division and status is a total
+    """CREATE TABLE IF NOT EXISTS file_footprint (
+        division varchar(64) not null,
+        file_status_id tinyint unsigned not null,
+        slot tinyint unsigned not null,
+        files bigint not null default 0,
+        disk_usage bigint not null default 0,
+        primary key (division, file_status_id, slot)
+       ) ENGINE = InnoDB DEFAULT CHARSET=latin1;""",
+
+    """CREATE TABLE IF NOT EXISTS file_footprint_root (
+        root varchar(256) not null primary key
+       ) ENGINE = InnoDB DEFAULT CHARSET=latin1;""",
+
+    "INSERT IGNORE INTO file_footprint_root (root) VALUES ('{dm_archive_root}');",
+
         # Create the file_ingest table
     """CREATE TABLE IF NOT EXISTS file_ingest (
         file_ingest_id INT UNSIGNED NOT NULL AUTO_INCREMENT,
@@ -482,6 +507,51 @@ create_statements = [
             VALUES (NEW.file_id, NEW.file_status_id, NOW());
         END;""",
 
+    """CREATE TRIGGER file_footprint_insert_trigger
+        AFTER INSERT ON file
+        FOR EACH ROW
+        BEGIN
+            IF EXISTS (SELECT 1 FROM file_footprint_root WHERE NEW.file_path LIKE CONCAT(root, '%')) THEN
+                INSERT INTO file_footprint (division, file_status_id, slot, files, disk_usage)
+                VALUES (NEW.division, NEW.file_status_id, NEW.file_id % 16, 1,
+                        IF(NEW.file_size < 384, 512, CEIL(NEW.file_size / 32768.0) * 32768))
+                ON DUPLICATE KEY UPDATE files = files + 1, disk_usage = disk_usage + VALUES(disk_usage);
+            END IF;
+        END;""",
+
+    """CREATE TRIGGER file_footprint_update_trigger
+        AFTER UPDATE ON file
+        FOR EACH ROW
+        BEGIN
+            IF NOT (OLD.file_status_id <=> NEW.file_status_id AND OLD.division <=> NEW.division
+                    AND OLD.file_path <=> NEW.file_path AND OLD.file_size <=> NEW.file_size) THEN
+                IF EXISTS (SELECT 1 FROM file_footprint_root WHERE OLD.file_path LIKE CONCAT(root, '%')) THEN
+                    INSERT INTO file_footprint (division, file_status_id, slot, files, disk_usage)
+                    VALUES (OLD.division, OLD.file_status_id, OLD.file_id % 16, -1,
+                            -IF(OLD.file_size < 384, 512, CEIL(OLD.file_size / 32768.0) * 32768))
+                    ON DUPLICATE KEY UPDATE files = files + VALUES(files), disk_usage = disk_usage + VALUES(disk_usage);
+                END IF;
+                IF EXISTS (SELECT 1 FROM file_footprint_root WHERE NEW.file_path LIKE CONCAT(root, '%')) THEN
+                    INSERT INTO file_footprint (division, file_status_id, slot, files, disk_usage)
+                    VALUES (NEW.division, NEW.file_status_id, NEW.file_id % 16, 1,
+                            IF(NEW.file_size < 384, 512, CEIL(NEW.file_size / 32768.0) * 32768))
+                    ON DUPLICATE KEY UPDATE files = files + 1, disk_usage = disk_usage + VALUES(disk_usage);
+                END IF;
+            END IF;
+        END;""",
+
+    """CREATE TRIGGER file_footprint_delete_trigger
+        AFTER DELETE ON file
+        FOR EACH ROW
+        BEGIN
+            IF EXISTS (SELECT 1 FROM file_footprint_root WHERE OLD.file_path LIKE CONCAT(root, '%')) THEN
+                INSERT INTO file_footprint (division, file_status_id, slot, files, disk_usage)
+                VALUES (OLD.division, OLD.file_status_id, OLD.file_id % 16, -1,
+                        -IF(OLD.file_size < 384, 512, CEIL(OLD.file_size / 32768.0) * 32768))
+                ON DUPLICATE KEY UPDATE files = files + VALUES(files), disk_usage = disk_usage + VALUES(disk_usage);
+            END IF;
+        END;""",
+
     """CREATE TRIGGER backup_record_update_trigger
         AFTER UPDATE ON backup_record
         FOR EACH ROW
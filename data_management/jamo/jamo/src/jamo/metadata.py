@@ -1,13 +1,14 @@
 import datetime
+import json
 import lapinpy.decision as decision
 import pymongo
 import os
 import re
-import copy
 import threading
 import urllib
 import cherrypy
 import collections
+import concurrent.futures
 from lapinpy import common, restful, curl, sdmlogger
 from bson.objectid import ObjectId
 from collections import deque
@@ -15,6 +16,8 @@ import uuid
 import functools
 from lapinpy.mongorestful import MongoRestful, convertToOID
 from lapinpy.common import toMongoObj
+from lapinpy.lapinpy_core import jsonify
+from lapinpy.ttlcache import TTLCache
 import time
 from typing import List
 
@@ -29,33 +32,8 @@ def processservice(name, description, typ, template=None):
     return inner
 
 
-class QueueHash:
-
-    def __init__(self, size):
-        self.size = size
-        self.array = [None] * size
-        self.on = 0
-        self.hash = {}
-
-    # would be cool to reorder this item somehow with last accessed
-
-    def __getitem__(self, item):
-        return self.hash[item]
-
-    def __contains__(self, key):
-        return key in self.hash
-
-    def __setitem__(self, key, value):
-        if self.on >= self.size:
-            self.on = 0
-        if self.array[self.on] is not None and self.array[self.on] in self.hash:
-            del self.hash[self.array[self.on]]
-        self.hash[key] = value
-        self.array[self.on] = key
-        self.on += 1
-
-    def clear(self):
-        self.hash.clear()
+# Sentinel for datastore responses that are not in the cache, since `None` is cached for failed lookups
+_CACHE_MISS = object()
 
 
 date_fields = {'added_date', 'dt_to_purge', 'file_date', 'modified_date', 'metadata_modified_date'}
@@ -124,7 +102,21 @@ class Metadata(MongoRestful):
                 self.stores[root_key] = []
             self.stores[root_key].append(row)
 
-        self.store_cache = QueueHash(2000)
+        # Datastore responses, keyed by `<identifier>/<key values>`. Entries live for the store's `cache_ttl` (or
+        # `datastore_cache_ttl`), failed lookups are cached as `None` for `datastore_cache_negative_ttl`
+        self.store_cache = TTLCache(getattr(self.config, 'datastore_cache_size', 2000),
+                                    getattr(self.config, 'datastore_cache_ttl', 3600))
+        self.store_cache_negative_ttl = getattr(self.config, 'datastore_cache_negative_ttl', 60)
+        # identifier -> {'hits': n, 'misses': n, 'failures': n, 'coalesced': n}
+        self.store_cache_stats = collections.defaultdict(lambda: {'hits': 0, 'misses': 0, 'failures': 0, 'coalesced': 0})
+        # Independent datastore lookups are fetched concurrently, with at most `datastore_max_concurrency` (or the
+        # store's `max_concurrency`) requests in flight per store. Identical requests in flight are coalesced.
+        self.store_executor = concurrent.futures.ThreadPoolExecutor(getattr(self.config, 'datastore_fetch_threads', 8),
+                                                                    thread_name_prefix='datastore')
+        self.store_max_concurrency = getattr(self.config, 'datastore_max_concurrency', 4)
+        self.store_semaphores = {}
+        self.store_inflight = {}
+        self.store_inflight_lock = threading.Lock()
 
         for row in self.get_processservices(None, None):
             self.process_services[row['name']] = row
@@ -171,6 +163,7 @@ class Metadata(MongoRestful):
     def shutdown(self):
         if self.updateThreadRunning:
             pass
+        self.store_executor.shutdown(wait=False)
 
     def addEvent(self, event, file):
         self.events.append((event, file))
@@ -596,38 +589,15 @@ class Metadata(MongoRestful):
         processed = []
         # print self.stores
         # print metadata
+        self._prefetch_stores([(key_values, store) for key in metadata if key in self.stores
+                               for store in self.stores[key]
+                               for key_values, success in [self._store_key_values(store, metadata, {})] if success])
         for key in metadata:
             if key in self.stores:
                 stores = self.stores[key]
                 #  key has been found, run through all the attached data stores
                 for store in stores:
-                    success = True
-                    key_values = collections.OrderedDict()
-                    if isinstance(store['key'], list):
-                        # dealing with a list of keys
-                        for item in store['key']:
-                            if item in metadata:
-                                # if it is an array of take the first item
-                                if isinstance(metadata[item], list):
-                                    if len(metadata[item]) == 1:
-                                        extracted_keys[item] = key_values[item] = metadata[item][0]
-                                    else:
-                                        success = False
-                                else:
-                                    extracted_keys[item] = key_values[item] = metadata[item]
-                            else:
-                                # not all parts of the composite keys found,
-                                # so we need to skip this one
-                                success = False
-                    else:
-                        # dealing with a single key, if it is an array of take the first item
-                        if isinstance(metadata[store['key']], list):
-                            if len(metadata[store['key']]) == 1:
-                                extracted_keys[store['key']] = key_values[store['key']] = metadata[store['key']][0]
-                            else:
-                                success = False
-                        else:
-                            extracted_keys[store['key']] = key_values[store['key']] = metadata[store['key']]
+                    key_values, success = self._store_key_values(store, metadata, extracted_keys)
                     if success:
                         try:
                             ret = self.processStore(key_values, store, processed, extracted_keys, metadata)
@@ -638,37 +608,174 @@ class Metadata(MongoRestful):
                 processed.append(key)
         return new_metadata, all_failed
 
-    def processStore(self, key_values, store, already_processed=[], extracted_keys={}, original_doc={}):
+    def _store_key_values(self, store, metadata, extracted_keys):
+        """Get the key values to look up a datastore with from a metadata document.
+
+        :param dict store: Datastore document
+        :param dict metadata: Metadata to take the key values from
+        :param dict extracted_keys: Dictionary the key values found are added to
+        :return: Tuple of the key values as an `OrderedDict` and whether all the keys were found
         """
-        keys and values now being passed as an ordered dictionary
+        success = True
+        key_values = collections.OrderedDict()
+        if isinstance(store['key'], list):
+            # dealing with a list of keys
+            for item in store['key']:
+                if item in metadata:
+                    # if it is an array of take the first item
+                    if isinstance(metadata[item], list):
+                        if len(metadata[item]) == 1:
+                            extracted_keys[item] = key_values[item] = metadata[item][0]
+                        else:
+                            success = False
+                    else:
+                        extracted_keys[item] = key_values[item] = metadata[item]
+                else:
+                    # not all parts of the composite keys found,
+                    # so we need to skip this one
+                    success = False
+        else:
+            # dealing with a single key, if it is an array of take the first item
+            if isinstance(metadata[store['key']], list):
+                if len(metadata[store['key']]) == 1:
+                    extracted_keys[store['key']] = key_values[store['key']] = metadata[store['key']][0]
+                else:
+                    success = False
+            else:
+                extracted_keys[store['key']] = key_values[store['key']] = metadata[store['key']]
+        return key_values, success
+
+    def _cascade_key_values(self, store, mapped_key, mapped_value, extracted_keys):
+        """Get the key values to look up a datastore with for a key extracted from another datastore's response.
+
+        :param dict store: Datastore document
+        :param str mapped_key: Extracted key that triggered the datastore
+        :param mapped_value: Extracted value
+        :param dict extracted_keys: Keys extracted so far, used for composite keys
+        :return: The key values as an `OrderedDict`, or `None` if not all parts of a composite key have been extracted
         """
-        # if any of the metadata keys are empty, return
+        key_values = collections.OrderedDict()
+        if isinstance(store['key'], list):
+            # dealing with a list of keys
+            for item in store['key']:
+                if item not in extracted_keys:
+                    # not all parts of the composite keys found,
+                    # so we need to skip this one
+                    return None
+                key_values[item] = extracted_keys[item]
+        else:
+            # dealing with a single key
+            key_values[mapped_key] = mapped_value
+        return key_values
+
+    def _store_request(self, key_values, store):
+        """Get the cache key and the URL to call for a datastore lookup.
+
+        :param OrderedDict key_values: Key values to look up
+        :param dict store: Datastore document
+        :return: Tuple of the cache key and the URL, which is `None` if the key values can't be used for a lookup
+        """
+        cache_key = store['identifier'] + '/' + '/'.join([str(val) for key, val in list(key_values.items())])
+        url = store['url']
         for key, value in list(key_values.items()):
-            if value is None:
-                return {}
+            if isinstance(value, list):
+                if len(value) == 1:
+                    value = value[0]
+                else:
+                    return cache_key, None
+            url = url.replace('{{' + key + '}}', str(value))
+        return cache_key, url
+
+    def _prefetch_stores(self, requests):
+        """Fetch the responses for independent datastore lookups concurrently, so that the lookups that follow (which
+        run in order, since they cascade and merge into the same document) are served from the cache. Errors are left
+        for those lookups to handle.
+
+        :param list requests: List of `(key_values, store)` tuples
+        """
+        pending = {}
+        for key_values, store in requests:
+            if any(value is None for value in key_values.values()):
+                continue
+            cache_key, url = self._store_request(key_values, store)
+            if url is not None and cache_key not in pending and cache_key not in self.store_cache:
+                pending[cache_key] = (url, store)
+        # A single lookup gains nothing from being handed off to another thread
+        if len(pending) > 1:
+            concurrent.futures.wait([self.store_executor.submit(self._get_store_data, cache_key, url, store)
+                                     for cache_key, (url, store) in pending.items()])
+
+    def _get_store_semaphore(self, store):
+        """Get the semaphore limiting the number of concurrent requests to a datastore.
+
+        :param dict store: Datastore document
+        """
+        with self.store_inflight_lock:
+            semaphore = self.store_semaphores.get(store['identifier'])
+            if semaphore is None:
+                semaphore = self.store_semaphores[store['identifier']] = threading.BoundedSemaphore(
+                    store.get('max_concurrency', self.store_max_concurrency))
+            return semaphore
+
+    def _get_store_data(self, cache_key, url, store):
+        """Call a datastore and cache its response. If a request for the same cache key is already in flight, its
+        response is waited on instead of making another request. Failed requests are cached as `None` for
+        `store_cache_negative_ttl` seconds.
+
+        :param str cache_key: Key to cache the response under
+        :param str url: URL to call
+        :param dict store: Datastore document
+        :return: The datastore response, or `None` if the request failed
+        :raises urllib.error.URLError: If the datastore can't be reached, in which case nothing is cached
+        """
+        stats = self.store_cache_stats[store['identifier']]
+        with self.store_inflight_lock:
+            future = self.store_inflight.get(cache_key)
+            in_flight = future is not None
+            if not in_flight:
+                future = self.store_inflight[cache_key] = concurrent.futures.Future()
+        if in_flight:
+            stats['coalesced'] += 1
+            return future.result()
+        stats['misses'] += 1
         try:
-            # Check to see if we've found this recently
-            cache_key = store['identifier'] + '/' + '/'.join([str(val) for key, val in list(key_values.items())])
-            if cache_key in self.store_cache:
-                data = copy.deepcopy(self.store_cache[cache_key])
-            else:
-                url = store['url']
-                for key, value in list(key_values.items()):
-                    if isinstance(value, list):
-                        if len(value) == 1:
-                            value = value[0]
-                        else:
-                            return {}
-                    url = url.replace('{{' + key + '}}', str(value))
+            with self._get_store_semaphore(store):
                 # Query the data store with the given URL, swapping the trigger key to the URL
                 data = curl.get(url)
-                self.store_cache[cache_key] = copy.deepcopy(data)
-        except urllib.error.URLError:
-            # the host is down.. lets cache this to try again later
+            self.store_cache.put(cache_key, data, store.get('cache_ttl'))
+        except urllib.error.URLError as e:
+            # the host is down.. lets not cache this so we try again later
+            future.set_exception(e)
             raise
         except Exception:
-            data = self.store_cache[cache_key] = None
+            data = None
+            stats['failures'] += 1
+            self.store_cache.put(cache_key, None, self.store_cache_negative_ttl)
             self.logger.error('failed to call store: %s' % url)
+        finally:
+            with self.store_inflight_lock:
+                del self.store_inflight[cache_key]
+        future.set_result(data)
+        return data
+
+    def processStore(self, key_values, store, already_processed=[], extracted_keys={}, original_doc={}):
+        """
+        keys and values now being passed as an ordered dictionary
+        """
+        # if any of the metadata keys are empty, return
+        for key, value in list(key_values.items()):
+            if value is None:
+                return {}
+        # Check to see if we've found this recently. The cached response is shared between lookups, so it must not be
+        # modified below.
+        cache_key, url = self._store_request(key_values, store)
+        if url is None:
+            return {}
+        data = self.store_cache.get(cache_key, _CACHE_MISS)
+        if data is _CACHE_MISS:
+            data = self._get_store_data(cache_key, url, store)
+        else:
+            self.store_cache_stats[store['identifier']]['hits'] += 1
         store_metadata = {}
         new_metadata = {}
         # We only want to add the first element of a composite key to `already_processed`, since that's used for
@@ -695,11 +802,22 @@ class Metadata(MongoRestful):
                     data = data[store['flatten']]
         orgin_data = data
         conform_keys = True if 'conform_keys' in store and store['conform_keys'] else False
+        # Keys used by the map are left out of the store metadata. `data` may be a cached response, so rather than
+        # deleting them they are tracked as `id(dict) -> set of keys` and skipped when the output is built.
+        consumed = {}
         # process the map
         if 'map' in store and store['map'] is not None:
             # A mapping for renaming keys
             store_map = store['map']
-            extracted_keys.update(self._extract_keys(data, store_map, conform_keys, original_doc))
+            new_keys = self._extract_keys(data, store_map, conform_keys, original_doc)
+            extracted_keys.update(new_keys)
+            # Fetch the datastores the extracted keys cascade to concurrently before merging them in order below
+            self._prefetch_stores(
+                [(ikey_values, istore) for mapped_key, mapped_value in new_keys.items()
+                 if mapped_key in self.stores and mapped_key not in already_processed and mapped_value is not None
+                 for istore in self.stores[mapped_key]
+                 for ikey_values in [self._cascade_key_values(istore, mapped_key, mapped_value, extracted_keys)]
+                 if ikey_values is not None])
 
             for map_name in store_map:
                 name = map_name
@@ -717,52 +835,45 @@ class Metadata(MongoRestful):
                     mapped_key = name if 'new_key' not in store_map[map_name] else store_map[map_name]['new_key']
                     mapped_value = data[name]
                     if conform_keys:
-                        mapped_key, mapped_value = self.conform(mapped_key, data[name])
+                        mapped_key, mapped_value = self.conform(mapped_key, self._copy_store_value(data[name], consumed))
                         # mapped_key = mapped_key.replace('-','_').lower()
                     if 'extract' in store_map[map_name] and store_map[map_name]['extract']:
                         # Skip the extract if skip_if_exists key exists in the original metadata doc
                         if 'skip_extract_if_exists' in store_map[map_name] and store_map[map_name]['skip_extract_if_exists'] in original_doc:
                             pass
                         else:
-                            extracted_keys[mapped_key] = new_metadata[mapped_key] = mapped_value
+                            extracted_keys[mapped_key] = new_metadata[mapped_key] = mapped_value if conform_keys else self._copy_store_value(mapped_value, consumed)
                             if mapped_key in self.stores and mapped_key not in already_processed and data[name] is not None:
                                 for istore in self.stores[mapped_key]:
                                     # returned_data = self.processStore(mapped_key, mapped_value, istore, already_processed)
                                     # new_metadata.update(returned_data)
-                                    success = True
-                                    ikey_values = collections.OrderedDict()
-                                    if isinstance(istore['key'], list):
-                                        # dealing with a list of keys
-                                        for item in istore['key']:
-                                            if item in extracted_keys:
-                                                ikey_values[item] = extracted_keys[item]
-                                            else:
-                                                # not all parts of the composite keys found,
-                                                # so we need to skip this one
-                                                success = False
-                                    else:
-                                        # dealing with a single key
-                                        ikey_values[mapped_key] = mapped_value
-                                    if success:
+                                    ikey_values = self._cascade_key_values(istore, mapped_key, mapped_value, extracted_keys)
+                                    if ikey_values is not None:
                                         returned_data = self.processStore(ikey_values, istore, already_processed, extracted_keys, original_doc)
                                         if returned_data:
                                             self.safeMerge(new_metadata, returned_data)
                     if 'use' not in store_map[map_name] or store_map[map_name]['use']:
                         # store_metadata[mapped_key]=data[name]
                         store_metadata[mapped_key] = mapped_value
-                    del data[name]
+                    consumed.setdefault(id(data), set()).add(name)
                     if old_data is not None:
                         data = old_data
         ignore_null = True if 'ignore_null' in store and store['ignore_null'] else False
         if 'only_use_map' not in store or not store['only_use_map']:
+            skip = consumed.get(id(data), ())
             for key in data:
+                if key in skip:
+                    continue
                 mapped_key = key
                 mapped_value = data[key]
                 if conform_keys:
                     # mapped_key = mapped_key.replace('-','_').lower()
-                    mapped_key, mapped_value = self.conform(mapped_key, mapped_value)
+                    mapped_key, mapped_value = self.conform(mapped_key, self._copy_store_value(mapped_value, consumed))
                 if not (ignore_null and (mapped_value is None or mapped_value == '')):
                     store_metadata[mapped_key] = mapped_value
+        if not conform_keys:
+            # `conform` already builds new containers, otherwise copy them so that the cached response isn't shared
+            store_metadata = {key: self._copy_store_value(value, consumed) for key, value in store_metadata.items()}
         if 'create_map' not in store or store['create_map']:
             # if there is a '.' in the identifier, create sub-documents
             if '.' in store['identifier']:
@@ -781,6 +892,21 @@ class Metadata(MongoRestful):
                 new_metadata[store['identifier']] = store_metadata
         return new_metadata
 
+    def _copy_store_value(self, value, consumed):
+        """Copy the dicts and lists in a datastore response value, leaving out any keys consumed by the store map.
+        Scalars are shared, which makes this much cheaper than a `deepcopy` of the whole response.
+
+        :param value: Value from the datastore response
+        :param dict consumed: Mapping of `id(dict)` to the set of keys to leave out of that dict
+        :return: Copy of the value
+        """
+        if isinstance(value, dict):
+            skip = consumed.get(id(value), ())
+            return {key: self._copy_store_value(item, consumed) for key, item in value.items() if key not in skip}
+        if isinstance(value, list):
+            return [self._copy_store_value(item, consumed) for item in value]
+        return value
+
     def conform(self, key, value):
         """
             Recursively remap keys, in case any values are dictionaries themselves
@@ -946,11 +1072,16 @@ class Metadata(MongoRestful):
     @restful.doc('Performs a query and return the first page of results, to get the next pages call nextpage. PageList can be used for making an iterable over this return result.')
     @restful.validate({'fields': {'required': False, 'type': list, 'validator': {'*': {'type': str}}},
                        'query': {'type': (str, dict), 'validator': {'*:1': {'type': '*'}}},
-                       'flatten': {'required': False, 'type': bool, 'default': False}})
+                       'flatten': {'required': False, 'type': bool, 'default': False},
+                       'keyset': {'required': False, 'type': bool,
+                                  'doc': 'Use stateless keyset pagination, where every page returns the cursor_id for the next page. Defaults to the server setting.'},
+                       'count': {'required': False, 'type': str,
+                                 'doc': 'How to count the matching records: exact, cached (an exact count shared between identical queries for a short time), estimated (only for queries without a filter) or lazy (record_count is only returned with the last page). Defaults to the server setting.'}})
     def post_pagequery(self, args, kwargs):
         fields = kwargs.get('fields', None)
         requestor = kwargs.get('requestor', None)
         flatten = kwargs.get('flatten', False)
+        keyset = kwargs.get('keyset', getattr(self.config, 'keyset_pagination', False))
         source = kwargs.get('source', 'file')
         if fields is None:
             # if there is a select, pull out the select for the fields, and set query to the where part
@@ -980,7 +1111,8 @@ class Metadata(MongoRestful):
             extra = self.apiSource
         self.queryLogger.info('%s - %s - %s', str(kwargs['query']), str(fields), requestor, extra=extra)
 
-        return self.pagequery(source, kwargs['query'], fields, return_count=10000, flatten=flatten)
+        return self.pagequery(source, kwargs['query'], fields, return_count=10000, flatten=flatten, keyset=keyset,
+                              count=kwargs.get('count'))
 
     @restful.permissions('portal')
     @restful.validate({'fields': {'required': False, 'type': list, 'validator': {'*': {'type': str}}},
@@ -994,6 +1126,55 @@ class Metadata(MongoRestful):
     # I believe this is the field that ensure the result of post_pagequery is a PageResponse object (ajtritt)
     post_pagequery.paged = True
 
+    @restful.doc('Streams all the records matching the query as newline delimited JSON, one record per line. Unlike pagequery no cursor is kept on the server and the whole result is sent in a single response, so clients should read it incrementally.')
+    @restful.stream('application/x-ndjson')
+    @restful.validate({'fields': {'required': False, 'type': list, 'validator': {'*': {'type': str}}},
+                       'query': {'type': (str, dict), 'validator': {'*:1': {'type': '*'}}},
+                       'flatten': {'required': False, 'type': bool, 'default': False},
+                       'limit': {'required': False, 'type': int, 'doc': 'Maximum number of records to return'},
+                       'source': {'required': False, 'type': str, 'default': 'file'}})
+    def post_export(self, args, kwargs):
+        fields = kwargs.get('fields', None)
+        query = convert_dates(kwargs['query'])
+        if isinstance(query, str):
+            query = toMongoObj(query)
+        if query is not None and '_id' in query:
+            query['_id'] = convertToOID(query['_id'])
+        if 'cltool' in kwargs and kwargs['cltool']:
+            extra = self.clSource
+        else:
+            extra = self.apiSource
+        self.queryLogger.info('%s - %s - %s', str(query), str(fields), kwargs.get('requestor', None), extra=extra)
+
+        cursor = self.db[kwargs.get('source', 'file')].find(query, fields,
+                                                            batch_size=getattr(self.config, 'export_batch_size', 1000))
+        if kwargs.get('limit'):
+            cursor = cursor.limit(kwargs['limit'])
+        return self._export_records(cursor, kwargs.get('flatten', False))
+
+    def _export_records(self, cursor, flatten=False):
+        """
+        Serialize the records of a cursor as newline delimited JSON. Lines are yielded in chunks of
+        `export_chunk_size` records so only one chunk is held in memory at a time.
+
+        :param pymongo.cursor.Cursor cursor: Cursor to read the records from, closed once exhausted or abandoned
+        :param bool flatten: Whether to flatten nested documents into dotted keys
+        """
+        chunk_size = getattr(self.config, 'export_chunk_size', 1000)
+        lines = []
+        try:
+            for record in cursor:
+                if flatten:
+                    record = self.flatten(record)
+                lines.append(json.dumps(record, default=jsonify))
+                if len(lines) >= chunk_size:
+                    yield ('\n'.join(lines) + '\n').encode('utf-8')
+                    lines = []
+            if lines:
+                yield ('\n'.join(lines) + '\n').encode('utf-8')
+        finally:
+            cursor.close()
+
     def post_query(self, args, kwargs):
         if len(args) > 0:
             return self.get_query(args, kwargs)
@@ -1085,7 +1266,11 @@ class Metadata(MongoRestful):
          'map': {'required': False, 'type': dict, 'validator': {'*': {'type': dict, 'validator': {
              'new_key': {'type': str, 'required': False}, 'use': {'type': bool, 'required': False},
              'extract': {'type': bool, 'required': False}}}}}, 'only_use_map': {'type': bool, 'required': False},
-         'conform_keys': {'type': bool, 'required': False}, 'ignore_null': {'type': bool, 'required': False}},
+         'conform_keys': {'type': bool, 'required': False}, 'ignore_null': {'type': bool, 'required': False},
+         'cache_ttl': {'type': int, 'required': False,
+                       'doc': 'Number of seconds responses from this data store are cached for. Defaults to the server setting.'},
+         'max_concurrency': {'type': int, 'required': False,
+                             'doc': 'Maximum number of concurrent calls to this data store. Defaults to the server setting.'}},
         allowExtra=False)
     @restful.permissions('add_store')
     def post_datastore(self, args, kwargs):
@@ -1144,6 +1329,18 @@ class Metadata(MongoRestful):
             return self.query('data_store', **kwargs)
         return self.query('data_store')
 
+    @restful.permissions('admin')
+    @restful.doc('Returns the datastore response cache statistics, in total and per datastore identifier', public=False)
+    def get_datastorecache(self, args, kwargs):
+        return {'size': len(self.store_cache),
+                'max_size': self.store_cache.max_size,
+                'ttl': self.store_cache.ttl,
+                'negative_ttl': self.store_cache_negative_ttl,
+                'hits': self.store_cache.hits,
+                'misses': self.store_cache.misses,
+                'evictions': self.store_cache.evictions,
+                'stores': {identifier: dict(stats) for identifier, stats in self.store_cache_stats.items()}}
+
     @restful.permissions('admin')
     def post_togglesubscriptions(self, args, kwargs):
         if 'Enabled' in kwargs:
@@ -1221,6 +1418,13 @@ class Metadata(MongoRestful):
         self.events.append(('file_update', args))
         self.startEventThread()
 
+    def add_bulk_update(self, args, kwargs):
+        """Queue updates of many file records, args are the key to match the records on and a list of (value, fields)
+        tuples. Records getting the same fields are updated with a single `smartUpdate`.
+        """
+        self.events.append(('file_bulk_update', args))
+        self.startEventThread()
+
     def runUpdate(self):
         try:
             while 1:
@@ -1229,6 +1433,13 @@ class Metadata(MongoRestful):
                     what, fields = data
                     if len(what) > 0 and fields is not None:
                         self.smartUpdate('file', what, {'$set': fields})
+                elif event == 'file_bulk_update':
+                    key, updates = data
+                    groups = collections.defaultdict(list)
+                    for value, fields in updates:
+                        groups[tuple(sorted(fields.items()))].append(value)
+                    for fields, values in groups.items():
+                        self.smartUpdate('file', {key: {'$in': values}}, {'$set': dict(fields)})
                 elif event == 'add':
                     subscriptions = self.subscriptionTree.test(data)
                     if subscriptions is None:
@@ -0,0 +1,234 @@
+import heapq
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+
+class PullQueueIndex:
+    """In-memory index of `REGISTERED` pull requests that have a known volume, grouped by priority and volume.
+
+    The index mirrors the ordering used by the pull queue: the next volume to restore is the one holding the request
+    with the lowest `(priority, pull_queue_id)` among the requested priorities, skipping any excluded (locked) volumes.
+
+    For every priority level a heap of `(min_pull_queue_id, volume)` entries is kept, and for every `(volume, priority)`
+    pair a heap of its `pull_queue_id`s. Removals are lazy: stale heap entries are discarded (or re-keyed) when they
+    reach the top of a heap, so adding, removing and selecting are all O(log n) amortized.
+
+    The registration time of the oldest pending request of every `(volume, priority)` pair is kept as well, so that a
+    volume can be held back for a coalescing window (see `next_volume`).
+    """
+
+    def __init__(self):
+        # pull_queue_id -> (volume, priority)
+        self._requests = {}
+        # volume -> set of pull_queue_ids
+        self._volumes = {}
+        # priority -> number of indexed requests
+        self._priority_counts = {}
+        # priority -> heap of (min pull_queue_id, volume)
+        self._priority_heaps = {}
+        # (volume, priority) -> heap of pull_queue_ids
+        self._volume_heaps = {}
+        # (volume, priority) -> pull_queue_id of its live entry in the priority heap
+        self._heads = {}
+        # (volume, priority) -> [number of indexed requests, earliest registration time since the pair was last empty]
+        self._pairs = {}
+        self._lock = threading.Lock()
+
+    def load(self, records: Iterable[dict[str, Any]]) -> None:
+        """Replace the contents of the index.
+
+        :param records: Records containing `pull_queue_id`, `volume` and `priority` keys, and optionally `registered`
+            (epoch seconds the request was registered, defaults to when its volume was first indexed or now)
+        """
+        with self._lock:
+            pairs = self._pairs
+            self._requests = {}
+            self._volumes = {}
+            self._priority_counts = {}
+            self._priority_heaps = {}
+            self._volume_heaps = {}
+            self._heads = {}
+            self._pairs = {}
+            for record in records:
+                pair = pairs.get((record.get('volume'), record.get('priority')))
+                self._add(record.get('pull_queue_id'), record.get('volume'), record.get('priority'),
+                          record.get('registered') or (pair[1] if pair else None))
+
+    def add(self, pull_queue_id: int, volume: str, priority: int, registered: Optional[float] = None) -> None:
+        """Add a pull request to the index. If the request is already indexed, its volume and priority are updated.
+
+        :param pull_queue_id: ID of the `pull_queue` record
+        :param volume: Volume the file resides on
+        :param priority: Priority of the request
+        :param registered: Epoch seconds the request was registered, defaults to now
+        """
+        with self._lock:
+            self._add(pull_queue_id, volume, priority, registered)
+
+    def remove(self, pull_queue_ids: Iterable[int]) -> None:
+        """Remove pull requests from the index. IDs that are not indexed are ignored.
+
+        :param pull_queue_ids: IDs of the `pull_queue` records to remove
+        """
+        with self._lock:
+            for pull_queue_id in pull_queue_ids:
+                self._remove(pull_queue_id)
+
+    def remove_volume(self, volume: str) -> list[int]:
+        """Remove all pull requests for a volume from the index.
+
+        :param volume: Volume to remove
+        :return: IDs of the removed `pull_queue` records
+        """
+        with self._lock:
+            pull_queue_ids = list(self._volumes.get(volume, ()))
+            for pull_queue_id in pull_queue_ids:
+                self._remove(pull_queue_id)
+            return pull_queue_ids
+
+    def next_volume(self, priorities: Iterable[int], excluded_volumes: Iterable[str] = (),
+                    hold_windows: Optional[dict[int, float]] = None,
+                    now: Optional[float] = None) -> Optional[dict[str, Any]]:
+        """Get the volume holding the lowest `(priority, pull_queue_id)` request for the given priorities. The index
+        is not modified (other than discarding stale entries).
+
+        With `hold_windows`, a volume is held back until its oldest pending request at that priority has been
+        registered for the priority's window. Requests for the volume registered in the meantime then go out in the
+        same batch, so a burst of requests for one tape costs a single mount.
+
+        :param priorities: Priorities to consider
+        :param excluded_volumes: Volumes to skip (e.g., volumes that are currently locked)
+        :param hold_windows: Seconds to hold a volume for, by priority (priorities not listed are not held)
+        :param now: Current epoch seconds, defaults to now
+        :return: Dictionary with `pull_queue_id`, `volume` and `priority` keys, or `None` if nothing is available
+        """
+        if hold_windows and now is None:
+            now = time.time()
+        with self._lock:
+            for priority in sorted(set(priorities)):
+                heap = self._priority_heaps.get(priority)
+                if not heap:
+                    continue
+                hold_window = hold_windows.get(priority) if hold_windows else None
+                skipped = []
+                found = None
+                while heap:
+                    pull_queue_id, volume = heap[0]
+                    if self._heads.get((volume, priority)) != pull_queue_id:
+                        # Superseded by a lower ID that was added later
+                        heapq.heappop(heap)
+                        continue
+                    current_min = self._volume_min(volume, priority)
+                    if current_min is None:
+                        heapq.heappop(heap)
+                        del self._heads[(volume, priority)]
+                    elif current_min != pull_queue_id:
+                        heapq.heapreplace(heap, (current_min, volume))
+                        self._heads[(volume, priority)] = current_min
+                    elif volume in excluded_volumes or (
+                            hold_window and now < self._pairs[(volume, priority)][1] + hold_window):
+                        skipped.append(heapq.heappop(heap))
+                    else:
+                        found = {'pull_queue_id': pull_queue_id, 'volume': volume, 'priority': priority}
+                        break
+                for entry in skipped:
+                    heapq.heappush(heap, entry)
+                if found:
+                    return found
+            return None
+
+    def held_until(self, volume: str, priority: int, hold_window: float) -> Optional[float]:
+        """Get when a volume stops being held at a priority.
+
+        :param volume: Volume
+        :param priority: Priority
+        :param hold_window: Seconds the volume is held for at this priority
+        :return: Epoch seconds, or `None` if the volume has no pending requests at this priority
+        """
+        pair = self._pairs.get((volume, priority))
+        return None if pair is None else pair[1] + hold_window
+
+    def get_volumes(self) -> list[str]:
+        """Get the volumes that have indexed pull requests.
+        """
+        with self._lock:
+            return list(self._volumes)
+
+    def get_volume_requests(self, volume: str) -> list[int]:
+        """Get the IDs of the indexed pull requests for a volume.
+
+        :param volume: Volume to get pull requests for
+        """
+        with self._lock:
+            return sorted(self._volumes.get(volume, ()))
+
+    def volume_count(self) -> int:
+        """Get the number of distinct volumes that have indexed pull requests.
+        """
+        return len(self._volumes)
+
+    def count(self, priority: Optional[int] = None) -> int:
+        """Get the number of indexed pull requests.
+
+        :param priority: If set, only count requests with this priority
+        """
+        if priority is None:
+            return len(self._requests)
+        return self._priority_counts.get(priority, 0)
+
+    def __contains__(self, pull_queue_id: int) -> bool:
+        return pull_queue_id in self._requests
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def _add(self, pull_queue_id: int, volume: str, priority: int, registered: Optional[float] = None) -> None:
+        current = self._requests.get(pull_queue_id)
+        if current == (volume, priority):
+            return
+        if current is not None:
+            self._remove(pull_queue_id)
+        self._requests[pull_queue_id] = (volume, priority)
+        registered = time.time() if registered is None else float(registered)
+        pair = self._pairs.setdefault((volume, priority), [0, registered])
+        pair[0] += 1
+        pair[1] = min(pair[1], registered)
+        self._volumes.setdefault(volume, set()).add(pull_queue_id)
+        self._priority_counts[priority] = self._priority_counts.get(priority, 0) + 1
+        heapq.heappush(self._volume_heaps.setdefault((volume, priority), []), pull_queue_id)
+        head = self._heads.get((volume, priority))
+        if head is None or pull_queue_id < head:
+            heapq.heappush(self._priority_heaps.setdefault(priority, []), (pull_queue_id, volume))
+            self._heads[(volume, priority)] = pull_queue_id
+
+    def _remove(self, pull_queue_id: int) -> None:
+        current = self._requests.pop(pull_queue_id, None)
+        if current is None:
+            return
+        volume, priority = current
+        pull_queue_ids = self._volumes.get(volume)
+        pull_queue_ids.discard(pull_queue_id)
+        if not pull_queue_ids:
+            del self._volumes[volume]
+        pair = self._pairs[current]
+        pair[0] -= 1
+        if pair[0] == 0:
+            # The volume no longer has pending requests at this priority, so the next one starts a new window
+            del self._pairs[current]
+        self._priority_counts[priority] -= 1
+        if self._priority_counts[priority] == 0:
+            del self._priority_counts[priority]
+
+    def _volume_min(self, volume: str, priority: int) -> Optional[int]:
+        """Get the lowest indexed `pull_queue_id` for the `(volume, priority)` pair, discarding stale entries.
+        """
+        volume_heap = self._volume_heaps.get((volume, priority))
+        if volume_heap is None:
+            return None
+        while volume_heap and self._requests.get(volume_heap[0]) != (volume, priority):
+            heapq.heappop(volume_heap)
+        if not volume_heap:
+            del self._volume_heaps[(volume, priority)]
+            return None
+        return volume_heap[0]
@@ -10,12 +10,16 @@ import matplotlib.dates as mdates
 import math
 from io import BytesIO
 import base64
+import hashlib
+import cherrypy
 from lapinpy import sdmlogger, restful, common
 from lapinpy.mysqlrestful import MySQLRestful
 from typing import Any, Optional, Callable
 
 from . import task
 from .hsi import HSI, HSI_status
+from .pull_index import PullQueueIndex
+from .tar_packer import TarPacker
 
 MIN_SINGLE_SIZE = 1024 * 1024 * 1024
 MAX_TAR_SIZE = 1024 * 1024 * 1024 * 1024
@@ -39,6 +43,35 @@ TRANSFER_MODES = {
     'Purge': 2
 }
 
+# Charts served by `get_*_stats`, `get_stats_chart` and `get_stats_series`. The queries are formatted with the number of
+# days in the time window, `name` with a description of the window.
+STATS_CHARTS = {
+    'ingest': {
+        'hour': 'select date_format(created_dt, "%y-%m-%d %H") as ymdh, count(*) as N, source, sum(file_size) / 1e9 as gb from file where created_dt > now() - interval {days} day group by ymdh, source order by ymdh desc',
+        'user': 'select file_owner, count(*) as N, source, sum(file_size) / 1e9 as gb from file where created_dt > now() - interval {days} day group by file_owner, source order by file_owner',
+        'sets': ('N', 'gb'),
+        'titles': ('Number of Files', 'File Footprint in GB'),
+        'labels': ('Files', 'GB'),
+        'name': 'Files Published by N Files and Footprint over the Last {window}',
+    },
+    'request': {
+        'hour': 'select date_format(dt_modified, "%y-%m-%d %H") as ymdh, count(*) as N, sum(b.file_size) / 1e9 as gb from request a join file b on a.file_id = b.file_id where dt_modified > now() - interval {days} day group by 1 order by ymdh desc',
+        'user': 'select a.requestor, count(*) as N, sum(b.file_size) / 1e9 as gb from request a join file b on a.file_id = b.file_id where dt_modified > now() - interval {days} day group by 1 order by count(*) desc',
+        'sets': ('N', 'gb'),
+        'titles': ('Number of Files', 'File Footprint in GB'),
+        'labels': ('Files', 'GB'),
+        'name': 'Files Requested by N Files and Footprint over the Last {window}',
+    },
+    'restore': {
+        'hour': 'select date_format(dt_modified, "%y-%m-%d %H") as ymdh, count(distinct volume) as vol, count(*) as N, sum(file_size) / 1e9 as gb from pull_queue p use index (pull_queue_status_id_dt_modified) join file f on f.file_id = p.file_id where queue_status_id = 3 and dt_modified > now() - interval {days} day group by ymdh order by ymdh desc',
+        'user': 'select requestor, count(distinct volume) as vol, count(*) as N, sum(file_size) / 1e9 as gb from pull_queue p use index (pull_queue_status_id_dt_modified) join file f on f.file_id = p.file_id where queue_status_id = 3 and dt_modified > now() - interval {days} day group by 1 order by N desc',
+        'sets': ('N', 'vol', 'gb'),
+        'titles': ('Number of Files', 'Tape Volumes to Load', 'File Footprint in GB'),
+        'labels': ('Files', 'Volumes', 'GB'),
+        'name': 'Files Restored by N Files, Footprint, and Tape Volumes over the Last {window}',
+    },
+}
+
 
 class ConfigurationException(Exception):
     """Exception to be raised if there is an issue with configuration.
@@ -80,6 +113,11 @@ class Tape(MySQLRestful):
         self._lock = threading.Lock()
         self.tar_record_info = {}
         self.disk_usage = {}
+        self.tape_status = {}
+        self.tape_status_time = None
+        self.tape_status_lock = threading.Lock()
+        self.stats_charts = {}
+        self.stats_charts_lock = threading.Lock()
         self.quota_used = 0
         self.remote_server_client = None
         self.repository_root_pattern = self.config.dm_archive_root + '%'
@@ -100,22 +138,14 @@ class Tape(MySQLRestful):
             self.quota_used = int(quota[0].get('used', 0))
             self.config.disk_size = int(quota[0].get('quota', self.config.disk_size))
 
-        # Initialize our repository stats
+        # Initialize our repository stats, the triggers on `file` only count files under the configured root
+        self.modify('delete from file_footprint_root where root != %s', self.config.dm_archive_root)
+        self.modify('insert ignore into file_footprint_root (root) values (%s)', self.config.dm_archive_root)
         self.repository_footprint()
         self.requested_restores = {}
-        self.save_requested_restores()
         self.get_diskusage(None, None)
-
-        self.refresh_tar_info()
         self.refresh_priority_counts()
 
-        # Distribute any tarball location information we might have
-        for rec in self.query('select distinct tar_record_id from pull_queue where queue_status_id = 1 and tar_record_id is not null and volume is null'):
-            tar_record_id = rec['tar_record_id']
-            if tar_record_id in self.tar_record_info:
-                tar_record = self.tar_record_info[tar_record_id]
-                self.modify('update pull_queue set volume=%s, position_a=%s, position_b=%s where tar_record_id=%s and queue_status_id=1 and volume is null', tar_record['volume'], tar_record['position_a'], tar_record['position_b'], tar_record_id)
-
         # Initialize remote path configuration
         self.remote_path_prefixes = {}
         for feature, remote_config in self.config.remote_sources.items():
@@ -128,16 +158,77 @@ class Tape(MySQLRestful):
         for division_config in self.config.division:
             division = self.divisions[division_config['name']] = Tape.Division(division_config['name'], self, division_config)
 
-            # Initialize put queue
-            self.init_put_queue(division_config['name'])
-
             # Initialize the active locks (volumes)
             division.pull_queue.init_locks(self.query(
                 'select distinct volume from pull_queue join file using(file_id) where queue_status_id = %s and division = %s',
                 [self.queue_status.IN_PROGRESS, division_config['name']], uselimit=False))
 
+        # The backlog of the other queues is loaded after we start serving tasks (pulls are served from the index loaded
+        # above), only the records that exist now are loaded since the ones added from here on are queued as they come in
+        self.hydrated = threading.Event()
+        self.hydrate_error = None
+        bounds = self.query(
+            'select (select max(file_id) from file) as file_id, (select max(file_ingest_id) from file_ingest) as file_ingest_id, (select max(md5_queue_id) from md5_queue) as md5_queue_id, (select max(backup_record_id) from backup_record) as backup_record_id')[0]
+        if getattr(self.config, 'hydrate_in_background', True):
+            threading.Thread(target=self.hydrate_queues, args=(bounds,), name='hydrate_queues', daemon=True).start()
+        else:
+            self.hydrate_queues(bounds)
+
         self.logger.info('started tape')
 
+    def hydrate_queues(self, bounds: dict[str, Optional[int]]) -> None:
+        """Load the tar location information and the backlog of the ingest, copy, tar, md5 and put queues of every
+        division, in chunks of `startup_chunk_size` records.
+
+        :param bounds: Largest `file_id`, `file_ingest_id`, `md5_queue_id` and `backup_record_id` to load records up to
+        """
+        start = time.time()
+        try:
+            self.save_requested_restores()
+            self.refresh_tar_info()
+
+            # Distribute any tarball location information we might have
+            distributed = False
+            for rec in self.query('select distinct tar_record_id from pull_queue where queue_status_id = 1 and tar_record_id is not null and volume is null'):
+                tar_record_id = rec['tar_record_id']
+                if tar_record_id in self.tar_record_info:
+                    tar_record = self.tar_record_info[tar_record_id]
+                    self.modify('update pull_queue set volume=%s, position_a=%s, position_b=%s where tar_record_id=%s and queue_status_id=1 and volume is null', tar_record['volume'], tar_record['position_a'], tar_record['position_b'], tar_record_id)
+                    distributed = True
+            if distributed:
+                self.refresh_pull_queue_index()
+
+            for division in self.divisions.values():
+                division.hydrate(self, bounds)
+                self.init_put_queue(division.division_name, bounds.get('backup_record_id'))
+        except Exception as e:
+            # Reported by `get_taskstatus`, the backlog stays unloaded until the service is restarted
+            self.hydrate_error = repr(e)
+            self.logger.exception('failed to load the queue backlog')
+            raise
+        self.hydrated.set()
+        self.logger.info('loaded the queue backlog in %.1f seconds' % (time.time() - start))
+
+    def _query_chunked(self, sql: str, values: list[Any], key: str, last: Optional[int]) -> Any:
+        """Stream the records of a query in chunks of `startup_chunk_size` records, paging on an increasing integer key
+        rather than with an offset, so every chunk is an index range scan.
+
+        :param sql: Query with a where clause, to which the key range, order and limit are appended
+        :param values: Values for the placeholders in `sql`
+        :param key: Key column to page on (e.g., `b.backup_record_id`), which must be selected
+        :param last: Largest key to load, `None` if the table is empty
+        :return: Generator of the records
+        """
+        chunk_size = getattr(self.config, 'startup_chunk_size', 50000)
+        after = 0
+        while last is not None:
+            records = self.query(f'{sql} and {key} > %s and {key} <= %s order by {key} limit %s',
+                                 values + [after, last, chunk_size], uselimit=False)
+            yield from records
+            if len(records) < chunk_size:
+                return
+            after = records[-1][key.split('.')[-1]]
+
     def getHpssFileInfo(self, in_file):
         with self.hpss_lock:
             if self.hsi is None:
@@ -169,13 +260,13 @@ class Tape(MySQLRestful):
                 rec['file_name'] = backup_record.get('origin_file_name')
             self.add_file(rec)
 
-    def init_put_queue(self, division_name):
-        backup_records = self.query(
-            'select f.local_purge_days, f.origin_file_path, f.origin_file_name, f.file_id, file_name, file_path, service, backup_record_id, file_status_id, backup_record_status_id, file_size, division from backup_record b left join file f on f.file_id = b.file_id where f.file_status_id in (%s,%s) and backup_record_status_id in (%s,%s) and dt_to_release is null and division = %s',
+    def init_put_queue(self, division_name, last_backup_record_id):
+        backup_records = self._query_chunked(
+            'select f.local_purge_days, f.origin_file_path, f.origin_file_name, f.file_id, file_name, file_path, service, b.backup_record_id, file_status_id, backup_record_status_id, file_size, division from backup_record b left join file f on f.file_id = b.file_id where f.file_status_id in (%s,%s) and backup_record_status_id in (%s,%s) and dt_to_release is null and division = %s',
             [
                 self.file_status.BACKUP_READY, self.file_status.BACKUP_IN_PROGRESS,
                 self.backup_record_status.REGISTERED, self.backup_record_status.TRANSFER_READY, division_name],
-            uselimit=False)
+            'b.backup_record_id', last_backup_record_id)
         self.add_files(backup_records)
 
     # Mark a task as completed
@@ -183,17 +274,43 @@ class Tape(MySQLRestful):
     def put_taskcomplete(self, _args, kwargs):
         self.divisions.get(kwargs.get('division')).task_manager.set_task_complete(kwargs['task_id'], kwargs['returned'])
 
-    # Get the next task to work on (marks the previous task as complete)
+    # Keep a lease on a batch of tasks alive
+    @restful.validate({'lease_id': {'type': str}, 'division': {'type': str}})
+    @restful.permissions('tape')
+    def put_leaseheartbeat(self, _args, kwargs):
+        return {'lease_id': kwargs.get('lease_id'),
+                'active': self.divisions.get(kwargs.get('division')).task_manager.heartbeat_lease(kwargs.get('lease_id'))}
+
+    # Report the results of a batch of tasks
+    @restful.validate({'lease_id': {'type': str}, 'division': {'type': str}, 'results': {'type': dict},
+                       'requeue': {'type': list, 'validator': {'*': {'type': str}}, 'required': False}})
+    @restful.permissions('tape')
+    def put_leasecomplete(self, _args, kwargs):
+        self.divisions.get(kwargs.get('division')).task_manager.complete_lease(kwargs.get('lease_id'),
+                                                                               kwargs.get('results'),
+                                                                               kwargs.get('requeue') or [])
+
+    # Get the next task to work on (marks the previous task as complete). With `max_tasks`, a batch of tasks is leased
+    # instead (reporting the results of the previous lease).
     @restful.validate({'features': {'type': list, 'validator': {'*': {'type': str}}},
-                       'tasks': {'type': list, 'validator': {'*': {'type': str}}}, 'division': {'type': str}})
+                       'tasks': {'type': list, 'validator': {'*': {'type': str}}}, 'division': {'type': str},
+                       'max_tasks': {'type': int, 'required': False}, 'max_bytes': {'type': int, 'required': False}})
     @restful.permissions('tape')
     def post_nexttask(self, _args, kwargs):
-        def create_task(next_task: dict[str, Any], queue_name: str) -> dict[str, Any]:
-            return {'task': queue_name, 'data': next_task.get('data'), 'task_id': None,
-                    'features': next_task.get('uses_resources'), 'service': kwargs.get('service'),
-                    'created': datetime.datetime.now(), 'division': kwargs.get('division')}
+        def create_task(next_task: dict[str, Any], queue_name: str, **extra) -> dict[str, Any]:
+            task_data = {'task': queue_name, 'data': next_task.get('data'), 'task_id': None,
+                         'features': next_task.get('uses_resources'), 'service': kwargs.get('service'),
+                         'created': datetime.datetime.now(), 'division': kwargs.get('division')} | extra
+            if kwargs.get('max_tasks') is not None:
+                # Prep and pull tasks are batches of records already, so they are not leased with other tasks
+                return {'lease_id': None, 'tasks': [task_data], 'bytes': task.task_size(task_data.get('data')),
+                        'service': kwargs.get('service'), 'division': kwargs.get('division')}
+            return task_data
 
         division = self.divisions.get(kwargs.get('division'))
+        if kwargs.get('lease_id') is not None:
+            division.task_manager.complete_lease(kwargs.get('lease_id'), kwargs.get('results') or {},
+                                                 kwargs.get('requeue') or [])
         if 'previous_task_id' not in kwargs:
             kwargs['previous_task_id'] = None
         if 'prep' in kwargs.get('tasks'):
@@ -211,7 +328,10 @@ class Tape(MySQLRestful):
                 division.task_manager.set_task_complete(kwargs.get('previous_task_id'), kwargs.get('returned'))
             next_task = division.pull_queue.next(kwargs.get('features'))
             if next_task:
-                return create_task(next_task, division.pull_queue.name) | {'records': len(next_task.get('data'))}
+                return create_task(next_task, division.pull_queue.name, records=len(next_task.get('data')))
+        if kwargs.get('max_tasks') is not None:
+            return division.task_manager.get_lease(kwargs.get('features'), kwargs.get('tasks'), kwargs.get('service'),
+                                                   kwargs.get('max_tasks'), kwargs.get('max_bytes'))
         return division.task_manager.get_task(kwargs.get('features'), kwargs.get('tasks'), kwargs.get('previous_task_id'),
                                               kwargs.get('service'), kwargs.get('returned'))
 
@@ -242,7 +362,7 @@ class Tape(MySQLRestful):
     def get_tasklist(self, _args, _kwargs):
         ret_value = {}
         for division in self.divisions.values():
-            ret_value[division.division_name] = {'orphan_files': division.orphan_files}
+            ret_value[division.division_name] = {'orphan_files': division.tar_packer.pending()}
             for key, value in division.__dict__.items():
                 if isinstance(value, task.Queue):
                     for key2, value2 in value.feature_queues.items():
@@ -265,43 +385,99 @@ class Tape(MySQLRestful):
                 division.task_manager.reset()
             ret[division.division_name] = division.task_manager.get_status()
         ret['resources_gone'] = self.resources_gone
+        ret['backlog_loaded'] = self.hydrated.is_set()
+        ret['backlog_error'] = self.hydrate_error
         return ret
 
+    def _tape_status_counts(self) -> dict:
+        """Count the records in each of the states reported by `get_tape_status`.
+
+        :return: Dictionary of counter name to count
+        """
+        counts = {}
+        counts['pull'] = self.query('select count(*) N from pull_queue where queue_status_id in (1,2)')[0].get('N')
+        counts['prep'] = self.query('select count(*) N from pull_queue where queue_status_id in (%s, %s) and volume is null',
+                                    [self.queue_status.REGISTERED, self.queue_status.PREP_IN_PROGRESS])[0].get('N')
+        counts['put'] = self.query('select count(*) N from backup_record where backup_record_status_id = 3')[0].get('N')
+        counts['error'] = self.query('select count(*) N from backup_record where backup_record_status_id = 5')[0].get('N')
+        counts['error'] += self.query('select count(*) N from pull_queue where queue_status_id in (4, 6)')[0].get('N')
+        counts['error'] += self.query('select count(*) N from file where file_status_id in (5, 9, 17)')[0].get('N')
+        counts['error'] += self.query('select count(*) N from file_ingest where file_ingest_status_id = 20')[0].get('N')
+        counts['other'] = self.query('select count(*) N from file where file_status_id in (1, 2, 3, 15)')[0].get('N')
+        counts['ingest'] = len(restful.run_internal('metadata', 'ingest_retry_records', None))
+        counts['vol'] = self.query('select count(distinct volume) N from pull_queue where queue_status_id = 1')[0].get('N')
+        counts['recent'] = self.query(
+            'select count(*) N from pull_queue where queue_status_id = 3 and dt_modified > now() - interval 1 hour')[
+            0].get('N')
+        return counts
+
+    @restful.cron('*', '*', '*', '*')
+    def refresh_tape_status(self, force: bool = False) -> None:
+        """Refresh the snapshot of record counts and reports served by `get_tape_status`, so that polling the status
+        doesn't query the database on every call. The cron job refreshes the snapshot once it is a quarter of
+        `tape_status_max_age` seconds old, so it is refreshed well before `get_tape_status` considers it stale. The
+        snapshot is timed from the start of the refresh, as that is when the counts were taken.
+
+        :param bool force: Refresh the snapshot regardless of its age
+        """
+        with self.tape_status_lock:
+            max_age = getattr(self.config, 'tape_status_max_age', 120)
+            start = time.time()
+            if not force and self.tape_status_time is not None and start - self.tape_status_time < max_age / 4:
+                return
+            snapshot = self._tape_status_counts()
+            snapshot['queue_status'] = self.query(
+                'select a.priority, min(a.dt_modified) as min, min(b.dt_begin) as dt_modified, count(distinct a.pull_queue_id) as n from pull_queue a join pull_queue_status_history b on a.pull_queue_id = b.pull_queue_id where a.queue_status_id not in (0, 3) group by 1 order by 1')
+            snapshot['active_states'] = self.query('select * from active')
+            snapshot['active'] = self.query(
+                'select a.requestor, count(*) as N, sum(b.file_size) / 1e9 as gb from pull_queue a join file b on a.file_id = b.file_id where a.queue_status_id not in (0, 3) group by 1 order by count(*) desc')
+            snapshot['age'] = self.query('select * from age')
+            # The five day reports are the series of the statistics charts kept by `refresh_stats_charts`
+            snapshot['request'] = self.get_cached_stats_chart('request', 5)['user']
+            snapshot['publish'] = self.get_cached_stats_chart('ingest', 5)['user']
+            snapshot['pull_stats'] = self.get_cached_stats_chart('restore', 5)['hour']
+            snapshot['put_stats'] = self.get_cached_stats_chart('ingest', 5)['hour']
+            self.tape_status = snapshot
+            self.tape_status_time = start
+
     # Dump the status for the gateway monitor
     def get_tape_status(self, _args, _kwargs):
-        ret = {}
+        # The counts come from the snapshot kept by `refresh_tape_status`. The first call waits for a snapshot, after
+        # that a snapshot older than `tape_status_max_age` seconds (the cron job is behind) is still served while it is
+        # refreshed in the background
+        max_age = getattr(self.config, 'tape_status_max_age', 120)
+        if self.tape_status_time is None:
+            self.refresh_tape_status()
+        elif time.time() - self.tape_status_time > max_age and not self.tape_status_lock.locked():
+            threading.Thread(target=self.refresh_tape_status, name='refresh_tape_status', daemon=True).start()
+        ret = dict(self.tape_status)
         ret['foot_print'] = self.disk_usage.get('disk_usage_files')
         ret['dna_free_tb'] = self.disk_usage.get('dna_free_tb')
-        ret['pull'] = self.query('select count(*) N from pull_queue where queue_status_id in (1,2)')[0].get('N')
-        ret['prep'] = self.query('select count(*) N from pull_queue where queue_status_id in (%s, %s) and volume is null',
-                                 [self.queue_status.REGISTERED, self.queue_status.PREP_IN_PROGRESS])[0].get('N')
-        ret['put'] = self.query('select count(*) N from backup_record where backup_record_status_id = 3')[0].get('N')
-        ret['error'] = self.query('select count(*) N from backup_record where backup_record_status_id = 5')[0].get('N')
-        ret['error'] += self.query('select count(*) N from pull_queue where queue_status_id in (4, 6)')[0].get('N')
-        ret['error'] += self.query('select count(*) N from file where file_status_id in (5, 9, 17)')[0].get('N')
-        ret['error'] += self.query('select count(*) N from file_ingest where file_ingest_status_id = 20')[0].get('N')
-        ret['other'] = self.query('select count(*) N from file where file_status_id in (1, 2, 3, 15)')[0].get('N')
-        ret['ingest'] = len(restful.run_internal('metadata', 'ingest_retry_records', None))
-        ret['vol'] = self.query('select count(distinct volume) N from pull_queue where queue_status_id = 1')[0].get('N')
-        ret['recent'] = self.query(
-            'select count(*) N from pull_queue where queue_status_id = 3 and dt_modified > now() - interval 1 hour')[
-            0].get('N')
         ret['hpss'] = (self.hsi_state.isup('archive') ^ 1) + (10 * (self.hsi_state.isup('hpss') ^ 1))
-        ret['queue_status'] = self.query(
-            'select a.priority, min(a.dt_modified) as min, min(b.dt_begin) as dt_modified, count(distinct a.pull_queue_id) as n from pull_queue a join pull_queue_status_history b on a.pull_queue_id = b.pull_queue_id where a.queue_status_id not in (0, 3) group by 1 order by 1')
-        ret['active_states'] = self.query('select * from active')
-        ret['active'] = self.query(
-            'select a.requestor, count(*) as N, sum(b.file_size) / 1e9 as gb from pull_queue a join file b on a.file_id = b.file_id where a.queue_status_id not in (0, 3) group by 1 order by count(*) desc')
-        ret['age'] = self.query('select * from age')
-        ret['request'] = self.get_requested_last_five_days_by_user(None, None)
-        ret['publish'] = self.get_ingested_last_five_days_by_user(None, None)
-        ret['pull_stats'] = self.get_restored_last_five_days_by_hour(None, None)
-        ret['put_stats'] = self.get_ingested_last_five_days_by_hour(None, None)
         ret['requested_restores'] = self.requested_restores
         ret['enabled_queues'] = {division_name: division.pull_queue.enabled_queues for division_name, division in
                                  self.divisions.items()}
         return ret
 
+    @restful.permissions('admin')
+    def get_tape_status_check(self, args, _kwargs):
+        """Compare the counts in the `get_tape_status` snapshot against the current counts in the database.
+
+        :param args: `refresh` replaces the snapshot with a fresh one after comparing
+        :return: Dictionary with whether the counts are consistent, the age of the snapshot in seconds and the counts
+            that differ
+        """
+        counts = self._tape_status_counts()
+        snapshot = self.tape_status
+        differences = {key: {'snapshot': snapshot.get(key), 'actual': count} for key, count in counts.items()
+                       if snapshot.get(key) != count}
+        ret = {'consistent': len(differences) == 0,
+               'age': None if self.tape_status_time is None else time.time() - self.tape_status_time,
+               'differences': differences}
+        if 'refresh' in args:
+            self.refresh_tape_status(force=True)
+        return ret
+
     @restful.permissions('admin')
     def post_reset_failed(self, _args, _kwargs):
         # update records and add them to the task queue
@@ -350,6 +526,8 @@ class Tape(MySQLRestful):
                     # Update `file` record status
                     self.modify('update file set file_status_id = %s where file_id = %s', file_to_state,
                                 pull_queue_record.get('file_id'))
+            self._sync_pull_queue_index([pull_queue_record.get('pull_queue_id')
+                                         for pull_queue_record in pull_queue_records])
 
         for division in self.divisions.values():
             # Update any ingest failures
@@ -492,56 +670,62 @@ class Tape(MySQLRestful):
                              'backup_record_id': backup_record.get('backup_record_id'),
                              'file_name': record.get('file_name'), 'file_path': record.get('file_path')}]},
                         [self._get_backup_service_feature_name(backup_record.get('service'))])
-            #  else we are going to save it off and put into a tarball
+            #  else we are going to save it off and put into a tarball with files from the same project area
             else:
                 for backup_record in record.get('backup_records'):
                     service = backup_record.get('service')
-                    #  If we don't have a collection for this service, start a new list
-                    if str(service) not in division.orphan_files:
-                        division.orphan_files[str(service)] = {
-                            'size': record.get('file_size'),
-                            'root_dir': record.get('file_path'),
-                            'backup_records': [{'file_id': record.get('file_id'),
-                                                'backup_record_id': backup_record.get('backup_record_id'),
-                                                'file_name': record.get('file_name'),
-                                                'file_path': record.get('file_path')}]}
-                    # Else add it to the current list of files to send off
-                    else:
-                        orphan_list = division.orphan_files[str(service)]
-                        orphan_list['size'] += record.get('file_size')
-                        orphan_list.get('backup_records').append(
-                            {'file_id': record.get('file_id'),
-                             'backup_record_id': backup_record.get('backup_record_id'),
-                             'file_name': record.get('file_name'), 'file_path': record.get('file_path')})
-                        orphan_list['root_dir'] = os.path.commonprefix(
-                            [orphan_list.get('root_dir'), record.get('file_path')])
-                        # If our collection is now big enough, send off the set to tape and remove the list
-                        if orphan_list.get('size') > MIN_SINGLE_SIZE:
-                            division.put_queue.add(
-                                {'file_size': orphan_list.get('size'), 'root_dir': orphan_list.get('root_dir'),
-                                 'records': orphan_list.get('backup_records'), 'service': service},
-                                [self._get_backup_service_feature_name(backup_record.get('service'))])
-                            del division.orphan_files[str(service)]
+                    tars = division.tar_packer.add(service, {'file_id': record.get('file_id'),
+                                                             'backup_record_id': backup_record.get('backup_record_id'),
+                                                             'file_name': record.get('file_name'),
+                                                             'file_path': record.get('file_path')},
+                                                   record.get('file_size'))
+                    # If the collection is now big enough, send off the set to tape
+                    for tar in tars:
+                        division.put_queue.add(tar, [self._get_backup_service_feature_name(service)])
+
+    @restful.cron('*/10', '*', '*', '*')
+    def flush_tar_bins(self):
+        """Send off the small files that have been waiting for a tar for longer than the division's `tar_max_age`.
+        """
+        with self.transfer_lock:
+            for division in self.divisions.values():
+                for tar in division.tar_packer.flush_aged():
+                    division.put_queue.add(tar, [self._get_backup_service_feature_name(tar.get('service'))])
+
+    @restful.doc('Gets the fill efficiency (size / target size) of the recently packed small file tars and the files '
+                 'still waiting for a tar, by division')
+    def get_tarpacking(self, args, _kwargs):
+        with self.transfer_lock:
+            return {name: division.tar_packer.report() for name, division in self.divisions.items()
+                    if not args or args[0] == name}
 
     # calculate the current repository footprint
-    @restful.cron('*/30', '*', '*', '*')
+    @restful.cron('*/5', '*', '*', '*')
     def repository_footprint(self):
-        # disk allocation is in MB, block sizes are 512 bytes for files < 384 and 32k for everything larger
-        data = self.query('select count(*) as files, ifnull(sum(case when file_size < 384 then 512 else ceil(file_size/32768.0)*32768 end), 0) as disk_usage from file where file_status_id not in (%s, %s) and file_path like %s',
-                          [self.cv.get('file_status').get('PURGED', 0),
-                           self.cv.get('file_status').get('DELETE', 0),
-                           self.repository_root_pattern])
-        if len(data) > 0:
-            self.disk_usage['files'] = int(data[0].get('files', 0))
-            self.disk_usage['disk_usage_files'] = int(data[0].get('disk_usage', 0))
-
-        # Files being restored
-        data = self.query('select count(*) as files, ifnull(sum(case when file_size < 384 then 512 else ceil(file_size/32768.0)*32768 end), 0) as disk_usage from file where file_status_id = %s and file_path like %s',
-                          [self.cv.get('file_status').get('RESTORE_IN_PROGRESS', 0),
-                           self.repository_root_pattern])
-        if len(data) > 0:
-            self.disk_usage['files_restoring'] = int(data[0].get('files', 0))
-            self.disk_usage['disk_usage_files_restoring'] = int(data[0].get('disk_usage', 0))
+        # disk allocation is in MB, block sizes are 512 bytes for files < 384 and 32k for everything larger.
+        # The totals are kept per division and file status in `file_footprint` by the triggers on `file`, so this only
+        # sums a handful of rows. `reconcile_repository_footprint` corrects any drift against the `file` table.
+        not_on_disk = (self.cv.get('file_status').get('PURGED', 0), self.cv.get('file_status').get('DELETE', 0))
+        restoring = self.cv.get('file_status').get('RESTORE_IN_PROGRESS', 0)
+        data = self.query('select division, file_status_id, sum(files) as files, sum(disk_usage) as disk_usage from file_footprint group by 1, 2',
+                          uselimit=False)
+        totals = {'files': 0, 'disk_usage_files': 0, 'files_restoring': 0, 'disk_usage_files_restoring': 0}
+        divisions = {}
+        for rec in data:
+            if rec.get('file_status_id') in not_on_disk:
+                continue
+            files, disk_usage = int(rec.get('files', 0)), int(rec.get('disk_usage', 0))
+            totals['files'] += files
+            totals['disk_usage_files'] += disk_usage
+            division = divisions.setdefault(rec.get('division'), {'files': 0, 'disk_usage': 0})
+            division['files'] += files
+            division['disk_usage'] += disk_usage
+            # Files being restored
+            if rec.get('file_status_id') == restoring:
+                totals['files_restoring'] += files
+                totals['disk_usage_files_restoring'] += disk_usage
+        self.disk_usage.update(totals)
+        self.disk_usage['divisions'] = divisions
 
         # all the space used that isn't accounted for by on-disk JAMO files we'll assign to other
         used_by_other = self.quota_used - (self.disk_usage.get('disk_usage_files', 0) - self.disk_usage.get('disk_usage_files_restoring', 0))
@@ -549,7 +733,7 @@ class Tape(MySQLRestful):
 
         # bytes free: ideally we could just use the disk remaining and subtract what is left to restore, but since
         # the quota numbers will only be updated daily, we need to calculate this ourselves
-        # we assume portal_usage is fairly static, so we only need to update this every 30 minutes
+        # we assume portal_usage is fairly static, so we only need to update this every 5 minutes
 
         self.disk_usage['date_updated'] = datetime.datetime.today()
         disk_usage = self.disk_usage.get('disk_usage_files', 0) + used_by_other
@@ -559,6 +743,49 @@ class Tape(MySQLRestful):
         self.disk_usage['bytes_free'] = bytes_free
         self.disk_usage['dna_free_tb'] = self.disk_usage.get('bytes_free', 0) / 1e12
 
+    @restful.cron('30', '2', '*', '*')
+    def reconcile_repository_footprint(self) -> dict:
+        """Recompute the repository footprint from the `file` table and correct the totals kept in `file_footprint`.
+
+        Both are read from the same consistent snapshot, so the difference is exact even while files keep changing,
+        and it is applied as an increment that adds up with the changes the triggers made since.
+
+        :return: Dictionary of `<division>/<file_status_id>` to the `files` and `disk_usage` corrections applied
+        """
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('start transaction with consistent snapshot')
+            cursor.execute('select division, file_status_id, count(*) as files, ifnull(sum(case when file_size < 384 then 512 else ceil(file_size/32768.0)*32768 end), 0) as disk_usage from file where file_path like %s group by 1, 2',
+                           [self.repository_root_pattern])
+            actual = {(rec['division'], rec['file_status_id']): (int(rec['files']), int(rec['disk_usage']))
+                      for rec in cursor.fetchall()}
+            cursor.execute('select division, file_status_id, sum(files) as files, sum(disk_usage) as disk_usage from file_footprint group by 1, 2')
+            kept = {(rec['division'], rec['file_status_id']): (int(rec['files']), int(rec['disk_usage']))
+                    for rec in cursor.fetchall()}
+            cursor.execute('commit')
+        finally:
+            conn.close()
+
+        corrections = {}
+        for key in sorted(set(actual) | set(kept)):
+            files = actual.get(key, (0, 0))[0] - kept.get(key, (0, 0))[0]
+            disk_usage = actual.get(key, (0, 0))[1] - kept.get(key, (0, 0))[1]
+            if files or disk_usage:
+                self.modify('insert into file_footprint (division, file_status_id, slot, files, disk_usage) values (%s, %s, 0, %s, %s) '
+                            'on duplicate key update files = files + values(files), disk_usage = disk_usage + values(disk_usage)',
+                            key[0], key[1], files, disk_usage)
+                corrections[f'{key[0]}/{key[1]}'] = {'files': files, 'disk_usage': disk_usage}
+        if corrections:
+            self.logger.warning(f'Corrected repository footprint: {corrections}')
+        self.repository_footprint()
+        return corrections
+
+    @restful.permissions('admin')
+    @restful.doc('Recomputes the repository footprint from all the files and corrects the incrementally kept totals, returning the corrections made.')
+    def post_reconcile_footprint(self, _args, _kwargs):
+        return self.reconcile_repository_footprint()
+
     # @restful.cron('*/5','*','*','*')
     def monitor(self):
         for division in self.divisions.values():
@@ -622,30 +849,40 @@ class Tape(MySQLRestful):
         self.requestor_counts = requestor_counts
 
     # Body from post_grouprestore and post_restore
-    def add_to_pull_queue(self, in_file, days, requestor, source=None):
-        def get_priority_and_limit_for_request():
-            if self.config.queue_2_match in requestor:
-                limit = self.config.queue_2_limit
-                priority = 2
-            else:
-                limit = self.config.queue_1_limit
-                priority = 1
-
-            # increment moved into lock after check of pre-existing request for same file
-            if requestor in self.requestor_counts:
-                # if this succeeds in a restore request, we'll be above the limit below, so >= rather than >
-                for limit_cutoff in limit:
-                    if self.requestor_counts[requestor] >= limit_cutoff:
-                        priority += 2
-                    else:
-                        break
+    def _get_request_priority(self, requestor):
+        if self.config.queue_2_match in requestor:
+            limit = self.config.queue_2_limit
+            priority = 2
+        else:
+            limit = self.config.queue_1_limit
+            priority = 1
+
+        # increment moved into lock after check of pre-existing request for same file
+        if requestor in self.requestor_counts:
+            # if this succeeds in a restore request, we'll be above the limit below, so >= rather than >
+            for limit_cutoff in limit:
+                if self.requestor_counts[requestor] >= limit_cutoff:
+                    priority += 2
+                else:
+                    break
+
+        # If the free space is less than our reserve, we'll bump the priority up to 8 (the 'lowest', e.g., don't actively restore)
+        if self.disk_usage['bytes_free'] < self.config.disk_reserve:
+            priority = 8
 
-            # If the free space is less than our reserve, we'll bump the priority up to 8 (the 'lowest', e.g., don't actively restore)
-            if self.disk_usage['bytes_free'] < self.config.disk_reserve:
-                priority = 8
+        return priority, limit
 
-            return priority, limit
+    def _replace_requestor(self, previous_requestor, requestor):
+        # Decrement count for previous requestor
+        previous_requestor_new_request_count = self.requestor_counts.get(previous_requestor, 0) - 1
+        if previous_requestor_new_request_count > 0:
+            self.requestor_counts[previous_requestor] = previous_requestor_new_request_count
+        elif previous_requestor in self.requestor_counts:
+            del self.requestor_counts[previous_requestor]
+        # Increment count for new requestor
+        self.requestor_counts[requestor] = self.requestor_counts.get(requestor, 0) + 1
 
+    def add_to_pull_queue(self, in_file, days, requestor, source=None):
         # Add the request to a log table
         request_id = self.modify('insert into request (file_id, requestor) values (%s, %s)', in_file['file_id'],
                                  requestor)
@@ -665,7 +902,7 @@ class Tape(MySQLRestful):
             # earlier states.  But if there is a failure somewhere, it could be in other states.  If it is still in the queue, the code below
             # should address this.
             file_id = in_file['file_id']
-            priority, limit = get_priority_and_limit_for_request()
+            priority, limit = self._get_request_priority(requestor)
 
             # look up the tar record id, this will slow down the insert, but help speed up the prep
             tar_record = self.query('select tar_record_id from backup_record where file_id = %d and service = 1' % file_id)
@@ -690,6 +927,7 @@ class Tape(MySQLRestful):
             # inconsistency in the file_state.  But the winner should set the state correctly and only one request
             # should get into the restore queue
             if pqid:
+                self._sync_pull_queue_index([pqid])
                 self.put_file([file_id], {'file_status_id': self.file_status.RESTORE_REGISTERED})
                 # switch to curdate to address DST issues
                 self.modify('update file set user_save_till=date_add(curdate(), interval %s day) where file_id=%s', days, file_id)
@@ -709,7 +947,7 @@ class Tape(MySQLRestful):
         elif in_file.get('file_status_id') == self.file_status.RESTORE_REGISTERED:
             # Restore has been requested, need to check whether to update priority for the request
             file_id = in_file.get('file_id')
-            priority, limit = get_priority_and_limit_for_request()
+            priority, limit = self._get_request_priority(requestor)
             with self.add_to_queue_lock:
                 existing_pull_queue_records = self.query(
                     'select * from pull_queue where file_id=%s and queue_status_id not in (%s, %s)',
@@ -720,19 +958,152 @@ class Tape(MySQLRestful):
                     if priority < existing_pull_queue_records[0].get('priority'):
                         self.modify('update pull_queue set priority=%s, requestor=%s where pull_queue_id=%s',
                                     priority, requestor, existing_pull_queue_records[0].get('pull_queue_id'))
-                        # Decrement count for previous requestor
-                        previous_requestor = existing_pull_queue_records[0].get('requestor')
-                        previous_requestor_new_request_count = self.requestor_counts.get(previous_requestor, 0) - 1
-                        if previous_requestor_new_request_count > 0:
-                            self.requestor_counts[previous_requestor] = previous_requestor_new_request_count
-                        elif previous_requestor in self.requestor_counts:
-                            del self.requestor_counts[previous_requestor]
-                        # Increment count for new requestor
-                        self.requestor_counts[requestor] = self.requestor_counts.get(requestor, 0) + 1
+                        self._sync_pull_queue_index([existing_pull_queue_records[0].get('pull_queue_id')])
+                        self._replace_requestor(existing_pull_queue_records[0].get('requestor'), requestor)
             return True
         return False
 
-    @restful.doc('Puts a request in to restore a list of files.  There is a limit of 500 files per request.')
+    def _chunks(self, values: list) -> list[list]:
+        """Split a list of values for `in (...)` clauses and multi-row inserts into chunks of `bulk_chunk_size`.
+        """
+        size = getattr(self.config, 'bulk_chunk_size', 10000)
+        return [values[i:i + size] for i in range(0, len(values), size)]
+
+    def bulk_add_to_pull_queue(self, files: list[dict], days: int, requestor: str,
+                               source: Optional[str] = None) -> tuple[int, int]:
+        """Set-based version of `add_to_pull_queue` for a list of files. The files' tar records, pending egress requests
+        and pull requests are looked up with one query per chunk of files, and the request, egress and pull_queue
+        records are written with multi-row statements in a single transaction. The metadata of all the files is then
+        updated with one `add_bulk_update` call.
+
+        :param files: `file` records with at least file_id, file_status_id and file_size
+        :param days: How many days to keep the files around after they have been restored
+        :param requestor: The user making the request
+        :param source: Source name for data center to add egress requests for
+        :return: The number of files queued for restore (or already queued), and the number of files that are on disk
+            and only had their `user_save_till` extended
+        """
+        if not files:
+            return 0, 0
+        restore = [in_file for in_file in files if in_file['file_status_id'] == self.file_status.PURGED]
+        registered = [in_file for in_file in files if in_file['file_status_id'] == self.file_status.RESTORE_REGISTERED]
+        on_disk = [in_file['file_id'] for in_file in files
+                   if in_file['file_status_id'] not in (self.file_status.PURGED, self.file_status.RESTORE_REGISTERED)]
+        file_ids = [in_file['file_id'] for in_file in files]
+        queued_ids = [in_file['file_id'] for in_file in restore + registered]
+
+        # look up the tar record ids, this will slow down the insert, but help speed up the prep
+        tar_records = {}
+        for chunk in self._chunks([in_file['file_id'] for in_file in restore]):
+            for record in self.query(f'select file_id, tar_record_id from backup_record where service = 1 and file_id in ({", ".join(["%s"] * len(chunk))})',
+                                     chunk, uselimit=False):
+                tar_records[record['file_id']] = record['tar_record_id']
+        pending_egress = set()
+        if source:
+            for chunk in self._chunks(file_ids):
+                pending_egress.update(record['file_id'] for record in self.query(
+                    f'select distinct file_id from egress where source=%s and egress_status_id in (%s, %s) and file_id in ({", ".join(["%s"] * len(chunk))})',
+                    [source, self.cv['queue_status']['REGISTERED'], self.cv['queue_status']['IN_PROGRESS']] + chunk,
+                    uselimit=False))
+
+        new_ids = []
+        reprioritized = {}
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            with self.add_to_queue_lock:
+                cursor.execute('start transaction')
+                # Add the requests to a log table. A multi-row insert gets consecutive ids starting at `lastrowid`, in
+                # the order of its rows
+                request_ids = {}
+                for chunk in self._chunks(file_ids):
+                    cursor.execute(f'insert into request (file_id, requestor) values {", ".join(["(%s, %s)"] * len(chunk))}',
+                                   [value for file_id in chunk for value in (file_id, requestor)])
+                    request_ids.update(zip(chunk, range(cursor.lastrowid, cursor.lastrowid + cursor.rowcount)))
+                if source:
+                    # Add to egress table if there's no egress request where file_id + source + egress_status_id in
+                    # (REGISTERED, IN_PROGRESS)
+                    cursor.executemany('insert into egress(file_id, egress_status_id, requestor, source, request_id) values(%s, %s, %s, %s, %s)',
+                                       [(file_id, self.cv['queue_status']['REGISTERED'], requestor, source, request_ids[file_id])
+                                        for file_id in file_ids if file_id not in pending_egress])
+
+                existing = {}
+                for chunk in self._chunks(queued_ids):
+                    cursor.execute(f'select pull_queue_id, file_id, priority, requestor from pull_queue where queue_status_id not in (%s, %s) and file_id in ({", ".join(["%s"] * len(chunk))})',
+                                   [self.queue_status.COMPLETE, self.queue_status.FAILED] + chunk)
+                    existing.update((record['file_id'], record) for record in cursor.fetchall())
+
+                pull_queue_rows = []
+                for in_file in restore:
+                    file_id = in_file['file_id']
+                    priority, _ = self._get_request_priority(requestor)
+                    tar_record_id = tar_records.get(file_id)
+                    # Get the vol/position if we know about it
+                    if tar_record_id and tar_record_id in self.tar_record_info:
+                        volume, position_a, position_b = self.tar_record_info[tar_record_id]['volume'], self.tar_record_info[tar_record_id]['position_a'], self.tar_record_info[tar_record_id]['position_b']
+                        in_file['volume'], in_file['position_a'], in_file['position_b'] = volume, position_a, position_b
+                    else:
+                        volume, position_a, position_b = None, None, None
+                    if file_id not in existing:
+                        self.requestor_counts[requestor] = self.requestor_counts.get(requestor, 0) + 1
+                        pull_queue_rows.append((file_id, requestor, priority, tar_record_id, volume, position_a, position_b))
+                        in_file['priority'] = priority
+                        new_ids.append(file_id)
+                    # Account for what is being restored so we don't go over the limit before the next update of
+                    # diskusage, see `add_to_pull_queue`
+                    disk_footprint = math.ceil(in_file['file_size'] / 32768.0) * 32768
+                    self.disk_usage['bytes_free'] -= disk_footprint
+                    self.disk_usage['bytes_used'] += disk_footprint
+
+                # Restore has been requested, update the priority and requestor of existing requests if higher (lower
+                # priority numeric value)
+                for in_file in registered:
+                    record = existing.get(in_file['file_id'])
+                    priority, _ = self._get_request_priority(requestor)
+                    if record is not None and priority < record.get('priority'):
+                        reprioritized.setdefault(priority, []).append(record.get('pull_queue_id'))
+                        self._replace_requestor(record.get('requestor'), requestor)
+
+                cursor.executemany('insert into pull_queue (file_id, requestor, priority, tar_record_id, volume, position_a, position_b) values (%s, %s, %s, %s, %s, %s, %s)',
+                                   pull_queue_rows)
+                for priority, pull_queue_ids in reprioritized.items():
+                    for chunk in self._chunks(pull_queue_ids):
+                        cursor.execute(f'update pull_queue set priority=%s, requestor=%s where pull_queue_id in ({", ".join(["%s"] * len(chunk))})',
+                                       [priority, requestor] + chunk)
+                pull_queue_ids = [pull_queue_id for pull_queue_ids in reprioritized.values() for pull_queue_id in pull_queue_ids]
+                for chunk in self._chunks(new_ids):
+                    cursor.execute(f'select pull_queue_id, file_id from pull_queue where queue_status_id not in (%s, %s) and file_id in ({", ".join(["%s"] * len(chunk))})',
+                                   [self.queue_status.COMPLETE, self.queue_status.FAILED] + chunk)
+                    pull_queue_ids.extend(record['pull_queue_id'] for record in cursor.fetchall())
+                    # switch to curdate to address DST issues
+                    cursor.execute(f'update file set file_status_id=%s, user_save_till=date_add(curdate(), interval %s day) where file_id in ({", ".join(["%s"] * len(chunk))})',
+                                   [self.file_status.RESTORE_REGISTERED, days] + chunk)
+                for chunk in self._chunks(on_disk):
+                    cursor.execute(f'update file set user_save_till=date_add(curdate(), interval %s day) where (user_save_till is null or user_save_till < date_add(curdate(), interval %s day)) and file_id in ({", ".join(["%s"] * len(chunk))})',
+                                   [days, days] + chunk)
+                cursor.execute('commit')
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        self._sync_pull_queue_index(pull_queue_ids)
+        new_ids = set(new_ids)
+        updates = []
+        for chunk in self._chunks(list(new_ids) + on_disk):
+            for record in self.query(f'select file_id, STR_TO_DATE(GREATEST(ifnull(date_add(created_dt, interval local_purge_days day),\'0000-00-00 00:00:00\'),ifnull(user_save_till,\'0000-00-00 00:00:00\')),\'%%Y-%%m-%%d %%T\') as dt_to_purge from file where file_id in ({", ".join(["%s"] * len(chunk))})',
+                                     chunk, uselimit=False):
+                fields = {'dt_to_purge': record['dt_to_purge']}
+                if record['file_id'] in new_ids:
+                    fields['file_status_id'] = self.file_status.RESTORE_REGISTERED
+                    fields['file_status'] = self.cv.get('file_status')[str(self.file_status.RESTORE_REGISTERED)]
+                updates.append((record['file_id'], fields))
+        if updates:
+            restful.run_internal('metadata', 'add_bulk_update', 'file_id', updates)
+        return len(restore) + len(registered), len(on_disk)
+
+    @restful.doc('Puts a request in to restore a list of files.')
     @restful.validate({'files': {'type': list, 'validator': {'*': {'type': str}},
                                  'doc': 'A list of jamo ids, which are the value of the _id key',
                                  'example': ['51d4c50e067c014cd6eab68c', '51d4a405067c014cd6ea1cb7']},
@@ -757,20 +1128,11 @@ class Tape(MySQLRestful):
         metadata_ids = kwargs['files']
         if len(metadata_ids) == 0:
             return
-        # note that this currently has a 500 file limit
-        files = self.query('select file_id, file_status_id, file_name, file_path, file_size from file where metadata_id in (%s)' % ('%s,' * len(metadata_ids))[:-1], metadata_ids)
-
-        restored_count = 0
-        updated_count = 0
-        for in_file in files:
-            if self.add_to_pull_queue(in_file, days, kwargs['requestor'], kwargs['source']):
-                restored_count += 1
-            else:
-                # switch to curdate to address DST issues
-                self.modify('update file set user_save_till=date_add(curdate(), interval %s day) where file_id=%s and (user_save_till is null or user_save_till< date_add(curdate(), interval %s day))',
-                            days, in_file['file_id'], days)
-                restful.run_internal('metadata', 'add_update', {'file_id': in_file['file_id']}, {'dt_to_purge': self.get_file([in_file['file_id']], None)['dt_to_purge']})
-                updated_count += 1
+        files = []
+        for chunk in self._chunks(metadata_ids):
+            files.extend(self.query('select file_id, file_status_id, file_name, file_path, file_size from file where metadata_id in (%s)' % ('%s,' * len(chunk))[:-1], chunk, uselimit=False))
+
+        restored_count, updated_count = self.bulk_add_to_pull_queue(files, days, kwargs['requestor'], kwargs.get('source'))
         return {'url': '/tape/pullqueue', 'restored_count': restored_count, 'updated_count': updated_count}
 
     @restful.doc('Adds a file to the restore queue. This file will be restored to its original location')
@@ -881,6 +1243,8 @@ class Tape(MySQLRestful):
         'tar_record_id': {'type': int, 'required': False},
         'remote_file_name': {'type': str, 'required': False},
         'remote_file_path': {'type': str, 'required': False},
+        'tar_offset': {'type': int, 'required': False},
+        'tar_size': {'type': int, 'required': False},
     }
 
     @restful.permissions('tape')
@@ -932,6 +1296,9 @@ class Tape(MySQLRestful):
             if file_id:
                 deletes += self.modify('delete from file_status_history where file_id = %s', file_id)
                 deletes += self.modify('delete from pull_queue where file_id = %s', file_id)
+                for division in self.divisions.values():
+                    division.pull_queue.unregister([pull_queue.get('pull_queue_id')
+                                                    for pull_queue in record.get('pull_queue')])
                 deletes += self.modify('delete from request where file_id = %s', file_id)
                 deletes += self.modify('delete from file where file_id = %s', file_id)
             if len(record.get('file')) == 1:
@@ -1096,10 +1463,28 @@ class Tape(MySQLRestful):
         Returns:
             A blank string if the number of elements is less than 2, otherwise a html string containing '<h3>name</h3><img src="data:image/png;base64,base64encodedimage"/>'
         """
+        png = self.render_chart(data, sets, titles, labels)
+        if png is None:
+            return ''
+        return f'<h3>{name}</h3><img src="data:image/png;base64,{base64.b64encode(png).decode("utf-8")}">'
+
+    def render_chart(self, data, sets, titles, labels):
+        """
+        Render a plot of the data as a PNG image
+
+        Args:
+            data: An array of dictionaries containing the data to plot, see `plot_data`
+            sets: A Tuple of the keys to plot, each key should be present in the data dictionaries
+            titles: A Tuple of the titles for each element of sets, these will be used as the graph title
+            labels: A Tuple of the labels for each element of sets, these will be used as the graph labels
+
+        Returns:
+            None if the number of elements is less than 2, otherwise the PNG image as bytes
+        """
 
-        # if the graph as 0 or 1 points, return an empty string
+        # if the graph as 0 or 1 points, there is nothing to plot
         if len(data) < 2:
-            return ''
+            return None
 
         # convert data into a dictionary where the key is the datetime version of ymdh and the value is a dictionary of the elements listed in 'sets'
         # Create an entry for now, so our graph plots out to the current time.  If there is an element in data, it will just be overwritten.
@@ -1110,90 +1495,172 @@ class Tape(MySQLRestful):
         # create a set of plots, one for each element in sets
         plt.rcParams['figure.autolayout'] = True
         fig = plt.figure(figsize=(6, 10.9))
-        plots = [fig.add_subplot(len(sets), 1, 1)]
-        for i in range(2, len(sets) + 1):
-            plots.append(fig.add_subplot(len(sets), 1, i, sharex=plots[0]))
-        plt.xticks(rotation=90)
-
-        # Create the plot
-        for plot, field, title, label in zip(plots, sets, titles, labels):
-            plot.grid(axis='both', linestyle='-', which='major', visible=True, c='lightgray', zorder=0)
-            plot.get_yaxis().set_major_formatter(tkr.FuncFormatter(lambda _, p: format(int(_), ',')))
-            if field != sets[-1]:
-                plot.tick_params('x', labelbottom=False)
-            plot.set_title(title)
-            plot.set(ylabel=label)
-            x = sorted(d)
-            y = [d[_][field] for _ in x]
-            plot.bar(x, y, width=0.03, edgecolor='none', zorder=3)
-        plot.get_xaxis().set_major_formatter(mdates.DateFormatter('%m/%d %H'))
-        # convert the plot to a bytestream and into a format that can be embedded in html
-        byte_stream = BytesIO()
-        fig.savefig(byte_stream, format='png')
-        return f'<h3>{name}</h3><img src="data:image/png;base64,{base64.b64encode(byte_stream.getvalue()).decode("utf-8")}">'
+        try:
+            plots = [fig.add_subplot(len(sets), 1, 1)]
+            for i in range(2, len(sets) + 1):
+                plots.append(fig.add_subplot(len(sets), 1, i, sharex=plots[0]))
+            plt.xticks(rotation=90)
+
+            # Create the plot
+            for plot, field, title, label in zip(plots, sets, titles, labels):
+                plot.grid(axis='both', linestyle='-', which='major', visible=True, c='lightgray', zorder=0)
+                plot.get_yaxis().set_major_formatter(tkr.FuncFormatter(lambda _, p: format(int(_), ',')))
+                if field != sets[-1]:
+                    plot.tick_params('x', labelbottom=False)
+                plot.set_title(title)
+                plot.set(ylabel=label)
+                x = sorted(d)
+                y = [d[_][field] for _ in x]
+                plot.bar(x, y, width=0.03, edgecolor='none', zorder=3)
+            plot.get_xaxis().set_major_formatter(mdates.DateFormatter('%m/%d %H'))
+            byte_stream = BytesIO()
+            fig.savefig(byte_stream, format='png')
+            return byte_stream.getvalue()
+        finally:
+            # pyplot keeps a reference to every figure until it is closed
+            plt.close(fig)
+
+    # CHARTS
+
+    def build_stats_chart(self, chart: str, days: int) -> dict:
+        """Run the queries for a statistics chart over a time window, render it and store it in the chart cache.
+
+        :param str chart: The name of the chart, a key of `STATS_CHARTS`
+        :param int days: The size of the time window in days
+        :return: The cache entry, with the hourly and per user series, the rendered chart as a PNG image (None if there
+            aren't enough points to plot), its ETag, the chart embedded in html and the time it was built
+        """
+        definition = STATS_CHARTS[chart]
+        hour = self.query(definition['hour'].format(days=days))
+        user = self.query(definition['user'].format(days=days), uselimit=False)
+        png = self.render_chart(hour, definition['sets'], definition['titles'], definition['labels'])
+        entry = {'hour': hour,
+                 'user': user,
+                 'png': png,
+                 'etag': None if png is None else '"{}"'.format(hashlib.md5(png).hexdigest()),
+                 'graph': '',
+                 'updated': time.time()}
+        if png is not None:
+            name = definition['name'].format(window='Five Days' if days == 5 else f'{days} Days')
+            entry['graph'] = f'<h3>{name}</h3><img src="data:image/png;base64,{base64.b64encode(png).decode("utf-8")}">'
+        self.stats_charts[(chart, days)] = entry
+        return entry
+
+    def get_cached_stats_chart(self, chart: str, days: int) -> dict:
+        """Get a statistics chart from the cache kept by `refresh_stats_charts`, only building it here if it isn't
+        cached or is older than `stats_chart_max_age` seconds.
+
+        :param str chart: The name of the chart, a key of `STATS_CHARTS`
+        :param int days: The size of the time window in days
+        :return: The cache entry, see `build_stats_chart`
+        """
+        max_age = getattr(self.config, 'stats_chart_max_age', 1200)
+        entry = self.stats_charts.get((chart, days))
+        if entry is None or time.time() - entry['updated'] > max_age:
+            with self.stats_charts_lock:
+                entry = self.stats_charts.get((chart, days))
+                if entry is None or time.time() - entry['updated'] > max_age:
+                    entry = self.build_stats_chart(chart, days)
+        return entry
+
+    @restful.cron('*/10', '*', '*', '*')
+    def refresh_stats_charts(self) -> None:
+        """Render every statistics chart for each time window in `stats_chart_windows` (days), so that the status pages
+        don't run the aggregate queries and matplotlib on a request thread.
+        """
+        for days in getattr(self.config, 'stats_chart_windows', [5]):
+            for chart in STATS_CHARTS:
+                with self.stats_charts_lock:
+                    self.build_stats_chart(chart, days)
+
+    def _stats_chart_args(self, args: list) -> tuple[str, int]:
+        if not args or args[0] not in STATS_CHARTS:
+            raise common.HttpException(400, 'Sorry you must provide one of the charts: {}'.format(', '.join(STATS_CHARTS)))
+        try:
+            days = int(args[1]) if len(args) > 1 else 5
+        except ValueError:
+            raise common.HttpException(400, f'Sorry the number of days {args[1]} is not an integer')
+        if days not in getattr(self.config, 'stats_chart_windows', [5]):
+            raise common.HttpException(400, f'Sorry there is no chart for a window of {days} days')
+        return args[0], days
+
+    @restful.raw
+    @restful.doc('Get a statistics chart as a PNG image, the last path element is the number of days (default 5). The '
+                 'chart is re-rendered every 10 minutes and has an ETag, so clients can revalidate with If-None-Match.')
+    def get_stats_chart(self, args, _kwargs):
+        chart, days = self._stats_chart_args(args)
+        entry = self.get_cached_stats_chart(chart, days)
+        if entry['png'] is None:
+            raise common.HttpException(404, f'Sorry there is not enough data to plot the {chart} chart')
+        cherrypy.response.headers['ETag'] = entry['etag']
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        cherrypy.response.headers['Last-Modified'] = cherrypy.lib.httputil.HTTPDate(entry['updated'])
+        if entry['etag'] in [_.strip() for _ in cherrypy.request.headers.get('If-None-Match', '').split(',')]:
+            cherrypy.response.status = 304
+            return b''
+        cherrypy.response.headers['Content-Type'] = 'image/png'
+        return entry['png']
+
+    @restful.doc('Get the hourly and per user series behind a statistics chart, the last path element is the number of '
+                 'days (default 5)')
+    def get_stats_series(self, args, _kwargs):
+        chart, days = self._stats_chart_args(args)
+        entry = self.get_cached_stats_chart(chart, days)
+        definition = STATS_CHARTS[chart]
+        return {'chart': chart,
+                'days': days,
+                'updated': datetime.datetime.fromtimestamp(entry['updated']),
+                'etag': entry['etag'],
+                'sets': definition['sets'],
+                'titles': definition['titles'],
+                'labels': definition['labels'],
+                'hour': entry['hour'],
+                'user': entry['user']}
+
+    def _stats_page(self, chart: str) -> dict:
+        entry = self.get_cached_stats_chart(chart, 5)
+        return {'hour': entry['hour'],
+                'user': entry['user'],
+                'graph': entry['graph']}
 
     # INGEST
 
     def get_ingested_last_five_days_by_hour(self, _args, _kwargs):
-        return self.query('select date_format(created_dt, "%y-%m-%d %H") as ymdh, count(*) as N, source, sum(file_size) / 1e9 as gb from file where created_dt > now() - interval 5 day group by ymdh, source order by ymdh desc')
+        return self.query(STATS_CHARTS['ingest']['hour'].format(days=5))
 
     def get_ingested_last_five_days_by_user(self, _args, _kwargs):
-        return self.query('select file_owner, count(*) as N, source, sum(file_size) / 1e9 as gb from file where created_dt > now() - interval 5 day group by file_owner, source order by file_owner', uselimit=False)
+        return self.query(STATS_CHARTS['ingest']['user'].format(days=5), uselimit=False)
 
     @restful.menu('Status>Ingested Last 5 days')
     @restful.template('ingest_stats.html')
     def get_ingest_stats(self, _args, _kwargs):
-        data = {}
-        data['hour'] = self.get_ingested_last_five_days_by_hour(None, None)
-        data['user'] = self.get_ingested_last_five_days_by_user(None, None)
-        data['graph'] = self.plot_data(data['hour'],
-                                       ('N', 'gb'),
-                                       ('Number of Files', 'File Footprint in GB'),
-                                       ('Files', 'GB'),
-                                       'Files Published by N Files and Footprint over the Last Five Days')
-        return data
+        return self._stats_page('ingest')
 
     # REQUEST
 
     def get_requested_last_five_days_by_hour(self, _args, _kwargs):
-        return self.query('select date_format(dt_modified, "%y-%m-%d %H") as ymdh, count(*) as N, sum(b.file_size) / 1e9 as gb from request a join file b on a.file_id = b.file_id where dt_modified > now() - interval 5 day group by 1 order by ymdh desc')
+        return self.query(STATS_CHARTS['request']['hour'].format(days=5))
 
     def get_requested_last_five_days_by_user(self, _args, _kwargs):
-        return self.query('select a.requestor, count(*) as N, sum(b.file_size) / 1e9 as gb from request a join file b on a.file_id = b.file_id where dt_modified > now() - interval 5 day group by 1 order by count(*) desc', uselimit=False)
+        return self.query(STATS_CHARTS['request']['user'].format(days=5), uselimit=False)
 
     @restful.menu('Status>Requested Last 5 days')
     @restful.template('request_stats.html')
     def get_request_stats(self, _args, _kwargs):
-        data = {}
-        data['hour'] = self.get_requested_last_five_days_by_hour(None, None)
-        data['user'] = self.get_requested_last_five_days_by_user(None, None)
-        data['graph'] = self.plot_data(data['hour'],
-                                       ('N', 'gb'),
-                                       ('Number of Files', 'File Footprint in GB'),
-                                       ('Files', 'GB'),
-                                       'Files Requested by N Files and Footprint over the Last Five Days')
-        return data
+        return self._stats_page('request')
 
     # RESTORE
 
     def get_restored_last_five_days_by_hour(self, _args, _kwargs):
-        return self.query('select date_format(dt_modified, "%y-%m-%d %H") as ymdh, count(distinct volume) as vol, count(*) as N, sum(file_size) / 1e9 as gb from pull_queue p use index (pull_queue_status_id_dt_modified) join file f on f.file_id = p.file_id where queue_status_id = 3 and dt_modified > now() - interval 5 day group by ymdh order by ymdh desc')
+        return self.query(STATS_CHARTS['restore']['hour'].format(days=5))
 
     def get_restored_last_five_days_by_user(self, _args, _kwargs):
-        return self.query('select requestor, count(distinct volume) as vol, count(*) as N, sum(file_size) / 1e9 as gb from pull_queue p use index (pull_queue_status_id_dt_modified) join file f on f.file_id = p.file_id where queue_status_id = 3 and dt_modified > now() - interval 5 day group by 1 order by N desc', uselimit=False)
+        return self.query(STATS_CHARTS['restore']['user'].format(days=5), uselimit=False)
 
     @restful.menu('Status>Restored Last 5 days')
     @restful.template('restore_stats.html')
     def get_restore_stats(self, _args, _kwargs):
-        data = {}
-        data['hour'] = self.get_restored_last_five_days_by_hour(None, None)
-        data['user'] = self.get_restored_last_five_days_by_user(None, None)
-        data['graph'] = self.plot_data(data['hour'],
-                                       ('N', 'vol', 'gb'),
-                                       ('Number of Files', 'Tape Volumes to Load', 'File Footprint in GB'),
-                                       ('Files', 'Volumes', 'GB'),
-                                       'Files Restored by N Files, Footprint, and Tape Volumes over the Last Five Days')
-        return data
+        return self._stats_page('restore')
 
     @restful.cron('0', '*', '*', '*')
     def save_requested_restores(self):
@@ -1793,6 +2260,22 @@ class Tape(MySQLRestful):
         file_path, file_name = os.path.split(kwargs['file'])
         return self.query('select * from file where (file_name=%s and file_path=%s) or (origin_file_name=%s and origin_file_path=%s) order by file_id desc limit 1', [file_name, file_path, file_name, file_path])
 
+    @restful.doc('Returns the latest file record for each of the requested paths, by path. Paths without a file record are left out')
+    @restful.validate({'files': {'type': list, 'validator': {'*': {'type': str}}}})
+    def post_latestfiles(self, _args, kwargs):
+        paths = [os.path.split(file) for file in dict.fromkeys(kwargs.get('files'))]
+        records = {}
+        for chunk in self._chunks(paths):
+            values = [value for path in chunk for value in path]
+            rows = ', '.join(['(%s, %s)'] * len(chunk))
+            for path, name in (('file_path', 'file_name'), ('origin_file_path', 'origin_file_name')):
+                for record in self.query(f'select file_id, file_name, file_path, origin_file_name, origin_file_path, metadata_id from file where ({path}, {name}) in ({rows})',
+                                         values, uselimit=False):
+                    file = os.path.join(record.get(path), record.get(name))
+                    if file not in records or records.get(file).get('file_id') < record.get('file_id'):
+                        records[file] = record
+        return records
+
     @restful.doc('Returns the file information for the requested file_id')
     @restful.generatedhtml(title='File #{{value}}')
     @restful.link(get_filehistory, 'file_id', 'status_history')
@@ -1865,6 +2348,8 @@ class Tape(MySQLRestful):
             del kwargs['skip_delay']
         else:
             delay = 24
+        # Set when the md5sum was computed while copying the file, so it does not need to be queued for an md5
+        skip_md5 = kwargs.pop('skip_md5', False)
         ret = self.smart_modify('file', 'file_id=%s' % args[0], kwargs)
         if 'file_status_id' in kwargs:
             file_status_id = kwargs.get('file_status_id')
@@ -1876,9 +2361,11 @@ class Tape(MySQLRestful):
                 file = self.get_file(args, None)
                 self._add_to_queue_by_feature(self.divisions.get(file.get('division')).tar_queue,
                                               self._get_tar_record_path(file), file)
-            restful.run_internal('metadata', 'add_update', {'file_id': file_id},
-                                 {'file_status_id': kwargs.get('file_status_id'),
-                                  'file_status': self.cv.get('file_status')[str(kwargs.get('file_status_id'))]})
+            metadata = {'file_status_id': kwargs.get('file_status_id'),
+                        'file_status': self.cv.get('file_status')[str(kwargs.get('file_status_id'))]}
+            if 'md5sum' in kwargs:
+                metadata['md5sum'] = kwargs.get('md5sum')
+            restful.run_internal('metadata', 'add_update', {'file_id': file_id}, metadata)
         elif 'md5sum' in kwargs:
             restful.run_internal('metadata', 'add_update', {'file_id': file_id}, {'md5sum': kwargs.get('md5sum')})
 
@@ -1894,7 +2381,7 @@ class Tape(MySQLRestful):
                 # replaced files will have a md5sum from the first go around.  This might be overkill, but ignore any previously
                 # calculated md5sum and redo the calculation
                 # if rec['md5sum'] is None and rec['validate_mode']!= VALIDATION_MODES['No_MD5'] :
-                if rec.get('validate_mode') != VALIDATION_MODES.get('No_MD5'):
+                if rec.get('validate_mode') != VALIDATION_MODES.get('No_MD5') and not skip_md5:
                     self.post_md5(None, {'file_path': os.path.join(rec.get('file_path'), rec.get('file_name')),
                                          'file_size': rec.get('file_size'),
                                          'callback': f'local://put_file/{rec.get("file_id")}',
@@ -1913,7 +2400,7 @@ class Tape(MySQLRestful):
 
         file_status_id = kwargs.get('file_status_id', None)
         if file_status_id == self.file_status.COPY_COMPLETE:
-            self.put_file([file_id], {'file_status_id': self.file_status.BACKUP_READY})
+            self.put_file([file_id], {'file_status_id': self.file_status.BACKUP_READY, 'skip_md5': 'md5sum' in kwargs})
         elif file_status_id == self.file_status.TAR_COMPLETE:
             self.put_file([file_id],
                           {'file_status_id': self.file_status.COPY_READY if next_status is None else next_status})
@@ -1924,7 +2411,21 @@ class Tape(MySQLRestful):
         self.modify('update md5_queue set queue_status_id=%s where md5_queue_id=%s', self.queue_status.IN_PROGRESS, record['md5_queue_id'])
         return {}
 
+    def _get_selected_file(self, record, file_status_id):
+        """Get the full file record for a selected copy or tar task, as the backlog is queued with only some of the
+        columns. Returns `None` if the file is no longer in `file_status_id` (e.g., it was queued twice while the backlog
+        was loading), in which case the task is skipped.
+
+        :param dict record: Record the task was queued with
+        :param int file_status_id: Status the file should be in
+        """
+        files = self.query('select * from file where file_id=%s and file_status_id=%s', [record['file_id'], file_status_id])
+        return files[0] if files else None
+
     def tar_selected(self, record):
+        record = self._get_selected_file(record, self.file_status.TAR_READY)
+        if record is None:
+            return None
         self.modify('update file set file_status_id=%s where file_id=%s', self.file_status.TAR_IN_PROGRESS, record['file_id'])
         # Secondary read/write race condition causes delete if write doesn't get to secondaries, so we are going to retry a
         # few times before giving up.  Ideally this run_internal should point ot the primaries
@@ -1943,13 +2444,38 @@ class Tape(MySQLRestful):
         return record
 
     def copy_selected(self, record):
+        record = self._get_selected_file(record, self.file_status.COPY_READY)
+        if record is None:
+            return None
         self.modify('update file set file_status_id=%s where file_id=%s', self.file_status.COPY_IN_PROGRESS, record['file_id'])
-        return {}
+        return record
 
     def transfer_selected(self, record):
-        backup_record_ids = ', '.join([str(x['backup_record_id']) for x in record['records']])
-        self.modify('update backup_record set backup_record_status_id=%d where backup_record_id in (%s)' % (self.backup_record_status.TRANSFER_IN_PROGRESS, backup_record_ids))
-        self.modify('update file f left join backup_record b on b.file_id=f.file_id set file_status_id=%d where backup_record_id in (%s)' % (self.file_status.BACKUP_IN_PROGRESS, backup_record_ids))
+        """Mark the backup records of a selected put task as in progress. Only the records still waiting to go to tape
+        are kept, as a record released while the backlog was loading can be queued twice. Returns `None` if none of
+        them are, in which case the task is skipped.
+
+        :param dict record: Record the task was queued with
+        """
+        # Checked and marked under the lock, so two copies of a record selected at the same time aren't both kept
+        with self.transfer_lock:
+            waiting = {rec['backup_record_id'] for rec in self.query(
+                'select backup_record_id from backup_record where backup_record_id in (%s) and backup_record_status_id in (%%s,%%s)'
+                % ', '.join(['%s'] * len(record['records'])),
+                [x['backup_record_id'] for x in record['records']]
+                + [self.backup_record_status.REGISTERED, self.backup_record_status.TRANSFER_READY], uselimit=False)}
+            records = []
+            for x in record['records']:
+                if x['backup_record_id'] in waiting:
+                    waiting.discard(x['backup_record_id'])
+                    records.append(x)
+            if not records:
+                return None
+            backup_record_ids = ', '.join([str(x['backup_record_id']) for x in records])
+            self.modify('update backup_record set backup_record_status_id=%d where backup_record_id in (%s)' % (self.backup_record_status.TRANSFER_IN_PROGRESS, backup_record_ids))
+            self.modify('update file f left join backup_record b on b.file_id=f.file_id set file_status_id=%d where backup_record_id in (%s)' % (self.file_status.BACKUP_IN_PROGRESS, backup_record_ids))
+        if len(records) < len(record['records']):
+            return dict(record, records=records)
         return {}
 
     def pull_selected(self, volume: str, division_name: str, backup_service: int) -> list[dict[str, Any]]:
@@ -1973,7 +2499,7 @@ class Tape(MySQLRestful):
             self.modify('update file set file_status_id = %s where file_id = %s', self.file_status.RESTORE_IN_PROGRESS,
                         pull_queue_record.get('file_id'))
         info = self.query(
-            'select q.pull_queue_id, q.volume, q.position_a, q.position_b, q.requestor, q.priority, f.file_permissions, f.file_path, b.service, f.file_name, b.remote_file_path, b.remote_file_name, b.backup_record_id, t.remote_path, b.tar_record_id, f.division from file f join pull_queue q on f.file_id = q.file_id left join backup_record b on f.file_id = b.file_id and b.service = %s left join tar_record t on t.tar_record_id = b.tar_record_id where q.queue_status_id = %s and q.volume = %s',
+            'select q.pull_queue_id, q.volume, q.position_a, q.position_b, q.requestor, q.priority, f.file_permissions, f.file_path, b.service, f.file_name, b.remote_file_path, b.remote_file_name, b.backup_record_id, t.remote_path, b.tar_record_id, b.tar_offset, b.tar_size, f.division from file f join pull_queue q on f.file_id = q.file_id left join backup_record b on f.file_id = b.file_id and b.service = %s left join tar_record t on t.tar_record_id = b.tar_record_id where q.queue_status_id = %s and q.volume = %s',
             [backup_service, self.queue_status.IN_PROGRESS, volume], uselimit=False)
         return info
 
@@ -1981,12 +2507,105 @@ class Tape(MySQLRestful):
     def put_pull(self, args, kwargs):
         self.smart_modify('pull_queue', 'pull_queue_id=%d' % int(args[0]), kwargs)
         file_id = self.query('select file_id from pull_queue where pull_queue_id=%s', [int(args[0])])[0]['file_id']
+        self._sync_pull_queue_index([int(args[0])])
         queue_status_id = kwargs.get('queue_status_id', None)
         if queue_status_id == self.queue_status.COMPLETE:
             self.put_file([file_id], {'file_status_id': self.file_status.RESTORED})
         elif queue_status_id == self.queue_status.IN_PROGRESS:
             self.put_file([file_id], {'file_status_id': self.file_status.RESTORE_IN_PROGRESS})
 
+    @restful.doc('Updates a batch of pull requests in a single transaction', public=False)
+    @restful.permissions('tape')
+    @restful.validate({'pulls': {'type': list,
+                                 'validator': {'*': {'type': dict,
+                                                     'validator': {'pull_queue_id': {'type': int},
+                                                                   'queue_status_id': {'type': int},
+                                                                   'volume': {'type': str, 'required': False},
+                                                                   'position_a': {'type': int, 'required': False},
+                                                                   'position_b': {'type': int, 'required': False}}}},
+                                 'doc': 'List of pull_queue updates',
+                                 'example': [{'pull_queue_id': 1, 'volume': 'AG1234', 'position_a': 142,
+                                              'position_b': 0, 'queue_status_id': 1}]}})
+    def put_pulls(self, _args, kwargs):
+        """Bulk version of `put_pull`. The `pull_queue` updates, grouped by the set of columns being updated, and the
+        moves of the associated `file` records to the matching restore state, grouped by that state, are applied in a
+        single transaction. The metadata of the files is then updated with one `add_bulk_update` call.
+        """
+        pulls = kwargs.get('pulls')
+        if not pulls:
+            return {'pull_queue_records': 0}
+        updates_by_columns = {}
+        for pull in pulls:
+            columns = tuple(sorted(key for key in pull if key != 'pull_queue_id'))
+            updates_by_columns.setdefault(columns, []).append(
+                [pull.get(column) for column in columns] + [pull.get('pull_queue_id')])
+        pull_queue_ids = [pull.get('pull_queue_id') for pull in pulls]
+        conn = self.connect()
+        try:
+            conn.begin()
+            cursor = conn.cursor()
+            for columns, values in updates_by_columns.items():
+                cursor.executemany(
+                    f'update pull_queue set {", ".join(f"{column} = %s" for column in columns)} where pull_queue_id = %s',
+                    values)
+            cursor.execute(
+                f'select pull_queue_id, file_id from pull_queue where pull_queue_id in ({", ".join(["%s"] * len(pull_queue_ids))})',
+                pull_queue_ids)
+            file_ids = {record.get('pull_queue_id'): record.get('file_id') for record in cursor.fetchall()}
+            file_status_ids = {self.queue_status.COMPLETE: self.file_status.RESTORED,
+                               self.queue_status.IN_PROGRESS: self.file_status.RESTORE_IN_PROGRESS}
+            files_by_status = {}
+            for pull in pulls:
+                file_id = file_ids.get(pull.get('pull_queue_id'))
+                file_status_id = file_status_ids.get(pull.get('queue_status_id'))
+                if file_id is not None and file_status_id is not None:
+                    files_by_status.setdefault(file_status_id, []).append(file_id)
+            for file_status_id, status_file_ids in files_by_status.items():
+                for chunk in self._chunks(status_file_ids):
+                    cursor.execute(f'update file set file_status_id=%s where file_id in ({", ".join(["%s"] * len(chunk))})',
+                                   [file_status_id] + chunk)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self._sync_pull_queue_index(pull_queue_ids)
+        updates = [(file_id, {'file_status_id': file_status_id,
+                              'file_status': self.cv.get('file_status')[str(file_status_id)]})
+                   for file_status_id, status_file_ids in files_by_status.items() for file_id in status_file_ids]
+        if updates:
+            restful.run_internal('metadata', 'add_bulk_update', 'file_id', updates)
+        return {'pull_queue_records': len(file_ids)}
+
+    def _sync_pull_queue_index(self, pull_queue_ids: list[int]) -> None:
+        """Update the divisions' in-memory pull queue indexes from the current database state of the given
+        `pull_queue` records. `REGISTERED` records with a known volume are (re)indexed, anything else is removed.
+
+        :param pull_queue_ids: IDs of the `pull_queue` records that were modified
+        """
+        if not pull_queue_ids:
+            return
+        records = {record.get('pull_queue_id'): record for record in self.query(
+            f'select pull_queue_id, volume, priority, queue_status_id, division from pull_queue join file using(file_id) where pull_queue_id in ({", ".join(["%s"] * len(pull_queue_ids))})',
+            list(pull_queue_ids), uselimit=False)}
+        for pull_queue_id in pull_queue_ids:
+            record = records.get(pull_queue_id)
+            for division_name, division in self.divisions.items():
+                if (record is not None and record.get('division') == division_name
+                        and record.get('queue_status_id') == self.queue_status.REGISTERED):
+                    division.pull_queue.register(pull_queue_id, record.get('volume'), record.get('priority'))
+                else:
+                    division.pull_queue.unregister([pull_queue_id])
+
+    @restful.cron('20', '*', '*', '*')
+    def refresh_pull_queue_index(self):
+        """Reload the in-memory pull queue indexes from the database to reconcile with any changes made outside of
+        this module.
+        """
+        for division in self.divisions.values():
+            division.pull_queue.refresh_index()
+
     @restful.validate(argsValidator=[{'name': 'division', 'type': str}, {'name': 'service_id', 'type': int}])
     @restful.permissions('tape')
     def get_heartbeat(self, args, _kwargs):
@@ -2246,7 +2865,7 @@ class Tape(MySQLRestful):
 
     class PullQueue:
         def __init__(self, name: str, tape: 'Tape', division_name: str, backup_service: int,
-                     default_features: list[str] = []):
+                     default_features: list[str] = [], hold_windows: Optional[dict[int, float]] = None):
             self.name = name
             self.tape = tape
             self.division_name = division_name
@@ -2254,46 +2873,81 @@ class Tape(MySQLRestful):
             self.volume_locks = {}
             self.enabled_queues = []
             self.default_features = default_features
+            # Seconds to hold a volume for after its first request is registered, by priority, so that requests for
+            # the same volume arriving in a burst are restored with a single mount
+            self.hold_windows = {int(priority): float(window) for priority, window in (hold_windows or {}).items()}
             self.lock = threading.Lock()
+            self.index = PullQueueIndex()
 
         def next(self, available_features: list[str]) -> Optional[dict[str, Any]]:
-            """Get the next pull task. The queue reads directly from the database and returns the highest priority
-            pull task to process next. If `available_features` does not contain the default features for this queue,
-            it will return `None` (this behavior will be changed when we add support for distributed egress). It will
-            return tasks where priority is in 0, 1, and any manually enabled queues (>1).
+            """Get the next pull task. The volume to restore is selected from the in-memory index of `REGISTERED` pull
+            requests, returning the volume holding the highest priority pull task to process next. If
+            `available_features` does not contain the default features for this queue, it will return `None` (this
+            behavior will be changed when we add support for distributed egress). It will return tasks where priority
+            is in 0, 1, and any manually enabled queues (>1). Volumes are held back for the hold window of their
+            priority, if one is configured, and every request registered for the volume by then is in the batch.
 
             :param list[str] available_features: Features supported by the handler making the request
             """
             if not set(self.default_features).intersection(available_features):
                 return None
             queues = sorted([0, 1] + self.enabled_queues)
-            pull_queue_volume_record = None
-            with self.lock:
-                query = f'select pull_queue_id, volume, priority from pull_queue join file using(file_id) where queue_status_id = %s and volume is not null and division = %s and priority in ({", ".join(["%s"] * len(queues))}) '
-                if self.volume_locks:
-                    query += f'and volume not in ({",".join(["%s"] * len(self.volume_locks))}) '
-                query += 'order by priority, pull_queue_id limit 1'
-                next_volume = self.tape.query(
-                    query,
-                    [self.tape.queue_status.REGISTERED, self.division_name] + queues + list(self.volume_locks.keys()))
-                if len(next_volume) > 0:
-                    pull_queue_volume_record = next_volume[0]
-                    self.volume_locks[pull_queue_volume_record.get('volume')] = {
-                        'pull_queue_id': pull_queue_volume_record.get('pull_queue_id'),
-                        'locked': datetime.datetime.now()}
-            if pull_queue_volume_record:
-                pull_task_records = self.tape.pull_selected(pull_queue_volume_record.get('volume'), self.division_name,
-                                                            self.backup_service)
+            while True:
+                with self.lock:
+                    pull_queue_volume_record = self.index.next_volume(queues, self.volume_locks, self.hold_windows)
+                    if pull_queue_volume_record is None:
+                        return None
+                    volume = pull_queue_volume_record.get('volume')
+                    self.volume_locks[volume] = {'pull_queue_id': pull_queue_volume_record.get('pull_queue_id'),
+                                                 'locked': datetime.datetime.now()}
+                pull_task_records = self.tape.pull_selected(volume, self.division_name, self.backup_service)
+                self.index.remove([record.get('pull_queue_id') for record in pull_task_records])
+                if pull_task_records:
+                    break
+                # The index is out of sync with the database (e.g., records were modified outside of this service), so
+                # drop the volume and try the next one
+                self.tape.logger.warning(f'pull queue index had no registered requests in the database for volume {volume}')
                 with self.lock:
-                    if pull_queue_volume_record.get('priority') in self.enabled_queues:
-                        remaining_in_pull_queue = self.tape.query(
-                            'select count(*) as cnt from pull_queue join file using(file_id) where queue_status_id = %s and priority = %s and division = %s',
-                            [self.tape.queue_status.REGISTERED, pull_queue_volume_record.get('priority'),
-                             self.division_name])[0]
-                        # If the queue is empty turn hold portal back on
-                        if remaining_in_pull_queue.get('cnt') == 0:
-                            self.enabled_queues.remove(pull_queue_volume_record.get('priority'))
-                return {'uses_resources': self.default_features, 'data': pull_task_records}
+                    self.index.remove_volume(volume)
+                    self.volume_locks.pop(volume, None)
+            with self.lock:
+                if pull_queue_volume_record.get('priority') in self.enabled_queues:
+                    remaining_in_pull_queue = self.tape.query(
+                        'select count(*) as cnt from pull_queue join file using(file_id) where queue_status_id = %s and priority = %s and division = %s',
+                        [self.tape.queue_status.REGISTERED, pull_queue_volume_record.get('priority'),
+                         self.division_name])[0]
+                    # If the queue is empty turn hold portal back on
+                    if remaining_in_pull_queue.get('cnt') == 0:
+                        self.enabled_queues.remove(pull_queue_volume_record.get('priority'))
+            return {'uses_resources': self.default_features, 'data': pull_task_records}
+
+        def refresh_index(self) -> None:
+            """(Re)load the in-memory index from the `REGISTERED` pull requests with a known volume in the database.
+            """
+            with self.lock:
+                self.index.load(self.tape.query(
+                    'select pull_queue_id, volume, priority, unix_timestamp(dt_modified) as registered from pull_queue join file using(file_id) where queue_status_id = %s and volume is not null and division = %s',
+                    [self.tape.queue_status.REGISTERED, self.division_name], uselimit=False))
+
+        def register(self, pull_queue_id: int, volume: Optional[str], priority: int) -> None:
+            """Add a `REGISTERED` pull request to the index (or update its volume and priority). Requests without a
+            volume are waiting on prep and are not indexed.
+
+            :param pull_queue_id: ID of the `pull_queue` record
+            :param volume: Volume the file resides on
+            :param priority: Priority of the request
+            """
+            if volume is None:
+                self.index.remove([pull_queue_id])
+            else:
+                self.index.add(pull_queue_id, volume, priority)
+
+        def unregister(self, pull_queue_ids: list[int]) -> None:
+            """Remove pull requests that are no longer `REGISTERED` from the index.
+
+            :param pull_queue_ids: IDs of the `pull_queue` records
+            """
+            self.index.remove(pull_queue_ids)
 
         def init_locks(self, volumes: list[dict[str, str]]) -> None:
             """Initialize volume locks from list of volumes.
@@ -2324,12 +2978,9 @@ class Tape(MySQLRestful):
                     self.enabled_queues.append(priority)
 
         def get_pending_tasks_count(self) -> int:
-            """Get the count of pending tasks.
+            """Get the count of pending tasks (distinct volumes with `REGISTERED` pull requests).
             """
-            with self.lock:
-                return self.tape.query(
-                    'select count(distinct volume) as cnt from pull_queue join file using(file_id) where queue_status_id = %s and volume is not null and division = %s',
-                    [self.tape.queue_status.REGISTERED, self.division_name])[0].get('cnt')
+            return self.index.volume_count()
 
         def delete_pending_tasks_for_file(self, file_id: int) -> None:
             """Deletes any pending tasks (`REGISTERED` state) for given `file_id`.
@@ -2337,8 +2988,12 @@ class Tape(MySQLRestful):
             :param file_id: File ID to delete pending tasks for
             """
             with self.lock:
+                pull_queue_records = self.tape.query(
+                    'select pull_queue_id from pull_queue where file_id = %s and queue_status_id = %s',
+                    [file_id, self.tape.queue_status.REGISTERED], uselimit=False)
                 self.tape.modify('delete from pull_queue where file_id = %s and queue_status_id = %s', file_id,
                                  self.tape.queue_status.REGISTERED)
+                self.index.remove([record.get('pull_queue_id') for record in pull_queue_records])
 
     class PrepQueue:
         def __init__(self, name: str, tape: 'Tape', backup_service: int, default_features: list[str] = []):
@@ -2353,7 +3008,8 @@ class Tape(MySQLRestful):
         def next(self, available_features: list[str]) -> Optional[dict[str, Any]]:
             """Get the next prep batch task. The queue reads directly from the database and returns batch prep tasks to
             process next. If `available_features` does not contain the default features for this queue, it will return
-            `None` (this behavior will be changed when we add support for distributed egress).
+            `None` (this behavior will be changed when we add support for distributed egress). The batch is claimed with
+            a single update, so the number of queries does not depend on the batch size.
 
             :param list[str] available_features: Features supported by the handler making the request
             """
@@ -2367,15 +3023,14 @@ class Tape(MySQLRestful):
                 prep_recs = self.tape.query(
                     'select pull_queue_id from pull_queue p join backup_record b using(file_id) where volume is null and b.service = %s and queue_status_id = %s limit %s',
                     [self.backup_service, self.tape.queue_status.REGISTERED, self.db_prep_tasks_max_batch_size])
-                for rec in prep_recs:
-                    self.tape.modify('update pull_queue set queue_status_id = %s where pull_queue_id = %s',
-                                     self.tape.queue_status.PREP_IN_PROGRESS, rec.get('pull_queue_id'))
+                pull_queue_ids = [rec.get('pull_queue_id') for rec in prep_recs]
+                if pull_queue_ids:
+                    self.tape.modify(
+                        f'update pull_queue set queue_status_id = %s where pull_queue_id in ({",".join(["%s"] * len(pull_queue_ids))})',
+                        self.tape.queue_status.PREP_IN_PROGRESS, *pull_queue_ids)
             if prep_recs:
-                query = f'select p.pull_queue_id, t.tar_record_id, t.remote_path, b.remote_file_path, b.remote_file_name, b.service from pull_queue p left join tar_record t on p.tar_record_id = t.tar_record_id join backup_record b using(file_id) where b.service = %s and p.pull_queue_id in ({",".join(["%s"] * len(prep_recs))})'
-                prep_task_records = self.tape.query(query,
-                                                    [self.backup_service] + [rec.get('pull_queue_id') for rec in
-                                                                             prep_recs],
-                                                    uselimit=False)
+                query = f'select p.pull_queue_id, t.tar_record_id, t.remote_path, b.remote_file_path, b.remote_file_name, b.service from pull_queue p left join tar_record t on p.tar_record_id = t.tar_record_id join backup_record b using(file_id) where b.service = %s and p.pull_queue_id in ({",".join(["%s"] * len(pull_queue_ids))})'
+                prep_task_records = self.tape.query(query, [self.backup_service] + pull_queue_ids, uselimit=False)
                 return {'uses_resources': self.default_features, 'data': prep_task_records}
 
         def get_pending_tasks_count(self) -> int:
@@ -2396,15 +3051,14 @@ class Tape(MySQLRestful):
         """
         def __init__(self, division_name: str, tape: 'Tape', config: dict[str, Any]):
             self.division_name = division_name
-            self.orphan_files = {}
+            # Files smaller than `MIN_SINGLE_SIZE` waiting to be packed into tars
+            self.tar_packer = TarPacker(config.get('tar_target_size', MIN_SINGLE_SIZE), config.get('tar_max_size'),
+                                        config.get('tar_max_age', 6 * 60 * 60), config.get('tar_locality_depth', 5))
             default_queue_features = config.get('default_queue_features', {})
 
             # Initialize tasks
             # Initialize the file ingest info queue
             self.ingest_queue = task.Queue('ingest', 0, default_features=default_queue_features.get('ingest', []))
-            tape._add_all_to_queue_by_feature(self.ingest_queue, tape.query(
-                'select * from file_ingest where file_ingest_status_id = %s and division = %s',
-                [tape.file_status.REGISTERED, division_name], uselimit=False), lambda record: record.get('_file'))
 
             # Prep drives Pull, do Prep first
             self.prep_queue = Tape.PrepQueue('prep', tape, config.get('default_backup_service'),
@@ -2412,24 +3066,16 @@ class Tape(MySQLRestful):
 
             # Pull is a user 'interactive' task, so should do next
             self.pull_queue = Tape.PullQueue('pull', tape, division_name, config.get('default_backup_service'),
-                                             default_features=default_queue_features.get('pull', []))
+                                             default_features=default_queue_features.get('pull', []),
+                                             hold_windows=config.get('pull_queue_hold_windows'))
+            self.pull_queue.refresh_index()
 
             # Copy and Tar pull data into the managed repository, important for users wanting to delete files, so these
             # are next
             self.copy_queue = task.Queue('copy', 2, default_features=default_queue_features.get('copy', []),
                                          task_selected=tape.copy_selected)
-            tape._add_all_to_queue_by_feature(self.copy_queue,
-                                              tape.query(
-                                                  'select * from file where file_status_id = %s and division = %s',
-                                                  [tape.file_status.COPY_READY, division_name], uselimit=False),
-                                              lambda record: record.get('origin_file_path'))
             self.tar_queue = task.Queue('tar', 3, default_features=default_queue_features.get('tar', []),
                                         task_selected=tape.tar_selected)
-            tape._add_all_to_queue_by_feature(self.tar_queue,
-                                              tape.query(
-                                                  'select * from file where file_status_id = %s and division = %s',
-                                                  [tape.file_status.TAR_READY, division_name], uselimit=False),
-                                              tape._get_tar_record_path)
 
             # End users don't care when these get done, but we don't want anything to backlog up, so put these all in
             # the same priority, so they round-robin
@@ -2437,13 +3083,33 @@ class Tape(MySQLRestful):
             self.delete_queue = task.Queue('delete', 4, [], default_features=default_queue_features.get('delete', []))
             self.put_queue = task.Queue('put', 5, [], default_features=default_queue_features.get('put', []),
                                         task_selected=tape.transfer_selected)
-            self.md5_queue = task.Queue('md5', 5,
-                                        tape.query(
-                                            'select * from md5_queue where queue_status_id = %s and division = %s',
-                                            [tape.file_status.REGISTERED, division_name], uselimit=False),
-                                        default_features=default_queue_features.get('md5', []),
+            self.md5_queue = task.Queue('md5', 5, default_features=default_queue_features.get('md5', []),
                                         task_selected=tape.md5_selected)
 
-            self.task_manager = task.TaskManager(division_name, config.get('max_resources', {}))
+            self.task_manager = task.TaskManager(division_name, config.get('max_resources', {}),
+                                                 config.get('lease_timeout', 600))
             self.task_manager.set_queues(self.ingest_queue, self.put_queue, self.copy_queue, self.md5_queue,
                                          self.tar_queue, self.purge_queue, self.delete_queue)
+
+        def hydrate(self, tape: 'Tape', bounds: dict[str, Optional[int]]) -> None:
+            """Load the backlog of the ingest, copy, tar and md5 queues. Only the columns needed to route and size the
+            tasks are loaded, the copy and tar tasks get the rest of their file record when they are selected.
+
+            :param tape: Tape instance to query with
+            :param bounds: Largest `file_id`, `file_ingest_id` and `md5_queue_id` to load records up to
+            """
+            tape._add_all_to_queue_by_feature(self.ingest_queue, tape._query_chunked(
+                'select file_ingest_id, file_size, _file, _callback, source, division from file_ingest where file_ingest_status_id = %s and division = %s',
+                [tape.file_status.REGISTERED, self.division_name], 'file_ingest_id', bounds.get('file_ingest_id')),
+                lambda record: record.get('_file'))
+            tape._add_all_to_queue_by_feature(self.copy_queue, tape._query_chunked(
+                'select file_id, file_size, origin_file_path, source from file where file_status_id = %s and division = %s',
+                [tape.file_status.COPY_READY, self.division_name], 'file_id', bounds.get('file_id')),
+                lambda record: record.get('origin_file_path'))
+            tape._add_all_to_queue_by_feature(self.tar_queue, tape._query_chunked(
+                'select file_id, file_size, file_path, origin_file_path, origin_file_name, local_purge_days, source from file where file_status_id = %s and division = %s',
+                [tape.file_status.TAR_READY, self.division_name], 'file_id', bounds.get('file_id')),
+                tape._get_tar_record_path)
+            self.md5_queue.add_all(tape._query_chunked(
+                'select md5_queue_id, file_path, file_size, callback, division from md5_queue where queue_status_id = %s and division = %s',
+                [tape.file_status.REGISTERED, self.division_name], 'md5_queue_id', bounds.get('md5_queue_id')))
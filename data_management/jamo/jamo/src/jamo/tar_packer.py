@@ -0,0 +1,141 @@
+import collections
+import datetime
+import os
+import time
+from typing import Any, Optional
+
+
+class TarPacker:
+    """Packs small files into tars by locality, for one division.
+
+    Files are collected in bins keyed by backup service and locality key, the first `locality_depth` components of
+    the file's directory (e.g., `/global/dna/dm_archive/<project>/<subsystem>`), so a tar holds files from one project
+    area and a restore of related files touches few tars. A bin is flushed as a tar once it reaches `target_size`, and
+    is flushed before it would grow past `max_size`. Bins older than `max_age` seconds are flushed regardless of their
+    size. Aged bins of the same service are first merged while they still fit in `target_size`, the bins with the
+    closest locality keys (the longest common path) first, so that sibling directories end up together.
+
+    The members of each tar are ordered by path, and the fill (size / `target_size`) of every flushed tar is kept for
+    `report`.
+    """
+
+    def __init__(self, target_size: int, max_size: Optional[int] = None, max_age: Optional[float] = None,
+                 locality_depth: int = 5, history: int = 1000):
+        """
+        :param target_size: Size in bytes to flush a bin at
+        :param max_size: Size in bytes a bin may not grow past, defaults to twice `target_size`
+        :param max_age: Seconds after which a bin is flushed regardless of its size, `None` to only flush on size
+        :param locality_depth: Number of directory components in the locality key
+        :param history: Number of flushed tars to keep for `report`
+        """
+        self.target_size = target_size
+        self.max_size = max_size or 2 * target_size
+        self.max_age = max_age
+        self.locality_depth = locality_depth
+        # (service name, locality key) -> {'service', 'size', 'created', 'records', 'sizes'}
+        self._bins = {}
+        self._flushed = collections.deque(maxlen=history)
+
+    def locality_key(self, file_path: str) -> str:
+        """Get the locality key for a directory.
+
+        :param file_path: Directory of the file
+        """
+        parts = file_path.rstrip('/').split('/')
+        return '/'.join(parts[:self.locality_depth + 1]) or '/'
+
+    def add(self, service: int, record: dict[str, Any], file_size: int,
+            now: Optional[float] = None) -> list[dict[str, Any]]:
+        """Add a file to its bin. Bins are keyed by the service's string form, so the same service given as an int or
+        as a str shares a bin.
+
+        :param service: Backup service the file is going to
+        :param record: Record containing `file_id`, `backup_record_id`, `file_name` and `file_path`
+        :param file_size: Size of the file in bytes
+        :param now: Current epoch seconds, defaults to now
+        :return: The tars that were flushed, as put tasks with `file_size`, `root_dir`, `records` and `service`
+        """
+        now = time.time() if now is None else now
+        key = (str(service), self.locality_key(record.get('file_path')))
+        tars = []
+        current = self._bins.get(key)
+        if current is not None and current['size'] + file_size > self.max_size:
+            tars.append(self._flush([key], 'size', now))
+        current = self._bins.setdefault(key, {'service': service, 'size': 0, 'created': now, 'records': [],
+                                              'sizes': []})
+        current['size'] += file_size
+        current['records'].append(record)
+        current['sizes'].append(file_size)
+        if current['size'] >= self.target_size:
+            tars.append(self._flush([key], 'size', now))
+        return tars
+
+    def flush_aged(self, now: Optional[float] = None) -> list[dict[str, Any]]:
+        """Flush the bins older than `max_age`, merging the bins of each service that fit together.
+
+        :param now: Current epoch seconds, defaults to now
+        :return: The tars that were flushed, as put tasks
+        """
+        if self.max_age is None:
+            return []
+        now = time.time() if now is None else now
+        # Groups of aged bins as [keys, common locality, size], in locality key order
+        groups = [[[key], key[1], self._bins[key]['size']] for key in sorted(self._bins)
+                  if now - self._bins[key]['created'] >= self.max_age]
+        while True:
+            best = None
+            for i in range(len(groups) - 1):
+                first, second = groups[i], groups[i + 1]
+                if first[0][0][0] != second[0][0][0] or first[2] + second[2] > self.target_size:
+                    continue
+                common = os.path.commonpath([first[1], second[1]])
+                if best is None or len(common) > len(best[1]):
+                    best = (i, common)
+            if best is None:
+                break
+            i, common = best
+            groups[i:i + 2] = [[groups[i][0] + groups[i + 1][0], common, groups[i][2] + groups[i + 1][2]]]
+        return [self._flush(keys, 'age', now) for keys, _, _ in groups]
+
+    def pending(self) -> dict[str, dict[str, dict[str, Any]]]:
+        """Get the files waiting in bins, by service and locality key.
+        """
+        return {service: {key: {'size': current['size'], 'root_dir': self._root_dir(current['records']),
+                                'backup_records': list(current['records'])}
+                          for (bin_service, key), current in self._bins.items() if bin_service == service}
+                for service in {service for service, _ in self._bins}}
+
+    def report(self) -> dict[str, Any]:
+        """Get the fill efficiency of the recently flushed tars and the state of the pending bins.
+        """
+        tars = list(self._flushed)
+        fills = [tar.get('fill') for tar in tars]
+        return {'target_size': self.target_size, 'max_size': self.max_size, 'max_age': self.max_age,
+                'tars': tars,
+                'summary': {'tars': len(tars), 'files': sum(tar.get('files') for tar in tars),
+                            'bytes': sum(tar.get('size') for tar in tars),
+                            'mean_fill': sum(fills) / len(fills) if fills else None,
+                            'under_half_full': sum(1 for fill in fills if fill < 0.5),
+                            'over_target': sum(1 for fill in fills if fill > 1)},
+                'pending': [{'service': service, 'locality': key, 'files': len(current['records']),
+                             'size': current['size'], 'fill': current['size'] / self.target_size,
+                             'created': datetime.datetime.fromtimestamp(current['created'])}
+                            for (service, key), current in sorted(self._bins.items())]}
+
+    def _flush(self, keys: list[tuple[str, str]], reason: str, now: float) -> dict[str, Any]:
+        members = []
+        for key in keys:
+            current = self._bins.pop(key)
+            service = current['service']
+            members.extend(zip(current['records'], current['sizes']))
+        members.sort(key=lambda member: (member[0].get('file_path'), member[0].get('file_name')))
+        records = [record for record, _ in members]
+        size = sum(file_size for _, file_size in members)
+        root_dir = self._root_dir(records)
+        self._flushed.append({'service': service, 'root_dir': root_dir, 'localities': len(keys),
+                              'files': len(records), 'size': size, 'fill': size / self.target_size,
+                              'reason': reason, 'flushed': datetime.datetime.fromtimestamp(now)})
+        return {'file_size': size, 'root_dir': root_dir, 'records': records, 'service': service}
+
+    def _root_dir(self, records: list[dict[str, Any]]) -> str:
+        return os.path.commonpath([record.get('file_path') for record in records]) if records else ''
@@ -0,0 +1,229 @@
+import collections
+import concurrent.futures
+import grp
+import io
+import os
+import pwd
+import stat
+import tarfile
+from typing import Iterable, Iterator, Optional
+
+# Directories listed at the same time by `scan_tree`, listing and stat calls release the GIL
+SCAN_WORKERS = 16
+# Files read at the same time ahead of the tar writer
+READ_WORKERS = 16
+# Files up to this size are read into memory ahead of the tar writer, larger files are streamed by the writer
+SMALL_FILE_SIZE = 1024 * 1024
+# Bytes of small files read ahead of the tar writer
+PREFETCH_BYTES = 64 * 1024 * 1024
+# Buffer size for writing the tar and copying large files into it
+WRITE_BUFFER_SIZE = 16 * 1024 * 1024
+
+
+class Entry:
+    """A file found by `scan_tree`.
+
+    :param tar_dest: Path of the file relative to the scanned folder
+    :param path: Path of the file
+    :param stat: `lstat` of the file, None for a symlink
+    :param realpath: Path the symlink resolves to, None for a file
+    :param folder_files: Number of files in the folder of the file
+    """
+    __slots__ = ('tar_dest', 'path', 'stat', 'realpath', 'folder_files', 'linkname')
+
+    def __init__(self, tar_dest: str, path: str, stat: Optional[os.stat_result], realpath: Optional[str] = None,
+                 folder_files: int = 0, linkname: Optional[str] = None):
+        self.tar_dest = tar_dest
+        self.path = path
+        self.stat = stat
+        self.realpath = realpath
+        self.folder_files = folder_files
+        # Set to add the entry to the tar as a symlink to `linkname`
+        self.linkname = linkname
+
+
+def _scan_folder(folder: str, root_length: int, ignore: set[str]) -> tuple[list[Entry], list[str]]:
+    files = []
+    folders = []
+    try:
+        with os.scandir(folder) as it:
+            for dir_entry in it:
+                try:
+                    is_dir = dir_entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    files.append(dir_entry)
+                # Symlinks to folders are not followed, as `os.walk` does by default
+                elif not dir_entry.is_symlink() and dir_entry.path[root_length:] not in ignore:
+                    folders.append(dir_entry.path)
+    except OSError:
+        # Unreadable folders are skipped, as `os.walk` does by default
+        return [], []
+    entries = []
+    for dir_entry in files:
+        tar_dest = dir_entry.path[root_length:]
+        if tar_dest in ignore:
+            continue
+        try:
+            if dir_entry.is_symlink():
+                entries.append(Entry(tar_dest, dir_entry.path, None, os.path.realpath(dir_entry.path), len(files)))
+            else:
+                entries.append(Entry(tar_dest, dir_entry.path, dir_entry.stat(follow_symlinks=False), None,
+                                     len(files)))
+        except FileNotFoundError:
+            # Removed since the folder was listed
+            continue
+    return entries, folders
+
+
+def scan_tree(root_folder: str, ignore: Iterable[str] = (), workers: int = SCAN_WORKERS) -> Iterator[Entry]:
+    """Walk a folder like `os.walk`, listing and stating the folders in parallel. The files are returned in the same
+    order as `os.walk` (top down, in directory order), symlinks to folders are not followed and symlinks to files are
+    resolved with `os.path.realpath`.
+
+    The folders below a folder are listed once the folder's files are returned, so the number of listings held in
+    memory is bounded by the width of the tree rather than its size.
+
+    :param root_folder: Folder to walk
+    :param ignore: Paths relative to `root_folder` of the folders and files to skip
+    :param workers: Number of folders to list at the same time
+    """
+    ignore = set(ignore)
+    root_length = len(root_folder) + 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        stack = [pool.submit(_scan_folder, root_folder, root_length, ignore)]
+        while stack:
+            entries, folders = stack.pop().result()
+            stack.extend(pool.submit(_scan_folder, folder, root_length, ignore) for folder in reversed(folders))
+            yield from entries
+
+
+def _read(entry: Entry):
+    f = open(entry.path, 'rb')
+    if entry.stat.st_size > SMALL_FILE_SIZE:
+        return f
+    with f:
+        return f.read()
+
+
+class TarWriter:
+    """Writes a tar from a stream of `Entry`, reading the files ahead of the writer in parallel and writing the tar
+    through a large buffer.
+
+    :param tar_file: Path of the tar to create
+    :param read_workers: Number of files to read at the same time
+    :param prefetch_bytes: Bytes of small files to read ahead of the writer
+    """
+
+    def __init__(self, tar_file: str, read_workers: int = READ_WORKERS, prefetch_bytes: int = PREFETCH_BYTES):
+        self.read_workers = read_workers
+        self.prefetch_bytes = prefetch_bytes
+        self._file = open(tar_file, 'wb', buffering=WRITE_BUFFER_SIZE)
+        self.tar = tarfile.open(fileobj=self._file, mode='w', copybufsize=WRITE_BUFFER_SIZE)
+        self._users = {}
+        self._groups = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        try:
+            self.tar.close()
+        finally:
+            self._file.close()
+
+    def _name(self, names: dict, lookup, key: int) -> str:
+        if key not in names:
+            try:
+                names[key] = lookup(key)[0]
+            except (KeyError, OverflowError):
+                names[key] = ''
+        return names.get(key)
+
+    def _tarinfo(self, entry: Entry) -> tarfile.TarInfo:
+        """`TarFile.gettarinfo` for a regular file, from the `lstat` done by the scan and with the owner names
+        cached.
+        """
+        st = entry.stat
+        info = tarfile.TarInfo(entry.tar_dest)
+        info.mode = st.st_mode
+        info.uid = st.st_uid
+        info.gid = st.st_gid
+        info.mtime = st.st_mtime
+        info.uname = self._name(self._users, pwd.getpwuid, st.st_uid)
+        info.gname = self._name(self._groups, grp.getgrgid, st.st_gid)
+        inode = (st.st_ino, st.st_dev)
+        if st.st_nlink > 1 and inode in self.tar.inodes:
+            info.type = tarfile.LNKTYPE
+            info.linkname = self.tar.inodes.get(inode)
+        else:
+            if st.st_nlink > 1:
+                self.tar.inodes[inode] = entry.tar_dest
+            info.type = tarfile.REGTYPE
+            info.size = st.st_size
+        return info
+
+    def _prefetch(self, entries: Iterable[Entry], pool: concurrent.futures.Executor):
+        pending = collections.deque()
+        pending_bytes = 0
+        for entry in entries:
+            if entry.linkname is None and entry.stat is not None and stat.S_ISREG(entry.stat.st_mode):
+                pending.append((entry, pool.submit(_read, entry)))
+                pending_bytes += min(entry.stat.st_size, SMALL_FILE_SIZE)
+            else:
+                pending.append((entry, None))
+            while pending_bytes > self.prefetch_bytes or len(pending) > self.read_workers * 64:
+                entry, future = pending.popleft()
+                if future is not None:
+                    pending_bytes -= min(entry.stat.st_size, SMALL_FILE_SIZE)
+                yield entry, future
+        yield from pending
+
+    def add_all(self, entries: Iterable[Entry]) -> list[Entry]:
+        """Add files to the tar in order. Files that can not be read are skipped.
+
+        :param entries: Files to add, a symlink entry is added as a symlink to its `linkname`
+        :return: The entries that could not be read
+        """
+        unreadable = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.read_workers) as pool:
+            for entry, future in self._prefetch(entries, pool):
+                if entry.linkname is not None:
+                    info = tarfile.TarInfo(entry.tar_dest)
+                    info.size = 0
+                    info.mode = 493
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = entry.linkname
+                    self.tar.addfile(info)
+                elif future is None:
+                    # Not a regular file (folder, fifo, ...), let `tarfile` work out how to add it
+                    try:
+                        self.tar.add(entry.path, arcname=entry.tar_dest)
+                    except OSError:
+                        unreadable.append(entry)
+                        continue
+                else:
+                    try:
+                        data = future.result()
+                    except OSError:
+                        unreadable.append(entry)
+                        continue
+                    info = self._tarinfo(entry)
+                    if info.type == tarfile.LNKTYPE:
+                        if not isinstance(data, bytes):
+                            data.close()
+                        self.tar.addfile(info)
+                    elif isinstance(data, bytes):
+                        # The file may have changed since it was stated, the data read is what is archived
+                        info.size = len(data)
+                        self.tar.addfile(info, io.BytesIO(data))
+                    else:
+                        with data:
+                            self.tar.addfile(info, data)
+                # The members are only needed to read a tar and would otherwise grow with the number of files
+                self.tar.members.clear()
+        return unreadable
@@ -28,6 +28,31 @@ def contains_list(list1, list2):
     return True
 
 
+# Features are interned as bits, so a set of features is an int mask and "handler has every feature a task needs" is
+# `task_mask & ~handler_mask == 0`
+_feature_bits = {}
+_feature_masks = {}
+_feature_lock = threading.Lock()
+
+
+def feature_mask(features):
+    """Get the bitmask for a list of features, interning any feature not seen before.
+
+    :param list[str] features: Features to get the mask for
+    """
+    key = tuple(features)
+    mask = _feature_masks.get(key)
+    if mask is None:
+        with _feature_lock:
+            mask = 0
+            for feature in key:
+                if feature not in _feature_bits:
+                    _feature_bits[feature] = 1 << len(_feature_bits)
+                mask |= _feature_bits[feature]
+            _feature_masks[key] = mask
+    return mask
+
+
 class Queue:
     # Constructor should set the size, priority
     def __init__(self, task_name, priority, queue=None, default_features=[], task_selected=None, get_task_features=None,
@@ -44,6 +69,14 @@ class Queue:
         # and a deque of all the tasks that belong to that distinct set of features
         self.round_robin_queues = []
         self.round_robin_on = 0
+        # Position of each feature string in round_robin_queues, and the features and feature mask at each position
+        self._positions = {}
+        self._signature_features = []
+        self._signature_masks = []
+        # Bit i is set while the deque for round_robin_queues[i] is not empty
+        self._ready = 0
+        # Handler feature mask -> bits of the positions in round_robin_queues the handler can run
+        self._eligible = {}
         self.record_count = 0
         self.file_size = 0
         self.on_lost = on_lost
@@ -82,38 +115,73 @@ class Queue:
                 if feature not in features:
                     features.append(feature)
         feature_str = ','.join(features)
-        if feature_str in self.feature_queues:
-            self.feature_queues.get(feature_str).append(record)
-        else:
-            self.feature_queues[feature_str] = deque([record])
-            self.round_robin_queues.append(feature_str)
         with self._lock:
+            if feature_str in self.feature_queues:
+                self.feature_queues.get(feature_str).append(record)
+            else:
+                self.feature_queues[feature_str] = deque([record])
+                self._add_signature(feature_str, features)
+            self._ready |= 1 << self._positions.get(feature_str)
             self.record_count += 1
             if 'file_size' in record:
                 self.file_size += record['file_size']
 
+    def _add_signature(self, feature_str, features):
+        # Called with `_lock` held
+        position = len(self.round_robin_queues)
+        mask = feature_mask(features)
+        self.round_robin_queues.append(feature_str)
+        self._positions[feature_str] = position
+        self._signature_features.append(features)
+        self._signature_masks.append(mask)
+        for handler_mask in self._eligible:
+            if mask & ~handler_mask == 0:
+                self._eligible[handler_mask] |= 1 << position
+
     def next(self, available_features):
-        for i in range(len(self.round_robin_queues)):
-            getting = (self.round_robin_on + i) % len(self.round_robin_queues)
-            feature_str = self.round_robin_queues[getting]
-            features = feature_str.split(',')
-            if len(self.feature_queues.get(feature_str)) > 0 and contains_list(features, available_features):
+        """Get the next task that can run with the given features. The distinct feature sets with tasks waiting are
+        taken round-robin, and the tasks of a feature set in the order they were added.
+
+        :param list[str] available_features: Features supported by the handler making the request
+        """
+        handler_mask = feature_mask(available_features)
+        while True:
+            with self._lock:
+                eligible = self._eligible.get(handler_mask)
+                if eligible is None:
+                    eligible = 0
+                    for position, mask in enumerate(self._signature_masks):
+                        if mask & ~handler_mask == 0:
+                            eligible |= 1 << position
+                    self._eligible[handler_mask] = eligible
+                candidates = self._ready & eligible
+                if not candidates:
+                    return None
+                # The first candidate at or after `round_robin_on`, wrapping around to the first candidate
+                later = candidates >> self.round_robin_on << self.round_robin_on
+                lowest = (later or candidates) & -(later or candidates)
+                getting = lowest.bit_length() - 1
+                tasks = self.feature_queues.get(self.round_robin_queues[getting])
+                if not tasks:
+                    # Emptied outside of `next`
+                    self._ready &= ~lowest
+                    continue
                 self.round_robin_on = getting + 1
-                data = self.feature_queues.get(feature_str).popleft()
-                with self._lock:
-                    self.record_count -= 1
-                    if 'file_size' in data:
-                        self.file_size -= data['file_size']
-                if self.on_task_selected is not None:
-                    ret = self.on_task_selected(data)
-                    if ret is not None:
-                        if len(ret) > 0:
-                            data = ret
-                    else:
-                        return self.next(available_features)
-                with self._lock:
-                    self.currently_running += 1
-                return {'uses_resources': features, 'data': data}
+                data = tasks.popleft()
+                if not tasks:
+                    self._ready &= ~lowest
+                self.record_count -= 1
+                if 'file_size' in data:
+                    self.file_size -= data['file_size']
+            if self.on_task_selected is not None:
+                ret = self.on_task_selected(data)
+                if ret is None:
+                    continue
+                if len(ret) > 0:
+                    data = ret
+            with self._lock:
+                self.currently_running += 1
+            return {'uses_resources': list(self._signature_features[getting]), 'data': data}
 
     def lost(self, data):
         with self._lock:
@@ -137,6 +205,10 @@ class Queue:
         with self._lock:
             self.record_count = 0
             self.file_size = 0
+            self._ready = 0
+            for position, feature_str in enumerate(self.round_robin_queues):
+                if self.feature_queues.get(feature_str):
+                    self._ready |= 1 << position
             for feature_str in self.feature_queues:
                 self.record_count += len(self.feature_queues.get(feature_str))
                 self.file_size += sum([x['file_size'] for x in self.feature_queues.get(feature_str) if 'file_size' in x])
@@ -156,8 +228,20 @@ class Queue:
         return {'record_count': self.get_size(), 'file_size': self.get_file_size(), 'currently_running': self.get_current_count()}
 
 
+def task_size(data):
+    """Get the number of bytes a task moves, from the `file_size` of its record(s).
+
+    :param dict|list[dict] data: Task data
+    """
+    if isinstance(data, list):
+        return sum(record.get('file_size') or 0 for record in data if isinstance(record, dict))
+    if isinstance(data, dict):
+        return data.get('file_size') or 0
+    return 0
+
+
 class TaskManager:
-    def __init__(self, division_name: str, max_resources: dict[str, int] = {}):
+    def __init__(self, division_name: str, max_resources: dict[str, int] = {}, lease_timeout: int = 600):
         self.queues = []
         self.task_cache = {}
         self.division_name = division_name
@@ -169,6 +253,10 @@ class TaskManager:
         self.task_prefix = ''.join(random.sample(string.ascii_uppercase + string.ascii_lowercase + string.digits, 8))
         self.on_task = 0
         self.task_name_to_queue = {}
+        # Batches of tasks handed out together, lease id -> {'service', 'task_ids', 'created', 'heartbeat'}
+        self.leases = {}
+        self.lease_timeout = lease_timeout
+        self.on_lease = 0
         self._lock = threading.Lock()
 
     def set_queues(self, *queues):
@@ -192,7 +280,10 @@ class TaskManager:
         for task in self.queues:
             ret[task.name] = task.get_status()
         return {'tasks': ret, 'current_used_resources': self.current_resource_counts,
-                'current_tasks': self.current_tasks, 'services': self.services}
+                'current_tasks': self.current_tasks, 'services': self.services,
+                'leases': {lease_id: {'service': lease['service'], 'tasks': len(lease['task_ids']),
+                                      'created': lease['created'], 'heartbeat': lease['heartbeat']}
+                           for lease_id, lease in list(self.leases.items())}}
 
     def get_short_status(self):
         ret = {}
@@ -226,20 +317,108 @@ class TaskManager:
 
         for service_id in lost_services:
             del self.services[service_id]
+        self.expire_leases()
+
+    def _release_task(self, task_id):
+        # Stop tracking a task and give back the resources it was using
+        task = self.current_tasks.pop(task_id, None)
+        if task is not None:
+            for feature in task['features']:
+                if feature in self.current_resource_counts:
+                    with self._lock:
+                        self.current_resource_counts[feature] -= 1
+        return task
 
     def set_task_complete(self, task_id, ret):
-        if task_id in self.current_tasks:
-            task = self.current_tasks.get(task_id)
-            del self.current_tasks[task_id]
+        task = self._release_task(task_id)
+        if task is not None:
             if not ret:
                 self.task_name_to_queue[task['task']].failed(task['data'])
             else:
                 self.task_name_to_queue[task['task']].finished(task['data'])
 
-            for feature in task['features']:
-                if feature in self.current_resource_counts:
-                    with self._lock:
-                        self.current_resource_counts[feature] -= 1
+    def get_lease(self, has_resources, has_tasks, service_id, max_tasks, max_bytes=None):
+        """Lease a batch of tasks to a handler. The tasks are picked as `get_task` would pick them one after the other,
+        until there are `max_tasks` of them or their sizes add up to `max_bytes`, so the last task may go over the
+        byte budget. The lease is kept alive with `heartbeat_lease` and the results reported with `complete_lease`.
+        The tasks of a lease whose heartbeat is older than `lease_timeout` seconds are treated as lost.
+
+        :param list[str] has_resources: Features supported by the handler
+        :param list[str] has_tasks: Names of the tasks the handler runs
+        :param service_id: ID of the handler's service
+        :param int max_tasks: Maximum number of tasks in the batch
+        :param int max_bytes: Byte budget for the batch, `None` for no budget
+        :return: Dictionary with the `lease_id` and the `tasks` (as returned by `get_task`), or `None` if there is no
+            task to run
+        """
+        self.expire_leases()
+        tasks = []
+        total_bytes = 0
+        while len(tasks) < max_tasks and (max_bytes is None or total_bytes < max_bytes):
+            task_data = self.get_task(has_resources, has_tasks, None, service_id, None)
+            if task_data is None:
+                break
+            tasks.append(task_data)
+            total_bytes += task_size(task_data['data'])
+        if not tasks:
+            return None
+        now = datetime.datetime.now()
+        with self._lock:
+            self.on_lease += 1
+            lease_id = f'{self.task_prefix}L{self.on_lease}'
+            self.leases[lease_id] = {'service': service_id, 'task_ids': {task_data['task_id'] for task_data in tasks},
+                                     'created': now, 'heartbeat': now}
+        for task_data in tasks:
+            task_data['lease_id'] = lease_id
+        return {'lease_id': lease_id, 'tasks': tasks, 'bytes': total_bytes, 'service': service_id,
+                'division': self.division_name}
+
+    def heartbeat_lease(self, lease_id):
+        """Keep a lease alive.
+
+        :param str lease_id: ID of the lease
+        :return: Whether the lease is still held (`False` once it has expired or completed)
+        """
+        lease = self.leases.get(lease_id)
+        if lease is None:
+            return False
+        lease['heartbeat'] = datetime.datetime.now()
+        return True
+
+    def complete_lease(self, lease_id, results, requeue=[]):
+        """Report the results of the tasks of a lease. The lease is closed once every task in it was reported.
+
+        :param str lease_id: ID of the lease
+        :param dict results: Task ID -> value returned by the task
+        :param list[str] requeue: IDs of the tasks that were not run and go back into their queue
+        """
+        for task_id, ret in results.items():
+            self.set_task_complete(task_id, ret)
+        for task_id in requeue:
+            task = self._release_task(task_id)
+            if task is not None:
+                queue = self.task_name_to_queue[task['task']]
+                queue.lost(task['data'])
+                queue.add(task['data'], task['features'], add_default_features=False)
+        lease = self.leases.get(lease_id)
+        if lease is not None:
+            with self._lock:
+                lease['task_ids'].difference_update(results, requeue)
+                if not lease['task_ids']:
+                    self.leases.pop(lease_id, None)
+
+    def expire_leases(self):
+        """Treat the tasks still outstanding in leases without a heartbeat for `lease_timeout` seconds as lost.
+        """
+        now = datetime.datetime.now()
+        for lease_id, lease in list(self.leases.items()):
+            if (now - lease['heartbeat']).total_seconds() >= self.lease_timeout:
+                with self._lock:
+                    self.leases.pop(lease_id, None)
+                for task_id in lease['task_ids']:
+                    task = self._release_task(task_id)
+                    if task is not None:
+                        self.task_name_to_queue[task['task']].lost(task['data'])
 
     def get_task(self, has_resources, has_tasks, previous_task, service_id, ret):
         if previous_task is not None:
@@ -0,0 +1,65 @@
+import concurrent.futures
+import hashlib
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+import checksum
+from parameterized import parameterized
+
+
+class TestChecksum(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def _write(self, file_name, data):
+        file_path = os.path.join(self.temp_dir.name, file_name)
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        return file_path
+
+    @parameterized.expand([
+        ('empty', b''),
+        ('smaller_than_buffer', os.urandom(1000)),
+        ('several_buffers', os.urandom(5 * 4096 + 123)),
+    ])
+    def test_copy_md5(self, _description, data):
+        from_file = self._write('from.bin', data)
+        to_file = os.path.join(self.temp_dir.name, 'to.bin')
+
+        self.assertEqual(checksum.copy_md5(from_file, to_file, buffer_size=4096),
+                         (len(data), hashlib.md5(data).hexdigest()))
+        with open(to_file, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_copy_md5_missing_file(self):
+        with self.assertRaises(OSError):
+            checksum.copy_md5(os.path.join(self.temp_dir.name, 'missing'), os.path.join(self.temp_dir.name, 'to'))
+
+    def test_md5_file(self):
+        data = os.urandom(3 * 4096 + 1)
+
+        self.assertEqual(checksum.md5_file(self._write('file.bin', data), buffer_size=4096),
+                         hashlib.md5(data).hexdigest())
+
+    @parameterized.expand([
+        ('one_worker', 1, None),
+        ('workers', 3, None),
+        ('executor', 1, concurrent.futures.ThreadPoolExecutor(max_workers=2)),
+    ])
+    def test_md5_files(self, _description, workers, executor):
+        data = [os.urandom(4096 * i + i) for i in range(5)]
+        file_paths = [self._write(f'file_{i}.bin', d) for i, d in enumerate(data)]
+
+        md5s = checksum.md5_files(file_paths + file_paths[:1], workers=workers, buffer_size=4096, executor=executor)
+
+        self.assertEqual({file_path: future.result() for file_path, future in md5s.items()},
+                         {file_path: hashlib.md5(d).hexdigest() for file_path, d in zip(file_paths, data)})
+
+    def test_md5_files_missing_file(self):
+        md5s = checksum.md5_files([os.path.join(self.temp_dir.name, 'missing')])
+
+        with self.assertRaises(OSError):
+            md5s[os.path.join(self.temp_dir.name, 'missing')].result()
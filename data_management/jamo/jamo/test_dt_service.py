@@ -1,7 +1,12 @@
 import datetime
+import io
 import os
 import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
+import time
 import unittest
 import dt_service
 import sdm_curl
@@ -30,9 +35,7 @@ class TestDTService(unittest.TestCase):
         self.hsi_status = Mock()
         hsi_status_mock.return_value = self.hsi_status
         self.curl_get.side_effect = [
-            {'division': {
-                'jgi': {'default_backup_service': 1,
-                        'tape_temp_dir': '/path/to/temp'}}},
+            {'division': [{'name': 'jgi', 'default_backup_service': 1, 'tape_temp_dir': '/path/to/temp'}]},
             {
                 "file_status": {
                     "1": "REGISTERED",
@@ -220,6 +223,110 @@ class TestDTService(unittest.TestCase):
                       self.curl_put.mock_calls)
         self.assertEqual(thread_count.value, 1)
 
+    def test_DTService_runner_leases(self):
+        def func(data):
+            if data.get('lost'):
+                raise dt_service.ResourceLostException('hsi_1', 1, True)
+            return data.get('name')
+
+        stop = Mock()
+        stop.value = 0
+        thread_count = MagicMock()
+        thread_count.value = 1
+        self.dt_service.max_tasks = 10
+        self.dt_service.max_bytes = 1000
+        self.curl_post.side_effect = [
+            {'lease_id': 'L1', 'tasks': [{'task_id': 'T1', 'task': 'my_task', 'data': {'name': 'foo'}},
+                                         {'task_id': 'T2', 'task': 'my_task', 'data': {'name': 'bar'}}]},
+            {'lease_id': 'L2', 'tasks': [{'task_id': 'T3', 'task': 'my_task', 'data': {'name': 'baz'}},
+                                         {'task_id': 'T4', 'task': 'my_task', 'data': {'lost': True}},
+                                         {'task_id': None, 'task': 'my_task', 'data': {'name': 'pull'}}]},
+        ]
+        self.dt_service.task_runners['my_task'] = func
+
+        self.dt_service.runner(stop, thread_count)
+
+        self.assertEqual(self.curl_post.mock_calls[1],
+                         call('api/tape/nexttask', features=['dna_w'], tasks=['copy'], max_tasks=10, max_bytes=1000,
+                              lease_id='L1', results={'T1': 'foo', 'T2': 'bar'}, requeue=[], service='my_service',
+                              division='jgi'))
+        self.assertIn(call('api/tape/task', task={'task_id': None, 'task': 'my_task', 'data': {'name': 'pull'}}),
+                      self.curl_put.mock_calls)
+        self.assertIn(call('api/tape/leasecomplete', lease_id='L2', results={'T3': 'baz'}, requeue=['T4'],
+                           division='jgi'), self.curl_put.mock_calls)
+        self.assertEqual(len(self.curl_post.mock_calls), 2)
+        self.assertEqual(stop.value, 0)
+        self.assertEqual(thread_count.value, 1)
+
+    @parameterized.expand([
+        ('active', True, {'T1': True, 'T2': True, 'T3': True}, 'L1'),
+        ('lost', False, {}, None),
+    ])
+    def test_DTService_run_leases_heartbeat(self, _description, active, expected_results, expected_lease_id):
+        heartbeat = threading.Event()
+
+        def put(url, **kwargs):
+            if url == 'api/tape/leaseheartbeat':
+                heartbeat.set()
+                return {'lease_id': kwargs.get('lease_id'), 'active': active}
+
+        def task(data):
+            ran.append(data.get('name'))
+            if data.get('name') == 'T1':
+                # Long enough for the heartbeat to be sent and its answer to be handled
+                heartbeat.wait(5)
+                time.sleep(0.1)
+            return True
+
+        ran = []
+        stop = Mock()
+        stop.value = 0
+        self.curl_put.side_effect = put
+        self.dt_service.LEASE_HEARTBEAT_INTERVAL = 0.01
+        self.dt_service.max_tasks = 10
+        self.curl_post.side_effect = [
+            {'lease_id': 'L1', 'tasks': [{'task_id': f'T{i}', 'task': 'my_task', 'data': {'name': f'T{i}'}}
+                                         for i in (1, 2, 3)]},
+            None,
+        ]
+        self.dt_service.task_runners['my_task'] = task
+
+        self.dt_service.run_leases(stop, 1)
+
+        self.assertIn(call('api/tape/leaseheartbeat', lease_id='L1', division='jgi'), self.curl_put.mock_calls)
+        self.assertEqual(ran, ['T1', 'T2', 'T3'] if active else ['T1'])
+        self.assertEqual(self.curl_post.mock_calls[1].kwargs.get('lease_id'), expected_lease_id)
+        self.assertEqual(self.curl_post.mock_calls[1].kwargs.get('results'), expected_results)
+        self.assertEqual(self.curl_post.mock_calls[1].kwargs.get('requeue'), [])
+
+    @patch('dt_service.checksum')
+    def test_DTService_run_leases_hash_workers(self, checksum_mock):
+        futures = {'/path/to/foo': Mock(), '/path/to/bar': Mock()}
+        futures['/path/to/foo'].result.return_value = 'FOO'
+        futures['/path/to/bar'].result.return_value = 'BAR'
+        checksum_mock.md5_files.return_value = dict(futures)
+        stop = Mock()
+        stop.value = 0
+        self.dt_service.max_tasks = 10
+        self.dt_service.hash_workers = 4
+        self.curl_post.side_effect = [
+            {'lease_id': 'L1', 'tasks': [{'task_id': 'T1', 'task': 'md5',
+                                          'data': {'file_path': '/path/to/foo', 'md5_queue_id': 1}},
+                                         {'task_id': 'T2', 'task': 'my_task', 'data': {}},
+                                         {'task_id': 'T3', 'task': 'md5',
+                                          'data': {'file_path': '/path/to/bar', 'md5_queue_id': 2}}]},
+            None,
+        ]
+        self.dt_service.task_runners['my_task'] = lambda data: True
+
+        self.dt_service.run_leases(stop, 1)
+
+        checksum_mock.md5_files.assert_called_once_with(['/path/to/foo', '/path/to/bar'], 4)
+        checksum_mock.md5_file.assert_not_called()
+        self._assertAllIn([call('api/tape/md5/1', {'md5sum': 'FOO', 'queue_status_id': 3}),
+                           call('api/tape/md5/2', {'md5sum': 'BAR', 'queue_status_id': 3})], self.curl_put)
+        self.assertEqual(self.dt_service.pending_md5, {})
+
     def test_DTService_stop_threads(self):
         self.dt_service.stop_threads()
 
@@ -239,6 +346,7 @@ class TestDTService(unittest.TestCase):
          [{2: 'my_service', 'server': 'my_server', 'type': 'HPSS'}],
          [],
          [{}],
+         [],
          {'service': 2, 'records': [{'file_path': '/path/to/', 'file_name': 'my_file.txt',
                                      'backup_record_id': 123, }]},
          False,
@@ -253,7 +361,8 @@ class TestDTService(unittest.TestCase):
          [{2: 'my_service', 'server': 'my_server', 'default_path': '/path/to/service',
            'type': 'HPSS'}, {'file_id': 456, 'file_status_id': 8}],
          [],
-         [{}, subprocess.CompletedProcess('cmd', 0, stdout=b'999 /path/to/temp/my_file.txt')],
+         [{}],
+         ['999 /path/to/temp/my_file.txt'],
          {'service': 2, 'records': [{'file_path': '/path/to/temp', 'file_name': 'my_file.txt',
                                      'backup_record_id': 123, 'file_id': 456}]},
          True,
@@ -275,6 +384,7 @@ class TestDTService(unittest.TestCase):
           {'file_id': 456, 'file_status_id': 8}],
          [],
          [subprocess.CalledProcessError(1, 'cmd')],
+         [],
          {'service': 2, 'records': [{'file_path': '/path/to/temp', 'file_name': 'my_file.txt',
                                      'backup_record_id': 123, 'file_id': 456}]},
          False,
@@ -291,7 +401,8 @@ class TestDTService(unittest.TestCase):
            'type': 'HPSS'},
           {'file_id': 456, 'file_status_id': 8}],
          [],
-         [{}, subprocess.CompletedProcess('cmd', 0, stdout=b'1000 /path/to/temp/my_file.txt')],
+         [{}],
+         ['1000 /path/to/temp/my_file.txt'],
          {'service': 2, 'records': [{'file_path': '/path/to/temp', 'file_name': 'my_file.txt',
                                      'backup_record_id': 123, 'file_id': 456}]},
          False,
@@ -306,7 +417,8 @@ class TestDTService(unittest.TestCase):
          [FileNotFoundError(), SimpleNamespace(**{'st_size': 999})],
          [{2: 'my_service', 'server': 'my_server', 'type': 'HPSS', 'default_path': '/path/to/default'}],
          [{'tar_record_id': 111}],
-         [{}, subprocess.CompletedProcess('cmd', 0, stdout=b'999 /path/to/temp/my_file_2.txt')],
+         [{}],
+         ['999 /path/to/temp/my_file_2.txt'],
          {'service': 2, 'root_dir': '/path/to/root',
           'records': [{'file_path': '/path/to/', 'file_name': 'my_file.txt',
                        'backup_record_id': 123, 'file_id': 456},
@@ -319,9 +431,10 @@ class TestDTService(unittest.TestCase):
           call('api/tape/backuprecords', records=[
               {'backup_record_status_id': 4, 'remote_file_path': '.', 'tar_record_id': 111,
                'backup_record_id': 321,
-               'remote_file_name': 'my_file_2.txtAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA.321'}])],
+               'remote_file_name': 'my_file_2.txtAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA.321',
+               'tar_size': 999, 'tar_offset': 512}])],
          [call.run(
-             'cd /path/to/temp/111_tar; htar -P -h -H server=my_server -cf /path/to/default_2022/000/000/111.tar -T 10 .',
+             'cd /path/to/temp/111_tar; htar -P -h -H server=my_server -cf /path/to/default_2022/000/000/111.tar -T 10 -L /path/to/temp/111_tar.list',
              shell=True, check=True)],
          [call.rmtree('/path/to/temp/111_tar')],
          [call.makedirs('/path/to/temp/111_tar'), call.unlink('/path/to/temp/111_tar/my_file_2.txtAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA.321'),
@@ -333,6 +446,7 @@ class TestDTService(unittest.TestCase):
          [{2: 'my_service', 'server': 'my_server', 'type': 'HPSS', 'default_path': '/path/to/default'}],
          [{'tar_record_id': 111}],
          [subprocess.CalledProcessError(1, 'cmd')],
+         [],
          {'service': 2, 'root_dir': '/path/to/root',
           'records': [{'file_path': '/path/to/', 'file_name': 'my_file.txt',
                        'backup_record_id': 123, 'file_id': 456},
@@ -347,7 +461,7 @@ class TestDTService(unittest.TestCase):
           call('api/tape/backuprecords', records=[{'backup_record_id': 321, 'backup_record_status_id': 5},
                                                   {'backup_record_id': 987, 'backup_record_status_id': 5}])],
          [call.run(
-             'cd /path/to/temp/111_tar; htar -P -h -H server=my_server -cf /path/to/default_2022/000/000/111.tar -T 10 .',
+             'cd /path/to/temp/111_tar; htar -P -h -H server=my_server -cf /path/to/default_2022/000/000/111.tar -T 10 -L /path/to/temp/111_tar.list',
              shell=True, check=True)],
          [],
          [call.makedirs('/path/to/temp/111_tar'), call.unlink(
@@ -361,7 +475,8 @@ class TestDTService(unittest.TestCase):
          [FileNotFoundError(), SimpleNamespace(**{'st_size': 999}), SimpleNamespace(**{'st_size': 888})],
          [{2: 'my_service', 'server': 'my_server', 'type': 'HPSS', 'default_path': '/path/to/default'}],
          [{'tar_record_id': 111}],
-         [{}, subprocess.CompletedProcess('cmd', 0, stdout=b'1000 /path/to/default_2022/000/000/111.tar')],
+         [{}],
+         ['1000 /path/to/default_2022/000/000/111.tar'],
          {'service': 2, 'root_dir': '/path/to/root',
           'records': [{'file_path': '/path/to/', 'file_name': 'my_file.txt',
                        'backup_record_id': 123, 'file_id': 456},
@@ -376,7 +491,7 @@ class TestDTService(unittest.TestCase):
           call('api/tape/backuprecords', records=[{'backup_record_id': 321, 'backup_record_status_id': 5},
                                                   {'backup_record_id': 987, 'backup_record_status_id': 5}])],
          [call.run(
-             'cd /path/to/temp/111_tar; htar -P -h -H server=my_server -cf /path/to/default_2022/000/000/111.tar -T 10 .',
+             'cd /path/to/temp/111_tar; htar -P -h -H server=my_server -cf /path/to/default_2022/000/000/111.tar -T 10 -L /path/to/temp/111_tar.list',
              shell=True, check=True)],
          [],
          [call.makedirs('/path/to/temp/111_tar'), call.unlink(
@@ -392,6 +507,7 @@ class TestDTService(unittest.TestCase):
            'default_path': '/path/to/default'}],
          [{'tar_record_id': 111}],
          [{}],
+         [],
          {'service': 2, 'backup_record_id': 123},
          True,
          [call('api/tape/backuprecord/123', data={'backup_record_status_id': 5})],
@@ -400,14 +516,15 @@ class TestDTService(unittest.TestCase):
          [],
          ),
     ])
+    @patch('builtins.open', new_callable=mock_open)
     @patch('dt_service.datetime')
     @patch('dt_service.os')
     @patch('dt_service.subprocess')
     @patch('dt_service.shutil')
     def test_DTService_run_put(self, _description, path_exists_responses, os_stat_responses, curl_get_responses, curl_post_responses,
-                               subprocess_run_responses, in_file, expected, expected_curl_put_calls,
+                               subprocess_run_responses, hsi_outputs, in_file, expected, expected_curl_put_calls,
                                expected_subprocess_calls, expected_shutil_calls, expected_os_calls,
-                               shutil_mock, subprocess_mock, os_mock, datetime_mock):
+                               shutil_mock, subprocess_mock, os_mock, datetime_mock, open_mock):
         self.curl_get.side_effect = curl_get_responses
         self.curl_post.side_effect = curl_post_responses
         self.hsi_status.isup.return_value = True
@@ -417,6 +534,8 @@ class TestDTService(unittest.TestCase):
         os_mock.path.split = os.path.split
         subprocess_mock.run.side_effect = subprocess_run_responses
         subprocess_mock.CalledProcessError = subprocess.CalledProcessError
+        self.dt_service.hsi_pool = Mock()
+        self.dt_service.hsi_pool.check_output.side_effect = hsi_outputs
         datetime_mock.datetime.today.return_value = datetime.datetime(2022, 2, 2)
 
         self.assertEqual(self.dt_service.run_put(in_file), expected)
@@ -526,14 +645,14 @@ class TestDTService(unittest.TestCase):
         ('success_cleanup', True, '/path/to/temp', [call.remove('/path/to/temp/my_file.txt')]),
         ('failure', False, '/path/to/local', []),
     ])
+    @patch('dt_service.file_copy')
     @patch('dt_service.os')
-    @patch('dt_service.shutil')
-    def test_DTService_run_copy_local(self, _description, success, origin_file_path, expected_os_calls, shutil_mock,
-                                      os_mock):
+    def test_DTService_run_copy_local(self, _description, success, origin_file_path, expected_os_calls, os_mock,
+                                      file_copy_mock):
         os_mock.path.join = os.path.join
         os_mock.path.exists.return_value = False
-        os_mock.path.getsize.return_value = 2000
-        shutil_mock.copyfile.side_effect = [''] if success else [Exception('Error')]
+        result = Mock(size=2000, md5sum='MD5SUM')
+        file_copy_mock.copy_file.side_effect = [result] if success else [Exception('Error')]
         self.dt_service.remote_sources = {
             'foo': {
                 'rsync_uri': 'rsync://user@rsync_uri/dm_archive',
@@ -553,18 +672,15 @@ class TestDTService(unittest.TestCase):
                              call.rename('/path/to/destination/.my_file_copy.txt', '/path/to/destination/my_file_copy.txt'),
                              call.chmod('/path/to/destination/my_file_copy.txt', 0o640)]
             curl_put_mock_calls = [call('api/tape/file/123', data={'file_size': 2000}),
-                                   call('api/tape/file/123', data={'file_status_id': 4})]
-            shutil_mock_calls = [
-                call.copyfile(f'{origin_file_path}/my_file.txt', '/path/to/destination/.my_file_copy.txt'),
-                call.copystat(f'{origin_file_path}/my_file.txt', '/path/to/destination/my_file_copy.txt')]
+                                   call('api/tape/file/123', data={'file_status_id': 4, 'md5sum': 'MD5SUM'})]
         else:
             os_mock_calls = [call.path.exists('/path/to/destination'),
                              call.makedirs('/path/to/destination', 0o751)]
             curl_put_mock_calls = [call('api/tape/file/123', data={'file_status_id': 5})]
-            shutil_mock_calls = [call.copyfile('/path/to/local/my_file.txt', '/path/to/destination/.my_file_copy.txt')]
         self._assertAllIn(os_mock_calls, os_mock)
         self._assertAllIn(curl_put_mock_calls, self.curl_put)
-        self._assertAllIn(shutil_mock_calls, shutil_mock)
+        file_copy_mock.copy_file.assert_called_with(f'{origin_file_path}/my_file.txt',
+                                                    '/path/to/destination/.my_file_copy.txt', md5=True, copy_stat=True)
         self._assertAllIn(expected_os_calls, os_mock)
 
     @parameterized.expand([
@@ -609,28 +725,36 @@ class TestDTService(unittest.TestCase):
     @parameterized.expand([
         ('success',
          {'file_path': '/path/to/my_file.txt', 'md5_queue_id': 123},
-         [{}],
+         ['MD5SUM'],
          True,
          call('api/tape/md5/123', {'md5sum': 'MD5SUM', 'queue_status_id': 3}),
          ),
         ('failure',
          {'file_path': '/path/to/my_file.txt', 'md5_queue_id': 123},
-         [subprocess.CalledProcessError(2, 'cmd'), {}],
+         [OSError(2, 'No such file or directory')],
          False,
          call('api/tape/md5/123', data={'queue_status_id': 4})
          ),
     ])
-    @patch('dt_service.subprocess')
-    def test_DTService_run_md5(self, _description, in_file, curl_put_responses, expected, expected_curl_put_call,
-                               subprocess_mock):
-        subprocess_mock.CalledProcessError = subprocess.CalledProcessError
-        subprocess_run_return_value = Mock()
-        subprocess_run_return_value.stdout = b'MD5SUM'
-        subprocess_mock.run.return_value = subprocess_run_return_value
-        self.curl_put.side_effect = curl_put_responses
+    @patch('dt_service.checksum')
+    def test_DTService_run_md5(self, _description, in_file, md5_file_responses, expected, expected_curl_put_call,
+                               checksum_mock):
+        checksum_mock.md5_file.side_effect = md5_file_responses
 
         self.assertEqual(self.dt_service.run_md5(in_file), expected)
         self.assertIn(expected_curl_put_call, self.curl_put.mock_calls)
+        checksum_mock.md5_file.assert_called_with('/path/to/my_file.txt')
+
+    @patch('dt_service.checksum')
+    def test_DTService_run_md5_pending(self, checksum_mock):
+        pending = Mock()
+        pending.result.return_value = 'MD5SUM'
+        self.dt_service.pending_md5 = {'/path/to/my_file.txt': pending}
+
+        self.assertEqual(self.dt_service.run_md5({'file_path': '/path/to/my_file.txt', 'md5_queue_id': 123}), True)
+        self.assertIn(call('api/tape/md5/123', {'md5sum': 'MD5SUM', 'queue_status_id': 3}), self.curl_put.mock_calls)
+        checksum_mock.md5_file.assert_not_called()
+        self.assertEqual(self.dt_service.pending_md5, {})
 
     @parameterized.expand([
         ('success',
@@ -653,14 +777,15 @@ class TestDTService(unittest.TestCase):
            'service': 1,
            'tar_record_id': 1000}],
          True,
-         b'FILE\t/path/to/remote/1000.tar\t51320295424\t51320295424\t427+1351567309546\tAU297200,AU297300\t12\t0\t1\t04/27/2013\t15:19:08\t09/12/2013\t10:04:51\nA:/home/f/foobar-> FILE\t/path/to/remote/my_file_2.gz\t41454833152\t41454833152\t5711+0\tAG457000\t5\t0\t1\t04/27/2013\t15:03:04\t09/12/2013\t10:04:3',
+         'FILE\t/path/to/remote/1000.tar\t51320295424\t51320295424\t427+1351567309546\tAU297200,AU297300\t12\t0\t1\t04/27/2013\t15:19:08\t09/12/2013\t10:04:51\nA:/home/f/foobar-> FILE\t/path/to/remote/my_file_2.gz\t41454833152\t41454833152\t5711+0\tAG457000\t5\t0\t1\t04/27/2013\t15:03:04\t09/12/2013\t10:04:3',
          True,
-         [call('api/tape/pull/1', volume='AU2972', position_a='427', position_b='1351567309546',
-               queue_status_id=1),
-          call('api/tape/pull/2', volume='AG4570', position_a='5711', position_b='0',
-               queue_status_id=1),
-          call('api/tape/pull/3', volume='AU2972', position_a='427', position_b='1351567309546',
-               queue_status_id=1)]),
+         [call('api/tape/pulls', pulls=[
+             {'pull_queue_id': 1, 'volume': 'AU2972', 'position_a': 427, 'position_b': 1351567309546,
+              'queue_status_id': 1},
+             {'pull_queue_id': 3, 'volume': 'AU2972', 'position_a': 427, 'position_b': 1351567309546,
+              'queue_status_id': 1},
+             {'pull_queue_id': 2, 'volume': 'AG4570', 'position_a': 5711, 'position_b': 0,
+              'queue_status_id': 1}])]),
         ('hsi_down',
          [{'pull_queue_id': 1,
            'remote_file_name': 'my_file_1.tar',
@@ -683,8 +808,9 @@ class TestDTService(unittest.TestCase):
          False,
          None,
          False,
-         [call('api/tape/pull/1', queue_status_id=1), call('api/tape/pull/2', queue_status_id=1),
-          call('api/tape/pull/3', queue_status_id=1)]),
+         [call('api/tape/pulls', pulls=[{'pull_queue_id': 1, 'queue_status_id': 1},
+                                        {'pull_queue_id': 2, 'queue_status_id': 1},
+                                        {'pull_queue_id': 3, 'queue_status_id': 1}])]),
         ('some_files_not_found_on_tape',
          [{'pull_queue_id': 1,
            'remote_file_name': 'my_file_1.tar',
@@ -699,10 +825,11 @@ class TestDTService(unittest.TestCase):
            'service': 1,
            'tar_record_id': None}],
          True,
-         b'FILE\t/path/to/remote/1000.tar\t51320295424\t51320295424\t427+1351567309546\tAU297200,AU297300\t12\t0\t1\t04/27/2013\t15:19:08\t09/12/2013\t10:04:51A:/home/e/edlee-> *** ls: No such file or directory [-2: HPSS_ENOENT]\n    /path/to/remote/my_file_2.gz',
+         'FILE\t/path/to/remote/1000.tar\t51320295424\t51320295424\t427+1351567309546\tAU297200,AU297300\t12\t0\t1\t04/27/2013\t15:19:08\t09/12/2013\t10:04:51A:/home/e/edlee-> *** ls: No such file or directory [-2: HPSS_ENOENT]\n    /path/to/remote/my_file_2.gz',
          False,
-         [call('api/tape/pull/1', volume='AU2972', position_a='427', position_b='1351567309546', queue_status_id=1),
-          call('api/tape/pull/2', queue_status_id=6)]),
+         [call('api/tape/pulls', pulls=[{'pull_queue_id': 1, 'volume': 'AU2972', 'position_a': 427,
+                                         'position_b': 1351567309546, 'queue_status_id': 1}]),
+          call('api/tape/pulls', pulls=[{'pull_queue_id': 2, 'queue_status_id': 6}])]),
         ('subprocess_call_failed',
          [{'pull_queue_id': 1,
            'remote_file_name': 'my_file_1.tar',
@@ -723,17 +850,17 @@ class TestDTService(unittest.TestCase):
            'service': 1,
            'tar_record_id': 1000}],
          True,
-         b'',
+         '',
          False,
-         [call('api/tape/pull/1', queue_status_id=6), call('api/tape/pull/2', queue_status_id=6),
-          call('api/tape/pull/3', queue_status_id=6)]),
+         [call('api/tape/pulls', pulls=[{'pull_queue_id': 1, 'queue_status_id': 6},
+                                        {'pull_queue_id': 3, 'queue_status_id': 6},
+                                        {'pull_queue_id': 2, 'queue_status_id': 6}])]),
     ])
-    @patch('dt_service.subprocess')
-    @patch('dt_service.time')
-    def test_DTService_run_prep_batch(self, _description, records, hsi_is_up, subprocess_return_value, expected,
-                                      expected_curl_put_calls, time_mock, subprocess_mock):
+    def test_DTService_run_prep_batch(self, _description, records, hsi_is_up, hsi_output, expected,
+                                      expected_curl_put_calls):
         self.hsi_status.isup.return_value = hsi_is_up
-        subprocess_mock.run.return_value = SimpleNamespace(stdout=subprocess_return_value)
+        self.dt_service.hsi_pool = Mock()
+        self.dt_service.hsi_pool.run.return_value = [hsi_output]
 
         self.assertEqual(self.dt_service.run_prep_batch(records), expected)
 
@@ -756,49 +883,80 @@ class TestDTService(unittest.TestCase):
            'position_a': 500, 'position_b': 600, 'pull_queue_id': 333},
           ],
          [{2: 'my_service', 'server': 'some_server'}],
-         [{}],
+         [{}, {}],
          False,
          1,
-         [call('api/tape/pull/111', queue_status_id=3),
-          call('api/tape/pull/2', queue_status_id=4),
-          call('api/tape/pull/333', queue_status_id=3),
+         [call('api/tape/pulls', pulls=[{'pull_queue_id': 111, 'queue_status_id': 3},
+                                        {'pull_queue_id': 2, 'queue_status_id': 4},
+                                        {'pull_queue_id': 333, 'queue_status_id': 3}]),
           call('api/tape/releaselockedvolume/jgi/my_volume')],
          [call.makedirs('/path/to/temp/tape_my_volume_20220202_000000'),
           call.makedirs('/path/to', 489),
           call.rename('/path/to/.my_file.txt', '/path/to/my_file.txt'),
+          call.remove('/path/to/.my_file_2.txt'),
           call.rename('/path/to/.my_file_3.txt', '/path/to/my_file_3.txt')],
-         [call.copy2('/path/to/temp/tape_my_volume_20220202_000000/path/to/remote/my_file.txt',
-                     '/path/to/.my_file.txt'),
-          call.copy2('/path/to/temp/tape_my_volume_20220202_000000/path/to/remote/my_file_2.txt',
-                     '/path/to/.my_file_2.txt'),
+         [call.copy_file('/path/to/temp/tape_my_volume_20220202_000000/path/to/remote/my_file.txt',
+                         '/path/to/.my_file.txt', disposable=True, copy_stat=True),
+          call.copy_file('/path/to/temp/tape_my_volume_20220202_000000/path/to/remote/my_file_2.txt',
+                         '/path/to/.my_file_2.txt', disposable=True, copy_stat=True),
           call.rmtree('/path/to/temp/tape_my_volume_20220202_000000')],
-         [call().write('get /path/to/temp/tape_my_volume_20220202_000000/remote : /path/to/remote\n'),
-          call().write('get /path/to/.my_file_3.txt : /path/to/remote/my_file_3.txt\n')],
+         [call().write('get /path/to/.my_file_3.txt : /path/to/remote/my_file_3.txt\n'),
+          call().write('/path/to/remote/my_file.txt\n'),
+          call().write('/path/to/remote/my_file_2.txt\n')],
+         [call.run(['hsi', '-h', 'some_server', 'in my_volume.cmd'], timeout=10800, check=True),
+          call.run(['htar', '-x', '-H', 'server=some_server', '-f', '/path/to/remote', '-L',
+                    '/path/to/temp/tape_my_volume_20220202_000000/remote.members'], timeout=10800, check=True)],
          ),
         ('pull_cmd_failure',
          [{'service': 2, 'volume': 'my_volume', 'file_path': '/path/to', 'file_name': 'my_file.txt',
-           'tar_record_id': 123, 'remote_path': '/path/to/remote',
+           'tar_record_id': None, 'remote_path': '/path/to/remote',
            'remote_file_path': '/path/to/remote', 'remote_file_name': 'my_file.txt',
            'position_a': 100, 'position_b': 200, 'pull_queue_id': 111}],
          [{2: 'my_service', 'server': 'some_server'}],
          [Exception('Error')],
          False,
          0,
-         [call('api/tape/pull/111', queue_status_id=4), call('api/tape/releaselockedvolume/jgi/my_volume')],
+         [call('api/tape/pulls', pulls=[{'pull_queue_id': 111, 'queue_status_id': 4}]),
+          call('api/tape/releaselockedvolume/jgi/my_volume')],
          [call.makedirs('/path/to/temp/tape_my_volume_20220202_000000'), call.makedirs('/path/to', 489)],
          [call.rmtree('/path/to/temp/tape_my_volume_20220202_000000')],
-         [call().write('get /path/to/temp/tape_my_volume_20220202_000000/remote : /path/to/remote\n')],
+         [call().write('get /path/to/.my_file.txt : /path/to/remote/my_file.txt\n')],
+         [call.run(['hsi', '-h', 'some_server', 'in my_volume.cmd'], timeout=10800, check=True)],
+         ),
+        ('pull_tar_member_htar_failure_byte_range',
+         [{'service': 2, 'volume': 'my_volume', 'file_path': '/path/to', 'file_name': 'my_file.txt',
+           'tar_record_id': 123, 'remote_path': '/path/to/remote/123.tar',
+           'remote_file_path': '.', 'remote_file_name': 'my_file.txt.111',
+           'tar_offset': 512, 'tar_size': 10,
+           'position_a': 100, 'position_b': 200, 'pull_queue_id': 111}],
+         [{2: 'my_service', 'server': 'some_server'}],
+         [Exception('Error'), {}],
+         False,
+         1,
+         [call('api/tape/pulls', pulls=[{'pull_queue_id': 111, 'queue_status_id': 3}]),
+          call('api/tape/releaselockedvolume/jgi/my_volume')],
+         [call.makedirs('/path/to/temp/tape_my_volume_20220202_000000'), call.makedirs('/path/to', 489),
+          call.remove('/path/to/temp/tape_my_volume_20220202_000000/123.tar'),
+          call.rename('/path/to/.my_file.txt', '/path/to/my_file.txt')],
+         [],
+         [call().write('./my_file.txt.111\n')],
+         [call.run(['htar', '-x', '-H', 'server=some_server', '-f', '/path/to/remote/123.tar', '-L',
+                    '/path/to/temp/tape_my_volume_20220202_000000/123.tar.members'], timeout=10800, check=True),
+          call.run(['hsi', '-h', 'some_server',
+                    'get /path/to/temp/tape_my_volume_20220202_000000/123.tar : /path/to/remote/123.tar'],
+                   timeout=10800, check=True)],
          ),
     ])
+    @patch('dt_service.file_copy')
     @patch('dt_service.shutil')
     @patch('dt_service.subprocess')
     @patch('builtins.open' if sys.version_info[0] >= 3 else '__builtin__.open', new_callable=mock_open)
     @patch('dt_service.datetime')
     @patch('dt_service.os')
     def test_DTService_run_pull(self, _description, files, curl_get_responses, subprocess_responses, path_exists,
-                                expected, expected_curl_put_calls, expected_os_calls, expected_shutil_calls,
-                                expected_file_write_calls, os_mock, datetime_mock, open_mock, subprocess_mock,
-                                shutil_mock):
+                                expected, expected_curl_put_calls, expected_os_calls, expected_copy_calls,
+                                expected_file_write_calls, expected_subprocess_calls, os_mock, datetime_mock,
+                                open_mock, subprocess_mock, shutil_mock, file_copy_mock):
         self.curl_get.side_effect = curl_get_responses
         self.hsi_status.isup.return_value = True
         os_mock.path.join = os.path.join
@@ -806,14 +964,118 @@ class TestDTService(unittest.TestCase):
         os_mock.path.exists.return_value = path_exists
         os_mock.path.basename = os.path.basename
         datetime_mock.datetime.now.return_value = datetime.datetime(2022, 2, 2)
-        shutil_mock.copy2.side_effect = [{}, Exception('Error'), {}]
+        file_copy_mock.copy_file.side_effect = [Mock(), Exception('Error'), Mock()]
         subprocess_mock.run.side_effect = subprocess_responses
 
-        self.assertEqual(self.dt_service.run_pull(files), expected)
+        with patch.object(self.dt_service, '_read_tar_member') as read_tar_member_mock:
+            self.assertEqual(self.dt_service.run_pull(files), expected)
         self._assertAllIn(expected_curl_put_calls, self.curl_put)
         self._assertAllIn(expected_os_calls, os_mock)
-        self._assertAllIn(expected_shutil_calls, shutil_mock)
-        self.assertIn(expected_file_write_calls, open_mock.mock_calls)
+        self._assertAllIn([c for c in expected_copy_calls if c[0] == 'copy_file'], file_copy_mock)
+        self._assertAllIn([c for c in expected_copy_calls if c[0] != 'copy_file'], shutil_mock)
+        self._assertAllIn(expected_file_write_calls, open_mock)
+        self._assertAllIn(expected_subprocess_calls, subprocess_mock)
+        if files[0].get('tar_offset') is not None:
+            read_tar_member_mock.assert_called_once_with(
+                '/path/to/temp/tape_my_volume_20220202_000000/123.tar', './my_file.txt.111', 512, 10,
+                '/path/to/.my_file.txt')
+
+    def test_DTService_tar_member_offsets_read_tar_member(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            members = []
+            for name, size in [('a.txt', 10), ('b' * 90 + '.txt', 600), ('c.txt', 0), ('d.txt', 512)]:
+                with open(os.path.join(temp_dir, name), 'wb') as f:
+                    f.write(os.urandom(size))
+                members.append((name, size))
+            tar_path = os.path.join(temp_dir, 'files.tar')
+            with tarfile.open(tar_path, 'w', format=tarfile.USTAR_FORMAT) as tar:
+                for name, _ in members:
+                    tar.add(os.path.join(temp_dir, name), arcname=name)
+
+            offsets = self.dt_service._tar_member_offsets(members)
+            with tarfile.open(tar_path) as tar:
+                self.assertEqual(offsets, [member.offset_data for member in tar.getmembers()])
+            for (name, size), offset in zip(members, offsets):
+                destination = os.path.join(temp_dir, 'restore', name)
+                self.assertTrue(self.dt_service._read_tar_member(tar_path, f'./{name}', offset, size, destination))
+                with open(destination, 'rb') as restored, open(os.path.join(temp_dir, name), 'rb') as original:
+                    self.assertEqual(restored.read(), original.read())
+            # The header in front of the offset has to be the member's
+            destination = os.path.join(temp_dir, 'restore', 'wrong')
+            self.assertFalse(self.dt_service._read_tar_member(tar_path, 'c.txt', offsets[0], 10, destination))
+            self.assertFalse(self.dt_service._read_tar_member(tar_path, 'a.txt', offsets[0], 11, destination))
+            self.assertFalse(self.dt_service._read_tar_member(tar_path, 'a.txt', offsets[0] + 512, 10, destination))
+            self.assertFalse(os.path.exists(destination))
+            os.truncate(tar_path, offsets[-1] + 10)
+            with self.assertRaises(EOFError):
+                self.dt_service._read_tar_member(tar_path, 'd.txt', offsets[-1], 512, destination)
+
+    def test_DTService_read_staged_tar(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            data = {'a.txt': os.urandom(10), 'b.txt': os.urandom(2000)}
+            tar_path = os.path.join(temp_dir, 'files.tar')
+            with tarfile.open(tar_path, 'w') as tar:
+                for name, content in data.items():
+                    info = tarfile.TarInfo(f'path/to/remote/{name}')
+                    info.size = len(content)
+                    info.mode = 0o640
+                    info.mtime = 1669155154
+                    tar.addfile(info, io.BytesIO(content))
+            members = [(f'/path/to/remote/{name}', {'restore_path': os.path.join(temp_dir, f'.{name}')})
+                       for name in data]
+            # The offset of b.txt is right, the one of a.txt points at b.txt so it is read with `tarfile`
+            members[0][1].update({'tar_offset': 1536, 'tar_size': 10})
+            members[1][1].update({'tar_offset': 1536, 'tar_size': 2000})
+            missing = ('/path/to/remote/c.txt', {'restore_path': os.path.join(temp_dir, '.c.txt')})
+
+            # A member that fails doesn't stop the ones after it
+            self.dt_service._read_staged_tar(tar_path, [missing] + members)
+
+            for (_, in_file), content in zip(members, data.values()):
+                self.assertTrue(in_file.get('extracted'))
+                with open(in_file.get('restore_path'), 'rb') as f:
+                    self.assertEqual(f.read(), content)
+                self.assertEqual(os.stat(in_file.get('restore_path')).st_mtime, 1669155154)
+                self.assertEqual(os.stat(in_file.get('restore_path')).st_mode & 0o777, 0o640)
+            self.assertNotIn('extracted', missing[1])
+            self.assertFalse(os.path.exists(tar_path))
+
+    @patch('dt_service.subprocess')
+    def test_DTService_extract_tar_members_debug(self, subprocess_mock):
+        self.dt_service.debug = True
+        pool = Mock()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.assertIsNone(self.dt_service._extract_tar_members(
+                'some_server', '/path/to/remote/123.tar', [('./my_file.txt', {})], temp_dir, pool))
+        subprocess_mock.run.assert_not_called()
+        pool.submit.assert_not_called()
+
+    @patch('dt_service.os')
+    def test_DTService_run_pull_bounds_tars_in_flight(self, os_mock):
+        events = []
+
+        def extract(server, tar, members, temp_dir, pool):
+            events.append(f'read {tar}')
+            future = Mock()
+            future.result.side_effect = lambda: events.append(f'written {tar}')
+            return future
+
+        os_mock.path.join = os.path.join
+        os_mock.path.exists.return_value = True
+        self.curl_get.side_effect = [{2: 'my_service', 'server': 'some_server'}]
+        self.hsi_status.isup.return_value = True
+        self.dt_service.pull_io_workers = 2
+        files = [{'service': 2, 'volume': 'my_volume', 'file_path': '/path/to', 'file_name': f'my_file_{i}.txt',
+                  'tar_record_id': i, 'remote_path': f'/path/to/remote/{i}.tar', 'remote_file_path': '.',
+                  'remote_file_name': f'my_file_{i}.txt', 'position_a': i, 'position_b': 0, 'pull_queue_id': i}
+                 for i in range(4)]
+
+        with patch.object(self.dt_service, '_extract_tar_members', side_effect=extract):
+            self.dt_service.run_pull(files)
+
+        self.assertEqual(events, ['read /path/to/remote/0.tar', 'read /path/to/remote/1.tar',
+                                  'written /path/to/remote/0.tar', 'read /path/to/remote/2.tar',
+                                  'written /path/to/remote/1.tar', 'read /path/to/remote/3.tar'])
 
     def test_DTService_run_pull_hsi_down_reset_records(self):
         files = [{'service': 2, 'volume': 'my_volume', 'file_path': '/path/to', 'file_name': 'my_file_1.txt',
@@ -826,8 +1088,8 @@ class TestDTService(unittest.TestCase):
                   'position_a': 100, 'position_b': 200, 'pull_queue_id': 222}
                  ]
         expected_curl_put_calls = [call('api/tape/releaselockedvolume/jgi/my_volume'),
-                                   call('api/tape/pull/111', queue_status_id=1),
-                                   call('api/tape/pull/222', queue_status_id=1)]
+                                   call('api/tape/pulls', pulls=[{'pull_queue_id': 111, 'queue_status_id': 1},
+                                                                 {'pull_queue_id': 222, 'queue_status_id': 1}])]
 
         self.curl_get.side_effect = [{2: 'my_service', 'server': 'some_server'}]
         self.hsi_status.isup.return_value = False
@@ -872,90 +1134,92 @@ class TestDTService(unittest.TestCase):
         self._assertAllIn(expected_shutil_calls, shutil_mock)
 
     @parameterized.expand([
-        ('copy_tar_local',
-         {'file_name': 'my_file', 'file_id': 123,
-          'origin_file_name': 'my_folder.tar', 'origin_file_path': '/path/to/origin',
-          'local_purge_days': 1, 'extract': [{'path': 'my_folder_2/my_file_3.txt',
-                                              'file_type': 'txt',
-                                              'metadata': {'foo': 'foo1'}}],
-          'index': 1, 'ignore': ['bar'],
-          'validate_mode': 0, 'metadata': {}, 'user': 'foobar',
-          'file_path': '/path/to/destination', 'path': '/path/to/file',
-          '_id': '5fab1aca47675a20c853bc11'},
-         ['/real/path/to/origin/my_folder/my_folder_1/my_file.txt', '/path/to/origin/my_folder/my_folder_link/my_file_2.txt', '/path/to/origin/my_folder/my_folder_3/my_file_3.txt', '/real/path/to/origin/my_folder/my_folder_4/my_file_4.txt'],
-         [call('api/metadata/file', data={'id': '5fab1aca47675a20c853bc11', 'data': {'folder_index': [{'file_name': 'my_file.txt', 'file_path': 'my_folder_2', 'id': '5fab1aca47675a20c853bc10'}, {'file_name': 'my_file_3.txt', 'file_path': 'my_folder_2', 'id': '5fab1aca47675a20c853bc12'}], 'current_location': '/path/to/temp/my_file.123.tar', 'file_size': 1000}}),
-          call('api/tape/file/123', file_status_id=16, origin_file_path='/path/to/temp', origin_file_name='my_file.123.tar', file_size=1000, next_status=2)]
-         ),
-        ('backup_tar_local',
-         {'file_name': 'my_folder.tar', 'file_id': 123,
-          'origin_file_name': 'my_folder.tar', 'origin_file_path': '/path/to/origin',
-          'local_purge_days': 0, 'extract': [{'path': 'my_folder_2/my_file_3.txt',
-                                              'file_type': 'txt',
-                                              'metadata': {'foo': 'foo1'}}],
-          'index': 1, 'ignore': ['bar'],
-          'validate_mode': 0, 'metadata': {}, 'user': 'foobar',
-          'file_path': '/path/to/origin', 'path': '/path/to/file',
-          '_id': '5fab1aca47675a20c853bc11'},
-         ['/real/path/to/origin/my_folder/my_folder_1/my_file.txt', '/path/to/origin/my_folder/my_folder_link/my_file_2.txt', '/path/to/origin/my_folder/my_folder_3/my_file_3.txt', '/real/path/to/origin/my_folder/my_folder_4/my_file_4.txt'],
-         [call('api/metadata/file', data={'id': '5fab1aca47675a20c853bc11', 'data': {'folder_index': [{'file_name': 'my_file.txt', 'file_path': 'my_folder_2', 'id': '5fab1aca47675a20c853bc10'}, {'file_name': 'my_file_3.txt', 'file_path': 'my_folder_2', 'id': '5fab1aca47675a20c853bc12'}], 'current_location': '/path/to/temp/my_folder.tar.123.tar', 'file_size': 1000}}),
-          call('api/tape/file/123', file_status_id=16, file_path='/path/to/temp', file_name='my_folder.tar.123.tar', origin_file_path='/path/to/origin', origin_file_name='my_folder.tar', file_size=1000, next_status=6)],
-         ),
-        ('copy_tar_remote',
-         {'file_name': 'my_file', 'file_id': 123,
-          'origin_file_name': 'my_folder.tar', 'origin_file_path': '/path/to/remote',
-          'local_purge_days': 1, 'extract': [{'path': 'my_folder_2/my_file_3.txt',
-                                              'file_type': 'txt',
-                                              'metadata': {'foo': 'foo1'}}],
-          'index': 1, 'ignore': ['bar'],
-          'validate_mode': 0, 'metadata': {}, 'user': 'foobar',
-          'file_path': '/path/to/destination', 'path': '/path/to/file',
-          '_id': '5fab1aca47675a20c853bc11'},
-         ['/real/path/to/remote/my_folder/my_folder_1/my_file.txt', '/path/to/remote/my_folder/my_folder_link/my_file_2.txt', '/path/to/remote/my_folder/my_folder_3/my_file_3.txt', '/real/path/to/remote/my_folder/my_folder_4/my_file_4.txt'],
-         [call('api/metadata/file', data={'id': '5fab1aca47675a20c853bc11', 'data': {'folder_index': [{'file_name': 'my_file.txt', 'file_path': 'my_folder_2', 'id': '5fab1aca47675a20c853bc10'}, {'file_name': 'my_file_3.txt', 'file_path': 'my_folder_2', 'id': '5fab1aca47675a20c853bc12'}], 'current_location': '/path/to/temp_remote/my_file.123.tar', 'file_size': 1000}}),
-          call('api/tape/file/123', file_status_id=16, origin_file_path='/path/to/temp_remote', origin_file_name='my_file.123.tar', file_size=1000, next_status=2)]
-         ),
-        ('backup_tar_remote',
-         {'file_name': 'my_folder.tar', 'file_id': 123,
-          'origin_file_name': 'my_folder.tar', 'origin_file_path': '/path/to/remote',
-          'local_purge_days': 0, 'extract': [{'path': 'my_folder_2/my_file_3.txt',
-                                              'file_type': 'txt',
-                                              'metadata': {'foo': 'foo1'}}],
-          'index': 1, 'ignore': ['bar'],
-          'validate_mode': 0, 'metadata': {}, 'user': 'foobar',
-          'file_path': '/path/to/remote', 'path': '/path/to/file',
-          '_id': '5fab1aca47675a20c853bc11'},
-         ['/real/path/to/remote/my_folder/my_folder_1/my_file.txt', '/path/to/remote/my_folder/my_folder_link/my_file_2.txt', '/path/to/remote/my_folder/my_folder_3/my_file_3.txt', '/real/path/to/remote/my_folder/my_folder_4/my_file_4.txt'],
-         [call('api/metadata/file', data={'id': '5fab1aca47675a20c853bc11', 'data': {'folder_index': [{'file_name': 'my_file.txt', 'file_path': 'my_folder_2', 'id': '5fab1aca47675a20c853bc10'}, {'file_name': 'my_file_3.txt', 'file_path': 'my_folder_2', 'id': '5fab1aca47675a20c853bc12'}], 'current_location': '/path/to/temp_remote/my_folder.tar.123.tar', 'file_size': 1000}}),
-          call('api/tape/file/123', file_status_id=16, file_path='/path/to/temp_remote', file_name='my_folder.tar.123.tar', origin_file_path='/path/to/remote', origin_file_name='my_folder.tar', file_size=1000, next_status=6)],
-         ),
+        ('copy_tar_local', 1, False),
+        ('backup_tar_local', 0, False),
+        ('copy_tar_remote', 1, True),
+        ('backup_tar_remote', 0, True),
     ])
-    @patch('dt_service.copy')
-    @patch('dt_service.tarfile')
-    @patch('dt_service.os')
-    def test_DTService_run_tar(self, _description, metadata_record, realpath_responses, expected_curl_put_calls, os_mock, tarfile_mock, copy_mock):
-        curl_get_responses = [{'metadata_id': '5fab1aca47675a20c853bc10'}, None]
-        os_mock.path.join = os.path.join
-        os_mock.path.split = os.path.split
-        os_mock.path.realpath.side_effect = realpath_responses
-        os_mock.walk.return_value = [('/path/to/origin/my_folder/my_folder_2', ['foo', 'bar'], ['my_file.txt', 'file_2_link.txt', 'my_file_3.txt', 'my_file_4.txt'])]
-        os_mock.path.islink.side_effect = [True, True, False, True]
-        os_mock.path.getsize.return_value = 1000
-        copy_mock.copy.return_value = ['foo', 'bar']
-        self.curl_get.side_effect = curl_get_responses
-        self.curl_post.return_value = {'metadata_id': '5fab1aca47675a20c853bc12'}
-        tar_info = Mock()
-        tarfile_mock.TarInfo.return_value = tar_info
-        self.dt_service.remote_sources = {
-            'foo': {
-                'path_prefix_source': '/path/to/remote',
-                'path_prefix_destination': '/path/to/local',
-                'path_temp': '/path/to/temp_remote',
+    def test_DTService_run_tar(self, _description, local_purge_days, remote):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            origin_file_path = os.path.join(temp_dir, 'remote' if remote else 'origin')
+            folder = os.path.join(origin_file_path, 'my_folder')
+            elsewhere = os.path.join(temp_dir, 'elsewhere')
+            for path in ['data', 'my_folder_2', 'bar']:
+                os.makedirs(os.path.join(folder, path))
+            os.makedirs(elsewhere)
+            os.makedirs(os.path.join(temp_dir, 'temp'))
+            os.makedirs(os.path.join(temp_dir, 'temp_remote'))
+            contents = {'data/real.txt': b'real', 'my_folder_2/my_file_3.txt': b'extracted',
+                        'bar/ignored.txt': b'ignored'}
+            for path, data in contents.items():
+                with open(os.path.join(folder, path), 'wb') as f:
+                    f.write(data)
+            for path in ['archived.txt', 'unarchived.txt']:
+                with open(os.path.join(elsewhere, path), 'wb') as f:
+                    f.write(path.encode())
+            # Archived file, link inside of the folder, broken link and file not archived
+            os.symlink(os.path.join(elsewhere, 'archived.txt'), os.path.join(folder, 'my_folder_2', 'my_file.txt'))
+            os.symlink('../data/real.txt', os.path.join(folder, 'my_folder_2', 'file_2_link.txt'))
+            os.symlink(os.path.join(elsewhere, 'missing.txt'), os.path.join(folder, 'my_folder_2', 'my_file_4.txt'))
+            os.symlink(os.path.join(elsewhere, 'unarchived.txt'), os.path.join(folder, 'my_folder_2', 'my_file_5.txt'))
+            # A link to a folder is not followed
+            os.symlink(elsewhere, os.path.join(folder, 'my_folder_link'))
+            self.dt_service.temp_dir = os.path.join(temp_dir, 'temp')
+            self.dt_service.remote_sources = {
+                'foo': {
+                    'path_prefix_source': os.path.join(temp_dir, 'remote'),
+                    'path_prefix_destination': '/path/to/local',
+                    'path_temp': os.path.join(temp_dir, 'temp_remote'),
+                }
             }
-        }
-
-        self.assertEqual(self.dt_service.run_tar(metadata_record), True)
-        self._assertAllIn(expected_curl_put_calls, self.curl_put)
-        self.assertIn(call(['foo', 'bar']), copy_mock.copy.mock_calls)
+            metadata_record = {'file_name': 'my_folder.tar' if local_purge_days == 0 else 'my_file', 'file_id': 123,
+                               'origin_file_name': 'my_folder.tar', 'origin_file_path': origin_file_path,
+                               'local_purge_days': local_purge_days,
+                               'extract': [{'path': 'my_folder_2/my_file_3.txt', 'file_type': 'txt',
+                                            'metadata': {'foo': 'foo1'}}],
+                               'index': 1, 'ignore': ['bar'],
+                               'validate_mode': 0, 'metadata': {}, 'user': 'foobar',
+                               'file_path': origin_file_path if local_purge_days == 0 else '/path/to/destination',
+                               'path': '/path/to/file', '_id': '5fab1aca47675a20c853bc11'}
+
+            def post(url, **kwargs):
+                if url == 'api/tape/latestfiles':
+                    return {os.path.join(elsewhere, 'archived.txt'): {'metadata_id': '5fab1aca47675a20c853bc10'}}
+                return {'metadata_id': '5fab1aca47675a20c853bc12'}
+
+            self.curl_post.side_effect = post
+
+            self.assertEqual(self.dt_service.run_tar(metadata_record), True)
+
+            tar_path = os.path.join(temp_dir, 'temp_remote' if remote else 'temp',
+                                    f'{metadata_record.get("file_name")}.123.tar')
+            latest_files = [c for c in self.curl_post.mock_calls if c.args[0] == 'api/tape/latestfiles']
+            self.assertEqual(len(latest_files), 1)
+            self.assertCountEqual(latest_files[0].kwargs.get('files'),
+                                  [os.path.join(elsewhere, name) for name in
+                                   ['archived.txt', 'missing.txt', 'unarchived.txt']])
+            metadata_put = [c for c in self.curl_put.mock_calls if c.args[0] == 'api/metadata/file'][0]
+            folder_index = metadata_put.kwargs.get('data').get('data').get('folder_index')
+            self.assertCountEqual(folder_index[:2], [{'file_name': 'real.txt', 'file_path': 'data'},
+                                                     {'file_name': 'my_file_5.txt', 'file_path': 'my_folder_2'}])
+            self.assertCountEqual(folder_index[2:], [
+                {'file_name': 'my_file.txt', 'file_path': 'my_folder_2', 'id': '5fab1aca47675a20c853bc10'},
+                {'file_name': 'my_file_3.txt', 'file_path': 'my_folder_2', 'id': '5fab1aca47675a20c853bc12'}])
+            with tarfile.open(tar_path) as tar:
+                self.assertCountEqual(tar.getnames(), ['data/real.txt', 'my_folder_2/file_2_link.txt',
+                                                       'my_folder_2/my_file_5.txt'])
+                self.assertEqual(tar.getmember('my_folder_2/file_2_link.txt').linkname, '../data/real.txt')
+                self.assertEqual(tar.extractfile('my_folder_2/my_file_5.txt').read(), b'unarchived.txt')
+            file_size = os.path.getsize(tar_path)
+            current_path, current_file = os.path.split(tar_path)
+            if local_purge_days:
+                expected = call('api/tape/file/123', file_status_id=16, origin_file_path=current_path,
+                                origin_file_name=current_file, file_size=file_size, next_status=2)
+            else:
+                expected = call('api/tape/file/123', file_status_id=16, file_path=current_path,
+                                file_name=current_file, origin_file_path=origin_file_path,
+                                origin_file_name='my_folder.tar', file_size=file_size, next_status=6)
+            self.assertIn(expected, self.curl_put.mock_calls)
 
     @parameterized.expand([
         ('already_purged',
@@ -1086,37 +1350,31 @@ class TestDTService(unittest.TestCase):
         ('exact_size', 999, True),
         ('minimum_size', 800, False),
     ])
-    @patch('dt_service.subprocess')
-    def test_DTService_verify_path_in_hsi(self, _description, expected_size, exact_size, subprocess_mock):
-        subprocess_mock.run.side_effect = [subprocess.CompletedProcess('cmd', 0, stdout=b'999 /path/to/remote')]
-        subprocess_mock.PIPE = subprocess.PIPE
+    def test_DTService_verify_path_in_hsi(self, _description, expected_size, exact_size):
+        self.dt_service.hsi_pool = Mock()
+        self.dt_service.hsi_pool.check_output.return_value = '999 /path/to/remote'
+
         self.dt_service._verify_path_in_hsi('server', '/path/to/remote', expected_size, exact_size)
 
-        self.assertIn(
-            call.run(['hsi', '-P', '-q', '-h', 'server', 'ls -1s /path/to/remote'], check=True, stdout=subprocess.PIPE),
-            subprocess_mock.mock_calls)
+        self.dt_service.hsi_pool.check_output.assert_called_once_with('server', 'ls -1s /path/to/remote')
 
     @parameterized.expand([
-        ('hsi_error', 999, True, [subprocess.CalledProcessError(1, 'cmd')], subprocess.CalledProcessError),
-        ('not_exact_size', 800, True, [subprocess.CompletedProcess('cmd', 0, stdout=b'999 /path/to/remote')],
-         dt_service.HSIVerificationFailedException),
-        ('not_minimum_size', 1000, False, [subprocess.CompletedProcess('cmd', 0, stdout=b'999 /path/to/remote')],
-         dt_service.HSIVerificationFailedException),
+        ('hsi_error', 999, True, dt_service.hsi.HSIError('hsi session to server closed'),
+         dt_service.hsi.HSIError),
+        ('not_found', 999, True, '*** ls: No such file or directory [-2: HPSS_ENOENT]',
+         dt_service.hsi.HSIError),
+        ('not_exact_size', 800, True, '999 /path/to/remote', dt_service.HSIVerificationFailedException),
+        ('not_minimum_size', 1000, False, '999 /path/to/remote', dt_service.HSIVerificationFailedException),
     ])
-    @patch('dt_service.subprocess')
     def test_DTService_verify_path_in_hsi_call_fails_raises_exception(self, _description, expected_size, exact_size,
-                                                                      subprocess_responses, expected_exception,
-                                                                      subprocess_mock):
-        subprocess_mock.run.side_effect = subprocess_responses
-        subprocess_mock.CalledProcessError = subprocess.CalledProcessError
-        subprocess_mock.PIPE = subprocess.PIPE
+                                                                      hsi_response, expected_exception):
+        self.dt_service.hsi_pool = Mock()
+        self.dt_service.hsi_pool.check_output.side_effect = [hsi_response]
 
         self.assertRaises(expected_exception,
                           self.dt_service._verify_path_in_hsi, 'server', '/path/to/remote', expected_size, exact_size)
 
-        self.assertIn(
-            call.run(['hsi', '-P', '-q', '-h', 'server', 'ls -1s /path/to/remote'], check=True, stdout=subprocess.PIPE),
-            subprocess_mock.mock_calls)
+        self.dt_service.hsi_pool.check_output.assert_called_once_with('server', 'ls -1s /path/to/remote')
 
     @parameterized.expand([
         ('single_file_success',
@@ -1224,12 +1482,12 @@ class TestDTService(unittest.TestCase):
          ),
     ])
     @patch('dt_service.tarfile')
-    @patch('dt_service.shutil')
+    @patch('dt_service.file_copy')
     @patch('dt_service.datetime')
     @patch('dt_service.os')
     def test_DTService_put_globus(self, _description, in_file, os_stat_responses, os_rename_responses,
                                   expected, expected_curl_put_calls, expected_os_calls, expected_tar_calls,
-                                  os_mock, datetime_mock, shutil_mock, tarfile_mock):
+                                  os_mock, datetime_mock, file_copy_mock, tarfile_mock):
         service = {'name': 'my_service', 'default_path': '/path/to/my_service'}
         os_mock.stat.side_effect = os_stat_responses
         os_mock.path.join = os.path.join
@@ -1249,6 +1507,9 @@ class TestDTService(unittest.TestCase):
         self._assertAllIn(expected_curl_put_calls, self.curl_put)
         self._assertAllIn(expected_os_calls, os_mock)
         self._assertAllIn(expected_tar_calls, tar)
+        if len(in_file.get('records')) == 1 and any(c[0] == 'rename' for c in expected_os_calls):
+            file_copy_mock.copy_file.assert_called_once_with('/path/to/temp/my_file.txt',
+                                                             '/path_to_globus_temp/my_file.txt.456', copy_stat=True)
 
     def test_DTService_get_backup_service_source_path(self):
         self.dt_service.backup_services = {'my_service': {'source_path': '/path_to_globus_timer',
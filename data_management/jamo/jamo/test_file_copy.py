@@ -0,0 +1,114 @@
+import errno
+import hashlib
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import file_copy
+from parameterized import parameterized
+
+
+def unsupported(source, destination, size):
+    raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+
+class TestFileCopy(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.data = os.urandom(3 * 1024 * 1024 + 17)
+        self.from_file = os.path.join(self.temp_dir.name, 'from.bin')
+        self.to_file = os.path.join(self.temp_dir.name, 'to.bin')
+        with open(self.from_file, 'wb') as f:
+            f.write(self.data)
+        os.chmod(self.from_file, 0o600)
+        os.utime(self.from_file, (1669155154, 1669155154))
+
+    def _assertCopied(self):
+        with open(self.to_file, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    @parameterized.expand([
+        (file_copy.COPY_FILE_RANGE,),
+        (file_copy.SENDFILE,),
+        (file_copy.BUFFERED,),
+    ])
+    def test_copy_file_falls_back(self, mechanism):
+        # Every mechanism preferred over `mechanism` is unsupported
+        names = [name for name, _ in file_copy.MECHANISMS]
+        if mechanism not in names:
+            self.skipTest(f'{mechanism} is not available')
+        mechanisms = [(name, unsupported if names.index(name) < names.index(mechanism) else function)
+                      for name, function in file_copy.MECHANISMS]
+
+        with patch.object(file_copy, 'MECHANISMS', mechanisms):
+            result = file_copy.copy_file(self.from_file, self.to_file)
+
+        self.assertEqual((result.mechanism, result.size, result.md5sum), (mechanism, len(self.data), None))
+        self.assertGreater(result.bytes_per_second, 0)
+        self._assertCopied()
+
+    def test_copy_file_error(self):
+        def error(source, destination, size):
+            raise OSError(errno.ENOSPC, 'No space left on device')
+
+        with patch.object(file_copy, 'MECHANISMS', [(file_copy.COPY_FILE_RANGE, error)]):
+            with self.assertRaises(OSError):
+                file_copy.copy_file(self.from_file, self.to_file)
+
+    @parameterized.expand([
+        (file_copy.COPY_FILE_RANGE, 'copy_file_range', file_copy._copy_file_range),
+        (file_copy.SENDFILE, 'sendfile', file_copy._sendfile),
+    ])
+    def test_copy_file_copied_nothing_falls_back(self, mechanism, os_function, function):
+        # The kernel call reports the end of the file right away
+        with patch.object(file_copy, 'MECHANISMS', [(mechanism, function), (file_copy.BUFFERED, file_copy._buffered)]), \
+                patch.object(file_copy.os, os_function, return_value=0, create=True):
+            result = file_copy.copy_file(self.from_file, self.to_file)
+
+        self.assertEqual((result.mechanism, result.size), (file_copy.BUFFERED, len(self.data)))
+        self._assertCopied()
+
+    def test_copy_file_short_copy(self):
+        def short(source, destination, size):
+            os.write(destination, self.data[:10])
+            return 10
+
+        with patch.object(file_copy, 'MECHANISMS', [(file_copy.COPY_FILE_RANGE, short)]):
+            with self.assertRaisesRegex(OSError, 'copied 10 of'):
+                file_copy.copy_file(self.from_file, self.to_file)
+
+    def test_copy_file_md5(self):
+        with patch.object(file_copy, 'MECHANISMS', [(file_copy.REFLINK, unsupported)] + file_copy.MECHANISMS[1:]):
+            result = file_copy.copy_file(self.from_file, self.to_file, md5=True)
+
+        self.assertEqual((result.mechanism, result.size, result.md5sum),
+                         (file_copy.BUFFERED, len(self.data), hashlib.md5(self.data).hexdigest()))
+        self._assertCopied()
+
+    def test_copy_file_copy_stat(self):
+        file_copy.copy_file(self.from_file, self.to_file, copy_stat=True)
+
+        self.assertEqual(os.stat(self.to_file).st_mtime, 1669155154)
+        self.assertEqual(os.stat(self.to_file).st_mode & 0o777, 0o600)
+        self.assertTrue(os.path.exists(self.from_file))
+
+    def test_copy_file_disposable_rename(self):
+        result = file_copy.copy_file(self.from_file, self.to_file, disposable=True, md5=True)
+
+        self.assertEqual((result.mechanism, result.size, result.md5sum),
+                         (file_copy.RENAME, len(self.data), hashlib.md5(self.data).hexdigest()))
+        self.assertFalse(os.path.exists(self.from_file))
+        self._assertCopied()
+
+    @patch('file_copy.os.rename')
+    def test_copy_file_disposable_other_filesystem(self, rename_mock):
+        rename_mock.side_effect = OSError(errno.EXDEV, 'Invalid cross-device link')
+
+        result = file_copy.copy_file(self.from_file, self.to_file, disposable=True)
+
+        self.assertNotEqual(result.mechanism, file_copy.RENAME)
+        self.assertTrue(os.path.exists(self.from_file))
+        self._assertCopied()
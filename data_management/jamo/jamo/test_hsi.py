@@ -1,6 +1,6 @@
 import subprocess
 import unittest
-from hsi import HSI, HSI_status
+from hsi import HSI, HSI_status, HSIError, HSIPool, HSISession
 import datetime
 from time import sleep
 from parameterized import parameterized
@@ -22,6 +22,20 @@ while :
 done
 '''
 
+# Answers like `hsi -P -q`, which prints a prompt before reading each command
+_SESSION_SCRIPT = r'''
+while printf 'A:/home/u/user-> ' && read -r in
+do case $in in
+   pwd) echo 'pwd0: /home/u/user' ;;
+   'ls -1s '*) echo "999 ${in#ls -1s }" ;;
+   'ls -P -N '*) printf 'FILE\t%s\t999\n' "${in#ls -P -N }" ;;
+   rm\ *) ;;
+   hang) sleep 5 ;;
+   *) printf '*** %s: Unknown command\n    %s\n' "$in" "$in" ;;
+ esac
+done
+'''
+
 
 @patch('hsi.time.sleep', new=MagicMock())
 class TestHSI(unittest.TestCase):
@@ -128,5 +142,61 @@ class TestHSI(unittest.TestCase):
         self.assertEqual(hsi_status.isup('hpss.nersc.gov'), expected)
 
 
+@patch.object(HSISession, 'command', ['bash', '-c', _SESSION_SCRIPT, 'hsi'])
+class TestHSIPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = HSIPool(size=1, timeout=1)
+        self.addCleanup(self.pool.close)
+
+    def _session(self):
+        return self.pool.idle.get('some_server')[0]
+
+    @patch.object(HSISession, 'pipeline_depth', 2)
+    def test_HSIPool_run_pipelined(self):
+        commands = [f'ls -1s /path/to/file_{i}' for i in range(5)] + ['rm /path/to/file_0', 'foo', 'ls -P -N /bar']
+
+        self.assertEqual(self.pool.run('some_server', commands),
+                         [f'999 /path/to/file_{i}' for i in range(5)] +
+                         ['', '*** foo: Unknown command\n    foo', 'FILE\t/bar\t999'])
+
+    def test_HSIPool_reuses_session(self):
+        self.assertEqual(self.pool.check_output('some_server', 'ls -1s /foo'), '999 /foo')
+        pid = self._session().process.pid
+
+        self.assertEqual(self.pool.check_output('some_server', 'ls -1s /bar'), '999 /bar')
+        self.assertEqual(self._session().process.pid, pid)
+
+    def test_HSIPool_reconnects_closed_session(self):
+        self.pool.check_output('some_server', 'ls -1s /foo')
+        self._session().process.kill()
+        self._session().process.wait()
+        # Seen as healthy, the failure is found when running the command
+        self._session().last_used = float('inf')
+
+        self.assertEqual(self.pool.check_output('some_server', 'ls -1s /bar'), '999 /bar')
+        self.assertTrue(self._session().alive())
+
+    def test_HSIPool_health_check(self):
+        self.pool.health_check_seconds = 0
+        self.pool.check_output('some_server', 'ls -1s /foo')
+        self._session().process.kill()
+        self._session().process.wait()
+
+        self.assertEqual(self.pool.check_output('some_server', 'ls -1s /bar'), '999 /bar')
+
+    def test_HSIPool_timeout_releases_session(self):
+        self.pool.timeout = 0.2
+
+        with self.assertRaises(HSIError):
+            self.pool.run('some_server', ['hang'])
+        self.assertEqual(self.pool.created, {'some_server': 0})
+        self.assertEqual(self.pool.check_output('some_server', 'ls -1s /foo'), '999 /foo')
+
+    def test_HSISession_multiline_command(self):
+        with self.assertRaises(ValueError):
+            self.pool.run('some_server', ['ls -1s /foo\nrm /foo'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,6 @@
 import collections
 import os
+import threading
 import time
 import unittest
 import metadata
@@ -7,7 +8,7 @@ import datetime
 import urllib
 from collections import OrderedDict
 from parameterized import parameterized
-from metadata import QueueHash, Metadata
+from metadata import Metadata
 from bson.objectid import ObjectId
 from lapinpy import common
 from unittest.mock import patch, Mock, MagicMock, call
@@ -62,43 +63,6 @@ class TestMetadata(unittest.TestCase):
             {'method': func, 'type': 'my_type', 'name': 'foo', 'template': 'my_template', 'description': 'foobar'},
             metadata.processservices)
 
-    def test_QueueHash_get_item_found(self):
-        queue_hash = QueueHash(10)
-        queue_hash.hash = {'foo': 'bar'}
-
-        self.assertEqual(queue_hash['foo'], 'bar')
-
-    def test_QueueHash_get_item_not_found(self):
-        queue_hash = QueueHash(10)
-        queue_hash.hash = {'foo': 'bar'}
-
-        self.assertRaises(KeyError, queue_hash.__getitem__, 'baz')
-
-    @parameterized.expand([
-        ('found', 'foo', True),
-        ('found', 'baz', False),
-    ])
-    def test_QueueHash_contains(self, _description, value, found):
-        queue_hash = QueueHash(10)
-        queue_hash.hash = {'foo': 'bar'}
-
-        self.assertEqual(value in queue_hash, found)
-
-    def test_QueueHash_set_item(self):
-        queue_hash = QueueHash(10)
-
-        queue_hash['foo'] = 'bar'
-
-        self.assertEqual(queue_hash.hash.get('foo'), 'bar')
-
-    def test_QueueHash_clear(self):
-        queue_hash = QueueHash(10)
-        queue_hash.hash = {'foo': 'bar'}
-
-        queue_hash.clear()
-
-        self.assertEqual(len(queue_hash.hash), 0)
-
     def test_Metadata_doneloading(self):
         @metadata.processservice(name='foo', description='foobar', typ='my_type', template='my_template')
         def func():
@@ -658,6 +622,111 @@ class TestMetadata(unittest.TestCase):
                                                     extracted_keys, original_doc), expected)
         self.assertEqual(already_processed, expected_already_processed)
 
+    @patch('metadata.curl')
+    def test_Metadata_processStore_does_not_modify_cache(self, curl):
+        curl.get.return_value = {'library_name': 'lib', 'history': ['foo'], 'run': {'id': 1, 'lane': 2}}
+        store = self.metadata.stores.get('illumina_sdm_seq_unit_id')[0]
+        store['map']['run>lane'] = {'extract': True}
+
+        first = self.metadata.processStore(OrderedDict([('illumina_sdm_seq_unit_id', 'bar')]), store, [], {}, {})
+        first['sdm_seq_unit']['run']['id'] = 2
+        second = self.metadata.processStore(OrderedDict([('illumina_sdm_seq_unit_id', 'bar')]), store, [], {}, {})
+
+        self.assertEqual(second, {'library_name': 'lib', 'lane': 2,
+                                  'sdm_seq_unit': {'library_name': 'lib', 'lane': 2, 'run': {'id': 1}}})
+        self.assertEqual(self.metadata.store_cache.get('sdm_seq_unit/bar'),
+                         {'library_name': 'lib', 'history': ['foo'], 'run': {'id': 1, 'lane': 2}})
+        curl.get.assert_called_once()
+        self.assertEqual(self.metadata.store_cache_stats['sdm_seq_unit'], {'hits': 1, 'misses': 1, 'failures': 0, 'coalesced': 0})
+
+    @patch('metadata.curl')
+    def test_Metadata_processStore_caches_failure(self, curl):
+        curl.get.side_effect = [ValueError('Bad response'), {'foo': 'bar'}]
+        now = [0]
+        self.metadata.store_cache = metadata.TTLCache(10, 3600, clock=lambda: now[0])
+        self.metadata.store_cache_negative_ttl = 60
+        store = self.metadata.stores.get('illumina_sdm_seq_unit_id')[0]
+
+        self.assertIsNone(self.metadata.processStore(OrderedDict([('illumina_sdm_seq_unit_id', 'bar')]), store, [], {}, {}))
+        self.assertIsNone(self.metadata.processStore(OrderedDict([('illumina_sdm_seq_unit_id', 'bar')]), store, [], {}, {}))
+        self.assertEqual(curl.get.call_count, 1)
+        now[0] = 61
+        self.assertEqual(self.metadata.processStore(OrderedDict([('illumina_sdm_seq_unit_id', 'bar')]), store, [], {}, {}),
+                         {'sdm_seq_unit': {'foo': 'bar'}})
+        self.assertEqual(self.metadata.store_cache_stats['sdm_seq_unit'], {'hits': 1, 'misses': 2, 'failures': 1, 'coalesced': 0})
+
+    @patch('metadata.curl')
+    def test_Metadata_processStore_store_cache_ttl(self, curl):
+        curl.get.side_effect = [{'foo': 'bar'}, {'foo': 'baz'}]
+        now = [0]
+        self.metadata.store_cache = metadata.TTLCache(10, 3600, clock=lambda: now[0])
+        store = self.metadata.stores.get('illumina_sdm_seq_unit_id')[0]
+        store['cache_ttl'] = 10
+
+        self.metadata.processStore(OrderedDict([('illumina_sdm_seq_unit_id', 'bar')]), store, [], {}, {})
+        now[0] = 11
+
+        self.assertEqual(self.metadata.processStore(OrderedDict([('illumina_sdm_seq_unit_id', 'bar')]), store, [], {}, {}),
+                         {'sdm_seq_unit': {'foo': 'baz'}})
+        self.assertEqual(curl.get.call_count, 2)
+
+    @patch('metadata.curl')
+    def test_Metadata_processStores_fetches_concurrently(self, curl):
+        # Both responses are only returned once both requests are in flight
+        barrier = threading.Barrier(2, timeout=5)
+
+        def get(url):
+            barrier.wait()
+            return {'url': url}
+
+        curl.get.side_effect = get
+        self.metadata.stores['library_name'] = [{'key': 'library_name', 'identifier': 'library',
+                                                 'url': 'https://foo.bar/library/{{library_name}}'}]
+
+        new_metadata, all_failed = self.metadata.processStores({'illumina_sdm_seq_unit_id': 'bar', 'library_name': 'baz'})
+
+        self.assertEqual(new_metadata, {'sdm_seq_unit': {'url': 'https://sdm.jgi.doe.gov/api/illumina/sdmsequnit2/bar'},
+                                        'library': {'url': 'https://foo.bar/library/baz'}})
+        self.assertEqual(all_failed, [])
+        self.assertEqual(curl.get.call_count, 2)
+
+    @patch('metadata.curl')
+    def test_Metadata_get_store_data_coalesces_requests(self, curl):
+        started = threading.Event()
+        release = threading.Event()
+
+        def get(url):
+            started.set()
+            release.wait(5)
+            return {'foo': 'bar'}
+
+        curl.get.side_effect = get
+        store = self.metadata.stores.get('illumina_sdm_seq_unit_id')[0]
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.metadata._get_store_data('sdm_seq_unit/bar', 'https://foo.bar/bar', store))) for _ in range(2)]
+        threads[0].start()
+        started.wait(5)
+        threads[1].start()
+        while self.metadata.store_cache_stats['sdm_seq_unit']['coalesced'] == 0:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, [{'foo': 'bar'}, {'foo': 'bar'}])
+        curl.get.assert_called_once_with('https://foo.bar/bar')
+        self.assertEqual(self.metadata.store_inflight, {})
+
+    def test_Metadata_get_datastorecache(self):
+        self.metadata.store_cache.put('sdm_seq_unit/bar', {'foo': 'bar'})
+        self.metadata.store_cache.get('sdm_seq_unit/bar')
+        self.metadata.store_cache_stats['sdm_seq_unit']['hits'] += 1
+
+        self.assertEqual(self.metadata.get_datastorecache(None, None),
+                         {'size': 1, 'max_size': 2000, 'ttl': 3600, 'negative_ttl': 60, 'hits': 1, 'misses': 0,
+                          'evictions': 0, 'stores': {'sdm_seq_unit': {'hits': 1, 'misses': 0, 'failures': 0, 'coalesced': 0}}})
+
     @parameterized.expand([
         ('str_value', 'bar', ('foo', 'bar')),
         ('dict_value', {'bar': 'baz'}, ('foo', {'bar': 'baz'})),
@@ -845,6 +914,39 @@ class TestMetadata(unittest.TestCase):
 
         self.assertEqual(self.metadata.post_pagequery(None, kwargs), expected)
 
+    @patch('metadata.basestring', str, create=True)
+    def test_Metadata_post_export(self):
+        self.metadata.config.export_chunk_size = 2
+        records = [{'_id': ObjectId('5327394649607a1be0059511'), 'file_name': 'foo', 'added_date': datetime.datetime(2022, 1, 2)},
+                   {'_id': ObjectId('5327394649607a1be0059512'), 'file_name': 'bar', 'metadata': {'library_name': 'ABCD'}},
+                   {'_id': ObjectId('5327394649607a1be0059513'), 'file_name': 'baz'}]
+        self.cursor.__iter__.return_value = iter(records)
+        self.cursor.limit.return_value = self.cursor
+
+        chunks = list(self.metadata.post_export(None, {'query': {'_id': '5327394649607a1be0059511'},
+                                                       'fields': ['file_name'], 'limit': 3, 'flatten': True}))
+
+        self.assertEqual(chunks, [
+            b'{"_id": "5327394649607a1be0059511", "file_name": "foo", "added_date": "2022-01-02T00:00:00"}\n'
+            b'{"_id": "5327394649607a1be0059512", "file_name": "bar", "metadata.library_name": "ABCD"}\n',
+            b'{"_id": "5327394649607a1be0059513", "file_name": "baz"}\n'])
+        self.db.find.assert_called_with({'_id': ObjectId('5327394649607a1be0059511')}, ['file_name'], batch_size=1000)
+        self.cursor.limit.assert_called_with(3)
+        self.cursor.close.assert_called_once()
+        self.assertEqual(self.metadata.post_export.stream, 'application/x-ndjson')
+
+    @patch('metadata.basestring', str, create=True)
+    def test_Metadata_post_export_closes_abandoned_cursor(self):
+        self.metadata.config.export_chunk_size = 1
+        self.cursor.__iter__.return_value = iter([{'file_name': 'foo'}, {'file_name': 'bar'}])
+
+        export = self.metadata.post_export(None, {'query': 'file_name = foo'})
+        self.assertEqual(next(export), b'{"file_name": "foo"}\n')
+        export.close()
+
+        self.cursor.close.assert_called_once()
+        self.db.find.assert_called_with({'file_name': 'foo'}, None, batch_size=1000)
+
     @patch('lapinpy.mongorestful.random')
     def test_Metadata_post_portalquery(self, random_mock):
         record = {
@@ -922,7 +1024,7 @@ class TestMetadata(unittest.TestCase):
 
     @parameterized.expand([
         ('no_limit_passed_defaults_to_all', {'_id': ObjectId('5327394649607a1be0059511')},
-         call.find().__getitem__(slice(0, 1000, None))),
+         call.find().__getitem__(slice(0, None, None))),
         ('limit_passed', {'_id': ObjectId('5327394649607a1be0059511'), 'limit': 50},
          call.find().__getitem__(slice(0, 50, None))),
     ])
@@ -1266,6 +1368,22 @@ class TestMetadata(unittest.TestCase):
 
         self.assertIn(expected_db_call, self.db.mock_calls)
 
+    @patch('metadata.Metadata.smartUpdate')
+    def test_Metadata_runUpdate_file_bulk_update(self, smart_update):
+        dt = datetime.datetime(2000, 1, 2)
+        self.metadata.events.append(('file_bulk_update', ('file_id', [
+            (1, {'dt_to_purge': dt, 'file_status_id': 28}),
+            (2, {'file_status_id': 28, 'dt_to_purge': dt}),
+            (3, {'dt_to_purge': datetime.datetime(2000, 1, 3)}),
+        ])))
+
+        self.metadata.runUpdate()
+
+        self.assertEqual(smart_update.call_args_list, [
+            call('file', {'file_id': {'$in': [1, 2]}}, {'$set': {'dt_to_purge': dt, 'file_status_id': 28}}),
+            call('file', {'file_id': {'$in': [3]}}, {'$set': {'dt_to_purge': datetime.datetime(2000, 1, 3)}}),
+        ])
+
     @patch('metadata.datetime')
     @patch('lapinpy.mongorestful.datetime')
     @patch('metadata.curl')
@@ -2030,13 +2148,10 @@ class TestMetadata(unittest.TestCase):
             },
         ]
         self.cursor.__iter__.return_value = iter(records)
-        # We set a fake document count to verify that the request is made for all documents.
-        self.db.count_documents.return_value = 1000
         expected_db_calls = [call.remove({'_id': ObjectId('5327394649607a1be0059512')}),
                              call.remove({'_id': ObjectId('5327394649607a1be0059513')}),
-                             # Verify that we're requesting records from 0 to total number of records (1000 in this
-                             #  case) from DB.
-                             call.find().__getitem__(slice(0, 1000, None))]
+                             # Verify that we're requesting all the records from DB, without a limit.
+                             call.find().__getitem__(slice(0, None, None))]
 
         self.metadata.update_queued_metadata_refresh()
 
@@ -0,0 +1,120 @@
+import unittest
+from pull_index import PullQueueIndex
+from parameterized import parameterized
+
+
+class TestPullQueueIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PullQueueIndex()
+        self.index.load([
+            {'pull_queue_id': 5, 'volume': 'AG1234', 'priority': 1},
+            {'pull_queue_id': 3, 'volume': 'AG5678', 'priority': 1},
+            {'pull_queue_id': 7, 'volume': 'AG5678', 'priority': 1},
+            {'pull_queue_id': 1, 'volume': 'AG9999', 'priority': 2},
+            {'pull_queue_id': 2, 'volume': 'AG1234', 'priority': 0},
+        ])
+
+    @parameterized.expand([
+        ('priority_0_first', [0, 1, 2], (), {'pull_queue_id': 2, 'volume': 'AG1234', 'priority': 0}),
+        ('lowest_id_within_priority', [1, 2], (), {'pull_queue_id': 3, 'volume': 'AG5678', 'priority': 1}),
+        ('excluded_volume', [1, 2], ('AG5678',), {'pull_queue_id': 5, 'volume': 'AG1234', 'priority': 1}),
+        ('fall_through_priorities', [1, 2], ('AG5678', 'AG1234'),
+         {'pull_queue_id': 1, 'volume': 'AG9999', 'priority': 2}),
+        ('priority_not_enabled', [1], ('AG5678', 'AG1234'), None),
+        ('unknown_priority', [5], (), None),
+    ])
+    def test_PullQueueIndex_next_volume(self, _description, priorities, excluded_volumes, expected):
+        self.assertEqual(self.index.next_volume(priorities, excluded_volumes), expected)
+
+    def test_PullQueueIndex_next_volume_does_not_consume(self):
+        self.assertEqual(self.index.next_volume([1], ('AG5678',)).get('volume'), 'AG1234')
+        self.assertEqual(self.index.next_volume([1]).get('volume'), 'AG5678')
+        self.assertEqual(len(self.index), 5)
+
+    def test_PullQueueIndex_remove(self):
+        self.index.remove([3, 100])
+
+        self.assertEqual(self.index.next_volume([1]), {'pull_queue_id': 5, 'volume': 'AG1234', 'priority': 1})
+        self.assertEqual(len(self.index), 4)
+        self.assertNotIn(3, self.index)
+
+    def test_PullQueueIndex_remove_volume(self):
+        self.assertEqual(sorted(self.index.remove_volume('AG5678')), [3, 7])
+
+        self.assertEqual(self.index.next_volume([1]), {'pull_queue_id': 5, 'volume': 'AG1234', 'priority': 1})
+        self.assertEqual(self.index.get_volume_requests('AG5678'), [])
+        self.assertEqual(self.index.volume_count(), 2)
+
+    def test_PullQueueIndex_add_updates_priority(self):
+        self.index.add(7, 'AG5678', 0)
+
+        self.assertEqual(self.index.next_volume([0]), {'pull_queue_id': 2, 'volume': 'AG1234', 'priority': 0})
+        self.assertEqual(self.index.next_volume([0], ('AG1234',)),
+                         {'pull_queue_id': 7, 'volume': 'AG5678', 'priority': 0})
+        self.assertEqual(self.index.count(0), 2)
+        self.assertEqual(self.index.count(1), 2)
+
+    def test_PullQueueIndex_add_after_volume_emptied(self):
+        self.index.remove([3, 7])
+        self.index.add(10, 'AG5678', 1)
+        self.index.add(4, 'AG5678', 1)
+
+        self.assertEqual(self.index.next_volume([1]), {'pull_queue_id': 4, 'volume': 'AG5678', 'priority': 1})
+        self.index.remove([4])
+        self.assertEqual(self.index.next_volume([1]), {'pull_queue_id': 5, 'volume': 'AG1234', 'priority': 1})
+        self.index.remove([5])
+        self.assertEqual(self.index.next_volume([1]), {'pull_queue_id': 10, 'volume': 'AG5678', 'priority': 1})
+        self.index.remove([10])
+        self.assertIsNone(self.index.next_volume([1]))
+        self.assertEqual(self.index.count(1), 0)
+
+    def test_PullQueueIndex_counts(self):
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.count(), 5)
+        self.assertEqual(self.index.count(1), 3)
+        self.assertEqual(self.index.volume_count(), 3)
+        self.assertEqual(sorted(self.index.get_volumes()), ['AG1234', 'AG5678', 'AG9999'])
+        self.assertEqual(self.index.get_volume_requests('AG1234'), [2, 5])
+
+
+    def test_PullQueueIndex_next_volume_hold_window(self):
+        index = PullQueueIndex()
+        index.add(1, 'AG1234', 1, registered=1000)
+        index.add(2, 'AG5678', 1, registered=1030)
+        index.add(3, 'AG9999', 2, registered=1000)
+        index.add(4, 'AG1234', 1, registered=1050)
+
+        self.assertIsNone(index.next_volume([1, 2], hold_windows={1: 60, 2: 60}, now=1059))
+        self.assertEqual(index.next_volume([1, 2], hold_windows={1: 60, 2: 600}, now=1060),
+                         {'pull_queue_id': 1, 'volume': 'AG1234', 'priority': 1})
+        self.assertEqual(index.next_volume([1, 2], ('AG1234',), hold_windows={1: 60, 2: 600}, now=1060), None)
+        self.assertEqual(index.next_volume([1, 2], ('AG1234',), hold_windows={1: 60}, now=1060),
+                         {'pull_queue_id': 3, 'volume': 'AG9999', 'priority': 2})
+        self.assertEqual(index.held_until('AG5678', 1, 60), 1090)
+
+    def test_PullQueueIndex_hold_window_restarts_when_volume_emptied(self):
+        index = PullQueueIndex()
+        index.add(1, 'AG1234', 1, registered=1000)
+        index.add(2, 'AG1234', 1, registered=1010)
+        index.remove([1])
+        self.assertEqual(index.held_until('AG1234', 1, 60), 1060)
+        index.remove([2])
+        self.assertIsNone(index.held_until('AG1234', 1, 60))
+        index.add(3, 'AG1234', 1, registered=2000)
+
+        self.assertIsNone(index.next_volume([1], hold_windows={1: 60}, now=2059))
+        self.assertEqual(index.next_volume([1], hold_windows={1: 60}, now=2060).get('pull_queue_id'), 3)
+
+    def test_PullQueueIndex_load_keeps_registration_time(self):
+        index = PullQueueIndex()
+        index.add(1, 'AG1234', 1, registered=1000)
+        index.load([{'pull_queue_id': 1, 'volume': 'AG1234', 'priority': 1},
+                    {'pull_queue_id': 2, 'volume': 'AG5678', 'priority': 1, 'registered': 1500}])
+
+        self.assertEqual(index.held_until('AG1234', 1, 60), 1060)
+        self.assertEqual(index.held_until('AG5678', 1, 60), 1560)
+
+
+if __name__ == '__main__':
+    unittest.main()
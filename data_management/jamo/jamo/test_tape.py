@@ -1,4 +1,6 @@
 import unittest
+import time
+import hashlib
 import tape
 import pymysql
 from datetime import datetime, timedelta
@@ -40,15 +42,15 @@ class TestTape(unittest.TestCase):
                                        'dm_archive_root_source': '/path/to/bar/dm_archive'},
                                },
             'backup_services_to_feature_name': {'HPSS': 'hsi'},
-            'division': {
-                'jgi': {'default_backup_service': 1,
-                        'tape_temp_dir': '/path/to/tape_temp_dir',
-                        'default_queue_features': {'ingest': ['nersc'], 'prep': ['hsi_1'], 'pull': ['hsi_1', 'dna_w'],
-                                                   'copy': ['dna_w'], 'tar': ['compute'], 'purge': ['dna_w'],
-                                                   'delete': ['dna_w'], 'put': [], 'md5': ['compute']},
-                        'max_resources': {'hsi_1': 18, 'hsi_2': 18}}
-            },
+            'backup_services': [{'name': 'archive'}, {'name': 'hpss'}],
+            'division': [{'name': 'jgi', 'default_backup_service': 'archive',
+                          'tape_temp_dir': '/path/to/tape_temp_dir',
+                          'default_queue_features': {'ingest': ['nersc'], 'prep': ['hsi_1'], 'pull': ['hsi_1', 'dna_w'],
+                                                     'copy': ['dna_w'], 'tar': ['compute'], 'purge': ['dna_w'],
+                                                     'delete': ['dna_w'], 'put': [], 'md5': ['compute']},
+                          'max_resources': {'hsi_1': 18, 'hsi_2': 18}}],
             'dm_archive_root_by_division': {'jgi': '/path/to/archive'},
+            'hydrate_in_background': False,
         })
 
         sample.return_value = 'AA'
@@ -58,6 +60,7 @@ class TestTape(unittest.TestCase):
         self.connection.return_value = self.connect
         self.cursor = Mock()
         self.connection.cursor.return_value = self.cursor
+        self.cursor.lastrowid = 1
         self.cursor.fetchall.side_effect = [
             [{'backup_service_id': 2, 'name': 'hpss', 'server': 'hpss.nersc.gov',
               'default_path': '/home/projects/dm_archive/root', 'type': 'HPSS', 'division': 'jgi'}],
@@ -89,12 +92,16 @@ class TestTape(unittest.TestCase):
              {'queue_status_id': 7, 'status': 'PREP_IN_PROGRESS'}, {'queue_status_id': 6, 'status': 'PREP_FAILED'},
              {'queue_status_id': 3, 'status': 'COMPLETE'}],
             [{'quota': 100000000, 'used': 50000000}],
-            [{'files': 10, 'disk_usage': 50}],
-            [{'files': 2, 'disk_usage': 10}],
+            [{'division': 'jgi', 'file_status_id': 1, 'files': 8, 'disk_usage': 40},
+             {'division': 'jgi', 'file_status_id': 12, 'files': 2, 'disk_usage': 10}],
+            [{'requestor': 'foobar', 'n': 5}],
+            [],
+            [{'volume': 'AG2910'}],
+            [{'file_id': 14462356, 'file_ingest_id': 1002, 'md5_queue_id': 431849, 'backup_record_id': 18774872}],
             [{'ymdh': '22-10-15 12', 'vol': 5, 'N': 10, 'gb': 50}],
             [{'tar_record_id': 224967, 'volume': 'AG1583', 'position_a': 1375, 'position_b': 14800029}],
-            [{'requestor': 'foobar', 'n': 5}],
             [{'tar_record_id': 224967}],
+            [],
             [{'file_ingest_id': 1001, 'file_ingest_status_id': 22, 'file_id': 14452074, 'file_size': 3753,
               'validate_mode': 0, 'transfer_mode': 0, 'local_purge_days': 90, 'auto_uncompress': 0, '_put_mode': 0,
               '_is_folder': 0, '_is_file': 1, '_dt_modified': datetime(2022, 5, 5, 13, 54, 19),
@@ -171,7 +178,6 @@ class TestTape(unittest.TestCase):
               'file_path': '/global/dna/dm_archive/sdm/illumina/05/26/89', 'service': 2,
               'backup_record_id': 18774872, 'file_status_id': 6, 'backup_record_status_id': 1,
               'file_size': 959524387, 'division': 'jgi'}],
-            [{'volume': 'AG2910'}],
         ]
         self.hsi = Mock()
         self.hsi_state = Mock()
@@ -205,7 +211,7 @@ class TestTape(unittest.TestCase):
                               'file_name': 'file_name.gz',
                               'file_path': '/file/path', 'service': 2,
                               'backup_record_id': 3, 'file_status_id': 6, 'backup_record_status_id': 1,
-                              'division': 'jgi', 'file_size': 959524387}],
+                              'division': 'jgi', 'file_size': tape.MIN_SINGLE_SIZE}],
                             True)
 
         self.assertIn(expected, self.tape.divisions.get('jgi').put_queue.feature_queues.get('hsi_2')[0].get('records'))
@@ -221,13 +227,80 @@ class TestTape(unittest.TestCase):
                                               'file_path': '/file/path', 'service': 2,
                                               'backup_record_id': 3, 'file_status_id': 6, 'backup_record_status_id': 1,
                                               'division': 'jgi',
-                                              'file_size': 959524387}]]
+                                              'file_size': tape.MIN_SINGLE_SIZE}]]
 
-        self.tape.init_put_queue('jgi')
+        self.tape.init_put_queue('jgi', 3)
 
         self.assertIn({'file_name': 'file_name.gz', 'file_id': 1, 'backup_record_id': 3, 'file_path': '/file/path'},
                       self.tape.divisions.get('jgi').put_queue.feature_queues.get('hsi_2')[0].get('records'))
 
+    def test_Tape_query_chunked(self):
+        self.tape.config.startup_chunk_size = 2
+        self.cursor.fetchall.side_effect = [[{'md5_queue_id': 1}, {'md5_queue_id': 3}], [{'md5_queue_id': 4}]]
+
+        records = list(self.tape._query_chunked('select md5_queue_id from md5_queue where queue_status_id = %s', [1],
+                                                'md5_queue_id', 5))
+
+        self.assertEqual(records, [{'md5_queue_id': 1}, {'md5_queue_id': 3}, {'md5_queue_id': 4}])
+        self.cursor.execute.assert_has_calls([
+            call('select md5_queue_id from md5_queue where queue_status_id = %s and md5_queue_id > %s and md5_queue_id <= %s order by md5_queue_id limit %s',
+                 [1, 0, 5, 2]),
+            call('select md5_queue_id from md5_queue where queue_status_id = %s and md5_queue_id > %s and md5_queue_id <= %s order by md5_queue_id limit %s',
+                 [1, 3, 5, 2])])
+
+    def test_Tape_query_chunked_empty_table(self):
+        self.cursor.execute.reset_mock()
+
+        self.assertEqual(list(self.tape._query_chunked('select md5_queue_id from md5_queue where queue_status_id = %s',
+                                                       [1], 'md5_queue_id', None)), [])
+        self.cursor.execute.assert_not_called()
+
+    def test_Tape_Division_hydrate(self):
+        division = self.tape.divisions.get('jgi')
+        self.cursor.fetchall.side_effect = [
+            [{'file_ingest_id': 5, 'file_size': 10, '_file': '/path/to/remote/foo', '_callback': 'file_ingest',
+              'source': None, 'division': 'jgi'}],
+            [{'file_id': 6, 'file_size': 20, 'origin_file_path': '/path/to/origin', 'source': None}],
+            [{'file_id': 7, 'file_size': 30, 'file_path': '/path/to', 'origin_file_path': '/path/to/origin',
+              'origin_file_name': 'bar', 'local_purge_days': 0, 'source': 'bar'}],
+            [{'md5_queue_id': 8, 'file_path': '/path/to/baz', 'file_size': 40, 'callback': 'local://put_file/8',
+              'division': 'jgi'}],
+        ]
+
+        division.hydrate(self.tape, {'file_id': 10, 'file_ingest_id': 10, 'md5_queue_id': 10})
+
+        self.assertEqual(division.ingest_queue.feature_queues.get('foo')[-1].get('file_ingest_id'), 5)
+        self.assertEqual(division.copy_queue.feature_queues.get('dna_w')[-1].get('file_id'), 6)
+        self.assertEqual(division.tar_queue.feature_queues.get('bar')[-1].get('file_id'), 7)
+        self.assertEqual(division.md5_queue.feature_queues.get('compute')[-1].get('md5_queue_id'), 8)
+        self.assertIn(call('select file_id, file_size, origin_file_path, source from file where file_status_id = %s and division = %s and file_id > %s and file_id <= %s order by file_id limit %s',
+                           [2, 'jgi', 0, 10, 50000]), self.cursor.execute.mock_calls)
+
+    def test_Tape_hydrate_queues(self):
+        self.tape.hydrated.clear()
+        self.tape.tar_record_info = {}
+        self.cursor.fetchall.return_value = []
+
+        self.tape.hydrate_queues({'file_id': None, 'file_ingest_id': None, 'md5_queue_id': None,
+                                  'backup_record_id': None})
+
+        self.assertTrue(self.tape.hydrated.is_set())
+
+    def test_Tape_hydrate_queues_failure(self):
+        self.tape.hydrated.clear()
+        self.tape.tar_record_info = {}
+        self.cursor.fetchall.return_value = []
+
+        with patch.object(self.tape, 'refresh_tar_info', side_effect=pymysql.err.OperationalError('gone away')):
+            self.assertRaises(pymysql.err.OperationalError, self.tape.hydrate_queues,
+                              {'file_id': None, 'file_ingest_id': None, 'md5_queue_id': None,
+                               'backup_record_id': None})
+
+        self.assertFalse(self.tape.hydrated.is_set())
+        status = self.tape.get_taskstatus([], None)
+        self.assertFalse(status.get('backlog_loaded'))
+        self.assertEqual(status.get('backlog_error'), "OperationalError('gone away')")
+
     def test_Tape_put_taskcomplete(self):
         self.tape.divisions.get('jgi').task_manager.current_tasks = {
             'copy': {'service': 'service_id', 'task': 'copy', 'data': {'name': 'foobar'},
@@ -315,12 +388,80 @@ class TestTape(unittest.TestCase):
     @patch('task.datetime')
     def test_Tape_post_nexttask(self, _description, kwargs, expected, datetime_mock):
         datetime_mock.datetime.now.return_value = datetime(2000, 1, 2, 3, 4, 5)
+        self.cursor.fetchall.return_value = [expected.get('data')]
         self.tape.enable_portal_long()
 
         actual = self.tape.post_nexttask(None, kwargs)
 
         self.assertEqual(actual, expected)
 
+    @patch('tape.task.datetime')
+    def test_Tape_post_nexttask_lease(self, datetime_mock):
+        datetime_mock.datetime.now.return_value = datetime(2000, 1, 2, 3, 4, 5)
+        md5_queue = tape.task.Queue('md5', 5, default_features=['compute'])
+        md5_queue.add_all([{'md5_queue_id': i, 'file_path': f'/path/to/file_{i}', 'file_size': 100} for i in range(5)])
+        task_manager = tape.task.TaskManager('jgi')
+        task_manager.set_queues(md5_queue)
+        task_manager.task_prefix = 'AAA'
+        self.tape.divisions.get('jgi').task_manager = task_manager
+
+        lease = self.tape.post_nexttask(None, {'features': ['compute'], 'tasks': ['md5'], 'service': 'md5_service',
+                                               'division': 'jgi', 'max_tasks': 4, 'max_bytes': 250})
+
+        self.assertEqual(lease.get('lease_id'), 'AAAL1')
+        self.assertEqual([task_data.get('data').get('md5_queue_id') for task_data in lease.get('tasks')], [0, 1, 2])
+        self.assertEqual(lease.get('bytes'), 300)
+
+        next_lease = self.tape.post_nexttask(None, {'features': ['compute'], 'tasks': ['md5'], 'service': 'md5_service',
+                                                    'division': 'jgi', 'max_tasks': 4, 'lease_id': 'AAAL1',
+                                                    'results': {'AAA1': True, 'AAA2': False},
+                                                    'requeue': ['AAA3']})
+
+        self.assertEqual([task_data.get('data').get('md5_queue_id') for task_data in next_lease.get('tasks')],
+                         [3, 4, 2])
+        self.assertEqual(list(task_manager.leases), ['AAAL2'])
+        self.assertEqual(md5_queue.currently_running, 3)
+
+    def test_Tape_post_nexttask_lease_pull(self):
+        pull_queue_mock = Mock()
+        pull_queue_mock.next.return_value = {'data': [{'foo': 'bar'}], 'uses_resources': ['hsi_1', 'dna_w']}
+        pull_queue_mock.name = 'pull'
+        self.tape.divisions.get('jgi').pull_queue = pull_queue_mock
+
+        lease = self.tape.post_nexttask(None, {'features': ['hsi_1', 'dna_w'], 'tasks': ['pull'],
+                                               'service': 'pull_service', 'division': 'jgi', 'max_tasks': 10})
+
+        self.assertIsNone(lease.get('lease_id'))
+        self.assertEqual([(task_data.get('task'), task_data.get('task_id'), task_data.get('records'))
+                          for task_data in lease.get('tasks')], [('pull', None, 1)])
+
+    def test_Tape_put_leaseheartbeat(self):
+        task_manager = self.tape.divisions.get('jgi').task_manager
+        task_manager.leases = {'AAAL1': {'service': 'md5_service', 'task_ids': {'AAA1'},
+                                         'created': datetime(2000, 1, 2, 3, 4, 5),
+                                         'heartbeat': datetime(2000, 1, 2, 3, 4, 5)}}
+
+        self.assertEqual(self.tape.put_leaseheartbeat(None, {'lease_id': 'AAAL1', 'division': 'jgi'}),
+                         {'lease_id': 'AAAL1', 'active': True})
+        self.assertGreater(task_manager.leases.get('AAAL1').get('heartbeat'), datetime(2000, 1, 2, 3, 4, 5))
+        self.assertEqual(self.tape.put_leaseheartbeat(None, {'lease_id': 'AAAL2', 'division': 'jgi'}),
+                         {'lease_id': 'AAAL2', 'active': False})
+
+    def test_Tape_put_leasecomplete(self):
+        task_manager = self.tape.divisions.get('jgi').task_manager
+        task_manager.leases = {'AAAL1': {'service': 'md5_service', 'task_ids': {'AAA1'},
+                                         'created': datetime(2000, 1, 2, 3, 4, 5),
+                                         'heartbeat': datetime(2000, 1, 2, 3, 4, 5)}}
+        task_manager.current_tasks = {'AAA1': {'service': 'md5_service', 'task': 'md5', 'data': {'name': 'foobar'},
+                                               'features': ['compute']}}
+        self.tape.divisions.get('jgi').md5_queue.currently_running = 1
+
+        self.tape.put_leasecomplete(None, {'lease_id': 'AAAL1', 'division': 'jgi', 'results': {'AAA1': True}})
+
+        self.assertEqual(task_manager.leases, {})
+        self.assertEqual(task_manager.current_tasks, {})
+        self.assertEqual(self.tape.divisions.get('jgi').md5_queue.currently_running, 0)
+
     @parameterized.expand([
         ('pull_in_tasks_no_previous_task_id',
          {'features': ['hsi_1', 'dna_w'], 'tasks': ['pull'], 'service': 'pull_service', 'returned': True,
@@ -570,12 +711,13 @@ class TestTape(unittest.TestCase):
                                   'md5_queue_id': 431849,
                                   'md5sum': None,
                                   'queue_status_id': 1}]}
-        orphan_files = {'2': {'backup_records': [{'backup_record_id': 18774872,
-                                                  'file_id': 14462356,
-                                                  'file_name': '52689.3.420190.AGCTCCTA-AGCTCCTA.fastq.gz',
-                                                  'file_path': '/global/dna/dm_archive/sdm/illumina/05/26/89'}],
-                              'root_dir': '/global/dna/dm_archive/sdm/illumina/05/26/89',
-                              'size': 959524387}}
+        orphan_files = {'2': {'/global/dna/dm_archive/sdm/illumina': {
+            'backup_records': [{'backup_record_id': 18774872,
+                                'file_id': 14462356,
+                                'file_name': '52689.3.420190.AGCTCCTA-AGCTCCTA.fastq.gz',
+                                'file_path': '/global/dna/dm_archive/sdm/illumina/05/26/89'}],
+            'root_dir': '/global/dna/dm_archive/sdm/illumina/05/26/89',
+            'size': 959524387}}}
         tar_queue = {'compute': [{'auto_uncompress': 0,
                                   'created_dt': datetime(2013, 4, 26, 17, 7, 29),
                                   'file_date': datetime(2012, 5, 18, 16, 50, 12),
@@ -637,6 +779,7 @@ class TestTape(unittest.TestCase):
         expected = {'jgi': {'current_tasks': {},
                             'current_used_resources': {},
                             'services': {},
+                            'leases': {},
                             'tasks': {'copy': {'currently_running': 0,
                                                'file_size': 2265588,
                                                'record_count': 2},
@@ -654,7 +797,9 @@ class TestTape(unittest.TestCase):
                                       'tar': {'currently_running': 0,
                                               'file_size': 602653198,
                                               'record_count': 2}}},
-                    'resources_gone': {}}
+                    'resources_gone': {},
+                    'backlog_loaded': True,
+                    'backlog_error': None}
 
         self.assertEqual(self.tape.get_taskstatus(['reset'], None), expected)
 
@@ -681,11 +826,18 @@ class TestTape(unittest.TestCase):
             [{'requestor': 'portal/foobar@foo.com', 'N': 22814, 'gb': 85.947542876}],
             [{'tab': 'Pulll_Queue', 'state': 'In Progress', 'group_vol': 'AG8046', 'status_id': 0, 'queue': 6,
               'section': 4, 'N': 1, 'min_date': datetime(2022, 1, 24, 15, 20, 30)}],
-            [{'requestor': 'portal/foobar@foo.com', 'N': 71874, 'gb': 16174.277529125}],
-            [{'file_owner': 'foobar', 'n': 1514, 'gb': 835.463351332}],
-            [{'ymdh': datetime(22, 5, 9, 6), 'vol': 277, 'N': 2331, 'gb': 1331.300473485}],
-            [{'ymdh': datetime(22, 5, 9, 6), 'N': 1156, 'gb': 92.501109338}],
         ]
+        # The five day reports come from the statistics charts
+        self.tape.stats_charts = {
+            ('request', 5): {'user': [{'requestor': 'portal/foobar@foo.com', 'N': 71874, 'gb': 16174.277529125}],
+                             'hour': [], 'updated': time.time()},
+            ('ingest', 5): {'user': [{'file_owner': 'foobar', 'n': 1514, 'gb': 835.463351332}],
+                            'hour': [{'ymdh': datetime(22, 5, 9, 6), 'N': 1156, 'gb': 92.501109338}],
+                            'updated': time.time()},
+            ('restore', 5): {'user': [],
+                             'hour': [{'ymdh': datetime(22, 5, 9, 6), 'vol': 277, 'N': 2331, 'gb': 1331.300473485}],
+                             'updated': time.time()},
+        }
         expected = {'active': [{'N': 22814,
                                 'gb': 85.947542876,
                                 'requestor': 'portal/foobar@foo.com'}],
@@ -732,6 +884,71 @@ class TestTape(unittest.TestCase):
 
         self.assertEqual(self.tape.get_tape_status(None, None), expected)
 
+    @patch('tape.restful.RestServer')
+    def test_Tape_get_tape_status_uses_snapshot(self, restserver):
+        self.hsi_state.isup.return_value = True
+        self.tape.tape_status = {'pull': 1, 'prep': 2}
+        self.tape.tape_status_time = time.time()
+        self.cursor.fetchall.reset_mock()
+
+        status = self.tape.get_tape_status(None, None)
+
+        self.assertEqual((status['pull'], status['prep'], status['hpss']), (1, 2, 0))
+        self.cursor.fetchall.assert_not_called()
+        restserver.Instance.return_value.run_method.assert_not_called()
+
+        # A snapshot older than `tape_status_max_age` is still served, and refreshed in the background
+        self.tape.config.tape_status_max_age = 60
+        self.tape.tape_status_time = time.time() - 61
+        with patch('tape.threading.Thread') as thread:
+            status = self.tape.get_tape_status(None, None)
+        self.assertEqual((status['pull'], status['prep']), (1, 2))
+        thread.assert_called_once_with(target=self.tape.refresh_tape_status, name='refresh_tape_status', daemon=True)
+        thread.return_value.start.assert_called_once()
+
+        # Unless a refresh is already running
+        with patch('tape.threading.Thread') as thread, self.tape.tape_status_lock:
+            self.tape.get_tape_status(None, None)
+        thread.assert_not_called()
+
+    @parameterized.expand([
+        ('no_snapshot', None, True),
+        ('fresh', 20, False),
+        ('refreshed_last_minute', 59, True),
+        ('stale', 200, True),
+    ])
+    def test_Tape_refresh_tape_status_cron(self, _description, refreshed_ago, refreshed):
+        self.tape.config.tape_status_max_age = 120
+        self.tape.tape_status_time = None if refreshed_ago is None else time.time() - refreshed_ago
+
+        with patch.object(self.tape, '_tape_status_counts', return_value={}) as counts, \
+                patch.object(self.tape, 'query', return_value=[]), patch.object(self.tape, 'get_cached_stats_chart'):
+            self.tape.refresh_tape_status()
+
+        self.assertEqual(counts.called, refreshed)
+
+    @parameterized.expand([
+        ('consistent', {'pull': 1, 'prep': 2, 'put': 3, 'error': 22, 'other': 8, 'ingest': 1, 'vol': 9, 'recent': 10},
+         {}),
+        ('inconsistent', {'pull': 5, 'prep': 2, 'put': 3, 'error': 20, 'other': 8, 'ingest': 1, 'vol': 9, 'recent': 10},
+         {'pull': {'snapshot': 5, 'actual': 1}, 'error': {'snapshot': 20, 'actual': 22}}),
+    ])
+    @patch('tape.restful.RestServer')
+    def test_Tape_get_tape_status_check(self, _description, snapshot, differences, restserver):
+        server = Mock()
+        server.run_method.return_value = {'foo': 'bar'}
+        restserver.Instance.return_value = server
+        self.tape.tape_status = snapshot
+        self.tape.tape_status_time = time.time() - 30
+        self.cursor.fetchall.side_effect = [[{'N': n}] for n in (1, 2, 3, 4, 5, 6, 7, 8, 9, 10)]
+
+        ret = self.tape.get_tape_status_check([], None)
+
+        self.assertEqual(ret['consistent'], not differences)
+        self.assertEqual(ret['differences'], differences)
+        self.assertAlmostEqual(ret['age'], 30, delta=5)
+        self.assertEqual(self.tape.tape_status, snapshot)
+
     @patch('pymysql.connect')
     def test_Tape_post_reset_failed(self, connect):
         def assert_value_in_queue(value, queue, features):
@@ -959,9 +1176,13 @@ class TestTape(unittest.TestCase):
             [file_tar_deleted_not_remote, file_tar_deleted_remote],
             [None],
             [pull_queue_failed],
+            [],
             [pull_queue_prep_failed],
+            [],
             [pull_queue_prep_lost],
+            [],
             [pull_queue_hanging],
+            [],
         ]
 
         self.tape.post_reset_failed(None, None)
@@ -998,12 +1219,15 @@ class TestTape(unittest.TestCase):
             call.execute('update pull_queue set queue_status_id = %s where pull_queue_id = %s', (1, 11657721)),
             call.execute('update pull_queue set queue_status_id = %s where pull_queue_id = %s', (1, 11445141)),
             call.execute('update file set file_status_id = %s where file_id = %s', (28, 13590906)),
-            call.execute('select * from file where file_status_id = %s and division = %s', [2, 'jgi']),
-            call.execute('select * from file where file_status_id = %s and division = %s', [14, 'jgi']),
-            call.execute('select * from md5_queue where queue_status_id = %s and division = %s', [1, 'jgi']),
+            call.execute('select file_id, file_size, origin_file_path, source from file where file_status_id = %s and division = %s and file_id > %s and file_id <= %s order by file_id limit %s',
+                         [2, 'jgi', 0, 14462356, 50000]),
+            call.execute('select file_id, file_size, file_path, origin_file_path, origin_file_name, local_purge_days, source from file where file_status_id = %s and division = %s and file_id > %s and file_id <= %s order by file_id limit %s',
+                         [14, 'jgi', 0, 14462356, 50000]),
+            call.execute('select md5_queue_id, file_path, file_size, callback, division from md5_queue where queue_status_id = %s and division = %s and md5_queue_id > %s and md5_queue_id <= %s order by md5_queue_id limit %s',
+                         [1, 'jgi', 0, 431849, 50000]),
             call.execute(
-                'select f.local_purge_days, f.origin_file_path, f.origin_file_name, f.file_id, file_name, file_path, service, backup_record_id, file_status_id, backup_record_status_id, file_size, division from backup_record b left join file f on f.file_id = b.file_id where f.file_status_id in (%s,%s) and backup_record_status_id in (%s,%s) and dt_to_release is null and division = %s',
-                [6, 7, 1, 2, 'jgi']),
+                'select f.local_purge_days, f.origin_file_path, f.origin_file_name, f.file_id, file_name, file_path, service, b.backup_record_id, file_status_id, backup_record_status_id, file_size, division from backup_record b left join file f on f.file_id = b.file_id where f.file_status_id in (%s,%s) and backup_record_status_id in (%s,%s) and dt_to_release is null and division = %s and b.backup_record_id > %s and b.backup_record_id <= %s order by b.backup_record_id limit %s',
+                [6, 7, 1, 2, 'jgi', 0, 18774872, 50000]),
             call.execute('select distinct volume from pull_queue join file using(file_id) where queue_status_id = %s and division = %s', [2, 'jgi']),
             call.execute('select * from file_ingest where file_ingest_status_id = %s and division = %s ', [20, 'jgi']),
             call.execute('select * from file_ingest where file_ingest_status_id = %s and division = %s ', [21, 'jgi']),
@@ -1068,13 +1292,14 @@ class TestTape(unittest.TestCase):
                             'origin_file_path': '/origin/file/path',
                             'origin_file_name': 'origin_file_name.gz', 'file_id': 1,
                             'file_name': 'file_name.gz',
-                            'file_path': '/file/path',
+                            'file_path': '/global/dna/dm_archive/sdm/illumina/05/26/90',
                             'backup_records': [{'backup_record_id': 3, 'service': 2}], 'file_status_id': 6,
                             'backup_record_status_id': 1,
                             'division': 'jgi',
                             'file_size': file_size})
 
-        self.assertIn({'file_name': 'file_name.gz', 'file_id': 1, 'backup_record_id': 3, 'file_path': '/file/path'},
+        self.assertIn({'file_name': 'file_name.gz', 'file_id': 1, 'backup_record_id': 3,
+                       'file_path': '/global/dna/dm_archive/sdm/illumina/05/26/90'},
                       self.tape.divisions.get('jgi').put_queue.feature_queues.get('hsi_2')[0].get('records'))
 
     @parameterized.expand([
@@ -1092,14 +1317,47 @@ class TestTape(unittest.TestCase):
                             'file_size': 1, 'division': 'jgi'})
 
         self.assertIn({'file_name': 'file_name.gz', 'file_id': 1, 'backup_record_id': 3, 'file_path': '/file/path'},
-                      self.tape.divisions.get('jgi').orphan_files.get(service_id).get('backup_records'))
+                      self.tape.divisions.get('jgi').tar_packer.pending().get(service_id).get('/file/path').get(
+                          'backup_records'))
         self.assertEqual(len(self.tape.divisions.get('jgi').put_queue.feature_queues), 0)
 
+    def test_Tape_add_file_packs_by_locality(self):
+        division = self.tape.divisions.get('jgi')
+        division.tar_packer = tape.TarPacker(1000)
+        for file_id, file_path in ((1, '/global/dna/dm_archive/sdm/illumina/01'),
+                                   (2, '/global/dna/dm_archive/img/data/01'),
+                                   (3, '/global/dna/dm_archive/sdm/illumina/00')):
+            self.tape.add_file({'file_id': file_id, 'file_name': f'file_{file_id}.gz', 'file_path': file_path,
+                                'backup_records': [{'backup_record_id': file_id + 10, 'service': 2}],
+                                'file_size': 500, 'division': 'jgi'})
+
+        self.assertEqual(division.put_queue.feature_queues.get('hsi_2')[0],
+                         {'file_size': 1000, 'root_dir': '/global/dna/dm_archive/sdm/illumina', 'service': 2,
+                          'records': [{'file_id': 3, 'backup_record_id': 13, 'file_name': 'file_3.gz',
+                                       'file_path': '/global/dna/dm_archive/sdm/illumina/00'},
+                                      {'file_id': 1, 'backup_record_id': 11, 'file_name': 'file_1.gz',
+                                       'file_path': '/global/dna/dm_archive/sdm/illumina/01'}]})
+        self.assertEqual(list(division.tar_packer.pending().get('2')), ['/global/dna/dm_archive/img/data'])
+
+    def test_Tape_flush_tar_bins(self):
+        division = self.tape.divisions.get('jgi')
+        division.tar_packer = tape.TarPacker(1000, max_age=60)
+        division.tar_packer.add(2, {'file_id': 1, 'backup_record_id': 11, 'file_name': 'file_1.gz',
+                                    'file_path': '/global/dna/dm_archive/img/data/01'}, 200, now=0)
+
+        self.tape.flush_tar_bins()
+
+        self.assertEqual(division.put_queue.feature_queues.get('hsi_2')[0].get('file_size'), 200)
+        self.assertEqual(division.tar_packer.pending(), {})
+        self.assertEqual(self.tape.get_tarpacking(['jgi'], None).get('jgi').get('summary').get('tars'), 1)
+
     @patch('tape.datetime')
     def test_Tape_repository_footprint(self, datetime_mock):
         self.cursor.fetchall.side_effect = [
-            [{'files': 19, 'disk_usage': 79691776}],
-            [{'files': 1, 'disk_usage': 1776}],
+            [{'division': 'jgi', 'file_status_id': 8, 'files': 15, 'disk_usage': 79590000},
+             {'division': 'jgi', 'file_status_id': 10, 'files': 100, 'disk_usage': 5000000},
+             {'division': 'jgi', 'file_status_id': 12, 'files': 1, 'disk_usage': 1776},
+             {'division': 'nmdc', 'file_status_id': 8, 'files': 3, 'disk_usage': 100000}],
         ]
         datetime_mock.datetime.today.return_value = datetime(2000, 1, 2, 3, 4, 5)
 
@@ -1112,10 +1370,41 @@ class TestTape(unittest.TestCase):
                                                 'disk_usage_files': 79691776,
                                                 'disk_usage_files_restoring': 1776,
                                                 'disk_usage_other': -29690000,
+                                                'divisions': {'jgi': {'files': 16, 'disk_usage': 79591776},
+                                                              'nmdc': {'files': 3, 'disk_usage': 100000}},
                                                 'dna_free_tb': 4.9998224e-05,
                                                 'files': 19,
                                                 'files_restoring': 1})
 
+    @patch('pymysql.connect')
+    @patch('tape.datetime')
+    def test_Tape_reconcile_repository_footprint(self, datetime_mock, connect):
+        datetime_mock.datetime.today.return_value = datetime(2000, 1, 2, 3, 4, 5)
+        connect.return_value = self.connection
+        self.cursor.fetchall.side_effect = [
+            # Full count from `file`
+            [{'division': 'jgi', 'file_status_id': 8, 'files': 15, 'disk_usage': 79590000},
+             {'division': 'jgi', 'file_status_id': 12, 'files': 1, 'disk_usage': 1776}],
+            # Totals kept in `file_footprint`
+            [{'division': 'jgi', 'file_status_id': 8, 'files': 14, 'disk_usage': 79557232},
+             {'division': 'jgi', 'file_status_id': 12, 'files': 1, 'disk_usage': 1776},
+             {'division': 'jgi', 'file_status_id': 13, 'files': 1, 'disk_usage': 512}],
+            # `repository_footprint` after correcting
+            [{'division': 'jgi', 'file_status_id': 8, 'files': 15, 'disk_usage': 79590000},
+             {'division': 'jgi', 'file_status_id': 12, 'files': 1, 'disk_usage': 1776}],
+        ]
+
+        corrections = self.tape.reconcile_repository_footprint()
+
+        self.assertEqual(corrections, {'jgi/8': {'files': 1, 'disk_usage': 32768},
+                                       'jgi/13': {'files': -1, 'disk_usage': -512}})
+        self.cursor.execute.assert_any_call('start transaction with consistent snapshot')
+        self.cursor.execute.assert_any_call(
+            'insert into file_footprint (division, file_status_id, slot, files, disk_usage) values (%s, %s, 0, %s, %s) '
+            'on duplicate key update files = files + values(files), disk_usage = disk_usage + values(disk_usage)',
+            ('jgi', 13, -1, -512))
+        self.assertEqual(self.tape.disk_usage['files'], 16)
+
     @patch('task.datetime')
     def test_Tape_monitor(self, datetime_mock):
         datetime_mock.datetime.now.return_value = datetime(2000, 1, 2, 3, 4, 5)
@@ -1169,7 +1458,8 @@ class TestTape(unittest.TestCase):
         self.tape.release_backup_records()
 
         self.assertIn({'file_name': 'Ga0506519_trna.gff', 'file_id': 14497587, 'backup_record_id': 18810203, 'file_path': '/global/dna/dm_archive/img/submissions/268204'},
-                      self.tape.divisions.get('jgi').orphan_files.get('1').get('backup_records'))
+                      self.tape.divisions.get('jgi').tar_packer.pending().get('1').get(
+                          '/global/dna/dm_archive/img/submissions').get('backup_records'))
 
     def test_Tape_refresh_tar_info(self):
         self.cursor.fetchall.side_effect = [
@@ -1219,6 +1509,7 @@ class TestTape(unittest.TestCase):
         self.cursor.fetchall.side_effect = egress_check_value_return_value + [
             [{'tar_record_id': 224967}],
             [],
+            [{'pull_queue_id': 1, 'volume': 'AG1583', 'priority': 2, 'queue_status_id': 1, 'division': 'jgi'}],
             [{'file_id': 14497587, 'transaction_id': 1, 'file_name': 'Ga0506519_trna.gff',
               'file_path': '/global/dna/dm_archive/img/submissions/268204', 'origin_file_name': 'Ga0506519_trna.gff',
               'origin_file_path': '/global/cfs/cdirs/img/annotated_submissions/268204', 'file_size': 3587990,
@@ -1268,7 +1559,7 @@ class TestTape(unittest.TestCase):
         restserver_mock.Instance.return_value = server_mock
         self.tape.use_db_pull_tasks = True
         self.cursor.lastrowid = 1
-        self.cursor.fetchall.side_effect = [existing_pq_records]
+        self.cursor.fetchall.side_effect = [existing_pq_records, []]
         self.tape.requestor_counts = requestor_counts
         self.tape.config.queue_2_match = 'foo'
 
@@ -1278,59 +1569,93 @@ class TestTape(unittest.TestCase):
         for c in expected_pq_updates:
             self.assertIn(c, self.cursor.mock_calls)
 
+    @patch('pymysql.connect')
     @patch('tape.restful.RestServer')
-    def test_Tape_post_grouprestore(self, restserver):
+    def test_Tape_post_grouprestore(self, restserver, connect):
+        connect.return_value = self.connection
         server = Mock()
         server.run_method.return_value = {'foo': 'bar'}
         restserver.Instance.return_value = server
-        self.cursor.lastrowid = 1
+        self.cursor.lastrowid = 100
+        self.cursor.rowcount = 2
         self.cursor.fetchall.side_effect = [
             [{'file_id': 14497587, 'file_status_id': 10, 'file_name': 'Ga0506519_trna.gff',
               'file_path': '/global/dna/dm_archive/img/submissions/268204', 'file_size': 3587990},
              {'file_id': 14452074, 'file_status_id': 13,
               'file_name': '52687.1.419438.TACGCCTT-TACGCCTT.filtered-report.txt',
               'file_path': '/global/dna/dm_archive/rqc/analyses-40/AUTO-400621', 'file_size': 3753}],
-            [{'tar_record_id': 224967}],
+            # tar records
+            [{'file_id': 14497587, 'tar_record_id': 224967}],
+            # existing pull requests
             [],
-            [{'file_id': 14497587, 'transaction_id': 1, 'file_name': 'Ga0506519_trna.gff',
-              'file_path': '/global/dna/dm_archive/img/submissions/268204', 'origin_file_name': 'Ga0506519_trna.gff',
-              'origin_file_path': '/global/cfs/cdirs/img/annotated_submissions/268204', 'file_size': 3587990,
-              'file_date': datetime(2022, 5, 6, 20, 43, 52), 'file_owner': 'gbp', 'file_group': 'img',
-              'file_permissions': '0100664', 'local_purge_days': 2, 'md5sum': 'b059f4bd49e682dfd55ef3e7f3e43ddf',
-              'file_status_id': 7, 'created_dt': datetime(2022, 5, 7, 9, 30, 46),
-              'modified_dt': datetime(2022, 5, 8, 10, 2, 17), 'validate_mode': 0, 'user_save_till': None,
-              'metadata_id': '62769e4d945720fe9292369e', 'auto_uncompress': 0, 'remote_purge_days': None,
-              'transfer_mode': 0, 'file_status': 'BACKUP_IN_PROGRESS', 'dt_to_purge': None}],
-            [{'backup_record_id': 18810203, 'file_id': 14497587, 'service': 1, 'remote_file_name': None,
-              'remote_file_path': None, 'tar_record_id': None, 'backup_record_status_id': 3, 'md5sum': None,
-              'dt_modified': datetime(2022, 5, 8, 10, 2, 17), 'dt_to_release': None}],
-            [{'file_status_history_id': 140638665, 'file_id': 14497587, 'file_status_id': 1,
-              'dt_begin': datetime(2022, 5, 7, 9, 30, 46),
-              'dt_end': datetime(2022, 5, 7, 9, 30, 46)}],
-            [{'file_id': 14452074, 'transaction_id': 1,
-              'file_name': '52687.1.419438.TACGCCTT-TACGCCTT.filtered-report.txt',
-              'file_path': '/global/dna/dm_archive/rqc/analyses-40/AUTO-400621',
-              'origin_file_name': '52687.1.419438.TACGCCTT-TACGCCTT.filtered-report.txt',
-              'origin_file_path': '/global/dna/shared/rqc/pipelines/filter/archive/03/14/72/79', 'file_size': 3753,
-              'file_date': datetime(2022, 4, 28, 15, 34, 51), 'file_owner': 'qc_user', 'file_group': 'qc_user',
-              'file_permissions': '0100755', 'local_purge_days': 90, 'md5sum': '7b7bc475335673a767e99963aa1c494e',
-              'file_status_id': 13, 'created_dt': datetime(2022, 4, 28, 16, 51, 17),
-              'modified_dt': datetime(2022, 5, 8, 0, 5, 45), 'validate_mode': 0,
-              'user_save_till': datetime(2022, 5, 21, 0, 0), 'metadata_id': '626b286a682a7f997d28e4a5',
-              'auto_uncompress': 0, 'remote_purge_days': None, 'transfer_mode': 0, 'file_status': 'RESTORED',
-              'dt_to_purge': None}],
-            [{'backup_record_id': 18763802, 'file_id': 14452074, 'service': 1,
-              'remote_file_name': '52687.1.419438.TACGCCTT-TACGCCTT.filtered-report.txt.18763802',
-              'remote_file_path': '.', 'tar_record_id': 439787, 'backup_record_status_id': 4, 'md5sum': None,
-              'dt_modified': datetime(2022, 4, 29, 17, 9, 6), 'dt_to_release': None}],
-            [{'file_status_history_id': 139708714, 'file_id': 14452074, 'file_status_id': 1,
-              'dt_begin': datetime(2022, 4, 28, 16, 51, 16), 'dt_end': datetime(2022, 4, 28, 16, 51, 16)}],
+            # new pull requests
+            [{'pull_queue_id': 5, 'file_id': 14497587}],
+            # `_sync_pull_queue_index`
+            [{'pull_queue_id': 5, 'volume': 'AG1583', 'priority': 1, 'queue_status_id': 1, 'division': 'jgi'}],
+            # dt_to_purge
+            [{'file_id': 14497587, 'dt_to_purge': datetime(2022, 5, 20)},
+             {'file_id': 14452074, 'dt_to_purge': datetime(2022, 5, 21)}],
         ]
 
         self.assertEqual(self.tape.post_grouprestore(None,
                                                      {'files': ['62769e4d945720fe9292369e', '626b286a682a7f997d28e4a5'],
                                                       'days': 10, 'requestor': 'foo'}),
                          {'restored_count': 1, 'updated_count': 1, 'url': '/tape/pullqueue'})
+        self.cursor.execute.assert_any_call('insert into request (file_id, requestor) values (%s, %s), (%s, %s)',
+                                            [14497587, 'foo', 14452074, 'foo'])
+        self.cursor.executemany.assert_any_call(
+            'insert into pull_queue (file_id, requestor, priority, tar_record_id, volume, position_a, position_b) values (%s, %s, %s, %s, %s, %s, %s)',
+            [(14497587, 'foo', 1, 224967, 'AG1583', 1375, 14800029)])
+        self.cursor.execute.assert_any_call(
+            'update file set file_status_id=%s, user_save_till=date_add(curdate(), interval %s day) where file_id in (%s)',
+            [28, 10, 14497587])
+        self.cursor.execute.assert_any_call(
+            'update file set user_save_till=date_add(curdate(), interval %s day) where (user_save_till is null or user_save_till < date_add(curdate(), interval %s day)) and file_id in (%s)',
+            [10, 10, 14452074])
+        self.cursor.execute.assert_any_call('commit')
+        server.run_method.assert_called_with('metadata', 'add_bulk_update', 'file_id', [
+            (14497587, {'dt_to_purge': datetime(2022, 5, 20), 'file_status_id': 28, 'file_status': 'RESTORE_REGISTERED'}),
+            (14452074, {'dt_to_purge': datetime(2022, 5, 21)})])
+
+    @patch('pymysql.connect')
+    @patch('tape.restful.RestServer')
+    def test_Tape_bulk_add_to_pull_queue_egress_and_priority(self, restserver, connect):
+        connect.return_value = self.connection
+        restserver.Instance.return_value = Mock()
+        self.tape.requestor_counts = {'foobar': 5}
+        self.tape.config.queue_2_match = 'foo'
+        self.cursor.lastrowid = 101
+        self.cursor.rowcount = 2
+        self.cursor.fetchall.side_effect = [
+            # pending egress requests
+            [{'file_id': 2}],
+            # existing pull requests
+            [{'pull_queue_id': 123, 'file_id': 1, 'priority': 8, 'requestor': 'foobar'},
+             {'pull_queue_id': 124, 'file_id': 2, 'priority': 1, 'requestor': 'foobar'}],
+            # `_sync_pull_queue_index`
+            [],
+        ]
+
+        self.assertEqual(self.tape.bulk_add_to_pull_queue([{'file_id': 1, 'file_status_id': 28, 'file_size': 100},
+                                                           {'file_id': 2, 'file_status_id': 28, 'file_size': 100}],
+                                                          5, 'foo', 'my_source'), (2, 0))
+        self.cursor.executemany.assert_any_call(
+            'insert into egress(file_id, egress_status_id, requestor, source, request_id) values(%s, %s, %s, %s, %s)',
+            [(1, 1, 'foo', 'my_source', 101)])
+        self.cursor.execute.assert_any_call('update pull_queue set priority=%s, requestor=%s where pull_queue_id in (%s)',
+                                            [2, 'foo', 123])
+        self.assertEqual(self.tape.requestor_counts, {'foobar': 4, 'foo': 1})
+
+    @patch('pymysql.connect')
+    def test_Tape_bulk_add_to_pull_queue_rollback(self, connect):
+        connect.return_value = self.connection
+        self.cursor.execute.side_effect = [None, pymysql.err.OperationalError('lock wait timeout')]
+        self.cursor.fetchall.side_effect = [[]]
+
+        self.assertRaises(pymysql.err.OperationalError, self.tape.bulk_add_to_pull_queue,
+                          [{'file_id': 1, 'file_status_id': 10, 'file_size': 100}], 5, 'foo')
+        self.connection.rollback.assert_called_once()
+        self.connection.close.assert_called()
 
     @patch('tape.restful.RestServer')
     def test_Tape_post_restore(self, restserver):
@@ -1343,6 +1668,7 @@ class TestTape(unittest.TestCase):
               'file_path': '/global/dna/dm_archive/img/submissions/268204', 'file_size': 3587990}],
             [{'tar_record_id': 224967}],
             [],
+            [{'pull_queue_id': 1, 'volume': 'AG1583', 'priority': 2, 'queue_status_id': 1, 'division': 'jgi'}],
             [{'file_id': 14497587, 'transaction_id': 1, 'file_name': 'Ga0506519_trna.gff',
               'file_path': '/global/dna/dm_archive/img/submissions/268204', 'origin_file_name': 'Ga0506519_trna.gff',
               'origin_file_path': '/global/cfs/cdirs/img/annotated_submissions/268204', 'file_size': 3587990,
@@ -2097,6 +2423,77 @@ class TestTape(unittest.TestCase):
 
         self.assertEqual(self.tape.plot_data(data, ('N', 'gb'), ('Number of files', 'Footprint'), ('N Files', 'Size in GB'), 'Graph Title'), expected)
 
+    def test_Tape_render_chart(self):
+        idx = datetime.now().replace(second=0, microsecond=0, minute=0)
+        data = [{'ymdh': (idx - timedelta(hours=4)).strftime('%y-%m-%d %H'), 'N': 10, 'gb': 10.1},
+                {'ymdh': (idx - timedelta(hours=2)).strftime('%y-%m-%d %H'), 'N': 20, 'gb': 20.2}]
+
+        png = self.tape.render_chart(data, ('N', 'gb'), ('Number of files', 'Footprint'), ('N Files', 'Size in GB'))
+
+        self.assertTrue(png.startswith(b'\x89PNG'))
+        self.assertIsNone(self.tape.render_chart(data[:1], ('N', 'gb'), ('Number of files', 'Footprint'),
+                                                 ('N Files', 'Size in GB')))
+
+    @patch('tape.Tape.render_chart')
+    def test_Tape_refresh_stats_charts(self, render_chart):
+        hour = [{'ymdh': '22-05-09 06', 'N': 2331, 'gb': 1331.300473485},
+                {'ymdh': '22-05-09 07', 'N': 2331, 'gb': 1331.300473485}]
+        user = [{'file_owner': 'foobar', 'N': 2331, 'gb': 1331.300473485}]
+        self.tape.config.stats_chart_windows = [5, 30]
+        render_chart.return_value = b'png'
+        self.cursor.fetchall.side_effect = [hour, user] * 6
+
+        self.tape.refresh_stats_charts()
+
+        self.assertEqual(sorted(self.tape.stats_charts), [('ingest', 5), ('ingest', 30), ('request', 5),
+                                                          ('request', 30), ('restore', 5), ('restore', 30)])
+        self.assertIn('interval 30 day', self.cursor.execute.call_args_list[-2][0][0])
+        entry = self.tape.stats_charts[('ingest', 5)]
+        self.assertEqual(entry['etag'], '"{}"'.format(hashlib.md5(b'png').hexdigest()))
+        self.assertIn('over the Last Five Days', entry['graph'])
+        self.assertIn('over the Last 30 Days', self.tape.stats_charts[('ingest', 30)]['graph'])
+
+        # The status pages are served from the cache
+        self.cursor.fetchall.reset_mock()
+        self.assertEqual(self.tape.get_ingest_stats(None, None), {'hour': hour, 'user': user, 'graph': entry['graph']})
+        self.cursor.fetchall.assert_not_called()
+
+    @patch('tape.cherrypy')
+    def test_Tape_get_stats_chart(self, cherrypy_mock):
+        self.tape.stats_charts[('restore', 5)] = {'hour': [], 'user': [], 'png': b'png', 'etag': '"abc"', 'graph': '',
+                                                  'updated': time.time()}
+        cherrypy_mock.request.headers = {}
+        cherrypy_mock.response.headers = {}
+
+        self.assertEqual(self.tape.get_stats_chart(['restore'], None), b'png')
+        self.assertEqual(cherrypy_mock.response.headers['ETag'], '"abc"')
+        self.assertEqual(cherrypy_mock.response.headers['Content-Type'], 'image/png')
+
+        # A matching If-None-Match is answered with 304 and no body
+        cherrypy_mock.request.headers = {'If-None-Match': '"xyz", "abc"'}
+        self.assertEqual(self.tape.get_stats_chart(['restore', '5'], None), b'')
+        self.assertEqual(cherrypy_mock.response.status, 304)
+
+    @parameterized.expand([
+        ('no_chart', []),
+        ('unknown_chart', ['foo']),
+        ('bad_days', ['ingest', 'foo']),
+        ('uncached_window', ['ingest', '365']),
+    ])
+    def test_Tape_get_stats_chart_invalid(self, _description, args):
+        self.assertRaises(common.HttpException, self.tape.get_stats_chart, args, None)
+
+    def test_Tape_get_stats_series(self):
+        updated = time.time()
+        hour = [{'ymdh': '22-05-09 06', 'N': 2331, 'gb': 1331.300473485}]
+        self.tape.stats_charts[('request', 5)] = {'hour': hour, 'user': [], 'png': None, 'etag': None, 'graph': '',
+                                                  'updated': updated}
+
+        self.assertEqual(self.tape.get_stats_series(['request'], None),
+                         {'chart': 'request', 'days': 5, 'updated': datetime.fromtimestamp(updated), 'etag': None,
+                          'sets': ('N', 'gb'), 'titles': ('Number of Files', 'File Footprint in GB'),
+                          'labels': ('Files', 'GB'), 'hour': hour, 'user': []})
+
     def test_Tape_save_requested_restores(self):
         record = {'Vol': 13, 'Gb': 2.589374624, 'Ymdh': '22-08-05 13', 'N': 42}
         self.cursor.fetchall.side_effect = [[record]]
@@ -2476,6 +2873,7 @@ class TestTape(unittest.TestCase):
               'modified_dt': datetime(2021, 5, 9, 6, 47, 25), 'validate_mode': 0, 'user_save_till': None,
               'metadata_id': '62791a11c2c506c5afdfce76', 'auto_uncompress': 0, 'remote_purge_days': None,
               'transfer_mode': 0}],
+            [],
             [{'file_id': 14512785, 'transaction_id': 1, 'file_name': '3300052084.tar.gz',
               'file_path': '/global/dna/dm_archive/img/submissions/268439', 'origin_file_name': '3300052084.tar.gz',
               'origin_file_path': '/global/dna/projectdirs/microbial/img_web_data_ava/download', 'file_size': 3323992,
@@ -2725,6 +3123,7 @@ class TestTape(unittest.TestCase):
               'dt_to_release': datetime(2022, 5, 10, 6, 45, 51)}],
             [{'file_status_history_id': 140881594, 'file_id': 14512785, 'file_status_id': 1,
               'dt_begin': datetime(2022, 5, 9, 6, 45), 'dt_end': datetime(2022, 5, 9, 6, 45)}],
+            [],
         ]
 
         self.tape.post_replacefile2([64391], {'file_ingest_status_id': 22})
@@ -2929,6 +3328,25 @@ class TestTape(unittest.TestCase):
             'select * from file where (file_name=%s and file_path=%s) or (origin_file_name=%s and origin_file_path=%s) order by file_id desc limit 1',
             ['268439', '/global/dna/dm_archive/img/submissions', '268439', '/global/dna/dm_archive/img/submissions'])
 
+    def test_Tape_post_latestfiles(self):
+        self.cursor.fetchall.side_effect = [
+            [{'file_id': 1, 'file_name': 'a.txt', 'file_path': '/path/to', 'origin_file_name': 'a.txt',
+              'origin_file_path': '/origin', 'metadata_id': 'm1'}],
+            [{'file_id': 2, 'file_name': 'b.txt', 'file_path': '/archive', 'origin_file_name': 'a.txt',
+              'origin_file_path': '/path/to', 'metadata_id': 'm2'},
+             {'file_id': 3, 'file_name': 'c.txt', 'file_path': '/archive', 'origin_file_name': 'c.txt',
+              'origin_file_path': '/path/to', 'metadata_id': 'm3'}],
+        ]
+
+        records = self.tape.post_latestfiles(None, {'files': ['/path/to/a.txt', '/path/to/c.txt', '/path/to/d.txt',
+                                                              '/path/to/a.txt']})
+
+        self.assertEqual({file: record.get('metadata_id') for file, record in records.items()},
+                         {'/path/to/a.txt': 'm2', '/path/to/c.txt': 'm3'})
+        self.cursor.execute.assert_any_call(
+            'select file_id, file_name, file_path, origin_file_name, origin_file_path, metadata_id from file where (file_path, file_name) in ((%s, %s), (%s, %s), (%s, %s))',
+            ['/path/to', 'a.txt', '/path/to', 'c.txt', '/path/to', 'd.txt'])
+
     def test_Tape_post_service(self):
         self.cursor.lastrowid = 100
         request = {'service': 'foobar', 'submited_dt': None, 'started_dt': '2022-05-08 9:54:15',
@@ -3125,6 +3543,29 @@ class TestTape(unittest.TestCase):
 
         self.assertEqual(self.tape.put_file([14509150], request), 1)
 
+    @patch('tape.restful.RestServer')
+    def test_Tape_put_file_copy_complete_md5sum(self, restserver):
+        server = Mock()
+        restserver.Instance.return_value = server
+        self.cursor.execute.return_value = 1
+        self.cursor.fetchall.side_effect = [
+            [{'origin_file_path': '/global/cfs/cdirs/img/annotated_submissions/268379',
+              'origin_file_name': 'Ga0536210_prodigal_proteins.faa', 'local_purge_days': 2, 'file_id': 14509150,
+              'file_size': 143528, 'validate_mode': 0, 'backup_record_id': 18821766, 'service': 1,
+              'file_name': 'Ga0536210_prodigal_proteins.faa',
+              'file_path': '/global/dna/dm_archive/img/submissions/268379', 'md5sum': None, 'division': 'jgi'}],
+        ]
+        md5_queue_size = self.tape.divisions.get('jgi').md5_queue.get_size()
+
+        self.assertEqual(self.tape.put_file([14509150], {'file_status_id': 4,
+                                                         'md5sum': 'fc33fde6efe1047ae6dc6336546ac4a7'}), 1)
+
+        server.run_method.assert_any_call('metadata', 'add_update', {'file_id': 14509150},
+                                          {'file_status_id': 4, 'file_status': 'COPY_COMPLETE',
+                                           'md5sum': 'fc33fde6efe1047ae6dc6336546ac4a7'})
+        self.assertNotIn('insert into md5_queue', str(self.cursor.execute.mock_calls))
+        self.assertEqual(self.tape.divisions.get('jgi').md5_queue.get_size(), md5_queue_size)
+
     def test_Tape_md5_selected(self):
         self.tape.md5_selected({'md5_queue_id': 431849})
 
@@ -3148,19 +3589,37 @@ class TestTape(unittest.TestCase):
         server = Mock()
         server.run_method.return_value = metadata_response
         restserver.Instance.return_value = server
+        self.cursor.fetchall.return_value = [{'file_id': 14509150}]
 
         self.assertEqual(self.tape.tar_selected({'file_id': 14509150}), expected)
         for c in expected_calls:
             self.assertIn(c, self.cursor.mock_calls)
+        self.assertIn(call.execute('select * from file where file_id=%s and file_status_id=%s limit 500', [14509150, 14]),
+                      self.cursor.mock_calls)
 
     def test_Tape_copy_selected(self):
-        self.tape.copy_selected({'file_id': 14509150})
+        self.cursor.fetchall.return_value = [{'file_id': 14509150, 'file_name': 'foo.txt'}]
+
+        self.assertEqual(self.tape.copy_selected({'file_id': 14509150}), {'file_id': 14509150, 'file_name': 'foo.txt'})
 
         self.cursor.execute.assert_called_with('update file set file_status_id=%s where file_id=%s', (3, 14509150))
 
+    def test_Tape_copy_selected_no_longer_ready(self):
+        self.cursor.fetchall.return_value = []
+
+        self.assertIsNone(self.tape.copy_selected({'file_id': 14509150}))
+
+        self.cursor.execute.assert_called_with('select * from file where file_id=%s and file_status_id=%s limit 500',
+                                               [14509150, 2])
+
     def test_Tape_transfer_selected(self):
-        self.tape.transfer_selected({'records': [{'backup_record_id': 3001}]})
+        self.cursor.fetchall.side_effect = [[{'backup_record_id': 3001}]]
+
+        self.assertEqual(self.tape.transfer_selected({'records': [{'backup_record_id': 3001}]}), {})
 
+        self.assertIn(call.execute(
+            'select backup_record_id from backup_record where backup_record_id in (%s) and backup_record_status_id in (%s,%s)',
+            [3001, 1, 2]), self.cursor.mock_calls)
         self.assertIn(
             call.execute('update backup_record set backup_record_status_id=3 where backup_record_id in (3001)', ()),
             self.cursor.mock_calls)
@@ -3168,6 +3627,30 @@ class TestTape(unittest.TestCase):
             'update file f left join backup_record b on b.file_id=f.file_id set file_status_id=7 where backup_record_id in (3001)',
             ()), self.cursor.mock_calls)
 
+    def test_Tape_transfer_selected_drops_records_no_longer_waiting(self):
+        # 3002 was put by another task, 3001 was queued twice in the same tar
+        self.cursor.fetchall.side_effect = [[{'backup_record_id': 3001}, {'backup_record_id': 3003}]]
+        record = {'file_size': 300, 'service': 1,
+                  'records': [{'backup_record_id': 3001}, {'backup_record_id': 3002}, {'backup_record_id': 3001},
+                              {'backup_record_id': 3003}]}
+
+        self.assertEqual(self.tape.transfer_selected(record),
+                         {'file_size': 300, 'service': 1,
+                          'records': [{'backup_record_id': 3001}, {'backup_record_id': 3003}]})
+
+        self.assertIn(
+            call.execute('update backup_record set backup_record_status_id=3 where backup_record_id in (3001, 3003)', ()),
+            self.cursor.mock_calls)
+
+    def test_Tape_transfer_selected_skips_task_with_no_records_waiting(self):
+        self.cursor.fetchall.side_effect = [[]]
+
+        self.assertIsNone(self.tape.transfer_selected({'records': [{'backup_record_id': 3001}]}))
+
+        self.assertNotIn(
+            call.execute('update backup_record set backup_record_status_id=3 where backup_record_id in (3001)', ()),
+            self.cursor.mock_calls)
+
     def test_Tape_pull_selected(self):
         pull_queue_records = [{'pull_queue_id': 11527020, 'file_id': 123}]
         info = [{'pull_queue_id': 11527020, 'volume': 'AG8142', 'position_a': 142, 'position_b': 0,
@@ -3182,7 +3665,7 @@ class TestTape(unittest.TestCase):
             call.execute('update pull_queue set queue_status_id = %s where pull_queue_id = %s', (2, 11527020)),
             call.execute('update file set file_status_id = %s where file_id = %s', (12, 123)),
             call.execute(
-                'select q.pull_queue_id, q.volume, q.position_a, q.position_b, q.requestor, q.priority, f.file_permissions, f.file_path, b.service, f.file_name, b.remote_file_path, b.remote_file_name, b.backup_record_id, t.remote_path, b.tar_record_id, f.division from file f join pull_queue q on f.file_id = q.file_id left join backup_record b on f.file_id = b.file_id and b.service = %s left join tar_record t on t.tar_record_id = b.tar_record_id where q.queue_status_id = %s and q.volume = %s',
+                'select q.pull_queue_id, q.volume, q.position_a, q.position_b, q.requestor, q.priority, f.file_permissions, f.file_path, b.service, f.file_name, b.remote_file_path, b.remote_file_name, b.backup_record_id, t.remote_path, b.tar_record_id, b.tar_offset, b.tar_size, f.division from file f join pull_queue q on f.file_id = q.file_id left join backup_record b on f.file_id = b.file_id and b.service = %s left join tar_record t on t.tar_record_id = b.tar_record_id where q.queue_status_id = %s and q.volume = %s',
                 [1, 2, 'AG8142']),
         ]
 
@@ -3209,7 +3692,9 @@ class TestTape(unittest.TestCase):
                   'tar_record_id': 392751,
                   'dt_modified': datetime(2022, 5, 9, 6, 56, 33),
                   'position_a': 142}
-        self.cursor.fetchall.side_effect = [[{'file_id': 13368043}]]
+        self.cursor.fetchall.side_effect = [[{'file_id': 13368043}],
+                                            [{'pull_queue_id': 11527020, 'volume': 'AG8142', 'priority': 6,
+                                              'queue_status_id': queue_status_id, 'division': 'jgi'}]]
 
         self.tape.put_pull([11527020], record)
 
@@ -3223,6 +3708,49 @@ class TestTape(unittest.TestCase):
         self.assertIn(call.execute('update file set  file_status_id=%s where file_id=13368043', [file_status_id]),
                       self.cursor.mock_calls)
 
+    @patch('pymysql.connect')
+    @patch('tape.restful.RestServer')
+    def test_Tape_put_pulls(self, restserver, connect):
+        connect.return_value = self.connection
+        server = Mock()
+        server.run_method.return_value = {'foo': 'bar'}
+        restserver.Instance.return_value = server
+        pulls = [{'pull_queue_id': 1, 'volume': 'AG8142', 'position_a': 142, 'position_b': 0, 'queue_status_id': 1},
+                 {'pull_queue_id': 2, 'volume': 'AG8142', 'position_a': 150, 'position_b': 0, 'queue_status_id': 1},
+                 {'pull_queue_id': 3, 'queue_status_id': 3},
+                 {'pull_queue_id': 4, 'queue_status_id': 3},
+                 {'pull_queue_id': 5, 'queue_status_id': 2}]
+        self.cursor.fetchall.side_effect = [
+            [{'pull_queue_id': 1, 'file_id': 101}, {'pull_queue_id': 2, 'file_id': 102},
+             {'pull_queue_id': 3, 'file_id': 103}, {'pull_queue_id': 4, 'file_id': 104},
+             {'pull_queue_id': 5, 'file_id': 105}],
+            [{'pull_queue_id': 1, 'volume': 'AG8142', 'priority': 1, 'queue_status_id': 1, 'division': 'jgi'},
+             {'pull_queue_id': 2, 'volume': 'AG8142', 'priority': 1, 'queue_status_id': 1, 'division': 'jgi'},
+             {'pull_queue_id': 3, 'volume': 'AG1234', 'priority': 1, 'queue_status_id': 3, 'division': 'jgi'},
+             {'pull_queue_id': 4, 'volume': 'AG1234', 'priority': 1, 'queue_status_id': 3, 'division': 'jgi'},
+             {'pull_queue_id': 5, 'volume': 'AG1234', 'priority': 1, 'queue_status_id': 2, 'division': 'jgi'}],
+        ]
+
+        self.assertEqual(self.tape.put_pulls(None, {'pulls': pulls}), {'pull_queue_records': 5})
+        self.assertIn(call.executemany(
+            'update pull_queue set position_a = %s, position_b = %s, queue_status_id = %s, volume = %s where pull_queue_id = %s',
+            [[142, 0, 1, 'AG8142', 1], [150, 0, 1, 'AG8142', 2]]), self.cursor.mock_calls)
+        self.assertIn(call.executemany('update pull_queue set queue_status_id = %s where pull_queue_id = %s',
+                                       [[3, 3], [3, 4], [2, 5]]), self.cursor.mock_calls)
+        # The files are moved to their restore state in the same transaction, one statement per state
+        file_updates = [
+            call.cursor().execute('update file set file_status_id=%s where file_id in (%s, %s)', [13, 103, 104]),
+            call.cursor().execute('update file set file_status_id=%s where file_id in (%s)', [12, 105])]
+        for file_update in file_updates:
+            self.assertLess(self.connection.mock_calls.index(file_update),
+                            self.connection.mock_calls.index(call.commit()))
+        self.connection.commit.assert_called_once()
+        server.run_method.assert_called_once_with('metadata', 'add_bulk_update', 'file_id', [
+            (103, {'file_status_id': 13, 'file_status': 'RESTORED'}),
+            (104, {'file_status_id': 13, 'file_status': 'RESTORED'}),
+            (105, {'file_status_id': 12, 'file_status': 'RESTORE_IN_PROGRESS'})])
+        self.assertEqual(self.tape.divisions['jgi'].pull_queue.index.get_volume_requests('AG8142'), [1, 2])
+
     def test_Tape_get_heartbeat(self):
         prep_queue = Mock()
         pull_queue = Mock()
@@ -3343,6 +3871,7 @@ class TestTape(unittest.TestCase):
                                                                'files_restoring': 2,
                                                                'disk_usage_files_restoring': 10,
                                                                'disk_usage_other': 49999960,
+                                                               'divisions': {'jgi': {'files': 10, 'disk_usage': 50}},
                                                                'dna_free_tb': 4.999999e-05})
 
     def test_Tape_add_all_to_queue_by_feature(self):
@@ -3525,11 +4054,12 @@ class TestTape(unittest.TestCase):
         self.assertRaises(common.HttpException, self.tape.post_backup_service_for_file, [1], request)
 
     @parameterized.expand([
-        ('unsupported_feature', ['not_supported'], [], {}, None, {}, [], [3]),
+        ('unsupported_feature', ['not_supported'], [{'pull_queue_id': 1, 'volume': 'volume_a', 'priority': 0}], [], {},
+         None, {}, [], [3]),
         ('no_volume_locks_priority_not_in_enabled_queue',
          ['foo'],
-         [[{'pull_queue_id': 1, 'volume': 'volume_a', 'priority': 0}],
-          [{'pull_queue_id': 1, 'file_id': 123}],
+         [{'pull_queue_id': 1, 'volume': 'volume_a', 'priority': 0}],
+         [[{'pull_queue_id': 1, 'file_id': 123}],
           [{'pull_queue_id': 1, 'volume': 'volume_a', 'position_a': 142, 'position_b': 0,
             'requestor': 'foo@bar.com', 'priority': 0, 'file_permissions': '0100640',
             'file_path': '/global/dna/dm_archive/img/submissions/254666', 'service': 1,
@@ -3555,15 +4085,13 @@ class TestTape(unittest.TestCase):
                     'volume': 'volume_a'}],
           'uses_resources': ['foo', 'bar']},
          {'volume_a': {'locked': datetime(2000, 1, 2, 3, 4, 5), 'pull_queue_id': 1}},
-         [call.execute(
-             'select pull_queue_id, volume, priority from pull_queue join file using(file_id) where queue_status_id = %s and volume is not null and division = %s and priority in (%s, %s, %s) order by priority, pull_queue_id limit 1',
-             [1, 'jgi', 0, 1, 3])],
+         [],
          [3],
          ),
         ('volume_locks_priority_not_in_enabled_queue',
          ['foo'],
-         [[{'pull_queue_id': 1, 'volume': 'volume_a', 'priority': 0}],
-          [{'pull_queue_id': 1, 'file_id': 123}],
+         [{'pull_queue_id': 1, 'volume': 'volume_a', 'priority': 0}],
+         [[{'pull_queue_id': 1, 'file_id': 123}],
           [{'pull_queue_id': 1, 'volume': 'volume_a', 'position_a': 142, 'position_b': 0,
             'requestor': 'foo@bar.com', 'priority': 0, 'file_permissions': '0100640',
             'file_path': '/global/dna/dm_archive/img/submissions/254666', 'service': 1,
@@ -3593,15 +4121,13 @@ class TestTape(unittest.TestCase):
                        'pull_queue_id': 1},
           'volume_b': {'locked': datetime(2000, 1, 2, 3, 4, 5),
                        'pull_queue_id': 2}},
-         [call.execute(
-             'select pull_queue_id, volume, priority from pull_queue join file using(file_id) where queue_status_id = %s and volume is not null and division = %s and priority in (%s, %s, %s) and volume not in (%s) order by priority, pull_queue_id limit 1',
-             [1, 'jgi', 0, 1, 3, 'volume_b'])],
+         [],
          [3],
          ),
         ('no_volume_locks_priority_in_enabled_queue_remaining_tasks_by_priority_empty',
          ['foo'],
-         [[{'pull_queue_id': 1, 'volume': 'volume_a', 'priority': 3}],
-          [{'pull_queue_id': 1, 'file_id': 123}],
+         [{'pull_queue_id': 1, 'volume': 'volume_a', 'priority': 3}],
+         [[{'pull_queue_id': 1, 'file_id': 123}],
           [{'pull_queue_id': 1, 'volume': 'volume_a', 'position_a': 142, 'position_b': 0,
             'requestor': 'foo@bar.com', 'priority': 3, 'file_permissions': '0100640',
             'file_path': '/global/dna/dm_archive/img/submissions/254666', 'service': 1,
@@ -3629,17 +4155,14 @@ class TestTape(unittest.TestCase):
           'uses_resources': ['foo', 'bar']},
          {'volume_a': {'locked': datetime(2000, 1, 2, 3, 4, 5),
                        'pull_queue_id': 1}},
-         [call.execute(
-             'select pull_queue_id, volume, priority from pull_queue join file using(file_id) where queue_status_id = %s and volume is not null and division = %s and priority in (%s, %s, %s) order by priority, pull_queue_id limit 1',
-             [1, 'jgi', 0, 1, 3]),
-          call.execute('select count(*) as cnt from pull_queue join file using(file_id) where queue_status_id = %s and priority = %s and division = %s limit 500',
+         [call.execute('select count(*) as cnt from pull_queue join file using(file_id) where queue_status_id = %s and priority = %s and division = %s limit 500',
                        [1, 3, 'jgi'])],
          []
          ),
         ('no_volume_locks_priority_in_enabled_queue_remaining_tasks_by_priority_not_empty',
          ['foo'],
-         [[{'pull_queue_id': 1, 'volume': 'volume_a', 'priority': 3}],
-          [{'pull_queue_id': 1, 'file_id': 123}],
+         [{'pull_queue_id': 1, 'volume': 'volume_a', 'priority': 3}],
+         [[{'pull_queue_id': 1, 'file_id': 123}],
           [{'pull_queue_id': 1, 'volume': 'volume_a', 'position_a': 142, 'position_b': 0,
             'requestor': 'foo@bar.com', 'priority': 3, 'file_permissions': '0100640',
             'file_path': '/global/dna/dm_archive/img/submissions/254666', 'service': 1,
@@ -3667,31 +4190,29 @@ class TestTape(unittest.TestCase):
           'uses_resources': ['foo', 'bar']},
          {'volume_a': {'locked': datetime(2000, 1, 2, 3, 4, 5),
                        'pull_queue_id': 1}},
-         [call.execute(
-             'select pull_queue_id, volume, priority from pull_queue join file using(file_id) where queue_status_id = %s and volume is not null and division = %s and priority in (%s, %s, %s) order by priority, pull_queue_id limit 1',
-             [1, 'jgi', 0, 1, 3]),
-          call.execute('select count(*) as cnt from pull_queue join file using(file_id) where queue_status_id = %s and priority = %s and division = %s limit 500',
+         [call.execute('select count(*) as cnt from pull_queue join file using(file_id) where queue_status_id = %s and priority = %s and division = %s limit 500',
                        [1, 3, 'jgi'])],
          [3],
          ),
         ('no_volume_locks_priority_not_in_enabled_queue_no_tasks_by_volume',
          ['foo'],
-         [[]],
+         [],
+         [],
          {},
          None,
          {},
-         [call.execute(
-             'select pull_queue_id, volume, priority from pull_queue join file using(file_id) where queue_status_id = %s and volume is not null and division = %s and priority in (%s, %s, %s) order by priority, pull_queue_id limit 1',
-             [1, 'jgi', 0, 1, 3])],
+         [],
          [3],
          ),
     ])
     @patch('tape.datetime')
-    def test_Tape_PullQueue_next(self, _description, available_features, sql_responses, volume_locks, expected,
-                                 expected_volume_locks, expected_sql_calls, expected_enabled_queues, datetime_mock):
+    def test_Tape_PullQueue_next(self, _description, available_features, indexed_records, sql_responses,
+                                 volume_locks, expected, expected_volume_locks, expected_sql_calls,
+                                 expected_enabled_queues, datetime_mock):
         datetime_mock.datetime.now.return_value = datetime(2000, 1, 2, 3, 4, 5)
         self.cursor.fetchall.side_effect = sql_responses
         pull_queue = Tape.PullQueue('pull', self.tape, 'jgi', 1, ['foo', 'bar'])
+        pull_queue.index.load(indexed_records)
         pull_queue.enabled_queues.append(3)
         pull_queue.volume_locks = volume_locks
 
@@ -3700,6 +4221,22 @@ class TestTape(unittest.TestCase):
         self.assertEqual(pull_queue.enabled_queues, expected_enabled_queues)
         for c in expected_sql_calls:
             self.assertIn(c, self.cursor.mock_calls)
+        if expected:
+            self.assertEqual(len(pull_queue.index), 0)
+
+    def test_Tape_PullQueue_next_hold_window(self):
+        pull_queue = Tape.PullQueue('pull', self.tape, 'jgi', 1, ['foo'], hold_windows={'1': 300})
+        pull_queue.index.add(1, 'volume_a', 1)
+        pull_queue.index.add(2, 'volume_b', 0)
+        self.cursor.lastrowid = 1
+        self.cursor.fetchall.side_effect = [[{'pull_queue_id': 2, 'file_id': 20}],
+                                            [{'pull_queue_id': 2, 'volume': 'volume_b'}]]
+
+        self.assertEqual(pull_queue.next(['foo']), {'uses_resources': ['foo'],
+                                                    'data': [{'pull_queue_id': 2, 'volume': 'volume_b'}]})
+        self.assertIsNone(pull_queue.next(['foo']))
+        self.assertEqual(pull_queue.hold_windows, {1: 300.0})
+        self.assertIn(1, pull_queue.index)
 
     def test_Tape_PullQueue_init_locks(self):
         pull_queue = Tape.PullQueue('pull', self.tape, 'jgi', 1, ['foo', 'bar'])
@@ -3733,18 +4270,48 @@ class TestTape(unittest.TestCase):
         self.assertEqual(pull_queue.enabled_queues, [4, 5, 6, 7])
 
     def test_Tape_PullQueue_get_pending_tasks_count(self):
-        self.cursor.fetchall.side_effect = [[{'cnt': 100}]]
         pull_queue = Tape.PullQueue('pull', self.tape, 'jgi', 1, ['foo'])
+        pull_queue.index.load([{'pull_queue_id': 1, 'volume': 'volume_a', 'priority': 1},
+                               {'pull_queue_id': 2, 'volume': 'volume_a', 'priority': 2},
+                               {'pull_queue_id': 3, 'volume': 'volume_b', 'priority': 1}])
 
-        self.assertEqual(pull_queue.get_pending_tasks_count(), 100)
+        self.assertEqual(pull_queue.get_pending_tasks_count(), 2)
 
     def test_Tape_PullQueue_delete_pending_tasks_for_file(self):
+        self.cursor.fetchall.side_effect = [[{'pull_queue_id': 1}]]
         pull_queue = Tape.PullQueue('pull', self.tape, 'jgi', 1, ['foo'])
+        pull_queue.index.load([{'pull_queue_id': 1, 'volume': 'volume_a', 'priority': 1},
+                               {'pull_queue_id': 2, 'volume': 'volume_b', 'priority': 1}])
 
         pull_queue.delete_pending_tasks_for_file(123)
 
         self.assertIn(call.execute('delete from pull_queue where file_id = %s and queue_status_id = %s', (123, 1)),
                       self.cursor.mock_calls)
+        self.assertNotIn(1, pull_queue.index)
+        self.assertIn(2, pull_queue.index)
+
+    def test_Tape_PullQueue_refresh_index(self):
+        self.cursor.fetchall.side_effect = [[{'pull_queue_id': 1, 'volume': 'volume_a', 'priority': 1},
+                                             {'pull_queue_id': 2, 'volume': 'volume_b', 'priority': 0}]]
+        pull_queue = Tape.PullQueue('pull', self.tape, 'jgi', 1, ['foo'])
+
+        pull_queue.refresh_index()
+
+        self.assertIn(call.execute(
+            'select pull_queue_id, volume, priority, unix_timestamp(dt_modified) as registered from pull_queue join file using(file_id) where queue_status_id = %s and volume is not null and division = %s',
+            [1, 'jgi']), self.cursor.mock_calls)
+        self.assertEqual(pull_queue.index.next_volume([0, 1]), {'pull_queue_id': 2, 'volume': 'volume_b', 'priority': 0})
+
+    def test_Tape_PullQueue_register(self):
+        pull_queue = Tape.PullQueue('pull', self.tape, 'jgi', 1, ['foo'])
+
+        pull_queue.register(1, 'volume_a', 1)
+        pull_queue.register(2, None, 1)
+
+        self.assertIn(1, pull_queue.index)
+        self.assertNotIn(2, pull_queue.index)
+        pull_queue.unregister([1])
+        self.assertNotIn(1, pull_queue.index)
 
     @parameterized.expand([
         ('unsupported_feature', ['not_supported'], [], None, []),
@@ -3778,8 +4345,7 @@ class TestTape(unittest.TestCase):
          [call.execute(
              'select pull_queue_id from pull_queue p join backup_record b using(file_id) where volume is null and b.service = %s and queue_status_id = %s limit %s',
              [1, 1, 1000]),
-          call.execute('update pull_queue set queue_status_id = %s where pull_queue_id = %s', (7, 1)),
-          call.execute('update pull_queue set queue_status_id = %s where pull_queue_id = %s', (7, 2)),
+          call.execute('update pull_queue set queue_status_id = %s where pull_queue_id in (%s,%s)', (7, 1, 2)),
           call.execute(
               'select p.pull_queue_id, t.tar_record_id, t.remote_path, b.remote_file_path, b.remote_file_name, b.service from pull_queue p left join tar_record t on p.tar_record_id = t.tar_record_id join backup_record b using(file_id) where b.service = %s and p.pull_queue_id in (%s,%s)',
               [1, 1, 2])]),
@@ -0,0 +1,99 @@
+import unittest
+from tar_packer import TarPacker
+from parameterized import parameterized
+
+
+def record(file_id, file_path):
+    return {'file_id': file_id, 'backup_record_id': file_id + 100, 'file_name': f'file_{file_id}.txt',
+            'file_path': file_path}
+
+
+class TestTarPacker(unittest.TestCase):
+
+    def setUp(self):
+        self.packer = TarPacker(1000, max_size=1500, max_age=3600, locality_depth=5)
+
+    @parameterized.expand([
+        ('deep', '/global/dna/dm_archive/sdm/illumina/05/26/89', '/global/dna/dm_archive/sdm/illumina'),
+        ('shallow', '/global/dna', '/global/dna'),
+        ('trailing_slash', '/global/dna/dm_archive/sdm/illumina/', '/global/dna/dm_archive/sdm/illumina'),
+    ])
+    def test_TarPacker_locality_key(self, _description, file_path, expected):
+        self.assertEqual(self.packer.locality_key(file_path), expected)
+
+    def test_TarPacker_add_flushes_at_target_size(self):
+        self.assertEqual(self.packer.add(1, record(1, '/global/dna/dm_archive/sdm/illumina/01'), 600, now=0), [])
+        self.assertEqual(self.packer.add(1, record(2, '/global/dna/dm_archive/img/data/01'), 600, now=0), [])
+        self.assertEqual(self.packer.add(2, record(3, '/global/dna/dm_archive/sdm/illumina/01'), 600, now=0), [])
+
+        tars = self.packer.add(1, record(4, '/global/dna/dm_archive/sdm/illumina/00'), 400, now=10)
+
+        self.assertEqual(tars, [{'file_size': 1000, 'root_dir': '/global/dna/dm_archive/sdm/illumina',
+                                 'records': [record(4, '/global/dna/dm_archive/sdm/illumina/00'),
+                                             record(1, '/global/dna/dm_archive/sdm/illumina/01')],
+                                 'service': 1}])
+        self.assertEqual(sorted(self.packer.pending()), ['1', '2'])
+        self.assertEqual(list(self.packer.pending().get('1')), ['/global/dna/dm_archive/img/data'])
+
+    def test_TarPacker_add_flushes_before_max_size(self):
+        self.packer.add(1, record(1, '/global/dna/dm_archive/sdm/illumina/01'), 900, now=0)
+
+        tars = self.packer.add(1, record(2, '/global/dna/dm_archive/sdm/illumina/02'), 700, now=0)
+
+        self.assertEqual([tar.get('records') for tar in tars], [[record(1, '/global/dna/dm_archive/sdm/illumina/01')]])
+        self.assertEqual(self.packer.pending().get('1').get('/global/dna/dm_archive/sdm/illumina'),
+                         {'size': 700, 'root_dir': '/global/dna/dm_archive/sdm/illumina/02',
+                          'backup_records': [record(2, '/global/dna/dm_archive/sdm/illumina/02')]})
+
+    def test_TarPacker_flush_aged_merges_neighbours(self):
+        self.packer.add(1, record(1, '/global/dna/dm_archive/sdm/pacbio/01'), 300, now=0)
+        self.packer.add(1, record(2, '/global/dna/dm_archive/img/data/01'), 500, now=0)
+        self.packer.add(1, record(3, '/global/dna/dm_archive/sdm/illumina/01'), 400, now=0)
+        self.packer.add(2, record(4, '/global/dna/dm_archive/sdm/illumina/01'), 100, now=0)
+        self.packer.add(1, record(5, '/global/dna/dm_archive/rqc/data/01'), 100, now=3000)
+
+        tars = self.packer.flush_aged(now=3600)
+
+        self.assertEqual([(tar.get('service'), tar.get('root_dir'), [r.get('file_id') for r in tar.get('records')])
+                          for tar in tars],
+                         [(1, '/global/dna/dm_archive/img/data/01', [2]),
+                          (1, '/global/dna/dm_archive/sdm', [3, 1]),
+                          (2, '/global/dna/dm_archive/sdm/illumina/01', [4])])
+        self.assertEqual(list(self.packer.pending().get('1')), ['/global/dna/dm_archive/rqc/data'])
+
+    def test_TarPacker_mixed_service_types(self):
+        self.packer.add(1, record(1, '/global/dna/dm_archive/sdm/illumina/01'), 300, now=0)
+        self.packer.add('1', record(2, '/global/dna/dm_archive/sdm/illumina/02'), 300, now=0)
+        self.packer.add('2', record(3, '/global/dna/dm_archive/img/data/01'), 300, now=0)
+
+        self.assertEqual(sorted(self.packer.pending()), ['1', '2'])
+        self.assertEqual([bin.get('files') for bin in self.packer.report().get('pending')], [2, 1])
+        tars = self.packer.flush_aged(now=3600)
+        self.assertEqual([(tar.get('service'), [r.get('file_id') for r in tar.get('records')]) for tar in tars],
+                         [(1, [1, 2]), ('2', [3])])
+
+    def test_TarPacker_flush_aged_without_max_age(self):
+        packer = TarPacker(1000)
+        packer.add(1, record(1, '/global/dna/dm_archive/sdm/illumina/01'), 300, now=0)
+
+        self.assertEqual(packer.flush_aged(now=10 ** 9), [])
+        self.assertEqual(packer.max_size, 2000)
+
+    def test_TarPacker_report(self):
+        self.packer.add(1, record(1, '/global/dna/dm_archive/sdm/illumina/01'), 1200, now=0)
+        self.packer.add(1, record(2, '/global/dna/dm_archive/img/data/01'), 200, now=0)
+        self.packer.flush_aged(now=3600)
+        self.packer.add(1, record(3, '/global/dna/dm_archive/img/data/01'), 500, now=3600)
+
+        report = self.packer.report()
+
+        self.assertEqual([(tar.get('files'), tar.get('fill'), tar.get('reason')) for tar in report.get('tars')],
+                         [(1, 1.2, 'size'), (1, 0.2, 'age')])
+        self.assertEqual(report.get('summary'), {'tars': 2, 'files': 2, 'bytes': 1400, 'mean_fill': 0.7,
+                                                 'under_half_full': 1, 'over_target': 1})
+        self.assertEqual([(pending.get('locality'), pending.get('files'), pending.get('fill'))
+                          for pending in report.get('pending')], [('/global/dna/dm_archive/img/data', 1, 0.5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import tarfile
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import tar_stream
+
+
+class TestTarStream(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.root = os.path.join(self.temp_dir.name, 'root')
+        for folder in ['a/b/c', 'a/d', 'e', 'skip/f']:
+            os.makedirs(os.path.join(self.root, folder))
+        for i, file in enumerate(['top.txt', 'a/one.txt', 'a/b/two.txt', 'a/b/c/three.txt', 'a/d/four.txt',
+                                  'e/five.txt', 'skip/f/six.txt', 'a/skip.txt']):
+            with open(os.path.join(self.root, file), 'wb') as f:
+                f.write(os.urandom(100 * i))
+        os.symlink('one.txt', os.path.join(self.root, 'a', 'link.txt'))
+        os.symlink(os.path.join(self.root, 'e'), os.path.join(self.root, 'a', 'folder_link'))
+
+    def test_scan_tree_walk_order(self):
+        expected = []
+        for root, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if os.path.join(root, d)[len(self.root) + 1:] != 'skip']
+            expected.extend(os.path.join(root, file)[len(self.root) + 1:] for file in files)
+        expected.remove('a/skip.txt')
+
+        entries = list(tar_stream.scan_tree(self.root, ignore=['skip', 'a/skip.txt'], workers=3))
+
+        self.assertEqual([entry.tar_dest for entry in entries], expected)
+        link = [entry for entry in entries if entry.tar_dest == 'a/link.txt'][0]
+        self.assertEqual((link.stat, link.realpath), (None, os.path.join(self.root, 'a', 'one.txt')))
+        top = [entry for entry in entries if entry.tar_dest == 'top.txt'][0]
+        self.assertEqual((top.stat.st_size, top.realpath, top.folder_files), (0, None, 1))
+
+    def test_scan_tree_unreadable_folder(self):
+        self.assertEqual(list(tar_stream.scan_tree(os.path.join(self.root, 'missing'))), [])
+
+    @patch('tar_stream.SMALL_FILE_SIZE', 200)
+    def test_TarWriter_add_all(self):
+        os.link(os.path.join(self.root, 'a', 'd', 'four.txt'), os.path.join(self.root, 'e', 'hard_link.txt'))
+        entries = [entry for entry in tar_stream.scan_tree(self.root) if entry.realpath is None]
+        entries.append(tar_stream.Entry('a/link.txt', os.path.join(self.root, 'a', 'link.txt'), None,
+                                        linkname='one.txt'))
+        entries.append(tar_stream.Entry('gone.txt', os.path.join(self.root, 'gone.txt'),
+                                        os.stat(os.path.join(self.root, 'top.txt'))))
+        tar_file = os.path.join(self.temp_dir.name, 'files.tar')
+
+        with tar_stream.TarWriter(tar_file, read_workers=2, prefetch_bytes=300) as writer:
+            unreadable = writer.add_all(entries)
+
+        self.assertEqual([entry.tar_dest for entry in unreadable], ['gone.txt'])
+        with tarfile.open(tar_file) as tar:
+            names = tar.getnames()
+            self.assertEqual(names, [entry.tar_dest for entry in entries[:-1]])
+            self.assertEqual(tar.getmember('a/link.txt').linkname, 'one.txt')
+            hard_links = [tar.getmember(name) for name in names if name in ('a/d/four.txt', 'e/hard_link.txt')]
+            self.assertEqual([member.islnk() for member in hard_links], [False, True])
+            for name in names:
+                member = tar.getmember(name)
+                if member.isfile():
+                    with open(os.path.join(self.root, name), 'rb') as f:
+                        self.assertEqual(tar.extractfile(member).read(), f.read())
+                    self.assertEqual(os.stat(os.path.join(self.root, name)).st_mtime, member.mtime)
@@ -63,6 +63,52 @@ class TestTask(unittest.TestCase):
         self.assertEqual(queue.record_count, 0)
         self.assertEqual(queue.currently_running, 1)
 
+    def test_Queue_next_round_robin(self):
+        queue = Queue('foobar', 0)
+        queue.add({'name': 'a1'}, ['foo'])
+        queue.add({'name': 'a2'}, ['foo'])
+        queue.add({'name': 'b1'}, ['bar'])
+        queue.add({'name': 'c1'}, ['foo', 'baz'])
+        queue.add({'name': 'c2'}, ['foo', 'baz'])
+
+        self.assertEqual([queue.next(['foo', 'baz']).get('data').get('name') for _ in range(4)],
+                         ['a1', 'c1', 'a2', 'c2'])
+        self.assertIsNone(queue.next(['foo', 'baz']))
+        self.assertEqual(queue.next(['bar']), {'uses_resources': ['bar'], 'data': {'name': 'b1'}})
+
+        # A feature set that was emptied takes its turn again once it has tasks
+        queue.add({'name': 'a3'}, ['foo'])
+        queue.add({'name': 'd1'}, ['qux'])
+        self.assertEqual(queue.next(['foo', 'qux']).get('data'), {'name': 'd1'})
+        self.assertEqual(queue.next(['foo', 'qux']).get('data'), {'name': 'a3'})
+        self.assertEqual(queue.record_count, 0)
+
+    def test_Queue_next_skips_unselected_tasks(self):
+        queue = Queue('foobar', 0, task_selected=lambda x: None if x.get('stale') else {})
+        for i in range(2000):
+            queue.add({'name': f'stale_{i}', 'stale': True}, ['foo'])
+        queue.add({'name': 'foobar'}, ['foo'])
+
+        self.assertEqual(queue.next(['foo']), {'uses_resources': ['foo'], 'data': {'name': 'foobar'}})
+        self.assertEqual(queue.record_count, 0)
+        self.assertEqual(queue.currently_running, 1)
+
+    def test_Queue_reset_resyncs_ready_tasks(self):
+        queue = Queue('foobar', 0)
+        queue.add({'name': 'foo'}, ['foo'])
+        queue.feature_queues.get('foo').clear()
+
+        self.assertIsNone(queue.next(['foo']))
+        queue.feature_queues.get('foo').append({'name': 'bar'})
+        queue.reset()
+        self.assertEqual(queue.next(['foo']).get('data'), {'name': 'bar'})
+
+    def test_feature_mask(self):
+        self.assertEqual(task.feature_mask(['foo', 'bar']), task.feature_mask(['bar', 'foo']))
+        self.assertEqual(task.feature_mask(['foo']) & ~task.feature_mask(['bar', 'foo']), 0)
+        self.assertNotEqual(task.feature_mask(['foo', 'baz']) & ~task.feature_mask(['bar', 'foo']), 0)
+        self.assertEqual(task.feature_mask([]), 0)
+
     def test_Queue_lost(self):
         def on_lost(_data):
             count[0] -= 1
@@ -189,6 +235,7 @@ class TestTask(unittest.TestCase):
         expected = {'current_tasks': {},
                     'current_used_resources': {},
                     'services': {},
+                    'leases': {},
                     'tasks': {'foobar': {'currently_running': 1,
                                          'file_size': 1132795,
                                          'record_count': 1}}}
@@ -397,6 +444,94 @@ class TestTask(unittest.TestCase):
         self.assertEqual(task_manager.current_resource_counts.get('foo'), 1)
         self.assertEqual(task_manager.current_resource_counts.get('bar'), 1)
 
+    @parameterized.expand([
+        ('max_tasks', 3, None, ['a', 'b', 'c']),
+        ('max_bytes', 10, 250, ['a', 'b', 'c']),
+        ('max_bytes_first_task_over_budget', 10, 50, ['a']),
+        ('fewer_tasks_queued', 10, None, ['a', 'b', 'c', 'd']),
+    ])
+    @patch('task.datetime')
+    def test_TaskManager_get_lease(self, _description, max_tasks, max_bytes, expected_names, datetime_mock):
+        datetime_mock.datetime.now.return_value = datetime(2000, 1, 2, 3, 4, 5)
+        queue = Queue('md5', 0)
+        queue.add_all([{'name': name, 'file_size': 100} for name in ['a', 'b', 'c', 'd']], ['foo'])
+        task_manager = TaskManager('jgi', {'foo': 5})
+        task_manager.set_queues(queue)
+        task_manager.task_prefix = 'AAA'
+
+        lease = task_manager.get_lease(['foo'], ['md5'], 'service_id', max_tasks, max_bytes)
+
+        self.assertEqual(lease.get('lease_id'), 'AAAL1')
+        self.assertEqual([task_data.get('data').get('name') for task_data in lease.get('tasks')], expected_names)
+        self.assertEqual(lease.get('bytes'), 100 * len(expected_names))
+        self.assertEqual(task_manager.leases.get('AAAL1').get('task_ids'),
+                         {task_data.get('task_id') for task_data in lease.get('tasks')})
+        self.assertEqual(set(task_manager.current_tasks), task_manager.leases.get('AAAL1').get('task_ids'))
+        self.assertEqual(task_manager.current_resource_counts, {'foo': len(expected_names)})
+
+    def test_TaskManager_get_lease_no_tasks(self):
+        task_manager = TaskManager('jgi')
+        task_manager.set_queues(Queue('md5', 0))
+
+        self.assertIsNone(task_manager.get_lease(['foo'], ['md5'], 'service_id', 10))
+        self.assertEqual(task_manager.leases, {})
+
+    def test_TaskManager_complete_lease(self):
+        def on_finish(data):
+            finish.append(data)
+        finish = []
+        queue = Queue('md5', 0, on_finish=on_finish)
+        queue.add_all([{'name': name} for name in ['a', 'b', 'c']], ['foo'])
+        task_manager = TaskManager('jgi')
+        task_manager.set_queues(queue)
+        lease = task_manager.get_lease(['foo'], ['md5'], 'service_id', 3)
+        task_ids = [task_data.get('task_id') for task_data in lease.get('tasks')]
+
+        task_manager.complete_lease(lease.get('lease_id'), {task_ids[0]: True}, [task_ids[2]])
+
+        self.assertEqual(finish, [{'name': 'a'}])
+        self.assertEqual(task_manager.leases.get(lease.get('lease_id')).get('task_ids'), {task_ids[1]})
+        self.assertEqual(list(queue.feature_queues.get('foo')), [{'name': 'c'}])
+        self.assertEqual(queue.currently_running, 1)
+        self.assertEqual(task_manager.current_resource_counts, {'foo': 1})
+
+        task_manager.complete_lease(lease.get('lease_id'), {task_ids[1]: False}, [])
+
+        self.assertEqual(task_manager.leases, {})
+        self.assertEqual(task_manager.current_tasks, {})
+        self.assertEqual(queue.currently_running, 0)
+
+    @patch('task.datetime')
+    def test_TaskManager_expire_leases(self, datetime_mock):
+        def on_lost(data):
+            lost.append(data)
+        lost = []
+        datetime_mock.datetime.now.return_value = datetime(2000, 1, 2, 3, 4, 5)
+        queue = Queue('md5', 0, on_lost=on_lost)
+        queue.add_all([{'name': name} for name in ['a', 'b']], ['foo'])
+        task_manager = TaskManager('jgi', lease_timeout=600)
+        task_manager.set_queues(queue)
+        first = task_manager.get_lease(['foo'], ['md5'], 'service_id', 1)
+        second = task_manager.get_lease(['foo'], ['md5'], 'service_id', 1)
+
+        datetime_mock.datetime.now.return_value = datetime(2000, 1, 2, 3, 12, 5)
+        self.assertTrue(task_manager.heartbeat_lease(second.get('lease_id')))
+        datetime_mock.datetime.now.return_value = datetime(2000, 1, 2, 3, 14, 5)
+        task_manager.expire_leases()
+
+        self.assertEqual(lost, [{'name': 'a'}])
+        self.assertEqual(list(task_manager.leases), [second.get('lease_id')])
+        self.assertFalse(task_manager.heartbeat_lease(first.get('lease_id')))
+        self.assertEqual(list(task_manager.current_tasks), [second.get('tasks')[0].get('task_id')])
+
+    @parameterized.expand([
+        ('dict', {'file_size': 100}, 100),
+        ('list', [{'file_size': 100}, {'file_size': 200}, {'foo': 'bar'}], 300),
+        ('no_size', {'file_size': None}, 0),
+    ])
+    def test_task_size(self, _description, data, expected):
+        self.assertEqual(task.task_size(data), expected)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -64,11 +64,16 @@ class File(restful.Restful):
             cursor = data['cursor_id']
             rows = data['record_count']
             data = data['records']
-            while len(data) < rows:
+            while rows is None or len(data) < rows:
                 try:
-                    data.extend(restful.run_internal(module, 'get_nextpage', cursor)['records'])
+                    page = restful.run_internal(module, 'get_nextpage', cursor)
                 except Exception:
                     break
+                if not page['records']:
+                    break
+                data.extend(page['records'])
+                cursor = page.get('cursor_id', cursor)
+                rows = page.get('record_count', rows)
         for i in range(len(data)):
             row = data[i]
             line = [''] * onCol
@@ -105,6 +105,7 @@ class Core(MySQLRestful):
                 self.permission_tree[child] = []
                 self.permission_tree[child].append(child)
             self.permission_tree[parent].append(self.permission_tree[child])
+        self._invalidate_auth_cache()
 
     def get_modules(self, args=None, kwargs=None):
         # Load any module configurations from the database
@@ -257,6 +258,8 @@ class Core(MySQLRestful):
             token = ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(32))
         # self.modify("delete from user_tokens where user_id = %s",userid)
         self.modify("insert into user_tokens values (null,%s,%s)", userid, token)
+        # The token may have been looked up (e.g., as a session id) before it was associated
+        self._invalidate_auth_cache(token)
         return self.query("select * from user_tokens where token=%s", [token])
 
     def associate_app_token(self, appid, token):
@@ -265,6 +268,18 @@ class Core(MySQLRestful):
         self.modify("insert into application_tokens (application_id, token) values (%s,%s)", appid, token)
         return self.query("select * from application_tokens where token=%s", [token])
 
+    def _invalidate_auth_cache(self, token=None):
+        """Drop the rest server's cached token permissions and user info after permissions or token associations
+        change.
+
+        :param str token: Only drop what is cached for this token, everything if None
+        """
+        restserver = getattr(self, 'restserver', None)
+        if restserver is not None and token is not None:
+            restserver.invalidate_auth_cache(token)
+        elif restserver is not None:
+            restserver.invalidate_auth_cache()
+
     # TODO This should be a delete rather than a get.  Also the redirect doesn't seem to work correctly
     @restful.permissions('admin')
     def get_removeuserpermission(self, args, kwargs):
@@ -278,6 +293,7 @@ class Core(MySQLRestful):
             kwargs['permission'] = self.query('select id from permission where name=%s', [kwargs['permission']])[0]['id']
         if len(self.query('select * from user_permissions where user_id=%s and permission=%s', [kwargs['user_id'], kwargs['permission']])) == 1:
             self.delete('delete from user_permissions where user_id=%s and permission=%s', kwargs['user_id'], kwargs['permission'])
+            self._invalidate_auth_cache()
         return {}
 
     @restful.permissions('admin')
@@ -320,6 +336,7 @@ class Core(MySQLRestful):
             kwargs['permission'] = self.query('select id from permission where name=%s', [kwargs['permission']])[0]['id']
         if len(self.query('select * from application_permissions where application=%s and permission=%s', [kwargs['application_id'], kwargs['permission']])) == 1:
             self.delete('delete from application_permissions where application=%s and permission=%s', kwargs['application_id'], kwargs['permission'])
+            self._invalidate_auth_cache()
         return {}
 
     @restful.permissions('admin')
@@ -355,6 +372,7 @@ class Core(MySQLRestful):
                           [kwargs['id'], kwargs['permission']])) == 0:
             self.modify('insert into application_permissions (application, permission) values (%s, %s)', kwargs['id'],
                         kwargs['permission'])
+            self._invalidate_auth_cache()
 
     def post_userpermission(self, args, kwargs):
         ### PYTHON2_BEGIN ###  # noqa: E266 - to be removed after migration cleanup
@@ -370,6 +388,7 @@ class Core(MySQLRestful):
                           [kwargs['user_id'], kwargs['permission']])) == 0:
             self.modify('insert into user_permissions (user_id, permission) values (%s, %s)', kwargs['user_id'],
                         kwargs['permission'])
+            self._invalidate_auth_cache()
 
     @restful.permissions('admin')
     @restful.generatedhtml(title='App {{value}}')
@@ -12,6 +12,7 @@ from google_auth_oauthlib.flow import Flow
 from .jqueue.queuemanager import QueueManager
 from signal import signal, SIGINT
 from .singleton import Singleton
+from .ttlcache import TTLCache
 from collections import OrderedDict
 from prometheus_client import Histogram, Counter, start_http_server
 import base64
@@ -145,6 +146,9 @@ class PageResponse(list):
         self.on = -1
 
     def __len__(self):
+        if self.dic['record_count'] is None:
+            self.dic['record_count'] = \
+                RestServer.Instance().run_method(self.module, 'get_pagecount', self.dic['cursor_id'])['record_count']
         return self.dic['record_count']
 
     def __iter__(self):
@@ -162,12 +166,19 @@ class PageResponse(list):
             ### PYTHON2_END ###  # noqa: E266 - to be removed after migration cleanup
 
             def __next__(iself):
-                if iself.i < self.dic['record_count'] - 1:
-                    iself.i += 1
+                # Lazily counted queries have no record count until the last page has been fetched
+                if self.dic['record_count'] is None or iself.i < self.dic['record_count'] - 1:
                     if iself.si + 2 > len(self.dic['records']):
                         iself.si = -1
-                        self.dic['records'] = \
-                            RestServer.Instance().run_method(self.module, 'get_nextpage', self.dic['cursor_id'])['records']
+                        # Keyset paginated queries return a new cursor id with every page
+                        page = RestServer.Instance().run_method(self.module, 'get_nextpage', self.dic['cursor_id'])
+                        self.dic['records'] = page['records']
+                        self.dic['cursor_id'] = page.get('cursor_id', self.dic['cursor_id'])
+                        if self.dic['record_count'] is None:
+                            self.dic['record_count'] = page.get('record_count')
+                        if not self.dic['records']:
+                            raise StopIteration
+                    iself.i += 1
                     iself.si += 1
                     return self.dic['records'][iself.si]
                 raise StopIteration
@@ -201,6 +212,11 @@ class RestServer:
         self.request_metrics_serialization_duration = Histogram('lapinpy_request_serialization_duration_seconds', 'request serialization duration in seconds', ['method', 'endpoint', 'module', 'source_ip'])
         self.request_metrics_size = Histogram('lapinpy_request_reponse_size', 'request size in bytes', ['method', 'endpoint', 'module', 'source_ip'], buckets=[int(10**x) for x in range(10)])
         self.request_metrics_errors = Counter('lapinpy_request_errors', 'number of not successful endpoint requests', ['method', 'endpoint', 'module', 'kind', 'source_ip'])
+        # Cache of (token kind, token) -> (permissions, user_info), so repeated calls with the same token don't hit the
+        # database
+        self.auth_cache = TTLCache()
+        self.auth_cache_metrics = Counter('lapinpy_auth_cache_requests', 'number of auth cache lookups', ['result'])
+        self.auth_cache_evictions = Counter('lapinpy_auth_cache_evictions', 'number of entries evicted from the auth cache')
 
     userdata = {'asdf': 'asdf'}
 
@@ -262,6 +278,45 @@ class RestServer:
                     return False
         return True
 
+    def get_auth(self, kind, token):
+        """Get the permissions and user info for a token, using the auth cache if possible. Copies of the cached values
+        are returned so callers are free to modify them.
+
+        :param str kind: Token kind, either `Bearer` (user token) or `Application`
+        :param str token: The token
+        :return: Tuple of (permissions, user_info)
+        """
+        key = (kind, token)
+        cached = self.auth_cache.get(key)
+        if cached is not None:
+            self.auth_cache_metrics.labels(result='hit').inc()
+        else:
+            self.auth_cache_metrics.labels(result='miss').inc()
+            if kind == 'Application':
+                cached = (self.core.get_apppermissions(token, None), self.core.get_appinfo_from_token(token))
+            else:
+                cached = (self.core.get_permissions_from_user_token(token), self.core.get_userinfo_from_user_token(token))
+            # Unknown tokens are not cached, a session id is only associated with a user once the OAuth flow completes
+            if cached[1] is not None:
+                evicted = self.auth_cache.put(key, cached)
+                if evicted:
+                    self.auth_cache_evictions.inc(evicted)
+        permissions, user_info = cached
+        return (list(permissions) if permissions is not None else None,
+                dict(user_info) if user_info is not None else None)
+
+    def invalidate_auth_cache(self, token=None):
+        """Drop cached token permissions and user info. Should be called whenever permissions or token
+        associations change.
+
+        :param str token: Only drop what is cached for this token, everything if None
+        """
+        if token is None:
+            self.auth_cache.clear()
+        else:
+            for kind in ('Bearer', 'Application'):
+                self.auth_cache.invalidate((kind, token))
+
     @cherrypy.expose
     def default(self, *args, **kwargs):
         response = None
@@ -273,18 +328,11 @@ class RestServer:
         if 'Authorization' in cherrypy.request.headers:
             auth = cherrypy.request.headers['Authorization']
             auth = auth.split(' ')
-            if len(auth) > 1:
-                token = auth[1]
-                if auth[0] == 'Bearer':
-                    permissions = self.core.get_permissions_from_user_token(token)
-                    user_info = self.core.get_userinfo_from_user_token(token)
-                elif auth[0] == 'Application':
-                    permissions = self.core.get_apppermissions((token), None)
-                    user_info = self.core.get_appinfo_from_token(token)
+            if len(auth) > 1 and auth[0] in ('Bearer', 'Application'):
+                permissions, user_info = self.get_auth(auth[0], auth[1])
         elif 'sessionid' in cookies:
             userid = cookies['sessionid'].value
-            permissions = self.core.get_permissions_from_user_token(userid)
-            user_info = self.core.get_userinfo_from_user_token(userid)
+            permissions, user_info = self.get_auth('Bearer', userid)
 
         if len(args) > 0 and args[0] == 'api':
             endpoint = '/' + '/'.join(args[0:3])
@@ -378,6 +426,9 @@ class RestServer:
                                 response = methodcall(parms, kwargs)
                                 end_measure = time.time()
                                 self.request_metrics_duration.labels(method=cherrypy.request.method, endpoint=endpoint, module=module, source_ip=cherrypy.request.remote.ip).observe(end_measure - start_measure)
+                                if hasattr(methodcall, 'stream'):
+                                    cherrypy.response.headers['Content-Type'] = methodcall.stream
+                                    cherrypy.response.stream = True
                                 if hasattr(methodcall, 'raw'):
                                     return response
                             elif permissions is not None:
@@ -1670,6 +1721,8 @@ class RestServer:
         else:
             self.configManager = ConfigManager(config)
         self.config = self.configManager.get_settings('lapinpy')
+        self.auth_cache.ttl = getattr(self.config, 'auth_cache_ttl', self.auth_cache.ttl)
+        self.auth_cache.max_size = getattr(self.config, 'auth_cache_size', self.auth_cache.max_size)
         if not (hasattr(self.config, 'verbose') and self.config.verbose):
             cherrypy.log.screen = None
 
@@ -1,14 +1,19 @@
 from . import restful
 from dateutil import parser
-from bson import ObjectId
+from bson import ObjectId, json_util
 import cherrypy
 from . import common
+from .ttlcache import TTLCache
 import re
+import base64
 import datetime
+import hashlib
+import hmac
 import pymongo
 import string
 import random
 import urllib
+import zlib
 
 ### PYTHON2_BEGIN ###  # noqa: E266 - to be removed after migration cleanup
 from past.builtins import basestring
@@ -19,6 +24,16 @@ install_aliases()
 
 
 MAXRETURN = 10000
+# Prefix of the cursor ids of keyset paginated queries, which carry their own state rather than referencing `cursors`
+KEYSET_CURSOR_PREFIX = 'ks.'
+# Longest keyset cursor id, it's passed in the URL path of `get_nextpage`. Queries with longer cursor ids (e.g., a large
+# `$in` query) continue from an in memory cursor
+KEYSET_CURSOR_MAX_LENGTH = 2000
+# How `pagequery` counts the matching records: `exact` counts them, `cached` shares the count between identical queries
+# for `count_cache_ttl` seconds (the pages are bounded by that count, so records added meanwhile may not be returned),
+# `estimated` uses the collection metadata for unfiltered queries, and `lazy` doesn't count them and only reports
+# `record_count` once the last page has been returned.
+PAGE_COUNT_MODES = ('exact', 'cached', 'estimated', 'lazy')
 
 
 def convertToOID(obj):
@@ -150,6 +165,16 @@ class MongoRestful(restful.Restful):
         self.client = pymongo.MongoClient('mongodb://%s:%s@%s/%s%s' % (user, password, host, db, mongo_options))
         self.db = self.client[db]
         self.cursors = {}
+        # Keyset cursor ids are signed so that clients can't alter the query they carry. Every replica needs the same
+        # key, so default to one derived from the database credentials.
+        config = getattr(self, 'config', None)
+        cursor_secret = getattr(config, 'cursor_secret', None)
+        if cursor_secret is None:
+            cursor_secret = '%s:%s@%s/%s' % (user, password, host, db)
+        self.cursor_key = hashlib.sha256(cursor_secret.encode('utf-8')).digest()
+        self.page_count_mode = getattr(config, 'page_count_mode', 'exact')
+        # (collection, normalized query) -> record count
+        self.count_cache = TTLCache(getattr(config, 'count_cache_size', 1000), getattr(config, 'count_cache_ttl', 30))
         self.thread = thread
         if self.thread:
             self.cleanThread = cherrypy.process.plugins.BackgroundTask(60, self.cleanCursors)
@@ -293,12 +318,21 @@ class MongoRestful(restful.Restful):
 
     def get_nextpage(self, args, kwargs):
         cursor_id = args[0]
+        if cursor_id.startswith(KEYSET_CURSOR_PREFIX) and cursor_id not in self.cursors:
+            state = self._decode_keyset_cursor(cursor_id)
+            state['start'] = state['end'] + 1
+            state['end'] = state['start'] + state['return_count'] - 1
+            if state['record_count'] is not None:
+                state['end'] = min(state['end'], state['record_count'])
+            return self._keyset_page(state)
         if cursor_id not in self.cursors:
             return None
         session_data = self.cursors[cursor_id]
         return_count = session_data['return_count']
         session_data['start'] = session_data['end'] + 1
-        session_data['end'] = min(session_data['start'] + return_count - 1, session_data['record_count'])
+        session_data['end'] = session_data['start'] + return_count - 1
+        if session_data['record_count'] is not None:
+            session_data['end'] = min(session_data['end'], session_data['record_count'])
         ret = {'start': session_data['start'], 'end': session_data['end'], 'cursor_id': session_data['cursor_id'],
                'record_count': session_data['record_count'], 'records': []}
         i = 0
@@ -323,7 +357,9 @@ class MongoRestful(restful.Restful):
             if i >= return_count:
                 break
 
-        if session_data['end'] >= ret['record_count']:
+        if session_data['record_count'] is None:
+            self._end_lazy_page(session_data, ret, i)
+        if ret['record_count'] is not None and session_data['end'] >= ret['record_count']:
             session_data['cursor'].close()
             del self.cursors[session_data['cursor_id']]
         else:
@@ -413,6 +449,15 @@ class MongoRestful(restful.Restful):
                 doc2 = doc2[sf]
         doc2[field.split('.')[-1]] = value
 
+    def __unsetvalue(self, doc, field):
+        doc2 = doc
+        for sf in field.split('.')[:-1]:
+            if not isinstance(doc2, dict) or sf not in doc2:
+                return
+            doc2 = doc2[sf]
+        if isinstance(doc2, dict):
+            doc2.pop(field.split('.')[-1], None)
+
     def encode_value(self, obj, to_type):
         ### PYTHON2_BEGIN ###  # noqa: E266 - to be removed after migration cleanup
         if isinstance(obj, basestring):
@@ -531,7 +576,34 @@ class MongoRestful(restful.Restful):
                 'data': data}
 
     def pagequery(self, collection, what=None, select=None, return_count=100,
-                  sort=None, modifiers={}, key_map=None, flatten=False, timeout=540):
+                  sort=None, modifiers={}, key_map=None, flatten=False, timeout=540, keyset=False, count=None):
+        """Runs a query and returns the first page of records. The following pages are retrieved by passing the returned
+        `cursor_id` to `get_nextpage`.
+
+        By default the query's cursor is held in memory until it is exhausted or hasn't been accessed for `timeout`
+        seconds. If `keyset` is set, no state is kept on the server. Instead the `cursor_id` encodes the query and the
+        sort key and `_id` of the last record returned, so any replica can serve the next page and each page is a new
+        indexed range query. Each page returns a new `cursor_id` that must be used for the page after it. Keyset
+        pagination requires any `modifiers` to be strings. If a modifier is a function the in memory cursor is used.
+
+        Unless `count` is `lazy`, the matching records are counted up front for `record_count`. With `lazy`,
+        `record_count` is `None` until the last page (the first page with fewer than `return_count` records) has been
+        returned, and `get_pagecount` can be called to count the records if needed.
+
+        :param str collection: Collection to query
+        :param what: Mongo query, or a query string to convert
+        :param list[str] select: Fields to return
+        :param int return_count: Number of records per page
+        :param tuple sort: `(field, direction)` to sort by
+        :param dict modifiers: Mapping of fields to a string (with `{{value}}` replaced by the field value) or a function
+            `(record, value)` returning the new value
+        :param dict key_map: Mapping of fields to a dict with a `type` to encode the query values for the field as
+        :param bool flatten: Whether to flatten the returned records
+        :param int timeout: Number of seconds an in memory cursor is kept without being accessed
+        :param bool keyset: Whether to use keyset pagination
+        :param str count: How to count the matching records, one of `PAGE_COUNT_MODES`. Defaults to the
+            `page_count_mode` setting
+        """
         ### PYTHON2_BEGIN ###  # noqa: E266 - to be removed after migration cleanup
         if isinstance(what, basestring):
         ### PYTHON2_END ###  # noqa: E266,E115 - to be removed after migration cleanup
@@ -557,17 +629,27 @@ class MongoRestful(restful.Restful):
             if len(key_types) > 0 and what is not None:
                 what = self.encode_values(what, key_types)
 
+        record_count = self._page_record_count(collection, what, count or self.page_count_mode)
+        return_count = min(MAXRETURN, return_count) if record_count is None else min(MAXRETURN, return_count, record_count)
+        if keyset and all(isinstance(func, basestring) for func in modifiers.values()):
+            state = {'collection': collection, 'what': what, 'fields': select, 'sort': list(sort) if sort else None,
+                     'modifiers': modifiers, 'flatten': flatten, 'return_count': return_count,
+                     'record_count': record_count, 'start': 1, 'end': return_count, 'after': None,
+                     'timeout': timeout}
+            ret = self._keyset_page(state)
+            ret.update({'fields': select, 'timeout': timeout})
+            return ret
+
         cursor = self.db[collection].find(what, select)
         if sort is not None:
             cursor.sort(*sort)
         cursor_id = self.getRandomId()
         while cursor_id in self.cursors:
             cursor_id = self.getRandomId()
-        record_count = self._count_documents(self.db[collection], what)
-        return_count = min(MAXRETURN, return_count, record_count)
         session_data = {'start': 1, 'end': return_count, 'cursor_id': cursor_id, 'cursor': cursor,
                         'record_count': record_count, 'return_count': return_count, 'modifiers': modifiers,
-                        'fields': select, 'flatten': flatten, 'timeout': timeout}
+                        'fields': select, 'flatten': flatten, 'timeout': timeout, 'collection': collection,
+                        'what': what}
         ret = {'start': session_data['start'], 'end': session_data['end'], 'cursor_id': cursor_id,
                'record_count': session_data['record_count'], 'records': [], 'fields': select, 'timeout': timeout}
         i = 0
@@ -591,13 +673,182 @@ class MongoRestful(restful.Restful):
             if i >= return_count:
                 break
 
-        if session_data['end'] >= ret['record_count']:
+        if record_count is None:
+            self._end_lazy_page(session_data, ret, i)
+        if ret['record_count'] is not None and session_data['end'] >= ret['record_count']:
             session_data['cursor'].close()
         else:
             session_data['last_accessed'] = datetime.datetime.now()
             self.cursors[cursor_id] = session_data
         return ret
 
+    def _keyset_page(self, state):
+        """Fetch a page of a keyset paginated query. Records are ordered by the sort field and then `_id`, and the page
+        starts after the last record of the previous page (`state['after']`), so no records are skipped or repeated.
+
+        :param dict state: State of the query, as created by `pagequery`
+        :return: The page, with the `cursor_id` for the next page
+        """
+        sort_field, what, order = self._keyset_query(state)
+        fields = state['fields']
+        # The sort key of the last record is needed for the next page, so it has to be returned
+        added_field = fields is not None and sort_field not in fields and sort_field != '_id'
+        if added_field:
+            fields = list(fields) + [sort_field]
+        ret = {'start': state['start'], 'end': state['end'], 'record_count': state['record_count'], 'records': []}
+        return_count = state['end'] - state['start'] + 1
+        if return_count > 0:
+            cursor = self.db[state['collection']].find(what, fields).sort(order).limit(return_count)
+            try:
+                for record in cursor:
+                    state['after'] = [self.__getvalue(record, sort_field), record['_id']]
+                    if added_field:
+                        self.__unsetvalue(record, sort_field)
+                    ### PYTHON2_BEGIN ###  # noqa: E266 - to be removed after migration cleanup
+                    for modifier, func in iteritems(state['modifiers']):
+                    ### PYTHON2_END ###  # noqa: E266,E115 - to be removed after migration cleanup
+                    ### PYTHON3_BEGIN ###  # noqa: E266,E115 - to be removed after migration cleanup
+                    # TODO: uncomment code below during cleanup  # noqa: E115 - to be removed after migration cleanup
+                    # for modifier, func in state['modifiers'].items():  # noqa: E115 - remove this noqa comment after migration cleanup
+                    ### PYTHON3_END ###  # noqa: E266,E115 - to be removed after migration cleanup
+                        self.__setvalue(record, modifier, func.replace('{{value}}', str(self.__getvalue(record, modifier))))
+                    if state['flatten']:
+                        record = self.flatten(record)
+                    ret['records'].append(record)
+            finally:
+                cursor.close()
+        if state['record_count'] is None:
+            self._end_lazy_page(state, ret, len(ret['records']))
+        ret['cursor_id'] = self._encode_keyset_cursor(state)
+        last_page = state['record_count'] is not None and state['end'] >= state['record_count']
+        if len(ret['cursor_id']) > KEYSET_CURSOR_MAX_LENGTH and not last_page:
+            ret['cursor_id'] = self._hold_keyset_query(state)
+        return ret
+
+    def _keyset_query(self, state):
+        """Build the query for the records after the last record returned by a keyset paginated query.
+
+        :param dict state: State of the query, as created by `pagequery`
+        :return: The sort field, the Mongo query and the sort order
+        """
+        sort_field, direction = state['sort'] if state['sort'] else ('_id', pymongo.ASCENDING)
+        what = state['what'] or {}
+        if state['after'] is not None:
+            what = {'$and': [what, self._keyset_filter(sort_field, direction, *state['after'])]}
+        order = [(sort_field, direction)]
+        if sort_field != '_id':
+            order.append(('_id', direction))
+        return sort_field, what, order
+
+    def _hold_keyset_query(self, state):
+        """Continue a keyset paginated query from an in memory cursor, for queries whose cursor id would be too long.
+
+        :param dict state: State of the query, as created by `pagequery`
+        :return: The id of the in memory cursor
+        """
+        _, what, order = self._keyset_query(state)
+        cursor_id = self.getRandomId()
+        while cursor_id in self.cursors:
+            cursor_id = self.getRandomId()
+        self.cursors[cursor_id] = {'start': state['start'], 'end': state['end'], 'cursor_id': cursor_id,
+                                   'cursor': self.db[state['collection']].find(what, state['fields']).sort(order),
+                                   'record_count': state['record_count'], 'return_count': state['return_count'],
+                                   'modifiers': state['modifiers'], 'fields': state['fields'],
+                                   'flatten': state['flatten'], 'timeout': state.get('timeout', 540),
+                                   'collection': state['collection'], 'what': state['what'],
+                                   'last_accessed': datetime.datetime.now()}
+        return cursor_id
+
+    def _end_lazy_page(self, state, page, returned):
+        """Set the end of a page of a lazily counted query from the number of records returned. A page with fewer
+        records than requested is the last one, so the record count is known and set.
+
+        :param dict state: State of the query
+        :param dict page: Page being returned
+        :param int returned: Number of records returned in the page
+        """
+        state['end'] = page['end'] = state['start'] + returned - 1
+        if returned < state['return_count']:
+            state['record_count'] = page['record_count'] = state['end']
+
+    def _page_record_count(self, collection, what, count):
+        """Get the number of records to report for a page query.
+
+        :param str collection: Collection being queried
+        :param dict what: Mongo query
+        :param str count: How to count the records, one of `PAGE_COUNT_MODES`
+        :return: The number of records, or `None` if `count` is `lazy`
+        """
+        if count not in PAGE_COUNT_MODES:
+            raise common.HttpException(400, 'count must be one of %s' % ', '.join(PAGE_COUNT_MODES))
+        if count == 'lazy':
+            return None
+        if count == 'estimated' and not what:
+            return self.db[collection].estimated_document_count()
+        if count == 'cached':
+            return self._cached_count(collection, what)
+        return self._count_documents(self.db[collection], what)
+
+    def _cached_count(self, collection, what):
+        """Count the records matching a query, sharing the count between identical queries for `count_cache_ttl`
+        seconds.
+
+        :param str collection: Collection being queried
+        :param dict what: Mongo query
+        """
+        key = (collection, json_util.dumps(what or {}, sort_keys=True))
+        record_count = self.count_cache.get(key)
+        if record_count is None:
+            record_count = self._count_documents(self.db[collection], what)
+            self.count_cache.put(key, record_count)
+        return record_count
+
+    def get_pagecount(self, args, kwargs):
+        """Count the records of a paginated query, for queries run with a lazy count.
+        """
+        cursor_id = args[0]
+        if cursor_id in self.cursors:
+            state = self.cursors[cursor_id]
+        elif cursor_id.startswith(KEYSET_CURSOR_PREFIX):
+            state = self._decode_keyset_cursor(cursor_id)
+        else:
+            return None
+        if state['record_count'] is not None:
+            return {'record_count': state['record_count']}
+        return {'record_count': self._cached_count(state['collection'], state['what'])}
+
+    def _keyset_filter(self, field, direction, last_value, last_id):
+        """Build the filter matching the records that sort after `(last_value, last_id)`. Missing (`null`) values sort
+        before any other value.
+
+        :param str field: Field the query is sorted by
+        :param int direction: Sort direction of the query
+        :param last_value: Value of `field` of the last record returned
+        :param last_id: `_id` of the last record returned
+        """
+        after = '$gt' if direction == pymongo.ASCENDING else '$lt'
+        if field == '_id':
+            return {'_id': {after: last_id}}
+        if last_value is None:
+            tie = {field: None, '_id': {after: last_id}}
+            return {'$or': [{field: {'$ne': None}}, tie]} if direction == pymongo.ASCENDING else tie
+        clauses = [{field: {after: last_value}}, {field: last_value, '_id': {after: last_id}}]
+        if direction != pymongo.ASCENDING:
+            clauses.append({field: None})
+        return {'$or': clauses}
+
+    def _encode_keyset_cursor(self, state):
+        payload = base64.urlsafe_b64encode(zlib.compress(json_util.dumps(state).encode('utf-8'))).decode('ascii')
+        signature = hmac.new(self.cursor_key, payload.encode('ascii'), hashlib.sha256).hexdigest()[:32]
+        return '%s%s.%s' % (KEYSET_CURSOR_PREFIX, payload, signature)
+
+    def _decode_keyset_cursor(self, cursor_id):
+        payload, _, signature = cursor_id[len(KEYSET_CURSOR_PREFIX):].rpartition('.')
+        expected = hmac.new(self.cursor_key, payload.encode('ascii'), hashlib.sha256).hexdigest()[:32]
+        if not hmac.compare_digest(signature, expected):
+            raise common.HttpException(400, 'Invalid cursor id')
+        return json_util.loads(zlib.decompress(base64.urlsafe_b64decode(payload)).decode('utf-8'))
+
     def flatten(self, record, subkey=None):
         ret = {}
         ### PYTHON2_BEGIN ###  # noqa: E266 - to be removed after migration cleanup
@@ -691,14 +942,9 @@ class MongoRestful(restful.Restful):
                     raise common.HttpException(400, 'page must be a number greater than 0')
                 start = page * limit
                 del what['_page']
-            records = self._count_documents(coll, what)
-            end = start + limit if limit is not None else records
+            # The slice is applied as a skip and limit, so the records don't need to be counted up front
             cursor = coll.find(what)
-            if end > records:
-                end = records
-            if start > records:
-                return []
-            cursor = cursor[start:end]
+            cursor = cursor[start:start + limit if limit is not None else None]
         ret = []
         for rec in cursor:
             ret.append(rec)
@@ -945,6 +945,23 @@ def raw(func):
     return func
 
 
+def stream(content_type):
+    '''Stream the response of the method instead of serializing it as JSON. The method must return an iterable of
+    `bytes` chunks, which are sent to the client as they are produced. Since the status has already been sent, an
+    error raised while iterating aborts the response.
+
+    Args:
+        content_type (str): The `Content-Type` of the response.
+    '''
+
+    def inner(func):
+        func.raw = True
+        func.stream = content_type
+        return func
+
+    return inner
+
+
 def ui_link(method):
     def inner(func):
         if 'ui_links' not in dir(func):
@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    A thread-safe least recently used cache where every entry expires after a time to live.
+
+    Entries are evicted in least recently used order once `max_size` is reached. Expired entries are
+    dropped lazily when they are looked up or when room is needed for a new entry. Hit, miss and
+    eviction counts are kept so callers can export them as metrics.
+
+    """
+
+    def __init__(self, max_size=10000, ttl=300, clock=time.monotonic):
+        """
+        :param int max_size: Maximum number of entries to hold
+        :param float ttl: Default number of seconds an entry is valid for
+        :param clock: Function returning the current time in seconds, used for testing
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Get the value cached for `key`, marking it as the most recently used entry.
+
+        :param key: Key to look up
+        :param default: Value to return if `key` is not cached or has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, ttl=None):
+        """
+        Cache `value` for `key`, evicting the least recently used entries if the cache is full.
+
+        :param key: Key to cache the value under
+        :param value: Value to cache
+        :param float ttl: Number of seconds the entry is valid for, defaults to the cache's `ttl`
+        :return: Number of entries evicted to make room
+        """
+        evicted = 0
+        with self._lock:
+            now = self._clock()
+            self._entries[key] = (now + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                # Drop anything that has already expired before evicting live entries
+                for expired_key in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                    del self._entries[expired_key]
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        return evicted
+
+    def invalidate(self, key):
+        """
+        Remove `key` from the cache if present.
+
+        :param key: Key to remove
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] > self._clock()
+
+    def __len__(self):
+        return len(self._entries)
@@ -303,18 +303,28 @@ class TestCore(unittest.TestCase):
     @parameterized.expand([
         ('new_permission',
          [[{'id': 1}], [], ],
-         call.cursor().execute('insert into user_permissions (user_id, permission) values (%s, %s)', ('user_id', 1))),
+         call.cursor().execute('insert into user_permissions (user_id, permission) values (%s, %s)', ('user_id', 1)),
+         True),
         ('existing_permission',
          [[{'id': 1}], [{'id': 1, 'user_id': 1, 'permission': 1}], ],
-         None),
+         None,
+         False),
     ])
-    def test_Core_post_userpermission(self, _description, records, expected_sql_call):
+    def test_Core_post_userpermission(self, _description, records, expected_sql_call, expected_cache_invalidated):
         self.cursor.fetchall.side_effect = records
 
         self.core.post_userpermission(None, {'permission': 'admin', 'user_id': 'user_id'})
 
         if expected_sql_call:
             self.assertIn(expected_sql_call, self.connection.mock_calls)
+        self.assertEqual(call.invalidate_auth_cache() in self.restserver.mock_calls, expected_cache_invalidated)
+
+    def test_Core_associate_user_token_invalidates_token(self):
+        self.cursor.fetchall.side_effect = [[{'id': 1, 'user_id': 2, 'token': 'SESSION'}]]
+
+        self.core.associate_user_token(2, 'SESSION')
+
+        self.assertIn(call.invalidate_auth_cache('SESSION'), self.restserver.mock_calls)
 
     def test_Core_get_app(self):
         record = {'id': 1, 'name': 'sdm', 'token': 'some_token',
@@ -5,6 +5,10 @@ from decimal import Decimal
 from lapinpy import curl
 from lapinpy.curl import Curl, CurlHttpException, MultiPartForm
 import urllib.error
+import http.server
+import json
+import pickle
+import threading
 import urllib.request
 from io import StringIO
 import sys
@@ -20,6 +24,33 @@ except ImportError:
     ### PYTHON2_END ###  # noqa: E266 - to be removed after migration cleanup
 
 
+class KeepAliveRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    connections = 0
+    requests = 0
+
+    def setup(self):
+        KeepAliveRequestHandler.connections += 1
+        http.server.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        KeepAliveRequestHandler.requests += 1
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps({'path': self.path}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Drop every third connection without telling the client, like a server closing idle connections
+        self.close_connection = KeepAliveRequestHandler.requests % 3 == 0
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
 class TestCurl(unittest.TestCase):
 
     @parameterized.expand([
@@ -32,7 +63,7 @@ class TestCurl(unittest.TestCase):
         self.assertEqual(curl.handler(obj), expected)
 
     @patch.object(urllib.request, 'Request')
-    @patch.object(urllib.request, 'urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_get(self, urlopen, request):
         response = Mock()
         response.read.return_value = '{"foo": "bar"}'
@@ -42,7 +73,7 @@ class TestCurl(unittest.TestCase):
         request.assert_called_with('http://someurl/get?foo=bar&')
 
     @patch.object(urllib.request, 'Request')
-    @patch.object(urllib.request, 'urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_post(self, urlopen, request):
         req = Mock()
         request.return_value = req
@@ -54,7 +85,7 @@ class TestCurl(unittest.TestCase):
         request.assert_called_with('http://someurl/post')
 
     @patch.object(urllib.request, 'Request')
-    @patch.object(urllib.request, 'urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_Curl_post(self, urlopen, request):
         req = Mock()
         request.return_value = req
@@ -70,7 +101,7 @@ class TestCurl(unittest.TestCase):
         self.assertEqual(req.get_method(), method.upper())
 
     @patch.object(urllib.request, 'Request')
-    @patch.object(urllib.request, 'urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_Curl_put(self, urlopen, request):
         req = Mock()
         request.return_value = req
@@ -86,7 +117,7 @@ class TestCurl(unittest.TestCase):
         self.assertEqual(req.get_method(), method.upper())
 
     @patch.object(urllib.request, 'Request')
-    @patch.object(urllib.request, 'urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_Curl_delete(self, urlopen, request):
         req = Mock()
         request.return_value = req
@@ -102,7 +133,7 @@ class TestCurl(unittest.TestCase):
         self.assertEqual(req.get_method(), method.upper())
 
     @patch.object(urllib.request, 'Request')
-    @patch.object(urllib.request, 'urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_Curl_get_no_cache(self, urlopen, request):
         req = Mock()
         request.return_value = req
@@ -130,7 +161,7 @@ class TestCurl(unittest.TestCase):
         (524,),
     ])
     @patch.object(urllib.request, 'Request')
-    @patch.object(urllib.request, 'urlopen')
+    @patch.object(Curl, '_Curl__open')
     @patch.object(curl, 'sleep')
     def test_Curl_retry_with_retriable_error(self, http_code, sleep, urlopen, request):
         error = urllib.error.HTTPError('http://127.0.0.1', http_code, 'Error', [], None)
@@ -143,6 +174,57 @@ class TestCurl(unittest.TestCase):
         # Verify 4 calls (original call and 3 retries)
         self.assertEqual(len(urlopen.mock_calls), 4)
 
+    @patch.object(curl.random, 'uniform')
+    @patch.object(Curl, '_Curl__open')
+    @patch.object(curl, 'sleep')
+    def test_Curl_retry_backoff(self, sleep, urlopen, uniform):
+        urlopen.side_effect = urllib.error.URLError('Connection refused')
+        uniform.side_effect = lambda low, high: high
+        curl = Curl('http://127.0.0.1', retry=4, backoff=5, max_backoff=30)
+
+        self.assertRaises(urllib.error.URLError, curl.get, 'api/service/endpoint')
+        self.assertEqual([c[0][0] for c in sleep.call_args_list], [5, 10, 20, 30])
+        self.assertEqual([c[0] for c in uniform.call_args_list], [(0, 2.5), (0, 5), (0, 10), (0, 15)])
+
+    def test_Curl_keep_alive(self):
+        KeepAliveRequestHandler.connections = 0
+        KeepAliveRequestHandler.requests = 0
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            curl = Curl('http://127.0.0.1:{}'.format(server.server_address[1]), retry=0)
+
+            for i in range(5):
+                self.assertEqual(curl.get('api/foo', data={'i': i}), {'path': '/api/foo?i={}&'.format(i)})
+                self.assertEqual(curl.post('api/bar', data={'i': i}), {'path': '/api/bar'})
+            # Pooled connections are not copied when the client is pickled for another process
+            self.assertEqual(pickle.loads(pickle.dumps(curl))._pools, {})
+            curl.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(KeepAliveRequestHandler.requests, 10)
+        # A new connection is only opened after the server dropped the previous one
+        self.assertEqual(KeepAliveRequestHandler.connections, 4)
+        self.assertEqual(curl.connection_stats()['created'], 4)
+
+    @patch.object(curl.os, 'getpid')
+    def test_ConnectionPool_discards_connections_after_fork(self, getpid):
+        getpid.return_value = 1
+        pool = curl.ConnectionPool(size=1)
+        connection = Mock()
+        pool.put(('http', 'foo', None), connection)
+        pool.put(('http', 'foo', None), Mock())
+        getpid.return_value = 2
+
+        new_connection, reused = pool.get(('http', 'foo', None), 10)
+
+        self.assertFalse(reused)
+        self.assertIsNot(new_connection, connection)
+        connection.close.assert_not_called()
+
+
     @patch.object(urllib.request, 'Request')
     def test_Curl_to_struct(self, request):
         curl = Curl('http://127.0.0.1')
@@ -190,7 +272,7 @@ class TestCurl(unittest.TestCase):
          {'Authorization': 'Application SOME_TOKEN', 'Content-length': 13}, 'foo=foo%2Bbar',
          'http://127.0.0.1/some/api'),
     ])
-    @patch('lapinpy.curl.urllib.request.urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_Curl_call(self, _description, method, data, output, expected, expected_request_headers,
                        expected_request_data, expected_full_url, urlopen_mock):
         ### PYTHON3_BEGIN ###  # noqa: E266 - to be removed after migration cleanup
@@ -211,7 +293,7 @@ class TestCurl(unittest.TestCase):
         self.assertEqual(request.full_url, expected_full_url)
 
     @patch.object(curl, 'make_boundary')
-    @patch('lapinpy.curl.urllib.request.urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_Curl_call_multipartform(self, urlopen_mock, make_boundary_mock):
         make_boundary_mock.return_value = '===============1234567891234567891=='
         method = 'POST'
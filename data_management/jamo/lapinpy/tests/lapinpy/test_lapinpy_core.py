@@ -44,6 +44,7 @@ class TestLapinpyCore(unittest.TestCase):
         self.server.core = self.core
         cherrypy.request.headers = {}
         cherrypy.request.cookie = {}
+        self.server.auth_cache.clear()
 
     def tearDown(self):
         self.filehandle.close()
@@ -125,6 +126,26 @@ class TestLapinpyCore(unittest.TestCase):
         self.assertEqual(next(i), {'record_id': 'bar'})
         self.assertRaises(StopIteration, next, i)
 
+    def test_PageResponse_iter_lazy_count(self):
+        self.server.run_method = Mock(side_effect=[{'record_count': 2, 'records': [{'record_id': 'bar'}],
+                                                    'cursor_id': 'my_cursor_2'}])
+
+        page_response = lapinpy_core.PageResponse({'record_count': None,
+                                                   'records': [{'record_id': 'foo'}],
+                                                   'cursor_id': 'my_cursor'}, 'file')
+
+        self.assertEqual([record for record in iter(page_response)], [{'record_id': 'foo'}, {'record_id': 'bar'}])
+        self.server.run_method.assert_called_once_with('file', 'get_nextpage', 'my_cursor')
+
+    def test_PageResponse_len_lazy_count(self):
+        self.server.run_method = Mock(return_value={'record_count': 5})
+
+        page_response = lapinpy_core.PageResponse({'record_count': None, 'records': [], 'cursor_id': 'my_cursor'},
+                                                  'file')
+
+        self.assertEqual(len(page_response), 5)
+        self.server.run_method.assert_called_once_with('file', 'get_pagecount', 'my_cursor')
+
     @parameterized.expand([
         ('alpha', 'foo', True),
         ('alpha_numeric', 'Foo123', True),
@@ -221,6 +242,72 @@ class TestLapinpyCore(unittest.TestCase):
         actual = self.server.default(*args, **kwargs)
         self._assertEqual(actual, expected_py2, expected_py3)
 
+    def test_RestServer_default_api_stream(self):
+        def func(args, kwargs):
+            yield b'{"foo": "bar"}\n'
+
+        cherrypy.request.headers = {'Authorization': 'Bearer TOKEN', 'Content-Length': 1000}
+        self.core.get_permissions_from_user_token.return_value = ['admin']
+        self.core.get_userinfo_from_user_token.return_value = {'user': 'foo', 'group': 'sdm'}
+        body = Mock()
+        del body.rawbody
+        body.read.return_value = b'{"foo": "bar"}'
+        cherrypy.request.body = body
+        app = Mock()
+        app.getrestmethod.return_value = func, 1
+        self.server.apps = {'my_module': app}
+        func.permissions = ['admin']
+        func.raw = True
+        func.stream = 'application/x-ndjson'
+
+        actual = self.server.default('api', 'my_module', 'my_method')
+
+        self.assertEqual(list(actual), [b'{"foo": "bar"}\n'])
+        self.assertEqual(cherrypy.response.headers['Content-Type'], 'application/x-ndjson')
+        self.assertTrue(cherrypy.response.stream)
+
+    @parameterized.expand([
+        ('bearer', 'Bearer', 'get_permissions_from_user_token', 'get_userinfo_from_user_token'),
+        ('application', 'Application', 'get_apppermissions', 'get_appinfo_from_token'),
+    ])
+    def test_RestServer_get_auth_cached(self, _description, kind, permissions_method, user_info_method):
+        getattr(self.core, permissions_method).return_value = ['admin']
+        getattr(self.core, user_info_method).return_value = {'user': 'foo', 'group': 'sdm'}
+
+        self.assertEqual(self.server.get_auth(kind, 'TOKEN'), (['admin'], {'user': 'foo', 'group': 'sdm'}))
+        permissions, user_info = self.server.get_auth(kind, 'TOKEN')
+        user_info['permissions'] = permissions
+
+        self.assertEqual(self.server.get_auth(kind, 'TOKEN'), (['admin'], {'user': 'foo', 'group': 'sdm'}))
+        self.assertEqual(getattr(self.core, permissions_method).call_count, 1)
+        self.assertEqual(getattr(self.core, user_info_method).call_count, 1)
+
+        self.server.invalidate_auth_cache()
+        self.server.get_auth(kind, 'TOKEN')
+        self.assertEqual(getattr(self.core, permissions_method).call_count, 2)
+
+    def test_RestServer_get_auth_unknown_token_not_cached(self):
+        self.core.get_permissions_from_user_token.return_value = []
+        self.core.get_userinfo_from_user_token.return_value = None
+
+        self.assertEqual(self.server.get_auth('Bearer', 'SESSION'), ([], None))
+        # The session is associated with a user once the OAuth flow completes
+        self.core.get_permissions_from_user_token.return_value = ['admin']
+        self.core.get_userinfo_from_user_token.return_value = {'user': 'foo'}
+
+        self.assertEqual(self.server.get_auth('Bearer', 'SESSION'), (['admin'], {'user': 'foo'}))
+
+    def test_RestServer_invalidate_auth_cache_token(self):
+        self.core.get_permissions_from_user_token.return_value = ['admin']
+        self.core.get_userinfo_from_user_token.return_value = {'user': 'foo'}
+        self.server.get_auth('Bearer', 'TOKEN')
+        self.server.get_auth('Bearer', 'OTHER')
+
+        self.server.invalidate_auth_cache('TOKEN')
+
+        self.assertNotIn(('Bearer', 'TOKEN'), self.server.auth_cache)
+        self.assertIn(('Bearer', 'OTHER'), self.server.auth_cache)
+
     def test_RestServer_default_api_internal_redirect(self):
         args = ['api', 'my_module', 'my_method']
         kwargs = {'XXredirect_internalXX': '/api/my_module/my_method'}
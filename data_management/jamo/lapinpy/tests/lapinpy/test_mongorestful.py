@@ -392,6 +392,144 @@ class TestMongoRestful(unittest.TestCase):
                          expected)
         self.assertIn(find_db_call, self.db.find.mock_calls)
 
+    def test_MongoRestful_pagequery_keyset(self):
+        records = [{'_id': ObjectId('62791a11c2c506c5afdfce76'), 'foo': 'foo1', 'bar': 1},
+                   {'_id': ObjectId('62791a11c2c506c5afdfce77'), 'foo': 'foo2', 'bar': 2},
+                   {'_id': ObjectId('62791a11c2c506c5afdfce78'), 'foo': 'foo3', 'bar': 2}]
+        cursor = MagicMock()
+        cursor.sort.return_value = cursor
+        cursor.limit.return_value = cursor
+        cursor.__iter__.side_effect = [iter(records[:2]), iter(records[2:])]
+        self.db.find.return_value = cursor
+        self.db.count_documents.return_value = 3
+
+        page = self.mongorestful.pagequery('file', {'foo': {'$exists': True}}, ['foo'], 2, ('bar', 1),
+                                           {'foo': '{{value}}_str'}, keyset=True)
+
+        self.assertEqual(page['records'], [{'_id': ObjectId('62791a11c2c506c5afdfce76'), 'foo': 'foo1_str'},
+                                           {'_id': ObjectId('62791a11c2c506c5afdfce77'), 'foo': 'foo2_str'}])
+        self.assertEqual((page['start'], page['end'], page['record_count']), (1, 2, 3))
+        self.assertTrue(page['cursor_id'].startswith(mongorestful.KEYSET_CURSOR_PREFIX))
+        self.assertEqual(self.mongorestful.cursors, {})
+        self.db.find.assert_called_with({'foo': {'$exists': True}}, ['foo', 'bar'])
+        cursor.sort.assert_called_with([('bar', 1), ('_id', 1)])
+
+        next_page = self.mongorestful.get_nextpage([page['cursor_id']], None)
+
+        self.assertEqual(next_page['records'], [{'_id': ObjectId('62791a11c2c506c5afdfce78'), 'foo': 'foo3_str'}])
+        self.assertEqual((next_page['start'], next_page['end'], next_page['record_count']), (3, 3, 3))
+        self.db.find.assert_called_with(
+            {'$and': [{'foo': {'$exists': True}},
+                      {'$or': [{'bar': {'$gt': 2}},
+                               {'bar': 2, '_id': {'$gt': ObjectId('62791a11c2c506c5afdfce77')}}]}]},
+            ['foo', 'bar'])
+        cursor.limit.assert_called_with(1)
+
+    def test_MongoRestful_pagequery_keyset_long_cursor(self):
+        records = [{'_id': ObjectId('62791a11c2c506c5afdfce76'), 'foo': 'foo1'}]
+        cursor = MagicMock()
+        cursor.sort.return_value = cursor
+        cursor.limit.return_value = cursor
+        cursor.__iter__.return_value = iter(records)
+        self.db.find.return_value = cursor
+        self.db.count_documents.return_value = 3
+        what = {'foo': {'$in': [f'foo{i}' for i in range(1000)]}}
+
+        page = self.mongorestful.pagequery('file', what, ['foo'], 1, keyset=True)
+
+        self.assertIn(page['cursor_id'], self.mongorestful.cursors)
+        session_data = self.mongorestful.cursors.get(page['cursor_id'])
+        self.assertEqual((session_data['start'], session_data['end'], session_data['record_count']), (1, 1, 3))
+        self.db.find.assert_called_with(
+            {'$and': [what, {'_id': {'$gt': ObjectId('62791a11c2c506c5afdfce76')}}]}, ['foo'])
+
+    def test_MongoRestful_pagequery_keyset_function_modifier(self):
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [{'_id': '62791a11c2c506c5afdfce76', 'foo': 'foo1'}]
+        self.db.find.return_value = cursor
+        self.db.count_documents.return_value = 2
+
+        page = self.mongorestful.pagequery('file', {}, return_count=1, modifiers={'foo': lambda x, y: y},
+                                           keyset=True)
+
+        self.assertIn(page['cursor_id'], self.mongorestful.cursors)
+
+    @parameterized.expand([
+        ('cursor', False),
+        ('keyset', True),
+    ])
+    def test_MongoRestful_pagequery_lazy_count(self, _description, keyset):
+        records = [{'_id': ObjectId('62791a11c2c506c5afdfce76')}, {'_id': ObjectId('62791a11c2c506c5afdfce77')},
+                   {'_id': ObjectId('62791a11c2c506c5afdfce78')}]
+        cursor = MagicMock()
+        cursor.sort.return_value = cursor
+        cursor.limit.return_value = cursor
+        cursor.__iter__.side_effect = [iter(records[:2]), iter(records[2:])] if keyset else [iter(records)] * 2
+        self.db.find.return_value = cursor
+
+        page = self.mongorestful.pagequery('file', {'foo': 'bar'}, return_count=2, keyset=keyset, count='lazy')
+
+        self.assertEqual((page['start'], page['end'], page['record_count'], len(page['records'])), (1, 2, None, 2))
+        next_page = self.mongorestful.get_nextpage([page['cursor_id']], None)
+        self.assertEqual((next_page['start'], next_page['end'], next_page['record_count'], len(next_page['records'])),
+                         (3, 3, 3, 1))
+        self.db.count_documents.assert_not_called()
+        self.assertEqual(self.mongorestful.cursors, {})
+
+    @parameterized.expand([
+        ('exact', {'foo': 'bar'}, 'exact', 5),
+        ('cached', {'foo': 'bar'}, 'cached', 5),
+        ('estimated_no_filter', {}, 'estimated', 100),
+        ('estimated_with_filter', {'foo': 'bar'}, 'estimated', 5),
+        ('lazy', {'foo': 'bar'}, 'lazy', None),
+    ])
+    def test_MongoRestful_page_record_count(self, _description, what, count, expected):
+        self.db.count_documents.return_value = 5
+        self.db.estimated_document_count.return_value = 100
+
+        self.assertEqual(self.mongorestful._page_record_count('file', what, count), expected)
+
+    def test_MongoRestful_page_record_count_invalid(self):
+        self.assertRaises(common.HttpException, self.mongorestful._page_record_count, 'file', {}, 'foo')
+
+    def test_MongoRestful_page_record_count_exact_not_cached(self):
+        self.db.count_documents.side_effect = [5, 6]
+
+        self.assertEqual(self.mongorestful._page_record_count('file', {'foo': 'bar'}, 'exact'), 5)
+        self.assertEqual(self.mongorestful._page_record_count('file', {'foo': 'bar'}, 'exact'), 6)
+
+    def test_MongoRestful_cached_count(self):
+        self.db.count_documents.side_effect = [5, 6]
+
+        self.assertEqual(self.mongorestful._cached_count('file', {'foo': 'bar', 'bar': 1}), 5)
+        self.assertEqual(self.mongorestful._cached_count('file', {'bar': 1, 'foo': 'bar'}), 5)
+        self.assertEqual(self.mongorestful._cached_count('file', {'foo': 'baz'}), 6)
+        self.assertEqual(self.db.count_documents.call_count, 2)
+
+    def test_MongoRestful_get_pagecount(self):
+        self.db.count_documents.return_value = 5
+        self.mongorestful.cursors = {'cursor_1': {'collection': 'file', 'what': {'foo': 'bar'}, 'record_count': None}}
+
+        self.assertEqual(self.mongorestful.get_pagecount(['cursor_1'], None), {'record_count': 5})
+        self.assertIsNone(self.mongorestful.get_pagecount(['cursor_2'], None))
+        self.db.count_documents.assert_called_with({'foo': 'bar'})
+
+    def test_MongoRestful_get_nextpage_keyset_invalid_signature(self):
+        cursor_id = self.mongorestful._encode_keyset_cursor({'collection': 'file'})
+
+        self.assertRaises(common.HttpException, self.mongorestful.get_nextpage, [cursor_id[:-1] + 'x'], None)
+
+    @parameterized.expand([
+        ('id', '_id', 1, None, 5, {'_id': {'$gt': 5}}),
+        ('ascending', 'foo', 1, 'bar', 5, {'$or': [{'foo': {'$gt': 'bar'}}, {'foo': 'bar', '_id': {'$gt': 5}}]}),
+        ('descending', 'foo', -1, 'bar', 5,
+         {'$or': [{'foo': {'$lt': 'bar'}}, {'foo': 'bar', '_id': {'$lt': 5}}, {'foo': None}]}),
+        ('ascending_null', 'foo', 1, None, 5, {'$or': [{'foo': {'$ne': None}}, {'foo': None, '_id': {'$gt': 5}}]}),
+        ('descending_null', 'foo', -1, None, 5, {'foo': None, '_id': {'$lt': 5}}),
+    ])
+    def test_MongoRestful_keyset_filter(self, _description, field, direction, last_value, last_id, expected):
+        self.assertEqual(self.mongorestful._keyset_filter(field, direction, last_value, last_id), expected)
+
     def test_MongoRestful_flatten(self):
         self.assertEqual(self.mongorestful.flatten({'foo': {'bar': {'baz': 1}, 'foobar': True}}),
                          {'foo.bar.baz': 1, 'foo.foobar': True})
@@ -407,7 +545,7 @@ class TestMongoRestful(unittest.TestCase):
         ('no_tqx_no_limit', {'_page': 1},
          [call.with_options(read_preference=Nearest(tag_sets=None, max_staleness=-1, hedge=None)),
           call.find({'foo': 'foo1'}),
-          call.find().__getitem__(slice(0, 2, None))]),
+          call.find().__getitem__(slice(0, 500, None))]),
         ('no_tqx_limit_set_to_1', {'_page': 1, 'limit': 1},
          [call.with_options(read_preference=Nearest(tag_sets=None, max_staleness=-1, hedge=None)),
           call.find({'foo': 'foo1'}),
@@ -415,7 +553,7 @@ class TestMongoRestful(unittest.TestCase):
         ('no_tqx_limit_set_to_none', {'limit': None},
          [call.with_options(read_preference=Nearest(tag_sets=None, max_staleness=-1, hedge=None)),
           call.find({'foo': 'foo1'}),
-          call.find().__getitem__(slice(0, 2, None))]),
+          call.find().__getitem__(slice(0, None, None))]),
         ('tqx', {'tqx': '', 'tq': 'limit 10', 'sort': ['bar', 1]},
          [call.with_options(read_preference=Nearest(tag_sets=None, max_staleness=-1, hedge=None)),
           call.find({'foo': 'foo1'}),
@@ -438,6 +576,7 @@ class TestMongoRestful(unittest.TestCase):
                           {'_id': '62791a11c2c506c5afdfce77', 'bar': 'bar2', 'foo': 'foo1'}])
         for db_call in expected_db_calls:
             self.assertIn(db_call, self.db.mock_calls)
+        self.db.count_documents.assert_not_called()
 
     @parameterized.expand([
         ('no_tqx_page_with_limit_none', {'_page': 1, 'limit': None}),
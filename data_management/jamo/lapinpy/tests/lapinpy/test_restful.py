@@ -679,6 +679,14 @@ class TestRestful(unittest.TestCase):
 
         self.assertEqual(func.raw, True)
 
+    def test_stream(self):
+        @restful.stream('application/x-ndjson')
+        def func():
+            pass
+
+        self.assertEqual(func.raw, True)
+        self.assertEqual(func.stream, 'application/x-ndjson')
+
     def test_ui_link(self):
         @restful.ui_link('POST')
         def func():
@@ -0,0 +1,60 @@
+import unittest
+from lapinpy.ttlcache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = TTLCache(max_size=2, ttl=10, clock=lambda: self.now)
+
+    def test_TTLCache_get(self):
+        self.cache.put('foo', 'bar')
+
+        self.assertEqual(self.cache.get('foo'), 'bar')
+        self.assertIsNone(self.cache.get('baz'))
+        self.assertEqual(self.cache.get('baz', 'default'), 'default')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_TTLCache_get_expired(self):
+        self.cache.put('foo', 'bar')
+        self.cache.put('baz', 'qux', ttl=30)
+        self.now += 10
+
+        self.assertIsNone(self.cache.get('foo'))
+        self.assertEqual(self.cache.get('baz'), 'qux')
+        self.assertNotIn('foo', self.cache)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_TTLCache_put_evicts_least_recently_used(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.get('a')
+
+        self.assertEqual(self.cache.put('c', 3), 1)
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+        self.assertIn('c', self.cache)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_TTLCache_put_drops_expired_before_evicting(self):
+        self.cache.put('a', 1, ttl=1)
+        self.cache.put('b', 2)
+        self.now += 5
+
+        self.assertEqual(self.cache.put('c', 3), 0)
+        self.assertIn('b', self.cache)
+        self.assertIn('c', self.cache)
+
+    def test_TTLCache_invalidate(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+
+        self.cache.invalidate('a')
+        self.assertNotIn('a', self.cache)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
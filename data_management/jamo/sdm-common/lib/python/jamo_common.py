@@ -870,12 +870,19 @@ class PageList(object):
                 return iself
 
             def __next__(iself):
-                if iself.i < self.total_record_count - 1:
-                    iself.i += 1
+                # Lazily counted queries have no record count until the last page has been fetched
+                if self.total_record_count is None or iself.i < self.total_record_count - 1:
                     if iself.si + 2 > len(self.current_list):
                         iself.si = -1
-                        self.current_list = self.curl.get('api/%s/nextpage/%s' % (self.service, self.cursor_id))[
-                            'records']
+                        # Keyset paginated queries return a new cursor id with every page
+                        page = self.curl.get('api/%s/nextpage/%s' % (self.service, self.cursor_id))
+                        self.current_list = page['records']
+                        self.cursor_id = page.get('cursor_id', self.cursor_id)
+                        if self.total_record_count is None:
+                            self.total_record_count = page.get('record_count')
+                        if not self.current_list:
+                            raise StopIteration
+                    iself.i += 1
                     iself.si += 1
                     return customtransform(self.current_list[iself.si], **self.methods)
                 raise StopIteration
@@ -883,6 +890,8 @@ class PageList(object):
         return Iterat()
 
     def __len__(self):
+        if self.total_record_count is None:
+            self.total_record_count = self.curl.get('api/%s/pagecount/%s' % (self.service, self.cursor_id))['record_count']
         return self.total_record_count
 
 
@@ -23,8 +23,13 @@ standard_library.install_aliases()
 from builtins import str  # noqa:  E402
 from builtins import range  # noqa:  E402
 from builtins import object  # noqa:  E402
+import collections  # noqa:  E402
+import io  # noqa:  E402
 import json  # noqa:  E402
+import os  # noqa:  E402
+import threading  # noqa:  E402
 import urllib.request  # noqa:  E402
+import urllib.response  # noqa:  E402
 import urllib.error  # noqa:  E402
 import urllib.parse  # noqa:  E402
 import http.client  # noqa:  E402
@@ -67,6 +72,163 @@ def handler(obj):
         raise TypeError('Object of type %s with value of %s is not JSON serializable' % (type(obj), repr(obj)))
 
 
+class ConnectionPool(object):
+    """
+    Idle persistent HTTP(S) connections kept per host, so consecutive requests to the same server reuse the TCP
+    connection instead of opening a new one. New TLS connections resume the session of the last connection made to the
+    same host, skipping the full handshake.
+
+    The pool is safe to use across threads. Connections inherited by a forked process are discarded rather than shared
+    with the parent.
+    """
+
+    def __init__(self, size=10, context=None):
+        """
+        :param int size: Maximum number of idle connections kept per host. More connections are opened when there are
+            more concurrent requests, but they are closed once done instead of returned to the pool
+        :param ssl.SSLContext context: Context used for HTTPS connections
+        """
+        self.size = size
+        self.context = context
+        self.created = 0
+        self.reused = 0
+        self._pid = os.getpid()
+        self._idle = collections.defaultdict(collections.deque)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def __check_fork(self):
+        if self._pid != os.getpid():
+            # The sockets belong to the parent process, leave them for it to use
+            self._pid = os.getpid()
+            self._idle = collections.defaultdict(collections.deque)
+            self._sessions = {}
+            self._lock = threading.Lock()
+
+    def get(self, key, timeout):
+        """
+        Get an idle connection for `key` or open a new one.
+
+        :param tuple key: Tuple of (scheme, host, tunnel host) to get a connection for
+        :param float timeout: Socket timeout for a new connection
+        :return: Tuple of (connection, whether it was reused from the pool)
+        """
+        self.__check_fork()
+        with self._lock:
+            idle = self._idle[key]
+            if idle:
+                self.reused += 1
+                return idle.pop(), True
+            self.created += 1
+        scheme, host, _tunnel_host = key
+        if scheme == 'https':
+            return _HTTPSConnection(host, self, timeout=timeout, context=self.context), False
+        return http.client.HTTPConnection(host, timeout=timeout), False
+
+    def put(self, key, connection):
+        """
+        Return a connection whose response has been fully read to the pool, closing it if the pool is full.
+
+        :param tuple key: Key the connection was obtained for
+        :param http.client.HTTPConnection connection: Connection to return
+        """
+        with self._lock:
+            idle = self._idle[key]
+            if len(idle) < self.size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def get_session(self, host):
+        return self._sessions.get(host)
+
+    def set_session(self, host, session):
+        if session is not None:
+            self._sessions[host] = session
+
+    def close(self):
+        """
+        Close all the idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, collections.defaultdict(collections.deque)
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+    """
+    `HTTPSConnection` that resumes the TLS session of the last connection its pool made to the same host.
+    """
+
+    def __init__(self, host, pool, **kwargs):
+        http.client.HTTPSConnection.__init__(self, host, **kwargs)
+        self._pool = pool
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname,
+                                              session=self._pool.get_session(server_hostname))
+        self._pool.set_session(server_hostname, self.sock.session)
+
+
+class KeepAliveHandler(urllib.request.HTTPHandler, urllib.request.HTTPSHandler):
+    """
+    urllib handler sending HTTP/1.1 keep-alive requests over the connections of a `ConnectionPool`, replacing the
+    default handlers that open (and close) a new connection for every request.
+
+    The response body is read before returning so the connection can go back to the pool right away.
+    """
+
+    def __init__(self, pool):
+        """
+        :param ConnectionPool pool: Pool to take connections from
+        """
+        urllib.request.HTTPSHandler.__init__(self, context=pool.context)
+        self.pool = pool
+
+    def http_open(self, req):
+        return self.__open('http', req)
+
+    def https_open(self, req):
+        return self.__open('https', req)
+
+    def __open(self, scheme, req):
+        headers = dict(req.unredirected_hdrs)
+        headers.update((key, value) for key, value in req.headers.items() if key not in headers)
+        headers = {name.title(): value for name, value in headers.items()}
+        tunnel_headers = {}
+        if req._tunnel_host and 'Proxy-Authorization' in headers:
+            tunnel_headers['Proxy-Authorization'] = headers.pop('Proxy-Authorization')
+        key = (scheme, req.host, req._tunnel_host)
+        while True:
+            connection, reused = self.pool.get(key, req.timeout)
+            if req._tunnel_host and not reused:
+                connection.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+            try:
+                connection.request(req.get_method(), req.selector, req.data, headers)
+                response = connection.getresponse()
+                body = response.read()
+            except Exception as e:
+                connection.close()
+                if reused and isinstance(e, (ConnectionError, http.client.RemoteDisconnected)):
+                    # The server closed the idle connection, try again with the next one
+                    continue
+                if isinstance(e, OSError):
+                    raise urllib.error.URLError(e)
+                raise
+            break
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.put(key, connection)
+        result = urllib.response.addinfourl(io.BytesIO(body), response.msg, req.get_full_url(), response.status)
+        result.msg = response.reason
+        return result
+
+
 def __call(method, url, **kwargs):
     split = url.split('/', 3)
     server = '/'.join(split[:3])
@@ -92,7 +254,13 @@ def post(url, *args, **kwargs):
 
 
 class Curl(object):
-    def __init__(self, server, userName=None, userPass=None, oauth=None, token=None, appToken=None, retry=3, bearerToken=None, errorsToRetry=None, verify_cert=True):
+    def __init__(self, server, userName=None, userPass=None, oauth=None, token=None, appToken=None, retry=3, bearerToken=None, errorsToRetry=None, verify_cert=True,
+                 pool_size=10, backoff=5, max_backoff=60):
+        """
+        :param int pool_size: Maximum number of idle keep-alive connections kept per host
+        :param float backoff: Base delay in seconds before the first retry, doubled for every following retry
+        :param float max_backoff: Maximum delay in seconds between retries
+        """
         self.userData = None
         if userName is not None and userPass is not None:
             self.setupAuth(userName, userPass)
@@ -108,6 +276,11 @@ class Curl(object):
         self.cache = {}
         self.verify_cert = verify_cert
         self.retryAttempts = retry
+        self.pool_size = pool_size
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._pools = {}
+        self._openers = {}
         self.errorsToRetry = [500]
         if errorsToRetry:
             if isinstance(errorsToRetry, (int, float)):
@@ -118,14 +291,46 @@ class Curl(object):
     def setupAuth(self, userName, password):
         self.userData = "Basic " + (userName + ":" + password).encode("base64").rstrip()
 
-    def __retry(self, request):
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pools'] = {}
+        state['_openers'] = {}
+        return state
+
+    def __open(self, request, verify):
+        opener = self._openers.get(verify)
+        if opener is None:
+            pool = ConnectionPool(self.pool_size,
+                                  ssl.create_default_context() if verify else ssl._create_unverified_context())
+            self._pools[verify] = pool
+            opener = self._openers.setdefault(verify, urllib.request.build_opener(KeepAliveHandler(pool)))
+        return opener.open(request)
+
+    def __retry(self, request, verify):
         for i in range(self.retryAttempts):
+            # Exponential backoff with jitter, so clients failing together don't all retry at the same time
+            delay = min(self.max_backoff, self.backoff * 2 ** i)
+            sleep(delay / 2 + random.uniform(0, delay / 2))
             try:
-                return urllib.request.urlopen(request)
+                return self.__open(request, verify)
             except Exception:
-                sleep(10)
+                pass
         # we should store this in a file to be called if it is critical
 
+    def close(self):
+        """
+        Close the idle keep-alive connections to the server.
+        """
+        for pool in list(self._pools.values()):
+            pool.close()
+
+    def connection_stats(self):
+        """
+        Get the number of connections opened and the number of requests that reused an idle connection.
+        """
+        pools = list(self._pools.values())
+        return {'created': sum(pool.created for pool in pools), 'reused': sum(pool.reused for pool in pools)}
+
     def __call(self, url, method, data=None, output='json', contenttype=None, verify=None, return_http_status_code=False):
         fullUrl = self.server + '/' + url
         if data is not None and method in ('GET', 'DELETE'):
@@ -183,19 +388,17 @@ class Curl(object):
             #  verify   False  |  V      !V     !V
             #
             # So if the local is set to true, use that, otherwise use the global if the local is not set (i.e., None)
-            if verify or (verify is None and self.verify_cert):
-                f = urllib.request.urlopen(req)
-            else:
-                f = urllib.request.urlopen(req, context=ssl._create_unverified_context())
+            verify = bool(verify or (verify is None and self.verify_cert))
+            f = self.__open(req, verify)
         except urllib.error.HTTPError as e:
             exception = CurlHttpException(e)
             if exception.code in self.errorsToRetry:
-                f = self.__retry(req)
+                f = self.__retry(req, verify)
             if f is None:
                 raise exception
         except (urllib.error.URLError, http.client.BadStatusLine) as e:
             # the server is not up maybe we should try again...
-            f = self.__retry(req)
+            f = self.__retry(req, verify)
             if f is None:
                 raise e
         response = f.read()
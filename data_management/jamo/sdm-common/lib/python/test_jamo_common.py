@@ -7,12 +7,12 @@ from bson.objectid import ObjectId
 
 try:
     ## PYTHON3_BEGIN ###  # noqa: E266 - to be removed after migration cleanup
-    from unittest.mock import patch, Mock
+    from unittest.mock import patch, Mock, call
     from tempfile import TemporaryDirectory
     ### PYTHON3_END ###  # noqa: E266 - to be removed after migration cleanup
 except ImportError:
     ### PYTHON2_BEGIN ###  # noqa: E266 - to be removed after migration cleanup
-    from mock import patch, Mock
+    from mock import patch, Mock, call
     from backports.tempfile import TemporaryDirectory
     from builtins import str
     ### PYTHON2_END ###  # noqa: E266 - to be removed after migration cleanup
@@ -435,6 +435,38 @@ class TestJamoCommon(unittest.TestCase):
                                    {'_id': ObjectId('5327394649607a1be0059513')},
                                    {'_id': ObjectId('5327394649607a1be0059514')}])
 
+    def test_PageList_iter_new_cursor_id(self):
+        curl = Mock()
+        page = {'cursor_id': 'cursor_1', 'record_count': 3, 'records': [{'_id': 1}]}
+        curl.get.side_effect = [{'cursor_id': 'cursor_2', 'record_count': 3, 'records': [{'_id': 2}]},
+                                {'cursor_id': 'cursor_3', 'record_count': 3, 'records': [{'_id': 3}]}]
+
+        entries = [i.dic for i in iter(jamo_common.PageList(page, curl, 'my_service'))]
+
+        self.assertEqual(entries, [{'_id': 1}, {'_id': 2}, {'_id': 3}])
+        self.assertEqual(curl.get.mock_calls, [call('api/my_service/nextpage/cursor_1'),
+                                               call('api/my_service/nextpage/cursor_2')])
+
+    def test_PageList_iter_lazy_count(self):
+        curl = Mock()
+        page = {'cursor_id': 'cursor_1', 'record_count': None, 'records': [{'_id': 1}, {'_id': 2}]}
+        curl.get.side_effect = [{'cursor_id': 'cursor_1', 'record_count': None, 'records': [{'_id': 3}, {'_id': 4}]},
+                                {'cursor_id': 'cursor_1', 'record_count': 4, 'records': []}]
+
+        entries = [i.dic for i in iter(jamo_common.PageList(page, curl, 'my_service'))]
+
+        self.assertEqual(entries, [{'_id': 1}, {'_id': 2}, {'_id': 3}, {'_id': 4}])
+        self.assertEqual(curl.get.call_count, 2)
+
+    def test_PageList_len_lazy_count(self):
+        curl = Mock()
+        curl.get.return_value = {'record_count': 10}
+        page_list = jamo_common.PageList({'cursor_id': 'cursor_1', 'record_count': None, 'records': []}, curl,
+                                         'my_service')
+
+        self.assertEqual(len(page_list), 10)
+        curl.get.assert_called_once_with('api/my_service/pagecount/cursor_1')
+
     def test_PageList_len(self):
         page = {'cursor_id': 'some_cursor_id',
                 'record_count': 3,
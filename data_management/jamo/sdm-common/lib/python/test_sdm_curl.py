@@ -15,9 +15,40 @@ from parameterized import parameterized
 from datetime import datetime
 from decimal import Decimal
 import urllib.error
+import http.server
+import json
+import pickle
+import threading
 from io import StringIO
 
 
+class KeepAliveRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    connections = 0
+    requests = 0
+
+    def setup(self):
+        KeepAliveRequestHandler.connections += 1
+        http.server.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        KeepAliveRequestHandler.requests += 1
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps({'path': self.path}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Drop every third connection without telling the client, like a server closing idle connections
+        self.close_connection = KeepAliveRequestHandler.requests % 3 == 0
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
 class TestSdmCurl(unittest.TestCase):
 
     @parameterized.expand([
@@ -30,7 +61,7 @@ class TestSdmCurl(unittest.TestCase):
         self.assertEqual(sdm_curl.handler(obj), expected)
 
     @patch('sdm_curl.urllib.request.Request')
-    @patch('sdm_curl.urllib.request.urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_get(self, urlopen, request):
         response = Mock()
         response.read.return_value = '{"foo": "bar"}'
@@ -40,7 +71,7 @@ class TestSdmCurl(unittest.TestCase):
         request.assert_called_with('http://someurl/get?foo=bar&')
 
     @patch('sdm_curl.urllib.request.Request')
-    @patch('sdm_curl.urllib.request.urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_post(self, urlopen, request):
         req = Mock()
         request.return_value = req
@@ -57,7 +88,7 @@ class TestSdmCurl(unittest.TestCase):
         ('return_http_status_code_false', False),
     ])
     @patch('sdm_curl.urllib.request.Request')
-    @patch('sdm_curl.urllib.request.urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_post_return_http_status_code(self, _description, return_http_status_code, urlopen, request):
         response = Mock()
         urlopen.return_value = response
@@ -76,7 +107,7 @@ class TestSdmCurl(unittest.TestCase):
 
     @parameterized.expand(['put', 'delete'])
     @patch('sdm_curl.urllib.request.Request')
-    @patch('sdm_curl.urllib.request.urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_curl_methods(self, method, urlopen, request):
         req = Mock()
         request.return_value = req
@@ -91,7 +122,7 @@ class TestSdmCurl(unittest.TestCase):
         self.assertEqual(req.get_method(), method.upper())
 
     @patch('sdm_curl.urllib.request.Request')
-    @patch('sdm_curl.urllib.request.urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_curl_get_no_cache(self, urlopen, request):
         req = Mock()
         request.return_value = req
@@ -115,7 +146,7 @@ class TestSdmCurl(unittest.TestCase):
         self.assertEqual(response, '{"bar":"foo"}')
 
     @patch('sdm_curl.urllib.request.Request')
-    @patch('sdm_curl.urllib.request.urlopen')
+    @patch.object(Curl, '_Curl__open')
     @patch.object(sdm_curl, 'sleep')
     def test_curl_retry_with_retriable_error(self, sleep, urlopen, request):
         error = urllib.error.HTTPError('http://127.0.0.1', 502, 'Error', [], None)
@@ -128,6 +159,57 @@ class TestSdmCurl(unittest.TestCase):
         # Verify 4 calls (original call and 3 retries)
         self.assertEqual(len(urlopen.mock_calls), 4)
 
+    @patch.object(sdm_curl.random, 'uniform')
+    @patch.object(Curl, '_Curl__open')
+    @patch.object(sdm_curl, 'sleep')
+    def test_curl_retry_backoff(self, sleep, urlopen, uniform):
+        urlopen.side_effect = urllib.error.URLError('Connection refused')
+        uniform.side_effect = lambda low, high: high
+        curl = Curl('http://127.0.0.1', retry=4, backoff=5, max_backoff=30)
+
+        self.assertRaises(urllib.error.URLError, curl.get, 'api/service/endpoint')
+        self.assertEqual([c[0][0] for c in sleep.call_args_list], [5, 10, 20, 30])
+        self.assertEqual([c[0] for c in uniform.call_args_list], [(0, 2.5), (0, 5), (0, 10), (0, 15)])
+
+    def test_curl_keep_alive(self):
+        KeepAliveRequestHandler.connections = 0
+        KeepAliveRequestHandler.requests = 0
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            curl = Curl('http://127.0.0.1:{}'.format(server.server_address[1]), retry=0)
+
+            for i in range(5):
+                self.assertEqual(curl.get('api/foo', data={'i': i}), {'path': '/api/foo?i={}&'.format(i)})
+                self.assertEqual(curl.post('api/bar', data={'i': i}), {'path': '/api/bar'})
+            # Pooled connections are not copied when the client is pickled for another process
+            self.assertEqual(pickle.loads(pickle.dumps(curl))._pools, {})
+            curl.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(KeepAliveRequestHandler.requests, 10)
+        # A new connection is only opened after the server dropped the previous one
+        self.assertEqual(KeepAliveRequestHandler.connections, 4)
+        self.assertEqual(curl.connection_stats()['created'], 4)
+
+    @patch.object(sdm_curl.os, 'getpid')
+    def test_connection_pool_discards_connections_after_fork(self, getpid):
+        getpid.return_value = 1
+        pool = sdm_curl.ConnectionPool(size=1)
+        connection = Mock()
+        pool.put(('http', 'foo', None), connection)
+        pool.put(('http', 'foo', None), Mock())
+        getpid.return_value = 2
+
+        new_connection, reused = pool.get(('http', 'foo', None), 10)
+
+        self.assertFalse(reused)
+        self.assertIsNot(new_connection, connection)
+        connection.close.assert_not_called()
+
+
     @patch('sdm_curl.urllib.request.Request')
     def test_curl_to_struct(self, request):
         curl = Curl('http://127.0.0.1')
@@ -179,7 +261,7 @@ class TestSdmCurl(unittest.TestCase):
          {'Authorization': 'Application SOME_TOKEN', 'Content-length': 13}, b'foo=foo%2Bbar',
          'http://127.0.0.1/some/api'),
     ])
-    @patch('sdm_curl.urllib.request.urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_Curl_call(self, _description, method, data, output, expected, expected_request_headers,
                        expected_request_data, expected_full_url, urlopen_mock):
         urlopen_response = Mock()
@@ -194,7 +276,7 @@ class TestSdmCurl(unittest.TestCase):
         self.assertEqual(request.full_url, expected_full_url)
 
     @patch('sdm_curl.random.choice')
-    @patch('sdm_curl.urllib.request.urlopen')
+    @patch.object(Curl, '_Curl__open')
     def test_Curl_call_multipartform(self, urlopen_mock, random_mock):
         random_mock.return_value = 'A'
         method = 'POST'